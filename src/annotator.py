@@ -2,25 +2,101 @@
 
 from __future__ import annotations
 
+import html
+import json
 import os
-import shutil
+import time
+import uuid
+from array import array
+from collections.abc import Callable, Sequence
+from contextlib import AbstractContextManager, nullcontext, suppress
+from functools import partial
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 import streamlit as st
 from omegaconf import OmegaConf
+from PIL import Image
 
+from archive import is_archive, write_label_manifests
+from bulk import find_matches
+from cluster import cluster_order
+from decode import (
+    PREFETCH_AHEAD,
+    load_placeholder,
+    load_preview,
+    prefetch_previews,
+    preview_size,
+)
+from dedup import drop_duplicates, get_duplicate_index
+from encode import (
+    EncodedPreview,
+    byte_budget,
+    cached_preview,
+    encode_image,
+    encode_preview,
+    payload_label,
+)
+from features import directory_features
+from headers import filter_view, parse_header_conditions
+from indexing import INDEX_POLL_INTERVAL, get_job, start_indexing
+from leases import LeaseQueue, lease_db_path
+from manifest import is_manifest
+from memprofile import (
+    MEMORY_LOG_PATH,
+    dump_snapshot,
+    finish_rerun,
+    format_bytes,
+    fragment_window,
+    report_rows,
+    start_rerun,
+    write_report,
+)
+from moves import assign_keywords, execute_moves, plan_moves
+from ordering import SORT_KEYS, sort_view
+from registry import AnnotationMap, FileRegistry, FileView, get_registry
+from snapshot import (
+    SNAPSHOT_INTERVAL,
+    SNAPSHOT_KEYS,
+    ensure_session_id,
+    latest_session,
+    load_snapshot,
+    restore_files,
+    save_files,
+    save_state,
+)
+from static_previews import (
+    preview_file,
+    publish_preview,
+    published_preview_url,
+    static_url,
+)
+from suggest import MIN_TRAINING_LABELS, SuggestionJob
+from tiles import VIEWPORT_WIDTH, ZOOM_LEVELS, get_pyramid, zoom_label
 from utils import (
-    filter_by_keyword,
+    get_file_path,
     get_filtered_files,
     get_metadata_str,
-    load_image,
+    is_image_source,
+    json_labels,
+    json_lock,
     load_json,
+    matches_keyword,
+    parse_conditions,
     save_json,
     update_json,
 )
+from watcher import watch
 
-__all__ = ["Annotator"]
+__all__ = ["DUPLICATE_MODES", "Annotator"]
+
+# What to do with byte-identical copies of an image, and how the choice is shown
+DUPLICATE_MODES = {
+    "show": "show all",
+    "hide": "hide duplicates",
+    "label": "label like their first-annotated twin",
+}
 
 
 class Annotator:
@@ -47,7 +123,21 @@ class Annotator:
         self.categories: str | None = None
         self.img_height_clamp: int = 0
         self.clamp_image: bool = False
+        self.watch_directory: bool = True
+        self.work_queue: bool = False
+        self.decode_workers: int = 0
+        self.static_previews: bool = False
+        self.preview_format: str = "auto"
+        self.preview_quality: int | None = None
+        self.preview_max_bytes: int | None = None
+        self.memory_profile: bool = False
+        self.memory_log: str = str(MEMORY_LOG_PATH)
+        self.index_images: bool = False
+        self.resume_session: bool = True
         self.state: Any = None
+        self.index_placeholder: Any = None
+        self.nav_container: Any = None
+        self.image_placeholder: Any = None
         self.back_placeholder: Any = None
         self.info_placeholder: Any = None
         self.options_buttons_placeholder: Any = None
@@ -58,7 +148,7 @@ class Annotator:
         self.meta_info: Any = None
         self.expander_placeholder: Any = None
         self.keyword_dict: dict[str, list[str]] | None = None
-        self.img_file_names: list[str] | None = None
+        self.img_file_names: Sequence[str] | None = None
         self.remaining: int | None = None
         self.n_annotated: int | None = None
         self.move_col: Any = None
@@ -85,7 +175,7 @@ class Annotator:
         if Path(self.config_path).suffix not in (".yml", ".yaml"):
             raise ValueError("Config file must be a yml or yaml file.")
         conf = OmegaConf.load(self.config_path)
-        if not conf.default_directory or not os.path.isdir(conf.default_directory):
+        if not conf.default_directory or not is_image_source(conf.default_directory):
             update_config = True
             conf.default_directory = os.getcwd()
         if not conf.json_path:
@@ -101,6 +191,22 @@ class Annotator:
         self.categories = conf.default_categories
         self.img_height_clamp = int(conf.image_height_clamp)
         self.clamp_image = conf.clamp_image
+        self.watch_directory = bool(conf.get("watch_directory", True))
+        self.work_queue = bool(conf.get("work_queue", False))
+        self.decode_workers = int(conf.get("decode_workers", 0))
+        # Static previews need Streamlit's static file serving
+        self.static_previews = bool(conf.get("static_previews", False)) and bool(
+            st.get_option("server.enableStaticServing")
+        )
+        self.preview_format = str(conf.get("preview_format", "auto"))
+        quality = conf.get("preview_quality")
+        self.preview_quality = int(quality) if quality else None
+        max_bytes = conf.get("preview_max_bytes")
+        self.preview_max_bytes = int(max_bytes) if max_bytes is not None else None
+        self.memory_profile = bool(conf.get("memory_profile", False))
+        self.memory_log = str(conf.get("memory_log") or MEMORY_LOG_PATH)
+        self.index_images = bool(conf.get("index_images", False))
+        self.resume_session = bool(conf.get("resume_session", True))
 
     def set_state_dict(self) -> None:
         """Set the state dictionary by adding key
@@ -127,7 +233,9 @@ class Annotator:
         if "hide_state" not in self.state:
             self.state.hide_state = 0
         if "annotations" not in self.state:
-            self.state.annotations = {}
+            self.state.annotations = AnnotationMap(
+                get_registry(self.state.img_dir, refresh=False)
+            )
         if "files" not in self.state:
             self.state.files = []
         if "is_expanded" not in self.state:
@@ -144,15 +252,54 @@ class Annotator:
             self.state.keyword_and_or = False
         if "move" not in self.state:
             self.state.move = False
+        if "manifest_filter" not in self.state:
+            self.state.manifest_filter = ""
+        if "size_filter" not in self.state:
+            self.state.size_filter = ""
+            self.state.sort_key = "name"
+        if "files_key" not in self.state:
+            self.state.files_key = None
+            self.state.files_version = 0
+        if "work_queue" not in self.state:
+            self.state.work_queue = self.work_queue
+            self.state.lease_owner = uuid.uuid4().hex
+        if "suggest" not in self.state:
+            self.state.suggest = False
+            self.state.suggestions = {}
+            self.state.suggestion_job = None
+            self.state.suggest_threshold = 0.9
+        if "name_order" not in self.state:
+            self.state.name_order = True
+        if "duplicates" not in self.state:
+            self.state.duplicates = "show"
+        if "cluster_order" not in self.state:
+            self.state.cluster_order = False
+            self.state.clusters = {}
+        if "bulk_query" not in self.state:
+            self.state.bulk_query = ""
+            self.state.bulk_matches = []
+            self.state.bulk_written = None
+        if "resume_pending" not in self.state:
+            # First run of the session: pick up where the last one left off
+            self.state.resume_pending = False
+            self.state.resume_file = None
+            self.state.session_id = self.get_session_id()
+            self.state.snapshot_state = None
+            self.state.snapshot_files = None
+            self.state.snapshot_key = None
+            self.state.snapshot_time = 0.0
+            if self.resume_session:
+                self.restore_session()
 
     def set_ui(self) -> None:
         """Set the order of the UI elements for the sidebar."""
         st.set_page_config(layout="wide")
         st.sidebar.title("Image Annotator")
-        # set up order of sidebar UI elements
-        self.back_placeholder = st.sidebar.empty()
-        self.info_placeholder = st.sidebar.empty()
-        self.options_buttons_placeholder = st.sidebar.empty()
+        self.index_placeholder = st.sidebar.empty()
+        # set up order of sidebar UI elements. The navigation container is
+        # filled by the `image_pane` fragment so annotate/back clicks only
+        # rerun that fragment instead of the whole script.
+        self.nav_container = st.sidebar.container()
         st.sidebar.markdown("---")
         self.move_clear_buttons_placeholder = st.sidebar.empty()
         self.checkbox_placeholder = st.sidebar.empty()
@@ -161,19 +308,59 @@ class Annotator:
         self.prompt_info = st.sidebar.empty()
         self.meta_info = st.sidebar.empty()
         self.expander_placeholder = st.sidebar.empty()
+        self.image_placeholder = st.empty()
 
     def set_dir(self) -> None:
         """Set the image directory and get image files if any exist.
         Also sets the current file in the state dict."""
-        if not os.path.isdir(self.state.img_dir):
+        if not is_image_source(self.state.img_dir):
             st.error(f"{self.state.img_dir} is not a valid directory!")
         else:
-            self.state.files = self.get_imgs()
+            start_indexing(self.state.img_dir, self.index_images)
+            if self.watch_directory:
+                watch(self.state.img_dir)
+            self.sync_files()
+            self.finish_resume()
+            self.index_status()
         if self.state.files and self.state.counter < len(self.state.files):
             self.state.current_file = self.state.files[self.state.counter]
+        elif self.is_indexing():
+            st.write("Listing images...")
         else:
             st.write("No image files in folder. Nothing to annotate.")
 
+    def is_indexing(self) -> bool:
+        """Check if the directory's index job is still running."""
+        job = get_job(self.state.img_dir)
+        return job is not None and not job.finished
+
+    def index_status(self) -> None:
+        """Show the progress of the directory's index job in the sidebar. The
+        progress is a fragment that reruns on its own while the job runs, so
+        it is only polled until indexing is done."""
+        job = get_job(self.state.img_dir)
+        if job is None or self.index_placeholder is None:
+            return
+        if job.error is not None:
+            self.index_placeholder.error(f"Indexing stopped: {job.error}")
+        elif not job.finished:
+            with self.index_placeholder.container():
+                st.fragment(self.index_progress, run_every=INDEX_POLL_INTERVAL)()
+
+    def index_progress(self) -> None:
+        """Show the index job's progress. The whole app is rerun once the job
+        is done, or when the first files are listed and none are shown yet,
+        so annotation can start on them."""
+        job = get_job(self.state.img_dir)
+        if job is None or job.finished:
+            st.rerun()
+            return
+        if not self.state.files and job.registry.version != self.state.files_version:
+            st.rerun()
+            return
+        progress = job.progress()
+        st.progress(progress.fraction, text=f"Indexing {progress.label}")
+
     def set_current_file(self) -> None:
         """Set the current file to the index of the
         state.counter.
@@ -203,141 +390,571 @@ class Annotator:
         """Set annotation for the current file, change the image, and update the
         json file.
 
-        ``results_d`` has a ``"directory"`` key (str) and a ``"files"`` key
-        (dict mapping filename to annotation label).
+        ``results_d`` has a ``"directory"`` key (str). Only the new label is
+        merged into the json ``"files"`` dict, so labels written by other
+        sessions on the same folder are kept.
 
         Args:
             label (str): Annotation label to assign to img file.
-            results_d (dict[str, Any]): Dictionary of annotations.
+            results_d (dict[str, Any]): Top-level json entries to write.
             json_path (str): Path to json file.
         """
-        self.state.annotations[self.state.current_file] = label
+        current_file = self.state.current_file
+        self.state.annotations[current_file] = label
         self.change_img(1)
-        update_json(results_d, json_path)
+        update_json({**results_d, "files": {current_file: label}}, json_path)
+        if self.state.duplicates == "label":
+            self.label_twins({twin: label for twin in self.get_twins(current_file)})
+
+    def annotate_files(self, labels: dict[str, str]) -> int:
+        """Annotate several of the remaining files at once.
+
+        The files are moved up to the counter (keeping their order) and
+        skipped over, and all labels are merged into the json file with one
+        write.
+
+        Args:
+            labels (dict[str, str]): File name to label of files at or after
+                the counter.
+
+        Returns:
+            int: Number of labels written.
+        """
+        if not labels:
+            return 0
+        self.state.files = self.state.files.reordered(
+            self.state.counter, lambda file: file not in labels
+        )
+        self.state.name_order = False
+        for file, label in labels.items():
+            self.state.annotations[file] = label
+        update_json(
+            {"directory": self.state.img_dir, "files": labels},
+            self.state.json_path,
+        )
+        self.change_img(len(labels))
+        return len(labels)
+
+    def get_twins(self, file: str) -> list[str]:
+        """Get the unlabeled files with the same content as a file.
+
+        Args:
+            file (str): File name.
+
+        Returns:
+            list[str]: Names of its unlabeled duplicates.
+        """
+        registry = get_registry(self.state.img_dir, refresh=False)
+        file_id = registry.id_of(file)
+        if file_id is None:
+            return []
+        twins = map(registry.name, get_duplicate_index(registry).twins(file_id))
+        return [twin for twin in twins if twin not in self.state.annotations]
+
+    def label_twins(self, labels: dict[str, str]) -> int:
+        """Label duplicates found by the dedup pass. The ones still ahead in
+        the queue are labeled with `annotate_files` so they are skipped; the
+        others are only recorded.
+
+        Args:
+            labels (dict[str, str]): File name to label.
+
+        Returns:
+            int: Number of labels written.
+        """
+        if not labels:
+            return 0
+        files = self.state.files
+        ahead = set(files.ids[self.state.counter :])
+        registry = files.registry
+        queued = {}
+        others = {}
+        for file, label in labels.items():
+            if registry.id_of(file) in ahead:
+                queued[file] = label
+            else:
+                others[file] = label
+        if others:
+            for file, label in others.items():
+                self.state.annotations[file] = label
+            update_json(
+                {"directory": self.state.img_dir, "files": others},
+                self.state.json_path,
+            )
+        return self.annotate_files(queued) + len(others)
+
+    def label_duplicates(self) -> int:
+        """Give every unlabeled duplicate the label of its first-annotated
+        twin, in the order labels were written to the json file.
+
+        Returns:
+            int: Number of labels written.
+        """
+        registry = get_registry(self.state.img_dir, refresh=False)
+        annotations = self.state.annotations
+        order: dict[str, int] = {}
+        if os.path.exists(self.state.json_path):
+            json_files = json_labels(
+                load_json(self.state.json_path), self.state.img_dir
+            )
+            order = {file: idx for idx, file in enumerate(json_files)}
+        labels = {}
+        for group in get_duplicate_index(registry).groups():
+            names = [registry.name(file_id) for file_id in group.tolist()]
+            labeled = [file for file in names if file in annotations]
+            if not labeled:
+                continue
+            first = min(labeled, key=lambda file: order.get(file, len(order)))
+            for file in names:
+                if file not in annotations:
+                    labels[file] = annotations[first]
+        return self.label_twins(labels)
 
     def get_keyword_file_dict(self) -> None:
         """Create a dictionary with key = keyword, val = list of filtered file names
-        that contain the keyword.
+        that contain the keyword. Each file goes to the first keyword it
+        contains, and every name is split only once (see `moves.assign_keywords`).
 
         Note: Filtering is performed on image filenames only, not prompt content.
         """
         if self.img_file_names is None:
             self.img_file_names = get_filtered_files(self.state.img_dir)
-        file_list_ = self.img_file_names.copy()
-        self.keyword_dict = {}
-        for keyword in self.state.split_keywords:
-            if not self.state.sep:
-                self.state.sep = " "
-            file_list_, filtered_files = filter_by_keyword(
-                file_list_, keyword, self.state.sep
-            )
-            self.keyword_dict[keyword] = filtered_files
+        if not self.state.sep:
+            self.state.sep = " "
+        self.keyword_dict = assign_keywords(
+            self.img_file_names, self.state.split_keywords, self.state.sep
+        )
+
+    def list_move_sources(self) -> Callable[[str], bool]:
+        """Set ``img_file_names`` to the files a move can take and get a check
+        that a file is among them. The directory's registry is used unless it
+        is still being listed, so the directory is not listed again.
 
-    def make_folders_move_files(self, use_keywords: bool = False) -> None:
+        Returns:
+            Callable[[str], bool]: True if a file name is currently listed.
+        """
+        registry = get_registry(self.state.img_dir)
+        if registry.indexing:
+            self.img_file_names = get_filtered_files(self.state.img_dir)
+            return set(self.img_file_names).__contains__
+        self.img_file_names = registry.view()
+        return registry.__contains__
+
+    def make_folders_move_files(
+        self, use_keywords: bool = False, dry_run: bool = False
+    ) -> None:
         """Make folders for each unique annotation. Filter state dict
         and move annotated files to their respective folders.
         Remove files from json and delete the json file if it is empty.
 
+        The number of files per folder is worked out before anything is
+        moved (see `moves.plan_moves`); with ``dry_run`` only these counts
+        are shown. Images in a zip or tar archive are not extracted: see
+        `write_archive_manifests`.
+
         Args:
             use_keywords (bool, optional): If True, use keyword dict instead
                 of json dict to move files.
+            dry_run (bool, optional): If True, only report how many files
+                would be moved to each folder. Defaults to False.
+        """
+        if is_archive(self.state.img_dir):
+            if not dry_run:
+                self.write_archive_manifests(use_keywords)
+            return
+        present = self.list_move_sources()
+        # Hold the json lock from reading to rewriting the json file so labels
+        # added by other sessions meanwhile are not lost
+        lock = (
+            nullcontext()
+            if use_keywords or dry_run
+            else json_lock(self.state.json_path)
+        )
+        with lock:
+            if use_keywords:
+                self.get_keyword_file_dict()
+                plan = plan_moves(self.state.img_dir, self.keyword_dict)
+            else:
+                if not os.path.exists(self.state.json_path):
+                    return
+                json_d = load_json(self.state.json_path)
+                labels = json_labels(json_d, self.state.img_dir)
+                if not labels and json_d.get("files"):
+                    st.warning(
+                        f"The json file holds labels for {json_d.get('directory')}, "
+                        f"not {self.state.img_dir}. No files were moved."
+                    )
+                    return
+                groups: dict[str, list[str]] = {}
+                for file, label in labels.items():
+                    groups.setdefault(label, []).append(file)
+                plan = plan_moves(self.state.img_dir, groups, present)
+            verb = "would move" if dry_run else "moving"
+            for folder_name, n_files in plan.counts.items():
+                st.info(f"{verb} {n_files} images to {folder_name}...")
+            if dry_run:
+                return
+            moved = execute_moves(plan)
+            if not use_keywords:
+                for files in moved.values():
+                    for file in files:
+                        self.state.annotations.pop(file, None)
+                        labels.pop(file, None)
+                if len(labels) > 0:
+                    save_json({**json_d, "files": labels}, self.state.json_path)
+                else:
+                    os.remove(self.state.json_path)
+                self.state.counter = 0
+
+    def write_archive_manifests(self, use_keywords: bool = False) -> None:
+        """Sort the images of an archive by writing a manifest per label that
+        lists them (see `archive.write_label_manifests`) instead of moving
+        them into folders. Annotations are kept in the json file, so sorted
+        images stay annotated and each manifest is rewritten in full.
+
+        Args:
+            use_keywords (bool, optional): If True, use keyword dict instead
+                of json dict to group files.
         """
         self.img_file_names = get_filtered_files(self.state.img_dir)
+        members = set(self.img_file_names)
+        groups: dict[str, list[str]] = {}
         if use_keywords:
             self.get_keyword_file_dict()
-            folder_names = {key for key, val in self.keyword_dict.items() if val}
+            for keyword, files in self.keyword_dict.items():
+                groups[keyword] = [file for file in files if file in members]
         else:
-            if os.path.exists(self.state.json_path):
-                json_d = load_json(self.state.json_path)
-            else:
+            if not os.path.exists(self.state.json_path):
                 return
-            folder_names = set(json_d["files"].values())
-        for folder_name in folder_names:
-            n_files = 0
-            remove_files = []
-            os.makedirs(os.path.join(self.state.img_dir, folder_name), exist_ok=True)
-            if use_keywords:
-                filtered_files = self.keyword_dict[folder_name]
-            else:
-                filtered_files = [
-                    file
-                    for (file, label) in json_d["files"].items()
-                    if folder_name == label
-                ]
-            for file in filtered_files:
-                if file in self.img_file_names:
-                    n_files += 1
-                    remove_files.append(file)
-                    img_file_path = os.path.join(self.state.img_dir, file)
-                    file_dest = os.path.join(self.state.img_dir, folder_name, file)
-                    shutil.move(img_file_path, file_dest)
-            st.info(f"moving {n_files} images to {folder_name}...")
-            for file in remove_files:
-                if not use_keywords:
-                    self.state.annotations.pop(file, None)
-                    json_d["files"].pop(file, None)
-        if not use_keywords:
-            if len(json_d["files"]) > 0:
-                save_json(json_d, self.state.json_path)
-            else:
-                os.remove(self.state.json_path)
-            self.state.counter = 0
+            labels = json_labels(load_json(self.state.json_path), self.state.img_dir)
+            for file, label in labels.items():
+                if file in members:
+                    groups.setdefault(label, []).append(file)
+        written = write_label_manifests(self.state.img_dir, groups)
+        for label, manifest_path in written.items():
+            st.info(f"listing {len(groups[label])} images in {manifest_path}...")
 
-    def get_imgs(self) -> list[str]:
-        """Get a sorted list of image paths. Images
+    def get_imgs(self) -> FileView:
+        """Get a sorted view of image paths. Images
         are filtered to png and jpg (specified in config.yml)
         and sorted. If the image directory is not a
-        valid directory, return an empty list.
+        valid directory, return an empty view.
+
+        The names come from the shared `FileRegistry` for the directory, so
+        the session only keeps an array of ids.
 
         Returns:
-            list[str]: List of sorted image paths.
+            FileView: Sorted image file names.
         """
-        img_file_names = get_filtered_files(self.state.img_dir)
-        if img_file_names:
-            img_file_names.sort()
-        if self.state.split_keywords:
-            keyword_filtered = []
-            for keyword in self.state.split_keywords:
-                if self.state.keyword_and_or:
-                    if not keyword_filtered:
-                        filter_files = img_file_names
-                    else:
-                        filter_files = keyword_filtered
-                    _, filtered = filter_by_keyword(
-                        filter_files, keyword, sep_=self.state.sep
-                    )
-                    keyword_filtered = filtered
-                else:
-                    _, filtered = filter_by_keyword(
-                        img_file_names, keyword, sep_=self.state.sep
-                    )
-                    keyword_filtered.extend(filtered)
-            keyword_filtered = list(set(keyword_filtered))
-            keyword_filtered.sort()
-            return keyword_filtered
+        registry = get_registry(self.state.img_dir)
+        img_file_names = registry.view()
+        keyword_predicate = self.get_keyword_predicate()
+        if keyword_predicate is not None:
+            img_file_names = img_file_names.filter(keyword_predicate)
+        if self.state.manifest_filter and registry.is_manifest:
+            img_file_names = img_file_names.keep_ids(
+                registry.manifest_ids(self.state.manifest_filter)
+            )
+        if self.state.size_filter:
+            img_file_names = filter_view(img_file_names, self.state.size_filter)
+        if self.state.duplicates == "hide":
+            img_file_names = drop_duplicates(img_file_names)
+        if self.state.sort_key != "name":
+            img_file_names = sort_view(img_file_names, 0, self.state.sort_key)
         return img_file_names
 
+    def get_keyword_predicate(self) -> Callable[[str], bool] | None:
+        """Get a function that checks a file name against the keyword filter.
+
+        Returns:
+            Callable[[str], bool] | None: Predicate, or None if no keywords
+                are set.
+        """
+        keywords = self.state.split_keywords
+        if not keywords:
+            return None
+        sep = self.state.sep
+        match = all if self.state.keyword_and_or else any
+        return lambda file: match(matches_keyword(file, key, sep) for key in keywords)
+
+    def get_lease_queue(self) -> LeaseQueue:
+        """Get this session's work queue for the current directory. The lease
+        database sits next to the json file, so every session sharing the json
+        file shares the queue.
+
+        Returns:
+            LeaseQueue: Queue owned by this session.
+        """
+        return LeaseQueue(
+            lease_db_path(self.state.json_path),
+            os.path.abspath(self.state.img_dir),
+            self.state.lease_owner,
+        )
+
+    def lease_files(self, candidates: FileView | None = None) -> None:
+        """Replace ``state.files`` with the next batch of files leased to this
+        session and reset the counter. Files annotated by any session or leased
+        to another one are skipped.
+
+        Args:
+            candidates (FileView | None, optional): Filtered files to lease
+                from. Defaults to `get_imgs`.
+        """
+        if candidates is None:
+            candidates = self.get_imgs()
+        done = set(self.state.annotations)
+        if os.path.exists(self.state.json_path):
+            done.update(
+                json_labels(load_json(self.state.json_path), self.state.img_dir)
+            )
+        leased = self.get_lease_queue().acquire(candidates, done)
+        registry = candidates.registry
+        self.state.files = candidates.keep_ids(registry.id_of(file) for file in leased)
+        self.state.counter = 0
+        self.reset_order()
+
+    def reset_order(self) -> None:
+        """Mark ``state.files`` as freshly built in ``state.sort_key`` order,
+        clustering it again if cluster order is on."""
+        self.state.name_order = self.state.sort_key == "name"
+        self.state.clusters = {}
+        if self.state.cluster_order:
+            self.cluster_files()
+
+    def get_files_key(self) -> tuple[Any, ...]:
+        """Get the settings ``state.files`` is built from, so `sync_files`
+        can tell when it has to be rebuilt.
+
+        Returns:
+            tuple[Any, ...]: Directory, filters, sort key, duplicate
+                handling and work queue mode.
+        """
+        return (
+            self.state.img_dir,
+            tuple(self.state.split_keywords),
+            self.state.keyword_and_or,
+            self.state.sep,
+            self.state.manifest_filter,
+            self.state.size_filter,
+            self.state.sort_key,
+            self.state.duplicates,
+            self.state.work_queue,
+        )
+
+    def sync_files(self) -> None:
+        """Bring ``state.files`` up to date with the directory.
+
+        The file view is only rebuilt when the directory or filters changed.
+        Otherwise files added or removed since the last sync (e.g. by the
+        directory watcher) are applied incrementally, and ``state.counter`` is
+        shifted so the current file stays the same. In work queue mode new
+        files are left for a later batch instead of joining the leased one.
+        """
+        registry = get_registry(self.state.img_dir)
+        version = registry.version
+        files_key = self.get_files_key()
+        changes = None
+        if (
+            self.state.files_key == files_key
+            and isinstance(self.state.files, FileView)
+            and self.state.files.registry is registry
+        ):
+            changes = registry.changes_since(self.state.files_version)
+        if (
+            changes is not None
+            and changes != ([], [])
+            and (
+                self.state.manifest_filter
+                or self.state.size_filter
+                or self.state.duplicates == "hide"
+            )
+        ):
+            # Manifest and size filters and hiding duplicates are evaluated
+            # over the whole view, not per name
+            changes = None
+        if changes is None:
+            self.state.files = self.get_imgs()
+            if self.state.work_queue:
+                self.lease_files(self.state.files)
+            else:
+                self.reset_order()
+        elif changes != ([], []):
+            added, removed = changes
+            if self.state.work_queue:
+                added = []
+            self.state.files, self.state.counter = self.state.files.synced(
+                added,
+                removed,
+                self.state.counter,
+                self.get_keyword_predicate(),
+                self.state.name_order,
+            )
+        self.state.files_key = files_key
+        self.state.files_version = version
+
+    def get_session_id(self) -> str:
+        """Get the id the session's snapshot is saved under. It is kept in the
+        page URL (``?session=``), so reloading the page after a restart finds
+        the session's own snapshot, while other sessions sharing the json
+        file keep theirs.
+
+        Returns:
+            str: Session id, added to the URL if it was not there.
+        """
+        session_id = ensure_session_id(st.query_params.get("session"))
+        st.query_params["session"] = session_id
+        return session_id
+
+    def restore_session(self) -> None:
+        """Restore the directory, filters, file list and position saved by
+        `save_session` before the app was restarted. The saved file list is
+        used as is, so the directory is not listed and the filters do not run
+        again; the position is settled by `finish_resume` once the files are
+        known. A session without a snapshot of its own (e.g. a page opened
+        without a session id) resumes from the snapshot saved last. Work
+        queue sessions lease fresh files instead."""
+        if self.state.work_queue:
+            return
+        json_path = self.state.json_path
+        snapshot = load_snapshot(json_path, self.state.session_id)
+        if snapshot is None:
+            latest = latest_session(json_path)
+            snapshot = load_snapshot(json_path, latest) if latest else None
+        if snapshot is None or not is_image_source(snapshot.state["img_dir"]):
+            return
+        for key in SNAPSHOT_KEYS:
+            if key != "current_file":
+                setattr(self.state, key, snapshot.state[key])
+        self.state.resume_file = snapshot.state["current_file"]
+        self.state.resume_pending = True
+        files = restore_files(snapshot)
+        if files is not None:
+            self.state.files = files
+            self.state.files_key = self.get_files_key()
+            self.state.files_version = files.registry.version
+            self.state.snapshot_files = files
+            self.state.snapshot_key = self.state.files_key
+            self.state.snapshot_time = time.monotonic()
+
+    def finish_resume(self) -> None:
+        """Finish restoring a session: load the labels saved in the json file
+        for the directory and move the counter to the saved file, or past it
+        to the first unlabeled file. Waits while the directory is still being
+        listed and the saved file has not been listed yet."""
+        if not self.state.resume_pending or not isinstance(self.state.files, FileView):
+            return
+        files = self.state.files
+        registry = files.registry
+        name = self.state.resume_file
+        file_id = registry.id_of(name) if name else None
+        if name and file_id is None and self.is_indexing():
+            return
+        self.state.annotations = self.load_annotations(registry)
+        counter = min(self.state.counter, len(files))
+        if file_id is not None and not (
+            counter < len(files) and files.ids[counter] == file_id
+        ):
+            with suppress(ValueError):
+                counter = files.ids.index(file_id)
+        is_labeled = self.state.annotations.is_labeled
+        while counter < len(files) and is_labeled(files.ids[counter]):
+            counter += 1
+        self.state.counter = counter
+        self.state.resume_pending = False
+        self.state.resume_file = None
+
+    def load_annotations(self, registry: FileRegistry) -> AnnotationMap:
+        """Load the labels saved in the json file for the current directory.
+
+        Args:
+            registry (FileRegistry): Registry of the current directory.
+
+        Returns:
+            AnnotationMap: Labels of the files that are still present.
+        """
+        annotations = AnnotationMap(registry)
+        if not os.path.exists(self.state.json_path):
+            return annotations
+        labels = json_labels(load_json(self.state.json_path), self.state.img_dir)
+        for file, label in labels.items():
+            if file in registry:
+                annotations[file] = label
+        missing = len(labels) - len(annotations)
+        if missing and registry.is_manifest and not self.is_indexing():
+            st.warning(
+                f"{missing} labeled files in the json file are not listed in "
+                f"{self.state.img_dir} and were not loaded."
+            )
+        return annotations
+
+    def save_session(self) -> None:
+        """Save a snapshot of the session for `restore_session`. The
+        directory, filters and position are saved when one of them changed,
+        the file list only when it changed: right away if it was rebuilt,
+        otherwise at most every `SNAPSHOT_INTERVAL` seconds."""
+        if (
+            not self.resume_session
+            or self.state.work_queue
+            or self.state.resume_pending
+            or not isinstance(self.state.files, FileView)
+        ):
+            return
+        state = {key: getattr(self.state, key, None) for key in SNAPSHOT_KEYS}
+        session_id = self.state.session_id
+        # Compared as JSON, since lists like split_keywords change in place
+        saved = json.dumps(state)
+        if saved != self.state.snapshot_state:
+            save_state(state, self.state.json_path, session_id)
+            self.state.snapshot_state = saved
+        if self.state.files is self.state.snapshot_files:
+            return
+        now = time.monotonic()
+        if (
+            self.state.snapshot_key == self.state.files_key
+            and now - self.state.snapshot_time < SNAPSHOT_INTERVAL
+        ):
+            return
+        save_files(self.state.files, state, self.state.json_path, session_id)
+        self.state.snapshot_files = self.state.files
+        self.state.snapshot_key = self.state.files_key
+        self.state.snapshot_time = now
+
     def reset_imgs(self) -> None:
         """Reset variables when a directory is changed."""
         img_file_names = self.get_imgs()
         self.state.counter = 0
-        self.state.annotations = {}
+        self.state.annotations = AnnotationMap(img_file_names.registry)
         self.state.files = img_file_names
+        self.state.suggestions = {}
+        self.state.suggestion_job = None
+        self.state.bulk_matches = []
+        self.state.bulk_written = None
+        if self.state.work_queue:
+            self.lease_files(img_file_names)
+        else:
+            self.reset_order()
         if self.state.files:
             self.state.current_file = self.state.files[self.state.counter]
         self.remaining = len(self.state.files)
         self.n_annotated = 0
-        self.info_placeholder.info(
-            f"Annotated: {self.n_annotated}, Remaining: {self.remaining}"
-        )
+        if self.info_placeholder is not None:
+            self.info_placeholder.info(
+                f"Annotated: {self.n_annotated}, Remaining: {self.remaining}"
+            )
 
     def change_dir(self) -> None:
         """Change directory and reset images."""
         new_dir = getattr(self.state, "_img_dir", None)
-        if not new_dir or not os.path.isdir(new_dir):
-            st.error(f"{new_dir!r} is not a valid directory. Please enter another one.")
+        if not new_dir or not is_image_source(new_dir):
+            st.error(
+                f"{new_dir!r} is not a valid directory or manifest. "
+                "Please enter another one."
+            )
         else:
             self.state.img_dir = new_dir
+            # Lists the directory in the background; reset_imgs only takes
+            # the files listed so far
+            start_indexing(new_dir, self.index_images)
             self.reset_imgs()
 
     def update_categories(self) -> None:
@@ -361,26 +978,271 @@ class Annotator:
         else:
             self.state.split_keywords = []
 
-    def keyword_move_files(self) -> None:
-        """Move files based on keywords."""
+    def keyword_move_files(self, dry_run: bool = False) -> None:
+        """Move files based on keywords.
+
+        Args:
+            dry_run (bool, optional): If True, only report how many files
+                would be moved to each keyword's folder. Defaults to False.
+        """
+        if dry_run:
+            if self.state.split_keywords:
+                self.make_folders_move_files(use_keywords=True, dry_run=True)
+            return
         self.state._keywords = ""
         if self.state.split_keywords:
             self.make_folders_move_files(use_keywords=True)
             self.state.split_keywords = []
             self.reset_imgs()
 
+    def change_manifest_filter(self) -> None:
+        """Change the manifest column filter if the conditions parse."""
+        new_filter = getattr(self.state, "_manifest_filter", "") or ""
+        try:
+            parse_conditions(new_filter)
+        except ValueError as err:
+            st.error(str(err))
+            return
+        self.state.manifest_filter = new_filter
+        self.state.counter = 0
+
+    def change_size_filter(self) -> None:
+        """Change the image size filter if the conditions parse."""
+        new_filter = getattr(self.state, "_size_filter", "") or ""
+        try:
+            parse_header_conditions(new_filter)
+        except ValueError as err:
+            st.error(str(err))
+            return
+        self.state.size_filter = new_filter
+        self.state.counter = 0
+
+    def change_sort_key(self) -> None:
+        """Change the order files are shown in."""
+        self.state.sort_key = getattr(self.state, "_sort_key", "name") or "name"
+        self.state.counter = 0
+
+    def change_duplicates(self) -> None:
+        """Change what is done with duplicate images. Labeling them applies
+        the labels of their annotated twins right away."""
+        self.state.duplicates = getattr(self.state, "_duplicates", "show") or "show"
+        if self.state.duplicates == "label":
+            n_labeled = self.label_duplicates()
+            st.info(f"labeled {n_labeled} duplicates like their twins")
+        else:
+            self.state.counter = 0
+
+    def change_work_queue(self) -> None:
+        """Turn work queue mode on or off. Turning it off gives this session's
+        leased files back to the other sessions."""
+        self.state.work_queue = bool(getattr(self.state, "_work_queue", False))
+        if not self.state.work_queue:
+            self.get_lease_queue().release()
+        self.state.counter = 0
+
+    def change_suggest(self) -> None:
+        """Turn label suggestions on or off, computing them when turned on."""
+        self.state.suggest = bool(getattr(self.state, "_suggest", False))
+        if self.state.suggest:
+            self.update_suggestions()
+
+    def change_suggest_threshold(self) -> None:
+        """Change the confidence needed to bulk confirm a suggestion."""
+        self.state.suggest_threshold = float(
+            getattr(self.state, "_suggest_threshold", self.state.suggest_threshold)
+        )
+
+    def update_suggestions(self) -> None:
+        """Start training on the annotations so far and suggesting a label for
+        each of the remaining files in the background. `suggestion_controls`
+        shows the job's progress and takes its suggestions once it is done."""
+        job = SuggestionJob(
+            self.state.img_dir,
+            self.state.annotations,
+            self.state.files[self.state.counter :],
+        )
+        job.start()
+        self.state.suggestion_job = job
+
+    def collect_suggestions(self) -> bool:
+        """Take the suggestions of a finished suggestion job into
+        ``state.suggestions``.
+
+        Returns:
+            bool: True while the job is still running.
+        """
+        job = self.state.suggestion_job
+        if job is None:
+            return False
+        if not job.finished:
+            return True
+        self.state.suggestion_job = None
+        if job.error is not None:
+            st.error(f"Suggesting labels failed: {job.error}")
+        else:
+            self.state.suggestions = job.result
+        return False
+
+    def suggestion_progress(self) -> None:
+        """Show the suggestion job's progress. The whole app is rerun once the
+        job is done, so the suggestions are shown."""
+        job = self.state.suggestion_job
+        if job is None or job.finished:
+            st.rerun()
+            return
+        st.progress(
+            job.fraction, text=f"Suggesting labels: {job.done:,} / {job.total:,}"
+        )
+
+    def _remaining_suggestions(self) -> tuple[FileView, np.ndarray, np.ndarray]:
+        """Look up the suggestions of the remaining files by registry id."""
+        remaining = self.state.files[self.state.counter :]
+        codes, confidence = self.state.suggestions.lookup(
+            np.frombuffer(remaining.ids, dtype=np.uint32)
+        )
+        return remaining, codes, confidence
+
+    def get_confident_suggestions(self) -> dict[str, str]:
+        """Get the remaining unannotated files whose suggestion is at least as
+        confident as ``state.suggest_threshold``.
+
+        Returns:
+            dict[str, str]: File name to suggested label, in ``state.files``
+                order.
+        """
+        if not self.state.suggestions:
+            return {}
+        remaining, codes, confidence = self._remaining_suggestions()
+        labels = self.state.suggestions.labels
+        confident = {}
+        for idx in np.flatnonzero(
+            (codes >= 0) & (confidence >= self.state.suggest_threshold)
+        ):
+            file = remaining[int(idx)]
+            if file not in self.state.annotations:
+                confident[file] = labels[codes[idx]]
+        return confident
+
+    def sort_by_confidence(self) -> None:
+        """Reorder the remaining files so the most confident suggestions come
+        first. Files without a suggestion go last."""
+        if self.state.suggestions:
+            remaining, codes, confidence = self._remaining_suggestions()
+            # Stable, so ties and files without a suggestion keep their order
+            order = np.argsort(np.where(codes >= 0, -confidence, 1.0), kind="stable")
+            ids = np.frombuffer(remaining.ids, dtype=np.uint32)[order]
+            self.state.files = FileView(
+                self.state.files.registry,
+                self.state.files.ids[: self.state.counter] + array("I", ids.tobytes()),
+            )
+        self.state.name_order = False
+        self.set_current_file()
+
+    def confirm_suggestions(self) -> None:
+        """Accept every suggestion from `get_confident_suggestions` with
+        `annotate_files`."""
+        self.annotate_files(self.get_confident_suggestions())
+
+    def change_cluster_order(self) -> None:
+        """Turn cluster order on or off. Turning it off puts the remaining
+        files back in ``state.sort_key`` order."""
+        self.state.cluster_order = bool(getattr(self.state, "_cluster_order", False))
+        if self.state.cluster_order:
+            self.cluster_files()
+        else:
+            self.state.clusters = {}
+            self.state.files = sort_view(
+                self.state.files, self.state.counter, self.state.sort_key
+            )
+            self.set_current_file()
+
+    def cluster_files(self) -> None:
+        """Cluster the remaining files by their image features and reorder them
+        cluster by cluster, largest cluster first."""
+        remaining = list(self.state.files[self.state.counter :])
+        if not remaining:
+            return
+        order, labels = cluster_order(directory_features(self.state.img_dir, remaining))
+        position = {remaining[idx]: pos for pos, idx in enumerate(order)}
+        self.state.files = self.state.files.reordered(
+            self.state.counter, position.__getitem__
+        )
+        self.state.clusters = {
+            file: int(label) for file, label in zip(remaining, labels)
+        }
+        self.state.name_order = False
+        self.set_current_file()
+
+    def get_cluster_rest(self) -> list[str]:
+        """Get the unannotated files from the counter on that are in the same
+        cluster as the current file.
+
+        Returns:
+            list[str]: File names in ``state.files`` order, starting with the
+                current file. Empty if the current file is not clustered.
+        """
+        clusters = self.state.clusters
+        current = clusters.get(self.state.current_file)
+        if current is None:
+            return []
+        return [
+            file
+            for file in self.state.files[self.state.counter :]
+            if clusters.get(file) == current and file not in self.state.annotations
+        ]
+
+    def change_bulk_query(self) -> None:
+        """Evaluate a new bulk annotation query over the remaining unannotated
+        files and keep the matches, so their count can be shown before they
+        are labeled."""
+        query = getattr(self.state, "_bulk_query", "") or ""
+        self.state.bulk_query = query
+        self.state.bulk_written = None
+        if not query.strip():
+            self.state.bulk_matches = []
+            return
+        remaining = [
+            file
+            for file in self.state.files[self.state.counter :]
+            if file not in self.state.annotations
+        ]
+        try:
+            self.state.bulk_matches = find_matches(
+                self.state.img_dir, remaining, query, self.state.sep
+            )
+        except ValueError as err:
+            st.error(str(err))
+            self.state.bulk_matches = []
+
+    def bulk_annotate(self) -> None:
+        """Give every file matching the bulk query the label picked next to
+        the button, with `annotate_files`, and keep the number written."""
+        label = getattr(self.state, "_bulk_label", None)
+        if not label:
+            return
+        remaining = set(self.state.files[self.state.counter :])
+        labels = {
+            file: label
+            for file in self.state.bulk_matches
+            if file in remaining and file not in self.state.annotations
+        }
+        self.state.bulk_written = (self.annotate_files(labels), label)
+        self.state.bulk_matches = []
+
+    def label_rest_of_cluster(self) -> None:
+        """Give every remaining file in the current file's cluster the label
+        picked next to the button, with `annotate_files`."""
+        label = getattr(self.state, "_cluster_label", None)
+        if not label:
+            return
+        self.annotate_files(dict.fromkeys(self.get_cluster_rest(), label))
+
     def get_sep(self) -> None:
         """Get separator if provided by user."""
         self.state.sep = getattr(self.state, "_sep", self.state.sep)
 
     def set_ui_values(self) -> None:
         """Set the UI element values and change any display values needed."""
-        self.n_annotated = len(self.state.annotations)
-        self.remaining = len(self.state.files) - self.state.counter
-        self.back_placeholder.button("BACK", on_click=self.change_img, args=(-1,))
-        self.info_placeholder.info(
-            f"Annotated: {self.n_annotated}, Remaining: {self.remaining}"
-        )
         (
             self.move_col,
             self.clear_col,
@@ -406,6 +1268,74 @@ class Annotator:
                 value=self.image_dir,
                 key="_img_dir",
                 on_change=self.change_dir,
+                help="A .csv, .jsonl or .parquet manifest listing image files, \
+                    or a .zip or .tar archive, can be used instead of a \
+                    directory.",
+            )
+            if is_manifest(self.state.img_dir):
+                st.text_input(
+                    "manifest filter",
+                    value=self.state.manifest_filter,
+                    key="_manifest_filter",
+                    on_change=self.change_manifest_filter,
+                    help="Comma separated column conditions, \
+                        e.g. `seed=42, prompt~cat, width>=1024`.",
+                )
+            st.text_input(
+                "size filter",
+                value=self.state.size_filter,
+                key="_size_filter",
+                on_change=self.change_size_filter,
+                help="Comma separated conditions on width, height, aspect, \
+                    megapixels, mode and format, read from the image headers, \
+                    e.g. `width>=2048, aspect>1, format=PNG`.",
+            )
+            st.selectbox(
+                "sort by",
+                SORT_KEYS,
+                index=SORT_KEYS.index(self.state.sort_key),
+                key="_sort_key",
+                on_change=self.change_sort_key,
+            )
+            st.selectbox(
+                "duplicates",
+                list(DUPLICATE_MODES),
+                index=list(DUPLICATE_MODES).index(self.state.duplicates),
+                format_func=DUPLICATE_MODES.get,
+                key="_duplicates",
+                on_change=self.change_duplicates,
+                help="Byte-identical copies of an image (e.g. from retries) can \
+                    be hidden from the queue, or labeled automatically with the \
+                    label of the copy that was annotated first.",
+            )
+            st.checkbox(
+                "Work Queue",
+                value=self.state.work_queue,
+                key="_work_queue",
+                on_change=self.change_work_queue,
+                help="If checked, this session is handed batches of files that \
+                    no other session with the same json file is working on.",
+            )
+            st.checkbox(
+                "Suggest Labels",
+                value=self.state.suggest,
+                key="_suggest",
+                on_change=self.change_suggest,
+                help="If checked, a label is suggested for each remaining image \
+                    from its colors, pixels and prompt, based on the images \
+                    annotated so far. The suggested button is highlighted.",
+            )
+            if self.state.suggest:
+                self.suggestion_controls()
+            self.bulk_controls()
+            st.checkbox(
+                "Cluster Order",
+                value=self.state.cluster_order,
+                key="_cluster_order",
+                on_change=self.change_cluster_order,
+                help="If checked, the remaining images are grouped by \
+                    similarity and shown cluster by cluster, with a button to \
+                    label the rest of the current cluster at once.",
             )
             show_categories = self.state.categories
             if isinstance(show_categories, list):
@@ -416,9 +1346,6 @@ class Annotator:
                 key="_categories",
                 on_change=self.update_categories,
             )
-            self.button_cols = self.options_buttons_placeholder.columns(
-                len(self.state.split_categories)
-            )
             subcol1, subcol2, subcol3 = st.columns(3)
             self.keyword_filter = subcol1.checkbox(
                 "Keyword Filter",
@@ -453,52 +1380,403 @@ class Annotator:
                         "Clicking this will move any files with matching keywords \
                         to folders in order of keyword!"
                     )
+                    self.key2.button(
+                        "Dry run",
+                        on_click=self.keyword_move_files,
+                        args=(True,),
+                        help="Show how many files would be moved to each folder.",
+                    )
                     self.key2.button("Keyword MOVE", on_click=self.keyword_move_files)
         if self.clear_annotations:
             if self.state.files and self.state.json_path:
-                save_json({}, self.state.json_path)
+                with json_lock(self.state.json_path):
+                    save_json({}, self.state.json_path)
             self.reset_imgs()
         if self.add_hide_button:
             self.reset_col.button("CLEAR", on_click=self.change_hide_state)
-        if self.state.counter < len(self.state.files):
-            if self.state.hide_state == 0:
-                self.file_path = os.path.join(
-                    self.state.img_dir, self.state.current_file
-                )
-                prompts, meta_data = get_metadata_str(self.file_path)
-                if self.state.show_prompt:
-                    self.prompt_info.markdown(prompts, unsafe_allow_html=True)
-                if self.state.show_meta:
-                    self.meta_info.markdown(meta_data, unsafe_allow_html=True)
-                image = load_image(
-                    self.file_path, self.img_height_clamp, self.state.clamp_state
-                )
-                st.image(image, use_container_width=False)
-                st.write(self.state.current_file)
-                json_dict = {
-                    "directory": self.state.img_dir,
-                    "files": self.state.annotations,
-                }
+        with self.nav_container:
+            self.image_pane()
+
+    def suggestion_controls(self) -> None:
+        """Render the buttons to update suggestions, sort the remaining files
+        by confidence and bulk confirm the confident ones. While suggestions
+        are being made, their progress is shown instead of the hint."""
+        running = self.collect_suggestions()
+        if running:
+            st.fragment(self.suggestion_progress, run_every=INDEX_POLL_INTERVAL)()
+        elif not self.state.suggestions:
+            st.caption(
+                f"Annotate at least {MIN_TRAINING_LABELS} images with two or \
+                more categories, then update the suggestions."
+            )
+        st.slider(
+            "confirm threshold",
+            0.5,
+            1.0,
+            value=self.state.suggest_threshold,
+            step=0.05,
+            key="_suggest_threshold",
+            on_change=self.change_suggest_threshold,
+            help="Suggestions at least this confident are confirmed together.",
+        )
+        n_confident = len(self.get_confident_suggestions())
+        sugcol1, sugcol2, sugcol3 = st.columns(3)
+        sugcol1.button(
+            "Update Suggestions", on_click=self.update_suggestions, disabled=running
+        )
+        sugcol2.button("Sort by Confidence", on_click=self.sort_by_confidence)
+        sugcol3.button(
+            f"Confirm {n_confident}",
+            on_click=self.confirm_suggestions,
+            disabled=not n_confident,
+        )
+
+    def bulk_controls(self) -> None:
+        """Render the bulk annotation query, its match count, a category
+        picker and the button that labels all matches."""
+        st.text_input(
+            "bulk annotate query",
+            value=self.state.bulk_query,
+            key="_bulk_query",
+            on_change=self.change_bulk_query,
+            help="Comma separated file name keywords and metadata conditions, \
+                e.g. `sampler=Euler a, prompt~blurry`. Every remaining file \
+                that matches all of them can be labeled at once.",
+        )
+        if self.state.bulk_written is not None:
+            written, label = self.state.bulk_written
+            st.success(f"Wrote {written} labels ({label}).")
+        if not self.state.bulk_query:
+            return
+        n_matches = len(self.state.bulk_matches)
+        st.caption(f"{n_matches} matching files")
+        labelcol, buttoncol = st.columns([3, 2])
+        labelcol.selectbox(
+            "bulk label",
+            self.state.split_categories,
+            key="_bulk_label",
+            label_visibility="collapsed",
+        )
+        buttoncol.button(
+            f"Label {n_matches} Matches",
+            on_click=self.bulk_annotate,
+            disabled=not n_matches,
+        )
+
+    @st.fragment
+    def image_pane(self) -> None:
+        """Render the navigation buttons, annotation info, category buttons and
+        the current image.
+
+        This is a Streamlit fragment, so clicking BACK or a category button
+        only reruns this method instead of rebuilding the sidebar, expander
+        and checkboxes. Widgets are drawn into `nav_container` (the fragment
+        body) while the image, prompt and metadata are written into
+        placeholders created by `set_ui`.
+        """
+        with self.fragment_profile("image_pane"):
+            if is_image_source(self.state.img_dir):
+                self.sync_files()
+                if self.state.work_queue:
+                    if self.state.counter >= len(self.state.files):
+                        self.lease_files()
+                    else:
+                        self.get_lease_queue().renew()
+                self.set_current_file()
+                self.save_session()
+            self.n_annotated = len(self.state.annotations)
+            self.remaining = len(self.state.files) - self.state.counter
+            self.back_placeholder = st.empty()
+            self.info_placeholder = st.empty()
+            self.options_buttons_placeholder = st.empty()
+            self.back_placeholder.button("BACK", on_click=self.change_img, args=(-1,))
+            self.info_placeholder.info(
+                f"Annotated: {self.n_annotated}, Remaining: {self.remaining}"
+            )
+            if self.state.counter >= len(self.state.files):
+                self.image_placeholder.empty()
+                self.options_buttons_placeholder.info("Everything is annotated.")
+                return
+            self.button_cols = self.options_buttons_placeholder.columns(
+                len(self.state.split_categories)
+            )
+            if self.state.hide_state != 0:
+                self.image_placeholder.empty()
                 for idx, option in enumerate(self.state.split_categories):
-                    self.button_cols[idx].button(
-                        option,
-                        on_click=self.annotate,
-                        args=(option, json_dict, self.state.json_path),
+                    self.button_cols[idx].button(option)
+                return
+            self.file_path = get_file_path(self.state.img_dir, self.state.current_file)
+            prompts, meta_data = get_metadata_str(self.file_path)
+            if self.state.show_prompt:
+                self.prompt_info.markdown(prompts, unsafe_allow_html=True)
+            if self.state.show_meta:
+                self.meta_info.markdown(meta_data, unsafe_allow_html=True)
+            if not self.state.clamp_state:
+                self.show_image(
+                    encode_image(
+                        self.zoom_view(),
+                        self.preview_format,
+                        self.preview_quality,
+                        self.get_byte_budget(),
+                        webp=False,
                     )
+                )
+            elif self.static_previews:
+                self.show_static_preview()
             else:
-                for idx, option in enumerate(self.state.split_categories):
-                    self.button_cols[idx].button(option)
+                self.show_clamped_preview()
+            json_dict = {"directory": self.state.img_dir}
+            suggested = self.show_suggestion()
+            for idx, option in enumerate(self.state.split_categories):
+                self.button_cols[idx].button(
+                    option,
+                    on_click=self.annotate,
+                    args=(option, json_dict, self.state.json_path),
+                    type="primary" if option == suggested else "secondary",
+                )
+            if self.state.cluster_order:
+                self.cluster_controls()
+            if self.state.clamp_state:
+                self.prefetch_next()
 
-        else:
-            self.options_buttons_placeholder.info("Everything is annotated.")
+    def cluster_controls(self) -> None:
+        """Render a category picker and a button that labels the rest of the
+        current file's cluster, if it has more than one file left."""
+        n_rest = len(self.get_cluster_rest())
+        if n_rest < 2:
+            return
+        labelcol, buttoncol = st.columns([3, 2])
+        labelcol.selectbox(
+            "label rest of cluster",
+            self.state.split_categories,
+            key="_cluster_label",
+            label_visibility="collapsed",
+        )
+        buttoncol.button(
+            f"Label {n_rest} in Cluster", on_click=self.label_rest_of_cluster
+        )
+
+    def show_suggestion(self) -> str | None:
+        """Add the current file's suggested label and its confidence to the
+        annotation info.
+
+        Returns:
+            str | None: Suggested label, or None if suggestions are off or the
+                file has none.
+        """
+        if not self.state.suggest:
+            return None
+        suggestion = self.state.suggestions.get(self.state.current_file)
+        if suggestion is None:
+            return None
+        label, confidence = suggestion
+        self.info_placeholder.info(
+            f"Annotated: {self.n_annotated}, Remaining: {self.remaining}, "
+            f"Suggested: {label} ({confidence:.0%})"
+        )
+        return label
+
+    def load_current_preview(self) -> Image.Image:
+        """Decode the clamped preview of the current image."""
+        return load_preview(
+            self.file_path,
+            self.img_height_clamp,
+            self.state.clamp_state,
+            self.decode_workers,
+        )
+
+    def get_byte_budget(self) -> int:
+        """Get the byte budget of a preview: ``preview_max_bytes`` from the
+        config, or `byte_budget` of the clamp height."""
+        if self.preview_max_bytes is not None:
+            return self.preview_max_bytes
+        return byte_budget(self.img_height_clamp)
+
+    def encode_current_preview(self, webp: bool) -> EncodedPreview:
+        """Encode the clamped preview of the current image for the browser.
+
+        Args:
+            webp (bool): False if the preview is shown with ``st.image``, which
+                re-encodes WebP.
+
+        Returns:
+            EncodedPreview: Bytes to send, with their format and quality.
+        """
+        return encode_preview(
+            self.file_path,
+            self.img_height_clamp,
+            self.state.clamp_state,
+            self.load_current_preview,
+            self.preview_format,
+            self.preview_quality,
+            self.get_byte_budget(),
+            webp,
+        )
+
+    def show_image(self, encoded: EncodedPreview) -> None:
+        """Draw an encoded image, the current file name and the payload size
+        in the image placeholder.
+
+        Args:
+            encoded (EncodedPreview): JPEG or PNG bytes to show.
+        """
+        self.state.payload_bytes = len(encoded.data)
+        with self.image_placeholder.container():
+            st.image(
+                encoded.data,
+                use_container_width=False,
+                output_format=encoded.format,
+            )
+            st.write(self.state.current_file)
+            st.caption(
+                payload_label(
+                    len(encoded.data),
+                    encoded.format,
+                    encoded.quality,
+                    encoded.passthrough,
+                )
+            )
+
+    def show_clamped_preview(self) -> None:
+        """Show the clamped preview of the current image with ``st.image``.
+        A placeholder is shown first only if the preview is not cached and
+        has to be decoded."""
+        encoded = cached_preview(
+            self.file_path,
+            self.img_height_clamp,
+            self.state.clamp_state,
+            self.preview_format,
+            self.preview_quality,
+            self.get_byte_budget(),
+            webp=False,
+        )
+        if encoded is None:
+            self.show_placeholder()
+            encoded = self.encode_current_preview(webp=False)
+        self.show_image(encoded)
+
+    def show_static_preview(self) -> None:
+        """Show the current image from a URL under Streamlit's static directory
+        so the browser can cache it. The preview is only decoded (after
+        showing a placeholder) the first time it is published."""
+        url = published_preview_url(
+            self.file_path, self.img_height_clamp, self.state.clamp_state
+        )
+        if url is None:
+            self.show_placeholder()
+            url = publish_preview(
+                self.file_path,
+                self.img_height_clamp,
+                self.state.clamp_state,
+                partial(self.encode_current_preview, webp=True),
+            )
+        src = static_url(url, st.get_option("server.baseUrlPath"))
+        published = preview_file(url)
+        self.state.payload_bytes = published.stat().st_size
+        with self.image_placeholder.container():
+            st.markdown(f'<img src="{html.escape(src)}">', unsafe_allow_html=True)
+            st.write(self.state.current_file)
+            st.caption(
+                payload_label(self.state.payload_bytes, published.suffix[1:].upper())
+            )
+
+    def zoom_view(self) -> Image.Image:
+        """Render the zoom and pan controls and get the visible region of the
+        current image from its tile pyramid. Used instead of the full-resolution
+        image when "Clamp Height" is unchecked.
+
+        Returns:
+            Image.Image: Visible region, at most `VIEWPORT_WIDTH` wide and
+                ``img_height_clamp`` high.
+        """
+        zoom = st.select_slider(
+            "Zoom",
+            options=ZOOM_LEVELS,
+            value="fit",
+            format_func=zoom_label,
+            key="_zoom",
+        )
+        pan_x = st.slider("Pan X", 0.0, 1.0, 0.5, key="_pan_x")
+        pan_y = st.slider("Pan Y", 0.0, 1.0, 0.5, key="_pan_y")
+        pyramid = get_pyramid(self.file_path)
+        view_size = (VIEWPORT_WIDTH, self.img_height_clamp)
+        level = pyramid.fit_level(view_size) if zoom == "fit" else int(zoom)
+        return pyramid.viewport(level, (pan_x, pan_y), view_size)
+
+    def show_placeholder(self) -> None:
+        """Show a low-resolution version of the current image, scaled to the
+        size of the full image, until the full image is decoded. Does nothing
+        if there is no fast way to get one."""
+        placeholder = load_placeholder(self.file_path)
+        if placeholder is None:
+            return
+        width, _ = preview_size(
+            self.file_path, self.img_height_clamp, self.state.clamp_state
+        )
+        with self.image_placeholder.container():
+            st.image(placeholder, width=width)
+            st.write(self.state.current_file)
+
+    def prefetch_next(self) -> None:
+        """Start decoding the next few images in the decode pool so the
+        following clicks do not wait for them. Does nothing unless
+        ``decode_workers`` is set in the config."""
+        if not self.decode_workers:
+            return
+        start = self.state.counter + 1
+        prefetch_previews(
+            (
+                get_file_path(self.state.img_dir, file)
+                for file in self.state.files[start : start + PREFETCH_AHEAD]
+            ),
+            self.img_height_clamp,
+            self.state.clamp_state,
+            self.decode_workers,
+        )
+
+    def fragment_profile(self, fragment: str) -> AbstractContextManager[None]:
+        """Trace a rerun of only ``fragment`` when ``memory_profile`` is set in
+        the config (see `memprofile.fragment_window`).
+
+        Args:
+            fragment (str): Name of the fragment, e.g. ``"image_pane"``.
+
+        Returns:
+            AbstractContextManager[None]: Context to run the fragment in.
+        """
+        if not self.memory_profile:
+            return nullcontext()
+        return fragment_window("annotator", fragment, self.state, self.memory_log)
+
+    def memory_panel(self) -> None:
+        """Record the memory profile of this rerun, append it to the memory
+        log and show it in a sidebar expander. Only used when
+        ``memory_profile`` is set in the config."""
+        report = finish_rerun("annotator", self.state)
+        write_report(report, self.memory_log)
+        with st.sidebar.expander("Memory profile"):
+            st.write(
+                f"Traced: {format_bytes(report.current)}, "
+                f"peak this rerun: {format_bytes(report.peak)}"
+            )
+            for title, rows in report_rows(report).items():
+                st.caption(title)
+                st.dataframe(rows, hide_index=True)
+            if st.button("Save snapshot", help="Dump every traced allocation."):
+                st.write(f"Saved {dump_snapshot()}")
+            st.caption(f"Reports are appended to {self.memory_log}")
 
     def run(self) -> None:
         """Method that keeps track of the order of methods called."""
         self.get_config_data()
+        if self.memory_profile:
+            start_rerun()
         self.set_state_dict()
         self.set_ui()
         self.set_dir()
         self.set_ui_values()
+        if self.memory_profile:
+            self.memory_panel()
 
 
 if __name__ == "__main__":
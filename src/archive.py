@@ -0,0 +1,415 @@
+"""Zip and tar archives used in place of an image directory.
+
+An archive is indexed once per version of the file, from the zip central
+directory or the tar member headers, into member name to byte offset. The
+archive is memory-mapped and members are read as `memoryview` slices of the
+map, so nothing is extracted to disk and reading an image header only touches
+the bytes the decoder asks for. Deflated zip members are inflated straight
+from the map. Compressed tarballs (``.tar.gz``) have no random access and are
+not supported; decompress them to ``.tar`` first.
+
+Images in an archive are addressed as ``<archive path>/<member name>``, so the
+paths built by `utils.get_file_path` can be passed to `open_image`,
+`open_file` and `file_mtime_ns` like ordinary file paths."""
+
+from __future__ import annotations
+
+import io
+import json
+import mmap
+import os
+import struct
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from PIL import Image
+
+__all__ = [
+    "ARCHIVE_SUFFIXES",
+    "MAX_OPEN_ARCHIVES",
+    "ArchiveIndex",
+    "MemberFile",
+    "archive_files",
+    "file_mtime_ns",
+    "get_index",
+    "is_archive",
+    "label_manifest_path",
+    "open_file",
+    "open_image",
+    "read_member",
+    "split_archive_path",
+    "write_label_manifests",
+]
+
+ARCHIVE_SUFFIXES = (".zip", ".tar")
+# Indexed (and memory-mapped) archives kept open per process
+MAX_OPEN_ARCHIVES = 8
+# Fixed part of a zip local file header, up to the name and extra lengths
+_LOCAL_HEADER = struct.Struct("<4s22xHH")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+_indexes: OrderedDict[str, ArchiveIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+class _Member(NamedTuple):
+    """Where a member's bytes are: for zip members ``offset`` is the local
+    header, for tar members the data itself."""
+
+    offset: int
+    size: int
+    compression: int
+
+
+def is_archive(path: str | Path) -> bool:
+    """Check if a path is a zip or tar archive used as the image "directory".
+
+    Args:
+        path (str | Path): Path provided as the image "directory".
+
+    Returns:
+        bool: True if the path is a file with an archive suffix.
+    """
+    return Path(path).suffix.lower() in ARCHIVE_SUFFIXES and os.path.isfile(path)
+
+
+def split_archive_path(path: str) -> tuple[str, str] | None:
+    """Split the path of an image inside an archive into the archive path and
+    the member name.
+
+    Args:
+        path (str): Path that may point into an archive, e.g.
+            ``/data/batch.zip/images/0001.png``.
+
+    Returns:
+        tuple[str, str] | None: Archive path and member name (with ``/``
+            separators), or None if no parent of ``path`` is an archive.
+    """
+    lowered = path.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        start = lowered.find(suffix)
+        while start != -1:
+            end = start + len(suffix)
+            if end < len(path) and path[end] in "/\\" and is_archive(path[:end]):
+                return path[:end], path[end + 1 :].replace("\\", "/")
+            start = lowered.find(suffix, end)
+    return None
+
+
+def _member_name(name: str) -> str:
+    return name[2:] if name.startswith("./") else name
+
+
+class ArchiveIndex:
+    """Random-access index of the members of one archive."""
+
+    def __init__(self, path: str):
+        """Index an archive and memory-map it.
+
+        Args:
+            path (str): Path to a ``.zip`` or ``.tar`` file.
+
+        Raises:
+            OSError: If the archive cannot be read or is not a valid zip or
+                uncompressed tar file.
+        """
+        self.path = path
+        stat = os.stat(path)
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        try:
+            if Path(path).suffix.lower() == ".zip":
+                self.members = self._index_zip(path)
+            else:
+                self.members = self._index_tar(path)
+        except (zipfile.BadZipFile, tarfile.TarError) as err:
+            raise OSError(f"Cannot index archive {path}: {err}") from err
+        with open(path, "rb") as infile:
+            self._map = (
+                mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                if stat.st_size
+                else b""
+            )
+        self._view = memoryview(self._map)
+
+    @staticmethod
+    def _index_zip(path: str) -> dict[str, _Member]:
+        """Read the central directory; local headers are only read on access."""
+        with zipfile.ZipFile(path) as archive:
+            return {
+                info.filename: _Member(
+                    info.header_offset, info.compress_size, info.compress_type
+                )
+                for info in archive.infolist()
+                if not info.is_dir() and not info.flag_bits & 0x1
+            }
+
+    @staticmethod
+    def _index_tar(path: str) -> dict[str, _Member]:
+        """Walk the member headers, seeking past the data of each member."""
+        with tarfile.open(path, "r:") as archive:
+            return {
+                _member_name(info.name): _Member(info.offset_data, info.size, -1)
+                for info in archive
+                if info.isreg() and not info.issparse()
+            }
+
+    def names(self) -> list[str]:
+        """Get the names of the file members.
+
+        Returns:
+            list[str]: Member names, in archive order.
+        """
+        return list(self.members)
+
+    def read(self, name: str) -> memoryview:
+        """Get the bytes of a member without copying stored data.
+
+        Args:
+            name (str): Member name.
+
+        Returns:
+            memoryview: Slice of the memory-mapped archive, or of the
+                inflated bytes for compressed zip members.
+
+        Raises:
+            FileNotFoundError: If there is no such member.
+            OSError: If the member uses an unsupported compression method.
+        """
+        member = self.members.get(name)
+        if member is None:
+            raise FileNotFoundError(f"No member {name!r} in {self.path}")
+        if member.compression < 0:
+            return self._view[member.offset : member.offset + member.size]
+        signature, name_len, extra_len = _LOCAL_HEADER.unpack_from(
+            self._map, member.offset
+        )
+        if signature != _LOCAL_HEADER_SIGNATURE:
+            raise OSError(f"Bad local header for {name!r} in {self.path}")
+        start = member.offset + _LOCAL_HEADER.size + name_len + extra_len
+        data = self._view[start : start + member.size]
+        if member.compression == zipfile.ZIP_STORED:
+            return data
+        if member.compression == zipfile.ZIP_DEFLATED:
+            try:
+                return memoryview(zlib.decompress(data, -zlib.MAX_WBITS))
+            except zlib.error as err:
+                raise OSError(f"Cannot inflate {name!r} in {self.path}") from err
+        with zipfile.ZipFile(self.path) as archive:
+            try:
+                return memoryview(archive.read(name))
+            except (NotImplementedError, RuntimeError) as err:
+                raise OSError(f"Cannot read {name!r} in {self.path}: {err}") from err
+
+
+def get_index(path: str) -> ArchiveIndex:
+    """Get the index of an archive, indexing it again if the file changed.
+
+    Args:
+        path (str): Archive path.
+
+    Returns:
+        ArchiveIndex: Index of the current version of the archive.
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(key)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None and index.version == (stat.st_mtime_ns, stat.st_size):
+            _indexes.move_to_end(key)
+            return index
+    index = ArchiveIndex(key)
+    with _indexes_lock:
+        # Evicted maps are closed by garbage collection once no member view
+        # refers to them
+        _indexes[key] = index
+        while len(_indexes) > MAX_OPEN_ARCHIVES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def archive_files(path: str) -> list[str]:
+    """List the file members of an archive.
+
+    Args:
+        path (str): Archive path.
+
+    Returns:
+        list[str]: Member names.
+
+    Raises:
+        OSError: If the archive cannot be read.
+    """
+    return get_index(path).names()
+
+
+def read_member(archive: str, name: str) -> memoryview:
+    """Get the bytes of an archive member (see `ArchiveIndex.read`).
+
+    Args:
+        archive (str): Archive path.
+        name (str): Member name.
+
+    Returns:
+        memoryview: Bytes of the member.
+    """
+    return get_index(archive).read(name)
+
+
+class MemberFile(io.RawIOBase):
+    """Read-only, seekable file over a buffer, so decoders read an archive
+    member in place and only the bytes they ask for are copied."""
+
+    def __init__(self, data: memoryview):
+        """Wrap the bytes of a member.
+
+        Args:
+            data (memoryview): Bytes to read.
+        """
+        super().__init__()
+        self._view = data
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def read(self, size: int | None = -1) -> bytes:
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        data = self._view[self._pos : end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:
+        target = memoryview(buffer).cast("B")
+        chunk = self._view[self._pos : self._pos + len(target)]
+        target[: len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+
+def open_file(path: str) -> BinaryIO:
+    """Open a file, or an archive member, for binary reading.
+
+    Args:
+        path (str): File path or ``<archive>/<member>`` path.
+
+    Returns:
+        BinaryIO: Readable, seekable file.
+    """
+    parts = split_archive_path(path)
+    if parts is None:
+        return open(path, "rb")
+    return MemberFile(read_member(*parts))
+
+
+def open_image(path: str) -> Image.Image:
+    """Open an image lazily, like `PIL.Image.open`, from a file or an
+    archive member.
+
+    Args:
+        path (str): File path or ``<archive>/<member>`` path.
+
+    Returns:
+        Image.Image: Image whose pixels are decoded on first access.
+    """
+    parts = split_archive_path(path)
+    if parts is None:
+        return Image.open(path)
+    return Image.open(MemberFile(read_member(*parts)))
+
+
+def file_mtime_ns(path: str) -> int:
+    """Get the modification time of a file; archive members have the time of
+    their archive, so caches keyed on it are invalidated when it is rewritten.
+
+    Args:
+        path (str): File path or ``<archive>/<member>`` path.
+
+    Returns:
+        int: Modification time in nanoseconds.
+
+    Raises:
+        OSError: If the file (or archive) does not exist.
+    """
+    parts = split_archive_path(path)
+    return os.stat(path if parts is None else parts[0]).st_mtime_ns
+
+
+def label_manifest_path(archive: str, label: str) -> str:
+    """Get the manifest that lists the images of an archive sorted to a label.
+
+    Args:
+        archive (str): Archive path.
+        label (str): Annotation label or keyword.
+
+    Returns:
+        str: ``<archive stem>_<label>.jsonl`` next to the archive.
+    """
+    archive_path = Path(archive)
+    return str(archive_path.with_name(f"{archive_path.stem}_{label}.jsonl"))
+
+
+def write_label_manifests(
+    archive: str, groups: Mapping[str, Iterable[str]]
+) -> dict[str, str]:
+    """Write one JSONL manifest per label listing the archive members sorted
+    to it, instead of extracting them into folders.
+
+    Paths in the manifests are relative to the archive's folder (e.g.
+    ``batch.zip/0001.png``), so a manifest can be opened as the image
+    "directory" to go through one label's images. Each manifest is rewritten
+    atomically with the complete list for its label.
+
+    Args:
+        archive (str): Archive path.
+        groups (Mapping[str, Iterable[str]]): Label to member names.
+
+    Returns:
+        dict[str, str]: Label to manifest path, for labels with members.
+    """
+    written = {}
+    archive_name = Path(archive).name
+    for label, members in groups.items():
+        rows = [
+            json.dumps({"file": f"{archive_name}/{member}", "label": label})
+            for member in members
+        ]
+        if not rows:
+            continue
+        target = label_manifest_path(archive, label)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(target)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as outfile:
+                outfile.write("\n".join(rows) + "\n")
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        written[label] = target
+    return written
@@ -0,0 +1,109 @@
+"""Find every file matching a query so they can be labeled in one batch.
+
+A query mixes file name keywords and metadata conditions, comma separated,
+e.g. ``cyberpunk, sampler=Euler a, prompt~blurry``. Parts with an operator are
+`utils.parse_conditions` conditions, checked against the manifest columns of
+a manifest or the generation metadata of each image otherwise. Parts without
+one are keywords that must all appear in the file name (see
+`utils.matches_keyword`)."""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+from registry import get_registry
+from utils import (
+    get_file_path,
+    get_metadata_dict,
+    matches_conditions,
+    matches_keyword,
+    parse_conditions,
+)
+
+__all__ = ["QUERY_WORKERS", "find_matches", "parse_query"]
+
+# Threads that read image metadata while evaluating a query
+QUERY_WORKERS = 8
+_OPERATOR_CHARS = "=<>!~"
+
+
+def parse_query(text: str) -> tuple[list[str], str]:
+    """Split a query into file name keywords and metadata conditions.
+
+    Args:
+        text (str): Comma separated keywords and conditions.
+
+    Returns:
+        tuple[list[str], str]: Keywords, and the conditions joined back into
+            `utils.parse_conditions` syntax.
+
+    Raises:
+        ValueError: If a condition does not parse.
+    """
+    keywords = []
+    conditions = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if any(char in part for char in _OPERATOR_CHARS):
+            conditions.append(part)
+        else:
+            keywords.append(part)
+    condition_text = ", ".join(conditions)
+    parse_conditions(condition_text)
+    return keywords, condition_text
+
+
+def _metadata_matches(image_path: str, conditions: list[tuple[str, str, str]]) -> bool:
+    try:
+        return matches_conditions(get_metadata_dict(image_path), conditions)
+    except (OSError, ValueError):
+        return False
+
+
+def find_matches(
+    img_dir: str,
+    files: Sequence[str],
+    query: str,
+    sep: str = " ",
+    workers: int = QUERY_WORKERS,
+) -> list[str]:
+    """Evaluate a query over files.
+
+    Keywords are checked first, so metadata is only read for files whose
+    names match.
+
+    Args:
+        img_dir (str): Image directory or manifest path.
+        files (Sequence[str]): File names to search.
+        query (str): Query in `parse_query` syntax.
+        sep (str, optional): Separator between words of file names. Defaults
+            to " ".
+        workers (int, optional): Threads that read image metadata. Defaults
+            to `QUERY_WORKERS`.
+
+    Returns:
+        list[str]: Matching file names, in ``files`` order.
+
+    Raises:
+        ValueError: If a condition does not parse.
+    """
+    keywords, condition_text = parse_query(query)
+    matches = [
+        file
+        for file in files
+        if all(matches_keyword(file, keyword, sep) for keyword in keywords)
+    ]
+    if not condition_text or not matches:
+        return matches
+    registry = get_registry(img_dir)
+    if registry.is_manifest:
+        allowed = set(registry.manifest_ids(condition_text))
+        return [file for file in matches if registry.id_of(file) in allowed]
+    conditions = parse_conditions(condition_text)
+    paths = [get_file_path(img_dir, file) for file in matches]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        keep = list(pool.map(lambda path: _metadata_matches(path, conditions), paths))
+    return [file for file, matched in zip(matches, keep) if matched]
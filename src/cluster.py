@@ -0,0 +1,154 @@
+"""Group similar images with k-means so they can be annotated together.
+
+k-means runs on `features` vectors with vectorized NumPy: k-means++ seeding
+and Lloyd iterations whose distance matrix is computed in row chunks."""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+__all__ = [
+    "KMEANS_ITERATIONS",
+    "MAX_CLUSTERS",
+    "TARGET_CLUSTER_SIZE",
+    "cluster_order",
+    "default_clusters",
+    "kmeans",
+]
+
+# Images per cluster aimed for when picking the number of clusters
+TARGET_CLUSTER_SIZE = 50
+# Upper bound on the number of clusters
+MAX_CLUSTERS = 256
+# Lloyd iterations run at most; stops early once no center moves
+KMEANS_ITERATIONS = 25
+# Rows whose distances to the centers are computed at once
+_ROW_CHUNK = 8192
+
+
+def default_clusters(n_items: int) -> int:
+    """Get the number of clusters used for ``n_items`` images.
+
+    Args:
+        n_items (int): Number of images.
+
+    Returns:
+        int: About one cluster per `TARGET_CLUSTER_SIZE` images, between 1
+            and `MAX_CLUSTERS`.
+    """
+    return max(1, min(MAX_CLUSTERS, math.ceil(n_items / TARGET_CLUSTER_SIZE)))
+
+
+def _sq_distances(points: np.ndarray, center: np.ndarray) -> np.ndarray:
+    diff = points - center
+    return np.einsum("ij,ij->i", diff, diff)
+
+
+def _assign(points: np.ndarray, centers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get the nearest center of each point and the squared distance to it."""
+    center_norms = np.einsum("ij,ij->i", centers, centers)
+    labels = np.empty(len(points), dtype=np.intp)
+    distances = np.empty(len(points), dtype=np.float32)
+    for start in range(0, len(points), _ROW_CHUNK):
+        chunk = points[start : start + _ROW_CHUNK]
+        # |x - c|^2 without the |x|^2 term, which is the same for every center
+        partial = center_norms - 2 * (chunk @ centers.T)
+        nearest = partial.argmin(axis=1)
+        labels[start : start + len(chunk)] = nearest
+        distances[start : start + len(chunk)] = np.maximum(
+            partial[np.arange(len(chunk)), nearest]
+            + np.einsum("ij,ij->i", chunk, chunk),
+            0,
+        )
+    return labels, distances
+
+
+def _seed_centers(points: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Pick ``k`` starting centers with k-means++."""
+    centers = np.empty((k, points.shape[1]), dtype=points.dtype)
+    centers[0] = points[rng.integers(len(points))]
+    closest = _sq_distances(points, centers[0])
+    for idx in range(1, k):
+        total = closest.sum()
+        if total > 0:
+            pick = rng.choice(len(points), p=closest / total)
+        else:
+            pick = rng.integers(len(points))
+        centers[idx] = points[pick]
+        closest = np.minimum(closest, _sq_distances(points, centers[idx]))
+    return centers
+
+
+def kmeans(
+    points: np.ndarray,
+    k: int,
+    iterations: int = KMEANS_ITERATIONS,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Cluster points with k-means.
+
+    Args:
+        points (np.ndarray): ``(n, d)`` array of vectors.
+        k (int): Number of clusters; lowered to ``n`` if larger.
+        iterations (int, optional): Maximum Lloyd iterations. Defaults to
+            `KMEANS_ITERATIONS`.
+        seed (int, optional): Seed of the k-means++ seeding, so the same
+            images are clustered the same way. Defaults to 0.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Cluster index of each point and the
+            ``(k, d)`` cluster centers.
+    """
+    points = np.asarray(points, dtype=np.float32)
+    k = min(k, len(points))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp), np.zeros((0, points.shape[1]), np.float32)
+    centers = _seed_centers(points, k, np.random.default_rng(seed))
+    labels, _ = _assign(points, centers)
+    for _ in range(iterations):
+        counts = np.bincount(labels, minlength=k)
+        used = counts > 0
+        # Sum the members of each cluster with one reduceat over sorted rows
+        order = np.argsort(labels, kind="stable")
+        starts = (np.cumsum(counts) - counts)[used]
+        new_centers = centers.copy()
+        new_centers[used] = (
+            np.add.reduceat(points[order], starts, axis=0) / counts[used, None]
+        )
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+        labels, _ = _assign(points, centers)
+    return labels, centers
+
+
+def cluster_order(
+    points: np.ndarray, k: int | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Order points cluster by cluster.
+
+    Larger clusters come first, and the points of a cluster are ordered from
+    the one nearest its center outwards.
+
+    Args:
+        points (np.ndarray): ``(n, d)`` array of vectors.
+        k (int | None, optional): Number of clusters. Defaults to
+            `default_clusters`.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Point indices in display order, and the
+            cluster index of each point.
+    """
+    if k is None:
+        k = default_clusters(len(points))
+    labels, centers = kmeans(points, k)
+    if not len(labels):
+        return np.zeros(0, dtype=np.intp), labels
+    _, distances = _assign(np.asarray(points, dtype=np.float32), centers)
+    counts = np.bincount(labels, minlength=len(centers))
+    # Rank 0 is the largest cluster; ties keep the lower cluster index first
+    rank = np.empty(len(centers), dtype=np.intp)
+    rank[np.argsort(-counts, kind="stable")] = np.arange(len(centers))
+    return np.lexsort((distances, rank[labels])), labels
@@ -0,0 +1,366 @@
+"""Image decoding helpers for the apps.
+
+Previews can be decoded and resized in an optional process pool and handed
+back through shared memory, so heavy formats (large PNGs, TIFFs) decode in
+parallel and outside the Streamlit script thread. Low-resolution placeholders
+(remembered thumbnails, EXIF thumbnails, JPEG draft decodes) can be shown
+while the full preview is decoded."""
+
+from __future__ import annotations
+
+import io
+import multiprocessing
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+from PIL import ExifTags, Image
+
+from archive import file_mtime_ns, open_image
+from utils import clamp_size, load_image
+
+__all__ = [
+    "MAX_CACHED_PREVIEWS",
+    "MAX_CACHED_THUMBNAILS",
+    "PLACEHOLDER_HEIGHT",
+    "PREFETCH_AHEAD",
+    "cache_usage",
+    "get_pool",
+    "load_placeholder",
+    "load_preview",
+    "prefetch_previews",
+    "preview_size",
+    "remember_thumbnail",
+    "shutdown_pool",
+]
+
+# Decoded previews kept per process (shared by all sessions)
+MAX_CACHED_PREVIEWS = 16
+# Files after the current one that the apps decode ahead of time
+PREFETCH_AHEAD = 2
+# Low-resolution thumbnails kept per process for instant placeholders
+MAX_CACHED_THUMBNAILS = 512
+# Height of the thumbnails kept for placeholders
+PLACEHOLDER_HEIGHT = 128
+# EXIF tags giving the offset and length of the embedded JPEG thumbnail
+_EXIF_THUMB_OFFSET = 0x0201
+_EXIF_THUMB_LENGTH = 0x0202
+# Modes copied through shared memory as-is; anything else is converted
+_RAW_MODES = ("L", "LA", "RGB", "RGBA")
+
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+_previews: OrderedDict[tuple, Future] = OrderedDict()
+_previews_lock = threading.Lock()
+_thumbnails: OrderedDict[tuple, Image.Image] = OrderedDict()
+_thumbnails_lock = threading.Lock()
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """Get the process pool shared by all sessions, (re)creating it if the
+    number of workers changed.
+
+    Workers are started with ``spawn`` so the pool is safe to create from the
+    Streamlit server's threads on every platform.
+
+    Args:
+        workers (int): Number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: Pool with ``workers`` processes.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _image_nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the preview and thumbnail caches.
+
+    Returns:
+        dict[str, tuple[int, int]]: Entries and approximate bytes of pixel
+            data per cache. Previews still being decoded count as entries
+            without bytes.
+    """
+    with _previews_lock:
+        futures = list(_previews.values())
+    previews = sum(
+        _image_nbytes(future.result())
+        for future in futures
+        if future.done() and not future.cancelled() and future.exception() is None
+    )
+    with _thumbnails_lock:
+        thumbnails = sum(_image_nbytes(image) for image in _thumbnails.values())
+        n_thumbnails = len(_thumbnails)
+    return {
+        "decoded previews": (len(futures), previews),
+        "placeholder thumbnails": (n_thumbnails, thumbnails),
+    }
+
+
+def shutdown_pool() -> None:
+    """Stop the worker processes and drop cached previews."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+    with _previews_lock:
+        _previews.clear()
+
+
+def _preview_mode(img: Image.Image) -> str:
+    """Pick the mode a preview is decoded to so it can be copied as raw bytes."""
+    if img.mode in _RAW_MODES:
+        return img.mode
+    if "A" in img.getbands() or "transparency" in img.info:
+        return "RGBA"
+    return "RGB"
+
+
+def _decode_into(
+    image_path: str, size: tuple[int, int], mode: str, shm_name: str
+) -> None:
+    """Worker: decode ``image_path`` at ``size`` into the shared memory block.
+
+    The block is created and unlinked by the parent process, which also
+    registered it with the (shared) resource tracker.
+    """
+    shm = SharedMemory(name=shm_name)
+    try:
+        with open_image(image_path) as img:
+            # JPEGs can decode straight to a smaller power-of-two scale
+            img.draft(mode, size)
+            if img.mode != mode:
+                img = img.convert(mode)
+            if img.size != size:
+                img = img.resize(size)
+            data = img.tobytes()
+        shm.buf[: len(data)] = data
+    finally:
+        shm.close()
+
+
+def _submit(
+    pool: ProcessPoolExecutor, image_path: str, height: int, is_clamped: bool
+) -> Future:
+    """Start decoding a preview in ``pool``. The returned future resolves to a
+    PIL image once the worker is done."""
+    with open_image(image_path) as img:
+        size = clamp_size(img.size, height) if is_clamped else img.size
+        mode = _preview_mode(img)
+    nbytes = size[0] * size[1] * Image.getmodebands(mode)
+    shm = SharedMemory(create=True, size=max(nbytes, 1))
+    result: Future = Future()
+
+    def _finish(worker_future: Future) -> None:
+        try:
+            worker_future.result()
+            view = Image.frombuffer(mode, size, shm.buf, "raw", mode, 0, 1)
+            image = view.copy()
+            # Release the buffer export before closing the block
+            del view
+            result.set_result(image)
+        except BaseException as err:
+            result.set_exception(err)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    try:
+        worker_future = pool.submit(_decode_into, image_path, size, mode, shm.name)
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    worker_future.add_done_callback(_finish)
+    return result
+
+
+def _preview_future(
+    image_path: str, height: int, is_clamped: bool, workers: int
+) -> Future:
+    """Get the cached or newly submitted preview future for an image."""
+    key = (image_path, file_mtime_ns(image_path), height, is_clamped)
+    with _previews_lock:
+        future = _previews.get(key)
+        if future is not None:
+            _previews.move_to_end(key)
+            return future
+    future = _submit(get_pool(workers), image_path, height, is_clamped)
+    with _previews_lock:
+        _previews[key] = future
+        while len(_previews) > MAX_CACHED_PREVIEWS:
+            _previews.popitem(last=False)
+    return future
+
+
+def load_preview(
+    image_path: str, height: int = 896, is_clamped: bool = True, workers: int = 0
+) -> Image.Image:
+    """Load an image the way `load_image` does, decoding it in the process
+    pool when ``workers`` is positive.
+
+    Previews are cached per process, so an image that was prefetched with
+    `prefetch_previews` is returned without waiting for a decode.
+
+    Args:
+        image_path (str): Path to the image to load.
+        height (int, optional): Height of the image if clamped. Defaults to 896.
+        is_clamped (bool, optional): True if the image will be clamped.
+            Defaults to True.
+        workers (int, optional): Decode worker processes; 0 decodes in this
+            thread. Defaults to 0.
+
+    Returns:
+        Image.Image: Clamped or full size image.
+    """
+    if workers <= 0:
+        image = load_image(image_path, height, is_clamped)
+    else:
+        try:
+            image = _preview_future(image_path, height, is_clamped, workers).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start over with a fresh pool
+            shutdown_pool()
+            image = load_image(image_path, height, is_clamped)
+    remember_thumbnail(image_path, image)
+    return image
+
+
+def prefetch_previews(
+    image_paths: Iterable[str],
+    height: int = 896,
+    is_clamped: bool = True,
+    workers: int = 0,
+) -> None:
+    """Start decoding previews in the background. Does nothing when
+    ``workers`` is 0.
+
+    Args:
+        image_paths (Iterable[str]): Images to decode, most urgent first.
+        height (int, optional): Height of the image if clamped. Defaults to 896.
+        is_clamped (bool, optional): True if the image will be clamped.
+            Defaults to True.
+        workers (int, optional): Decode worker processes. Defaults to 0.
+    """
+    if workers <= 0:
+        return
+    for image_path in image_paths:
+        try:
+            _preview_future(image_path, height, is_clamped, workers)
+        except (OSError, BrokenProcessPool):
+            continue
+
+
+def _thumbnail_key(image_path: str) -> tuple[str, int]:
+    return image_path, file_mtime_ns(image_path)
+
+
+def remember_thumbnail(image_path: str, image: Image.Image) -> None:
+    """Keep a small copy of a decoded image to use as its placeholder later.
+
+    Args:
+        image_path (str): Path the image was loaded from.
+        image (Image.Image): Decoded image (any size).
+    """
+    try:
+        key = _thumbnail_key(image_path)
+    except OSError:
+        return
+    with _thumbnails_lock:
+        if key in _thumbnails:
+            _thumbnails.move_to_end(key)
+            return
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail.width, PLACEHOLDER_HEIGHT), Image.Resampling.BOX)
+    with _thumbnails_lock:
+        _thumbnails[key] = thumbnail
+        while len(_thumbnails) > MAX_CACHED_THUMBNAILS:
+            _thumbnails.popitem(last=False)
+
+
+def _exif_thumbnail(img: Image.Image) -> Image.Image | None:
+    """Decode the JPEG thumbnail embedded in an image's EXIF data, if any."""
+    raw = img.info.get("exif")
+    if not raw:
+        return None
+    ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset = ifd1.get(_EXIF_THUMB_OFFSET)
+    length = ifd1.get(_EXIF_THUMB_LENGTH)
+    if not offset or not length:
+        return None
+    # Offsets are relative to the TIFF header, after the "Exif\0\0" marker
+    start = offset + (6 if raw.startswith(b"Exif") else 0)
+    thumbnail = Image.open(io.BytesIO(raw[start : start + length]))
+    thumbnail.load()
+    return thumbnail
+
+
+def load_placeholder(image_path: str) -> Image.Image | None:
+    """Get a low-resolution stand-in for an image that is much faster to
+    produce than the full decode.
+
+    Uses, in order: a thumbnail remembered from an earlier decode, the
+    thumbnail embedded in the EXIF data, or a 1/8 scale JPEG draft decode.
+
+    Args:
+        image_path (str): Path to the image.
+
+    Returns:
+        Image.Image | None: Small image, or None if there is no fast way to
+            get one (e.g. a PNG that has not been shown yet).
+    """
+    try:
+        key = _thumbnail_key(image_path)
+    except OSError:
+        return None
+    with _thumbnails_lock:
+        thumbnail = _thumbnails.get(key)
+    if thumbnail is not None:
+        return thumbnail
+    try:
+        with open_image(image_path) as img:
+            if img.format != "JPEG":
+                return None
+            try:
+                thumbnail = _exif_thumbnail(img)
+            except (OSError, SyntaxError, ValueError):
+                thumbnail = None
+            if thumbnail is None:
+                img.draft("RGB", (img.width // 8, img.height // 8))
+                thumbnail = img.copy()
+    except OSError:
+        return None
+    return thumbnail
+
+
+def preview_size(image_path: str, height: int, is_clamped: bool) -> tuple[int, int]:
+    """Get the size `load_preview` will return, reading only the header.
+
+    Args:
+        image_path (str): Path to the image.
+        height (int): Height of the image if clamped.
+        is_clamped (bool): True if the image will be clamped.
+
+    Returns:
+        tuple[int, int]: Width and height of the preview.
+    """
+    with open_image(image_path) as img:
+        return clamp_size(img.size, height) if is_clamped else img.size
@@ -0,0 +1,310 @@
+"""Find byte-identical duplicate images in a directory.
+
+Generation retries often write the same image again under another name. A
+`DuplicateIndex` finds them in three rounds, each only over the files the
+previous one could not tell apart: files are grouped by size (from the stat
+index, see `ordering.StatIndex`), then by a hash of their first and last
+`PARTIAL_BYTES`, and only files that still collide are hashed in full.
+Hard links to the same file are read once. Files are memory-mapped and
+hashed in a thread pool (``hashlib`` releases the GIL on large buffers), and
+digests are kept per file until it changes, so checking again after new
+files arrive only reads the new ones."""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import threading
+from array import array
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from archive import read_member
+from ordering import get_stat_index
+from registry import FileRegistry, FileView
+from utils import get_file_path
+
+__all__ = [
+    "DEDUP_WORKERS",
+    "PARTIAL_BYTES",
+    "DuplicateIndex",
+    "cache_usage",
+    "drop_duplicates",
+    "get_duplicate_index",
+]
+
+# Bytes hashed from each end of a file before hashing all of it
+PARTIAL_BYTES = 64 * 1024
+# Threads reading and hashing files at once
+DEDUP_WORKERS = 8
+# Size of the blake2b digests compared
+_DIGEST_SIZE = 16
+
+
+@contextmanager
+def _mapped(registry: FileRegistry, name: str) -> Iterator[memoryview]:
+    """Map a file (or archive member) into memory for hashing."""
+    if registry.is_archive:
+        yield read_member(registry.directory, name)
+        return
+    with open(get_file_path(registry.directory, name), "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            yield memoryview(b"")
+            return
+        with (
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            memoryview(mapped) as view,
+        ):
+            yield view
+
+
+def _digest(registry: FileRegistry, name: str, full: bool) -> bytes | None:
+    """Hash a whole file, or only its first and last `PARTIAL_BYTES`.
+    Returns None if the file cannot be read."""
+    hasher = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+    try:
+        with _mapped(registry, name) as view:
+            if full or len(view) <= 2 * PARTIAL_BYTES:
+                hasher.update(view)
+            else:
+                hasher.update(view[:PARTIAL_BYTES])
+                hasher.update(view[-PARTIAL_BYTES:])
+    except OSError:
+        return None
+    return hasher.digest()
+
+
+class DuplicateIndex:
+    """Groups of identical files of one registry, found again whenever the
+    registry changes."""
+
+    def __init__(self, registry: FileRegistry):
+        """Initialize an empty index; call `refresh` to fill it.
+
+        Args:
+            registry (FileRegistry): Registry of the directory.
+        """
+        self.registry = registry
+        self._version = -1
+        self._groups: list[np.ndarray] = []
+        self._group_of: dict[int, int] = {}
+        # (id, full) -> ((mtime, size) the digest was computed at, digest)
+        self._digests: dict[tuple[int, bool], tuple[tuple[int, int], bytes | None]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of files hashed so far."""
+        return len(self._digests)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the digests and groups."""
+        digests = len(self._digests) * (_DIGEST_SIZE + 200)
+        groups = sum(group.nbytes + 100 for group in self._groups)
+        return digests + groups + len(self._group_of) * 100
+
+    def _hash(
+        self,
+        ids: np.ndarray,
+        stamps: dict[int, tuple[int, int]],
+        full: bool,
+        workers: int,
+    ) -> dict[int, bytes | None]:
+        """Get the digests of files, hashing the ones not hashed since they
+        last changed in a thread pool."""
+        digests = {}
+        todo = []
+        for file_id in ids.tolist():
+            cached = self._digests.get((file_id, full))
+            if cached is not None and cached[0] == stamps[file_id]:
+                digests[file_id] = cached[1]
+            else:
+                todo.append(file_id)
+        if todo:
+            name = self.registry.name
+            names = [name(file_id) for file_id in todo]
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                hashed = pool.map(
+                    lambda file: _digest(self.registry, file, full), names
+                )
+                for file_id, digest in zip(todo, hashed):
+                    self._digests[(file_id, full)] = (stamps[file_id], digest)
+                    digests[file_id] = digest
+        return digests
+
+    def refresh(self, workers: int = DEDUP_WORKERS) -> None:
+        """Find the duplicates again if the registry changed since the last
+        pass.
+
+        Args:
+            workers (int, optional): Threads hashing files. Defaults to
+                `DEDUP_WORKERS`.
+        """
+        registry = self.registry
+        with self._lock:
+            version = registry.version
+            if version == self._version:
+                return
+            ids = np.frombuffer(registry.view().ids, dtype=np.uint32)
+            stats = get_stat_index(registry)
+            mtime, size = stats.stats(ids)
+            readable = size >= 0
+            ids, mtime, size = ids[readable], mtime[readable], size[readable]
+            _, inverse, counts = np.unique(
+                size, return_inverse=True, return_counts=True
+            )
+            same_size = counts[inverse] > 1
+            ids, mtime, size = ids[same_size], mtime[same_size], size[same_size]
+            stamps = dict(zip(ids.tolist(), zip(mtime.tolist(), size.tolist())))
+            # Hard links to one file are read once, through their first name
+            inode = stats.inodes(ids)
+            linked = inode >= 0
+            _, first, inverse = np.unique(
+                inode[linked], return_index=True, return_inverse=True
+            )
+            source = ids.copy()
+            source[linked] = ids[linked][first][inverse]
+            source_of = dict(zip(ids.tolist(), source.tolist()))
+            unique = np.unique(source)
+            partial = self._hash(unique, stamps, False, workers)
+            buckets: dict[tuple[int, bytes], list[int]] = {}
+            for file_id, nbytes in zip(ids.tolist(), size.tolist()):
+                digest = partial[source_of[file_id]]
+                if digest is not None:
+                    buckets.setdefault((nbytes, digest), []).append(file_id)
+            collisions = [
+                bucket
+                for (nbytes, _), bucket in buckets.items()
+                if len(bucket) > 1 and nbytes > 2 * PARTIAL_BYTES
+            ]
+            full = self._hash(
+                np.unique(
+                    np.array(
+                        [source_of[i] for bucket in collisions for i in bucket],
+                        np.uint32,
+                    )
+                ),
+                stamps,
+                True,
+                workers,
+            )
+            groups = []
+            for (nbytes, _), bucket in buckets.items():
+                if len(bucket) < 2:
+                    continue
+                if nbytes <= 2 * PARTIAL_BYTES:
+                    # The partial digest already covered the whole file
+                    groups.append(bucket)
+                    continue
+                by_digest: dict[bytes, list[int]] = {}
+                for file_id in bucket:
+                    digest = full[source_of[file_id]]
+                    if digest is not None:
+                        by_digest.setdefault(digest, []).append(file_id)
+                groups.extend(group for group in by_digest.values() if len(group) > 1)
+            live = set(stamps)
+            for key in [key for key in self._digests if key[0] not in live]:
+                del self._digests[key]
+            self._groups = [np.array(group, dtype=np.uint32) for group in groups]
+            self._group_of = {
+                file_id: idx for idx, group in enumerate(groups) for file_id in group
+            }
+            self._version = version
+
+    def groups(self) -> list[np.ndarray]:
+        """Get every group of identical files.
+
+        Returns:
+            list[np.ndarray]: Registry ids of each group, in name order.
+        """
+        self.refresh()
+        return list(self._groups)
+
+    @property
+    def group_of(self) -> dict[int, int]:
+        """Index in `groups` of every file that has duplicates, by id, as of
+        the last `refresh`."""
+        return self._group_of
+
+    def twins(self, file_id: int) -> list[int]:
+        """Get the other files identical to one file.
+
+        Args:
+            file_id (int): Registry id.
+
+        Returns:
+            list[int]: Registry ids of its duplicates, in name order.
+        """
+        self.refresh()
+        idx = self._group_of.get(file_id)
+        if idx is None:
+            return []
+        return [twin for twin in self._groups[idx].tolist() if twin != file_id]
+
+
+_indexes: dict[FileRegistry, DuplicateIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_duplicate_index(registry: FileRegistry) -> DuplicateIndex:
+    """Get the process-wide duplicate index of a registry.
+
+    Args:
+        registry (FileRegistry): Registry of the directory.
+
+    Returns:
+        DuplicateIndex: Shared index.
+    """
+    with _indexes_lock:
+        index = _indexes.get(registry)
+        if index is None:
+            index = _indexes[registry] = DuplicateIndex(registry)
+        return index
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the duplicate indexes.
+
+    Returns:
+        dict[str, tuple[int, int]]: Files hashed and approximate bytes.
+    """
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return {
+        "content hashes": (
+            sum(len(index) for index in indexes),
+            sum(index.nbytes for index in indexes),
+        )
+    }
+
+
+def drop_duplicates(view: FileView) -> FileView:
+    """Keep only the first file of each group of identical files, in the
+    view's order.
+
+    Args:
+        view (FileView): Files to deduplicate.
+
+    Returns:
+        FileView: Files without their later duplicates.
+    """
+    index = get_duplicate_index(view.registry)
+    index.refresh()
+    group_of = index.group_of
+    if not group_of:
+        return view
+    seen: set[int] = set()
+    keep = array("I")
+    for file_id in view.ids:
+        group = group_of.get(file_id)
+        if group is not None:
+            if group in seen:
+                continue
+            seen.add(group)
+        keep.append(file_id)
+    return FileView(view.registry, keep)
@@ -0,0 +1,309 @@
+"""Encode previews for sending to the browser with an explicit format,
+quality and size budget.
+
+Lossy previews are encoded at the highest quality tier that fits a byte budget
+picked from the clamp height. Previews that are the original image in a format
+the browser can take as-is are sent as the original file's bytes."""
+
+from __future__ import annotations
+
+import base64
+import io
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import NamedTuple
+
+from PIL import Image
+
+from archive import file_mtime_ns, open_file, open_image
+from utils import clamp_size
+
+__all__ = [
+    "BUDGET_BYTES_PER_PIXEL",
+    "MAX_CACHED_ENCODINGS",
+    "PREVIEW_FORMATS",
+    "QUALITY_TIERS",
+    "EncodedPreview",
+    "byte_budget",
+    "cache_usage",
+    "cached_preview",
+    "encode_image",
+    "encode_preview",
+    "payload_label",
+    "to_data_uri",
+]
+
+# Values accepted for the ``preview_format`` config key
+PREVIEW_FORMATS = ("auto", "webp", "jpeg", "png")
+# Lossy qualities tried in turn until a preview fits its byte budget
+QUALITY_TIERS = (90, 80, 70, 55, 40)
+# Byte budget per displayed pixel of a square preview at the clamp height,
+# e.g. about 240 KB for the default clamp of 896
+BUDGET_BYTES_PER_PIXEL = 0.3
+# Encoded previews kept per process (shared by all sessions)
+MAX_CACHED_ENCODINGS = 32
+_PIL_FORMATS = {"webp": "WEBP", "jpeg": "JPEG", "jpg": "JPEG", "png": "PNG"}
+
+_encodings: OrderedDict[tuple, EncodedPreview] = OrderedDict()
+_encodings_lock = threading.Lock()
+
+
+class EncodedPreview(NamedTuple):
+    """Bytes sent to the browser for one preview."""
+
+    data: bytes
+    # PIL format name, e.g. "WEBP"
+    format: str
+    # Encoder quality, None for lossless or original bytes
+    quality: int | None
+    # True if ``data`` is the original file
+    passthrough: bool
+
+
+def byte_budget(height: int) -> int:
+    """Get the default byte budget of a preview clamped to ``height``.
+
+    Args:
+        height (int): Clamp height in pixels.
+
+    Returns:
+        int: Budget in bytes.
+    """
+    return int(BUDGET_BYTES_PER_PIXEL * height * height)
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    return "A" in image.getbands() or "transparency" in image.info
+
+
+def _pick_format(image: Image.Image, fmt: str, webp: bool) -> str:
+    """Resolve a `PREVIEW_FORMATS` value to a PIL format name."""
+    pil_format = _PIL_FORMATS.get(fmt.lower())
+    if pil_format == "WEBP" and not webp:
+        pil_format = None
+    if pil_format is not None:
+        return pil_format
+    if webp:
+        return "WEBP"
+    return "PNG" if _has_alpha(image) else "JPEG"
+
+
+def _save(image: Image.Image, pil_format: str, quality: int | None) -> bytes:
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, format="PNG")
+    else:
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if _has_alpha(image) else "RGB")
+        image.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+
+def encode_image(
+    image: Image.Image,
+    fmt: str = "auto",
+    quality: int | None = None,
+    max_bytes: int = 0,
+    webp: bool = True,
+) -> EncodedPreview:
+    """Encode an image, lowering the quality tier until it fits ``max_bytes``.
+
+    Args:
+        image (Image.Image): Image to encode.
+        fmt (str, optional): One of `PREVIEW_FORMATS`. ``"auto"`` picks WebP,
+            or JPEG (PNG with transparency) if ``webp`` is False. Defaults to
+            "auto".
+        quality (int | None, optional): Highest quality to try; lower
+            `QUALITY_TIERS` are tried after it. Defaults to the top tier.
+        max_bytes (int, optional): Byte budget, 0 for none. If no tier fits,
+            the lowest one is used. Defaults to 0.
+        webp (bool, optional): False if the client re-encodes WebP (as
+            ``st.image`` does), in which case JPEG or PNG is used instead.
+            Defaults to True.
+
+    Returns:
+        EncodedPreview: Encoded bytes with their format and quality.
+    """
+    pil_format = _pick_format(image, fmt, webp)
+    if pil_format == "PNG":
+        return EncodedPreview(_save(image, "PNG", None), "PNG", None, False)
+    tiers = [tier for tier in QUALITY_TIERS if quality is None or tier < quality]
+    if quality is not None:
+        tiers.insert(0, quality)
+    for tier in tiers:
+        data = _save(image, pil_format, tier)
+        if not max_bytes or len(data) <= max_bytes:
+            break
+    return EncodedPreview(data, pil_format, tier, False)
+
+
+def _passthrough_format(
+    image_path: str, height: int, is_clamped: bool, webp: bool
+) -> str | None:
+    """Get the format of an image whose original bytes can be sent as its
+    preview: it needs no resize and is a JPEG (or WebP if allowed)."""
+    with open_image(image_path) as img:
+        size = clamp_size(img.size, height) if is_clamped else img.size
+        if size != img.size:
+            return None
+        if img.format == "JPEG" or (webp and img.format == "WEBP"):
+            return img.format
+    return None
+
+
+def _encoding_key(
+    image_path: str,
+    height: int,
+    is_clamped: bool,
+    fmt: str,
+    quality: int | None,
+    max_bytes: int | None,
+    webp: bool,
+) -> tuple:
+    """Get the cache key of an encoded preview, with the default byte budget
+    filled in."""
+    if max_bytes is None:
+        max_bytes = byte_budget(height)
+    return (
+        image_path,
+        file_mtime_ns(image_path),
+        height,
+        is_clamped,
+        fmt,
+        quality,
+        max_bytes,
+        webp,
+    )
+
+
+def cached_preview(
+    image_path: str,
+    height: int,
+    is_clamped: bool,
+    fmt: str = "auto",
+    quality: int | None = None,
+    max_bytes: int | None = None,
+    webp: bool = True,
+) -> EncodedPreview | None:
+    """Get an image's preview if `encode_preview` has it cached.
+
+    Takes the same arguments as `encode_preview`, without ``load``.
+
+    Returns:
+        EncodedPreview | None: Encoded bytes, or None if the preview still
+            has to be encoded.
+    """
+    key = _encoding_key(image_path, height, is_clamped, fmt, quality, max_bytes, webp)
+    with _encodings_lock:
+        encoded = _encodings.get(key)
+        if encoded is not None:
+            _encodings.move_to_end(key)
+        return encoded
+
+
+def encode_preview(
+    image_path: str,
+    height: int,
+    is_clamped: bool,
+    load: Callable[[], Image.Image],
+    fmt: str = "auto",
+    quality: int | None = None,
+    max_bytes: int | None = None,
+    webp: bool = True,
+) -> EncodedPreview:
+    """Get the bytes to send for an image's preview.
+
+    The original file's bytes are used when no resize is needed and it is
+    already a JPEG or WebP. Otherwise the preview is decoded with ``load`` and
+    encoded with `encode_image`. Results are cached per process.
+
+    Args:
+        image_path (str): Path to the image.
+        height (int): Height of the image if clamped.
+        is_clamped (bool): True if the image is clamped.
+        load (Callable[[], Image.Image]): Decodes the preview; only called if
+            the original bytes cannot be used.
+        fmt (str, optional): One of `PREVIEW_FORMATS`. Defaults to "auto".
+        quality (int | None, optional): Highest quality to try. Defaults to
+            the top of `QUALITY_TIERS`.
+        max_bytes (int | None, optional): Byte budget, 0 for none. Defaults
+            to `byte_budget` of ``height``.
+        webp (bool, optional): False if the client re-encodes WebP. Defaults
+            to True.
+
+    Returns:
+        EncodedPreview: Encoded bytes with their format and quality.
+    """
+    if max_bytes is None:
+        max_bytes = byte_budget(height)
+    key = _encoding_key(image_path, height, is_clamped, fmt, quality, max_bytes, webp)
+    with _encodings_lock:
+        encoded = _encodings.get(key)
+        if encoded is not None:
+            _encodings.move_to_end(key)
+            return encoded
+    pil_format = _passthrough_format(image_path, height, is_clamped, webp)
+    if pil_format is not None:
+        with open_file(image_path) as infile:
+            encoded = EncodedPreview(infile.read(), pil_format, None, True)
+    else:
+        encoded = encode_image(load(), fmt, quality, max_bytes, webp)
+    with _encodings_lock:
+        _encodings[key] = encoded
+        while len(_encodings) > MAX_CACHED_ENCODINGS:
+            _encodings.popitem(last=False)
+    return encoded
+
+
+def payload_label(
+    nbytes: int,
+    pil_format: str,
+    quality: int | None = None,
+    passthrough: bool = False,
+) -> str:
+    """Describe a preview payload for display, e.g. ``"182.4 KB WEBP q80"``.
+
+    Args:
+        nbytes (int): Payload size in bytes.
+        pil_format (str): PIL format name.
+        quality (int | None, optional): Encoder quality. Defaults to None.
+        passthrough (bool, optional): True if the payload is the original
+            file. Defaults to False.
+
+    Returns:
+        str: Human readable size, format and quality.
+    """
+    if nbytes < 1024**2:
+        label = f"{nbytes / 1024:.1f} KB {pil_format}"
+    else:
+        label = f"{nbytes / 1024**2:.2f} MB {pil_format}"
+    if passthrough:
+        return f"{label} (original)"
+    return f"{label} q{quality}" if quality is not None else label
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the encoded preview cache.
+
+    Returns:
+        dict[str, tuple[int, int]]: Entries and bytes of encoded data.
+    """
+    with _encodings_lock:
+        sizes = [len(encoded.data) for encoded in _encodings.values()]
+    return {"encoded previews": (len(sizes), sum(sizes))}
+
+
+def to_data_uri(encoded: EncodedPreview) -> str:
+    """Wrap an encoded preview in a base64 data URI.
+
+    Args:
+        encoded (EncodedPreview): Encoded preview.
+
+    Returns:
+        str: ``data:image/...;base64,...`` string.
+    """
+    data = base64.b64encode(encoded.data).decode("ascii")
+    return f"data:image/{encoded.format.lower()};base64,{data}"
@@ -0,0 +1,299 @@
+"""Stream annotations from the annotations json file to CSV, JSONL or a
+COCO-style classification json for training pipelines.
+
+Usage:
+    python src/export.py annotations.json labels.csv --dims --meta
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import warnings
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from pathlib import Path
+from typing import IO, Any
+
+from archive import open_image
+from manifest import FILE_COLUMNS, is_manifest, iter_manifest
+from utils import get_file_path, get_metadata_dict, load_json
+
+__all__ = [
+    "EXPORT_FORMATS",
+    "META_COLUMNS",
+    "export",
+    "iter_records",
+    "write_coco",
+    "write_csv",
+    "write_jsonl",
+]
+
+EXPORT_FORMATS = ("csv", "jsonl", "coco")
+# Stable Diffusion metadata columns always written to CSV when ``meta`` is set
+META_COLUMNS = ("prompt", "negative_prompt", "steps", "sampler", "cfg_scale", "seed")
+_DIM_COLUMNS = ("width", "height", "format")
+
+
+def _column_name(key: str) -> str:
+    """Normalise a metadata key such as ``"CFG scale"`` to ``"cfg_scale"``."""
+    return key.strip().lower().replace(" ", "_")
+
+
+def _read_dims(image_path: str) -> dict[str, Any]:
+    """Read width, height and format from the image header only."""
+    try:
+        with open_image(image_path) as img:
+            return {"width": img.width, "height": img.height, "format": img.format}
+    except OSError:
+        return dict.fromkeys(_DIM_COLUMNS)
+
+
+def _read_meta(image_path: str) -> dict[str, Any]:
+    """Read Stable Diffusion parameters from the image's text chunks."""
+    if Path(image_path).suffix.lower() != ".png":
+        return {}
+    try:
+        meta = get_metadata_dict(image_path)
+    except OSError:
+        return {}
+    return {
+        _column_name(key): value
+        for key, value in meta.items()
+        if isinstance(value, (str, int, float))
+    }
+
+
+def _iter_sources(
+    directory: str, labels: Mapping[str, str]
+) -> Iterator[tuple[str, str, dict[str, Any]]]:
+    """Yield ``(file, label, known_columns)`` for every labelled file.
+
+    For a manifest, rows are streamed in manifest order and their columns are
+    returned, so values the manifest already has are not read from the image.
+    Labels of files the manifest does not list are skipped with a warning.
+    """
+    if not is_manifest(directory):
+        for file, label in labels.items():
+            yield file, label, {}
+        return
+    found: set[str] = set()
+    for row in iter_manifest(directory):
+        file = next((str(row[col]) for col in FILE_COLUMNS if row.get(col)), None)
+        if file is None or file not in labels:
+            continue
+        found.add(file)
+        columns = {
+            _column_name(key): value
+            for key, value in row.items()
+            if key not in FILE_COLUMNS
+        }
+        yield file, labels[file], columns
+    missing = len(labels) - len(found)
+    if missing:
+        example = next(file for file in labels if file not in found)
+        warnings.warn(
+            f"{missing} labeled files (e.g. {example!r}) are not listed in "
+            f"{directory} and were not exported.",
+            stacklevel=2,
+        )
+
+
+def iter_records(
+    json_path: str | Path,
+    dims: bool = False,
+    meta: bool = False,
+    directory: str | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Stream one record per annotated file. The json file itself is read
+    whole, since its ``"files"`` are needed to join manifest rows; only the
+    records are streamed.
+
+    Args:
+        json_path (str | Path): Annotations json file written by the app.
+        dims (bool, optional): Add ``width``, ``height`` and ``format``.
+            Defaults to False.
+        meta (bool, optional): Add Stable Diffusion metadata columns.
+            Defaults to False.
+        directory (str | None, optional): Image directory or manifest. Defaults
+            to the ``"directory"`` saved in the json file.
+
+    Yields:
+        dict[str, Any]: Record with ``file``, ``path`` and ``label`` keys and
+            the optional dimension and metadata keys. When the source is a
+            manifest, its columns are used before any image is opened.
+    """
+    annotations = load_json(json_path)
+    if directory is None:
+        directory = annotations.get("directory") or os.path.dirname(
+            os.path.abspath(json_path)
+        )
+    labels = annotations.get("files", {})
+    for file, label, columns in _iter_sources(directory, labels):
+        path = get_file_path(directory, file)
+        record: dict[str, Any] = {"file": file, "path": path, "label": label}
+        if dims:
+            if columns.get("width") and columns.get("height"):
+                record.update({key: columns.get(key) for key in _DIM_COLUMNS})
+            else:
+                record.update(_read_dims(path))
+        if meta:
+            extra = columns or _read_meta(path)
+            for key, value in extra.items():
+                record.setdefault(key, value)
+        yield record
+
+
+def write_csv(
+    records: Iterable[dict[str, Any]],
+    outfile: IO[str],
+    extra_columns: Sequence[str] = (),
+) -> int:
+    """Write records as CSV. The header is the first record's keys plus
+    ``extra_columns``; keys that later records add outside it are dropped.
+
+    Args:
+        records (Iterable[dict[str, Any]]): Records from `iter_records`.
+        outfile (IO[str]): Text file opened with ``newline=""``.
+        extra_columns (Sequence[str], optional): Columns to include even if
+            the first record lacks them. Defaults to none.
+
+    Returns:
+        int: Number of records written.
+    """
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        return 0
+    fieldnames = list(first)
+    fieldnames.extend(col for col in extra_columns if col not in first)
+    writer = csv.DictWriter(outfile, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for record in itertools.chain([first], records):
+        writer.writerow(record)
+        count += 1
+    return count
+
+
+def write_jsonl(records: Iterable[dict[str, Any]], outfile: IO[str]) -> int:
+    """Write records as JSON lines.
+
+    Args:
+        records (Iterable[dict[str, Any]]): Records from `iter_records`.
+        outfile (IO[str]): Text file to write to.
+
+    Returns:
+        int: Number of records written.
+    """
+    count = 0
+    for record in records:
+        outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def write_coco(records: Iterable[dict[str, Any]], outfile: IO[str]) -> int:
+    """Write records as a COCO-style classification json with ``images``,
+    ``annotations`` (one ``category_id`` per image) and ``categories``.
+
+    Images are written as they arrive and annotations are buffered in a
+    temporary file, so memory use does not grow with the number of images.
+
+    Args:
+        records (Iterable[dict[str, Any]]): Records from `iter_records`.
+        outfile (IO[str]): Text file to write to.
+
+    Returns:
+        int: Number of records written.
+    """
+    categories: dict[str, int] = {}
+    count = 0
+    outfile.write('{"images": [')
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as annotations:
+        for image_id, record in enumerate(records, start=1):
+            category_id = categories.setdefault(record["label"], len(categories) + 1)
+            image = {"id": image_id, "file_name": record["file"]}
+            image.update(
+                (key, value)
+                for key, value in record.items()
+                if key not in ("file", "label")
+            )
+            annotation = {
+                "id": image_id,
+                "image_id": image_id,
+                "category_id": category_id,
+            }
+            sep = ",\n" if count else "\n"
+            outfile.write(sep + json.dumps(image, ensure_ascii=False))
+            annotations.write(sep + json.dumps(annotation))
+            count += 1
+        outfile.write('\n], "annotations": [')
+        annotations.seek(0)
+        shutil.copyfileobj(annotations, outfile)
+    category_list = [{"id": idx, "name": name} for name, idx in categories.items()]
+    outfile.write('\n], "categories": ' + json.dumps(category_list) + "}\n")
+    return count
+
+
+_WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "coco": write_coco}
+
+
+def export(
+    json_path: str | Path,
+    out_path: str | Path,
+    fmt: str | None = None,
+    dims: bool = False,
+    meta: bool = False,
+    directory: str | None = None,
+) -> int:
+    """Export annotations to a file.
+
+    Args:
+        json_path (str | Path): Annotations json file written by the app.
+        out_path (str | Path): Output file.
+        fmt (str | None, optional): One of `EXPORT_FORMATS`. Defaults to the
+            output suffix (``.csv``, ``.jsonl``), or ``"coco"`` for ``.json``.
+        dims (bool, optional): Join image dimensions. Defaults to False.
+        meta (bool, optional): Join Stable Diffusion metadata. Defaults to False.
+        directory (str | None, optional): Image directory or manifest. Defaults
+            to the one saved in the json file.
+
+    Returns:
+        int: Number of records written.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if fmt is None:
+        suffix = Path(out_path).suffix.lower().lstrip(".")
+        fmt = "coco" if suffix == "json" else suffix
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r}, use one of {EXPORT_FORMATS}")
+    records = iter_records(json_path, dims=dims, meta=meta, directory=directory)
+    with open(out_path, "w", encoding="utf-8", newline="") as outfile:
+        if fmt == "csv":
+            return write_csv(records, outfile, META_COLUMNS if meta else ())
+        return _WRITERS[fmt](records, outfile)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("json_path", help="annotations json file")
+    parser.add_argument("out_path", help="output .csv, .jsonl or .json file")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, dest="fmt")
+    parser.add_argument("--dims", action="store_true", help="join image sizes")
+    parser.add_argument("--meta", action="store_true", help="join SD metadata")
+    parser.add_argument("--directory", help="override the image directory")
+    args = parser.parse_args(argv)
+    count = export(**vars(args))
+    print(f"exported {count} annotations to {args.out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Cheap per-image feature vectors for label suggestions.
+
+Each image is described by a color histogram, a tiny grayscale thumbnail and
+hashed prompt tokens from its generation metadata. Everything is computed on
+the CPU with NumPy from a heavily downscaled decode, so a folder of large
+images is featurized quickly without any model download. The vectors of a
+directory are kept in one ``.npz`` file per directory in the system temp
+folder, so they are only computed again for new or edited images."""
+
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from hashlib import sha1
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from archive import file_mtime_ns, open_image
+from utils import get_file_path, get_metadata_dict
+
+__all__ = [
+    "FEATURE_CACHE_DIR",
+    "FEATURE_DIMS",
+    "FEATURE_WORKERS",
+    "HIST_BINS",
+    "MAX_CACHED_FEATURES",
+    "THUMB_SIZE",
+    "TOKEN_DIMS",
+    "cache_usage",
+    "compute_features",
+    "directory_features",
+    "image_features",
+    "iter_directory_features",
+    "prompt_tokens",
+]
+
+# Histogram bins per RGB channel
+HIST_BINS = 16
+# Side of the grayscale thumbnail used as a pixel vector
+THUMB_SIZE = 8
+# Buckets prompt tokens are hashed into
+TOKEN_DIMS = 64
+FEATURE_DIMS = 3 * HIST_BINS + THUMB_SIZE * THUMB_SIZE + TOKEN_DIMS
+# Images are decoded to at most this size before featurizing
+_SOURCE_SIZE = 64
+# Feature vectors kept per process (shared by all sessions)
+MAX_CACHED_FEATURES = 50_000
+# Threads used to featurize a batch of images
+FEATURE_WORKERS = min(8, os.cpu_count() or 1)
+# Per-directory feature files, shared by all sessions and processes
+FEATURE_CACHE_DIR = Path(tempfile.gettempdir()) / "image_annotator_features"
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_features: OrderedDict[tuple[str, int], np.ndarray] = OrderedDict()
+_features_lock = threading.Lock()
+# Serializes read-merge-write of the per-directory files within a process
+_disk_lock = threading.Lock()
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def prompt_tokens(image_path: str) -> list[str]:
+    """Get the lowercase word tokens of an image's prompt.
+
+    Args:
+        image_path (str): Path to image file.
+
+    Returns:
+        list[str]: Tokens, empty if the image has no prompt metadata.
+    """
+    prompt = get_metadata_dict(image_path).get("Prompt", "")
+    if not isinstance(prompt, str):
+        return []
+    return _TOKEN_RE.findall(prompt.lower())
+
+
+def image_features(image_path: str) -> np.ndarray:
+    """Compute the feature vector of one image.
+
+    The color histogram, thumbnail and prompt blocks are each scaled to unit
+    length so they weigh the same in cosine similarity.
+
+    Args:
+        image_path (str): Path to image file.
+
+    Returns:
+        np.ndarray: ``float32`` vector of length `FEATURE_DIMS`.
+    """
+    with open_image(image_path) as img:
+        img.draft("RGB", (_SOURCE_SIZE, _SOURCE_SIZE))
+        img.thumbnail((_SOURCE_SIZE, _SOURCE_SIZE))
+        rgb = img.convert("RGB")
+    pixels = np.asarray(rgb, dtype=np.uint8).reshape(-1, 3)
+    shift = 8 - (HIST_BINS.bit_length() - 1)
+    hist = np.concatenate(
+        [
+            np.bincount(pixels[:, channel] >> shift, minlength=HIST_BINS)
+            for channel in range(3)
+        ]
+    ).astype(np.float32)
+    # Square root of the normalized counts (Hellinger) keeps large flat areas
+    # from dominating the histogram
+    hist = _unit(np.sqrt(hist / max(len(pixels), 1)))
+    thumb = np.asarray(
+        rgb.convert("L").resize((THUMB_SIZE, THUMB_SIZE), Image.Resampling.BOX),
+        dtype=np.float32,
+    ).ravel()
+    thumb = _unit(thumb - thumb.mean())
+    tokens = np.zeros(TOKEN_DIMS, dtype=np.float32)
+    for token in prompt_tokens(image_path):
+        tokens[zlib.crc32(token.encode()) % TOKEN_DIMS] += 1
+    return np.concatenate([hist, thumb, _unit(tokens)]).astype(np.float32)
+
+
+def _cached_features(image_path: str) -> np.ndarray:
+    """Get the features of an image from the cache, computing them if the
+    image is new or changed. Unreadable images get a zero vector."""
+    try:
+        key = (image_path, file_mtime_ns(image_path))
+    except OSError:
+        return np.zeros(FEATURE_DIMS, dtype=np.float32)
+    with _features_lock:
+        features = _features.get(key)
+        if features is not None:
+            _features.move_to_end(key)
+            return features
+    try:
+        features = image_features(image_path)
+    except (OSError, ValueError):
+        features = np.zeros(FEATURE_DIMS, dtype=np.float32)
+    with _features_lock:
+        _features[key] = features
+        while len(_features) > MAX_CACHED_FEATURES:
+            _features.popitem(last=False)
+    return features
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the in-memory feature cache.
+
+    Returns:
+        dict[str, tuple[int, int]]: Entries and bytes of feature vectors.
+    """
+    with _features_lock:
+        sizes = [features.nbytes for features in _features.values()]
+    return {"image features": (len(sizes), sum(sizes))}
+
+
+def compute_features(
+    image_paths: Sequence[str], workers: int = FEATURE_WORKERS
+) -> np.ndarray:
+    """Get the feature vectors of many images, decoding uncached ones in a
+    thread pool.
+
+    Args:
+        image_paths (Sequence[str]): Paths to image files.
+        workers (int, optional): Threads to decode with. Defaults to
+            `FEATURE_WORKERS`.
+
+    Returns:
+        np.ndarray: ``float32`` array of shape ``(len(image_paths),
+            FEATURE_DIMS)``, one row per path.
+    """
+    if not image_paths:
+        return np.zeros((0, FEATURE_DIMS), dtype=np.float32)
+    if workers <= 1 or len(image_paths) == 1:
+        rows = [_cached_features(path) for path in image_paths]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_cached_features, image_paths))
+    return np.stack(rows)
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return file_mtime_ns(path)
+    except OSError:
+        return -1
+
+
+def _cache_file(directory: str, cache_dir: Path) -> Path:
+    digest = sha1(os.path.abspath(directory).encode()).hexdigest()[:20]
+    return cache_dir / f"{digest}.npz"
+
+
+def _load_cache(path: Path) -> dict[str, tuple[int, np.ndarray]]:
+    """Read a per-directory feature file into a dict of name to (mtime,
+    vector). Missing, corrupt or outdated files read as empty."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            names, mtimes, vectors = data["names"], data["mtimes"], data["vectors"]
+        # Files from before names were saved as one buffer read as outdated
+        if names.dtype != np.uint8:
+            return {}
+        names = names.tobytes().decode("utf-8").split("\0") if len(names) else []
+    except (OSError, ValueError, KeyError):
+        return {}
+    if vectors.ndim != 2 or vectors.shape[1] != FEATURE_DIMS:
+        return {}
+    if not len(names) == len(mtimes) == len(vectors):
+        return {}
+    return {
+        name: (int(mtime), vector)
+        for name, mtime, vector in zip(names, mtimes, vectors)
+    }
+
+
+def _save_cache(path: Path, entries: dict[str, tuple[int, np.ndarray]]) -> None:
+    """Write a per-directory feature file atomically."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    names = list(entries)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            np.savez(
+                outfile,
+                # One NUL-joined UTF-8 buffer like `snapshot.save_files`, not
+                # a fixed-width array padded to the longest name
+                names=np.frombuffer("\0".join(names).encode("utf-8"), np.uint8),
+                mtimes=np.array([entries[name][0] for name in names], np.int64),
+                vectors=np.array(
+                    [entries[name][1] for name in names], np.float32
+                ).reshape(-1, FEATURE_DIMS),
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def directory_features(
+    directory: str,
+    files: Sequence[str],
+    workers: int = FEATURE_WORKERS,
+    cache_dir: Path | None = None,
+) -> np.ndarray:
+    """Get the feature vectors of files in a directory (or manifest), reusing
+    the directory's feature file for images that have not changed.
+
+    Args:
+        directory (str): Image directory or manifest path.
+        files (Sequence[str]): File names in the directory.
+        workers (int, optional): Threads to decode new images with. Defaults
+            to `FEATURE_WORKERS`.
+        cache_dir (Path | None, optional): Folder of the per-directory
+            feature files. Defaults to ``FEATURE_CACHE_DIR``.
+
+    Returns:
+        np.ndarray: ``float32`` array of shape ``(len(files), FEATURE_DIMS)``.
+    """
+    with closing(
+        iter_directory_features(directory, [files], workers, cache_dir)
+    ) as rows:
+        return next(rows)
+
+
+def iter_directory_features(
+    directory: str,
+    chunks: Iterable[Sequence[str]],
+    workers: int = FEATURE_WORKERS,
+    cache_dir: Path | None = None,
+) -> Iterator[np.ndarray]:
+    """Get the feature vectors of files in a directory chunk by chunk, so only
+    one chunk of vectors is held at a time. The directory's feature file is
+    read once, and the vectors computed for new or edited images are written
+    back once the iteration ends.
+
+    Args:
+        directory (str): Image directory or manifest path.
+        chunks (Iterable[Sequence[str]]): File names in the directory, in
+            chunks.
+        workers (int, optional): Threads to decode new images with. Defaults
+            to `FEATURE_WORKERS`.
+        cache_dir (Path | None, optional): Folder of the per-directory
+            feature files. Defaults to ``FEATURE_CACHE_DIR``.
+
+    Yields:
+        np.ndarray: ``float32`` array of shape ``(len(chunk), FEATURE_DIMS)``
+            for each chunk.
+    """
+    cache_path = _cache_file(directory, cache_dir or FEATURE_CACHE_DIR)
+    with _disk_lock:
+        entries = _load_cache(cache_path)
+    computed: dict[str, tuple[int, np.ndarray]] = {}
+    try:
+        for chunk in chunks:
+            names = list(chunk)
+            paths = [get_file_path(directory, name) for name in names]
+            mtimes = [_mtime_ns(path) for path in paths]
+            rows = np.zeros((len(names), FEATURE_DIMS), dtype=np.float32)
+            missing = []
+            for idx, (name, mtime) in enumerate(zip(names, mtimes)):
+                entry = entries.get(name)
+                if entry is not None and entry[0] == mtime:
+                    rows[idx] = entry[1]
+                else:
+                    missing.append(idx)
+            if missing:
+                rows[missing] = compute_features(
+                    [paths[idx] for idx in missing], workers
+                )
+                for idx in missing:
+                    computed[names[idx]] = (mtimes[idx], rows[idx].copy())
+            yield rows
+    finally:
+        if computed:
+            with _disk_lock:
+                # Merge with entries written by other sessions in the meantime
+                entries = _load_cache(cache_path)
+                entries.update(computed)
+                _save_cache(cache_path, entries)
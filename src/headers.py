@@ -0,0 +1,320 @@
+"""Width, height, mode and format of every image of a directory, read from the
+image headers only.
+
+`PIL.Image.open` is lazy: it parses the header and stops before the pixel
+data, so indexing a folder costs a small read per file. Headers are read in a
+thread pool the first time a filter or sort needs them and kept per process in
+NumPy arrays indexed by `registry.FileRegistry` id, so filtering or sorting by
+size afterwards only touches those arrays (see `ordering.sort_view`)."""
+
+from __future__ import annotations
+
+import threading
+from array import array
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from archive import open_image
+from registry import FileRegistry, FileView
+from utils import get_file_path, matches_conditions, parse_conditions
+
+__all__ = [
+    "HEADER_COLUMNS",
+    "HEADER_SORT_KEYS",
+    "HEADER_WORKERS",
+    "HeaderIndex",
+    "ImageHeader",
+    "cache_usage",
+    "filter_view",
+    "get_header_index",
+    "parse_header_conditions",
+    "read_header",
+]
+
+# Threads reading headers; reads are small and mostly wait on the disk
+HEADER_WORKERS = 16
+# Columns header filters can use
+HEADER_COLUMNS = ("width", "height", "aspect", "megapixels", "mode", "format")
+# Sort keys backed by the header index, largest (or widest) first
+HEADER_SORT_KEYS = ("resolution", "aspect ratio")
+
+# Read state of an id in the index
+_UNREAD, _READ, _UNREADABLE = 0, 1, 2
+
+
+class ImageHeader(NamedTuple):
+    """Size, mode and format of an image, from its header."""
+
+    width: int
+    height: int
+    mode: str
+    format: str
+
+    @property
+    def aspect(self) -> float:
+        """Width divided by height."""
+        return self.width / self.height if self.height else 0.0
+
+
+def read_header(image_path: str) -> ImageHeader | None:
+    """Read an image's header without decoding its pixels.
+
+    Args:
+        image_path (str): Path to the image (may point into an archive).
+
+    Returns:
+        ImageHeader | None: Header, or None if the file is not a readable
+            image.
+    """
+    try:
+        with open_image(image_path) as img:
+            return ImageHeader(img.width, img.height, img.mode, img.format or "")
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+
+def parse_header_conditions(text: str) -> list[tuple[str, str, str]]:
+    """Parse conditions over `HEADER_COLUMNS`, e.g. ``width>=2048, aspect>1``.
+
+    Args:
+        text (str): Conditions in `utils.parse_conditions` syntax.
+
+    Returns:
+        list[tuple[str, str, str]]: Parsed conditions.
+
+    Raises:
+        ValueError: If a condition does not parse or names another column.
+    """
+    conditions = parse_conditions(text)
+    for column, _, _ in conditions:
+        if column not in HEADER_COLUMNS:
+            raise ValueError(
+                f"Unknown column {column!r}; use one of {', '.join(HEADER_COLUMNS)}."
+            )
+    return conditions
+
+
+def _ids_array(file_ids: Iterable[int]) -> np.ndarray:
+    return np.array(file_ids, dtype=np.uint32).reshape(-1)
+
+
+class HeaderIndex:
+    """Headers of the images of one registry, stored by registry id."""
+
+    def __init__(self, registry: FileRegistry):
+        """Initialize an empty index; headers are read by `ensure`.
+
+        Args:
+            registry (FileRegistry): Registry whose ids index the arrays.
+        """
+        self.registry = registry
+        self._state = np.zeros(0, dtype=np.uint8)
+        self._width = np.zeros(0, dtype=np.int32)
+        self._height = np.zeros(0, dtype=np.int32)
+        self._mode = np.zeros(0, dtype=np.uint8)
+        self._format = np.zeros(0, dtype=np.uint8)
+        # Mode and format names by code
+        self._modes: list[str] = []
+        self._formats: list[str] = []
+        self._lock = threading.Lock()
+
+    def _grow(self, capacity: int) -> None:
+        extra = capacity - len(self._state)
+        if extra <= 0:
+            return
+        for attr in ("_state", "_width", "_height", "_mode", "_format"):
+            values = getattr(self, attr)
+            setattr(self, attr, np.concatenate([values, np.zeros(extra, values.dtype)]))
+
+    @staticmethod
+    def _code(names: list[str], name: str) -> int:
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def ensure(self, file_ids: Iterable[int], workers: int = HEADER_WORKERS) -> None:
+        """Read the headers of the ids that have not been read yet, in a
+        thread pool.
+
+        Args:
+            file_ids (Iterable[int]): Registry ids.
+            workers (int, optional): Threads to read with. Defaults to
+                `HEADER_WORKERS`.
+        """
+        ids = _ids_array(file_ids)
+        with self._lock:
+            self._grow(self.registry.capacity)
+            missing = ids[self._state[ids] == _UNREAD].tolist()
+        if not missing:
+            return
+        directory = self.registry.directory
+        paths = [get_file_path(directory, self.registry.name(idx)) for idx in missing]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            headers = list(pool.map(read_header, paths))
+        with self._lock:
+            for file_id, header in zip(missing, headers):
+                if header is None:
+                    self._state[file_id] = _UNREADABLE
+                    continue
+                self._state[file_id] = _READ
+                self._width[file_id] = header.width
+                self._height[file_id] = header.height
+                self._mode[file_id] = self._code(self._modes, header.mode)
+                self._format[file_id] = self._code(self._formats, header.format)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the header arrays."""
+        arrays = (self._state, self._width, self._height, self._mode, self._format)
+        return sum(values.nbytes for values in arrays)
+
+    def header(self, file_id: int) -> ImageHeader | None:
+        """Get the header of one id, reading it if needed.
+
+        Args:
+            file_id (int): Registry id.
+
+        Returns:
+            ImageHeader | None: Header, or None if the image is unreadable.
+        """
+        self.ensure([file_id])
+        if self._state[file_id] != _READ:
+            return None
+        return ImageHeader(
+            int(self._width[file_id]),
+            int(self._height[file_id]),
+            self._modes[self._mode[file_id]],
+            self._formats[self._format[file_id]],
+        )
+
+    def column(self, name: str, ids: np.ndarray) -> np.ndarray:
+        """Get the values of a header column for ids that have been read.
+
+        Args:
+            name (str): One of `HEADER_COLUMNS`.
+            ids (np.ndarray): Registry ids.
+
+        Returns:
+            np.ndarray: One value per id. Aspect ratios are rounded to 3
+                decimals and megapixels to 2, so ``aspect=1.5`` matches.
+        """
+        if name == "width":
+            return self._width[ids]
+        if name == "height":
+            return self._height[ids]
+        if name == "mode":
+            return np.array([*self._modes, ""], dtype=object)[self._mode[ids]]
+        if name == "format":
+            return np.array([*self._formats, ""], dtype=object)[self._format[ids]]
+        width = self._width[ids].astype(np.float64)
+        height = self._height[ids].astype(np.float64)
+        if name == "aspect":
+            return np.round(width / np.maximum(height, 1), 3)
+        return np.round(width * height / 1e6, 2)
+
+    def matching(self, file_ids: array, conditions: str) -> np.ndarray:
+        """Get a mask of the ids whose headers meet every condition.
+
+        Each condition is evaluated once per distinct column value with
+        `utils.matches_conditions`, then spread over the ids, so the cost
+        is a few array passes however many images there are. Unreadable
+        images never match.
+
+        Args:
+            file_ids (array): ``array('I')`` of registry ids.
+            conditions (str): Conditions over `HEADER_COLUMNS`.
+
+        Returns:
+            np.ndarray: Boolean mask aligned with ``file_ids``.
+
+        Raises:
+            ValueError: If the conditions do not parse.
+        """
+        parsed = parse_header_conditions(conditions)
+        ids = _ids_array(file_ids)
+        self.ensure(ids)
+        mask = self._state[ids] == _READ
+        for condition in parsed:
+            values, inverse = np.unique(
+                self.column(condition[0], ids), return_inverse=True
+            )
+            passed = np.array(
+                [
+                    matches_conditions({condition[0]: value}, [condition])
+                    for value in values.tolist()
+                ],
+                dtype=bool,
+            )
+            mask &= passed[inverse.ravel()]
+        return mask
+
+    def sort_values(self, key: str, ids: np.ndarray) -> np.ndarray:
+        """Get ascending sort values for a header sort key; unreadable images
+        sort last.
+
+        Args:
+            key (str): One of `HEADER_SORT_KEYS`.
+            ids (np.ndarray): Registry ids.
+
+        Returns:
+            np.ndarray: One value per id.
+        """
+        if key == "resolution":
+            values = -(self._width[ids].astype(np.float64) * self._height[ids])
+        else:
+            values = -self.column("aspect", ids).astype(np.float64)
+        values[self._state[ids] != _READ] = np.inf
+        return values
+
+
+_indexes: dict[FileRegistry, HeaderIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_header_index(registry: FileRegistry) -> HeaderIndex:
+    """Get the process-wide header index of a registry.
+
+    Args:
+        registry (FileRegistry): Registry of the directory.
+
+    Returns:
+        HeaderIndex: Shared index.
+    """
+    with _indexes_lock:
+        index = _indexes.get(registry)
+        if index is None:
+            index = _indexes[registry] = HeaderIndex(registry)
+        return index
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the header indexes.
+
+    Returns:
+        dict[str, tuple[int, int]]: Indexes and the bytes of their arrays.
+    """
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return {"header indexes": (len(indexes), sum(i.nbytes for i in indexes))}
+
+
+def filter_view(view: FileView, conditions: str) -> FileView:
+    """Keep the files whose headers meet conditions such as ``width>=2048,
+    aspect>1, format=PNG``, preserving the view's order.
+
+    Args:
+        view (FileView): Files to filter.
+        conditions (str): Conditions over `HEADER_COLUMNS`.
+
+    Returns:
+        FileView: Filtered view.
+
+    Raises:
+        ValueError: If the conditions do not parse.
+    """
+    mask = get_header_index(view.registry).matching(view.ids, conditions)
+    kept = _ids_array(view.ids)[mask]
+    return FileView(view.registry, array("I", kept.astype(np.uint32).tobytes()))
@@ -0,0 +1,196 @@
+"""Background indexing of image directories.
+
+Switching to a large directory used to list it inside the widget callback,
+freezing the app until every name was known. An `IndexJob` does the work in
+a daemon thread instead: it lists the directory into its registry in growing
+batches (see `registry.FileRegistry.refresh_in_batches`), so sessions can
+show the first files while the rest is listed, then warms the stat index the
+modified and file size sort keys use and, optionally, reads every image's
+size and metadata for the size filter and the remaining sort keys. Jobs are
+shared by all sessions and report their progress for the apps' sidebars."""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections.abc import Callable
+from typing import NamedTuple
+
+import numpy as np
+
+from headers import get_header_index
+from ordering import get_metadata_index, get_stat_index
+from registry import FileRegistry, get_registry
+
+__all__ = [
+    "INDEX_CHUNK",
+    "INDEX_POLL_INTERVAL",
+    "INDEX_RETRY_DELAY",
+    "MAX_INDEX_JOBS",
+    "IndexJob",
+    "IndexProgress",
+    "get_job",
+    "start_indexing",
+]
+
+# Images whose header and metadata are read between progress updates
+INDEX_CHUNK = 256
+# Seconds between progress refreshes in the apps while a job runs
+INDEX_POLL_INTERVAL = 1.0
+# Seconds before a failed job is started again, so a directory that keeps
+# failing is not relisted on every rerun
+INDEX_RETRY_DELAY = 30.0
+# Jobs kept at once; finished jobs of the least recent directories are dropped
+MAX_INDEX_JOBS = 8
+
+
+class IndexProgress(NamedTuple):
+    """Where an index job is."""
+
+    # "listing", "sort keys", "image sizes", "metadata" or "done"
+    phase: str
+    done: int
+    # None while the number of files is not known yet
+    total: int | None
+
+    @property
+    def fraction(self) -> float:
+        """Share of the current phase that is done, 0 when unknown."""
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    @property
+    def label(self) -> str:
+        """Short description for the apps, e.g. ``"listing: 1,024 files"``."""
+        if self.total is None:
+            return f"{self.phase}: {self.done:,} files"
+        return f"{self.phase}: {self.done:,} / {self.total:,}"
+
+
+class IndexJob(threading.Thread):
+    """Daemon thread that lists one directory and builds its sort indexes."""
+
+    def __init__(self, registry: FileRegistry, read_images: bool = False):
+        """Initialize the job and mark the registry as being indexed. Call
+        ``start`` to begin.
+
+        Args:
+            registry (FileRegistry): Registry of the directory to index.
+            read_images (bool, optional): Also read every image's header and
+                metadata. Defaults to False.
+        """
+        super().__init__(name=f"index:{registry.directory}", daemon=True)
+        self.registry = registry
+        self.read_images = read_images
+        self.error: Exception | None = None
+        # time.monotonic() when the job finished, None while it runs
+        self.finished_at: float | None = None
+        self._progress = IndexProgress("listing", 0, None)
+        # Set before the thread starts so no session relists meanwhile
+        registry.indexing = True
+
+    def progress(self) -> IndexProgress:
+        """Get the job's current progress.
+
+        Returns:
+            IndexProgress: Phase and counts.
+        """
+        return self._progress
+
+    @property
+    def finished(self) -> bool:
+        """True once every phase is done (or the job failed)."""
+        return self._progress.phase == "done"
+
+    def run(self) -> None:
+        """Run every phase, recording the first error instead of raising."""
+        registry = self.registry
+        try:
+            try:
+                for listed in registry.refresh_in_batches():
+                    self._progress = IndexProgress("listing", listed, None)
+            finally:
+                registry.indexing = False
+            self._progress = IndexProgress("sort keys", 0, 1)
+            get_stat_index(registry).refresh()
+            if self.read_images:
+                ids = np.array(registry.view().ids, dtype=np.uint32)
+                self._read_chunks("image sizes", ids, get_header_index(registry).ensure)
+                self._read_chunks("metadata", ids, get_metadata_index(registry).ensure)
+        except Exception as err:
+            # Shown in the sidebar; the files listed so far stay usable
+            self.error = err
+        finally:
+            self.finished_at = time.monotonic()
+            self._progress = IndexProgress("done", len(registry), len(registry))
+
+    def _read_chunks(
+        self, phase: str, ids: np.ndarray, ensure: Callable[[np.ndarray], None]
+    ) -> None:
+        """Call an index's ``ensure`` over ``ids`` chunk by chunk, updating
+        the progress after each chunk."""
+        total = len(ids)
+        self._progress = IndexProgress(phase, 0, total)
+        for start in range(0, total, INDEX_CHUNK):
+            ensure(ids[start : start + INDEX_CHUNK])
+            self._progress = IndexProgress(
+                phase, min(start + INDEX_CHUNK, total), total
+            )
+
+
+_jobs: dict[str, IndexJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def _needs_restart(job: IndexJob, read_images: bool) -> bool:
+    """Check if a finished job has to be replaced: it failed at least
+    `INDEX_RETRY_DELAY` seconds ago, or it skipped the image phases that are
+    now requested. Running jobs are kept."""
+    if not job.finished or job.finished_at is None:
+        return False
+    if job.error is not None:
+        return time.monotonic() - job.finished_at >= INDEX_RETRY_DELAY
+    return read_images and not job.read_images
+
+
+def start_indexing(directory: str, read_images: bool = False) -> IndexJob:
+    """Start the index job of a directory, or reuse the one already started
+    in this process. A finished job is replaced by a new one when it failed
+    (after `INDEX_RETRY_DELAY`) or did not read the images and
+    ``read_images`` is requested now. Returns at once.
+
+    Args:
+        directory (str): Image directory, manifest or archive.
+        read_images (bool, optional): Also read every image's header and
+            metadata. Defaults to False.
+
+    Returns:
+        IndexJob: Job of ``directory``.
+    """
+    key = os.path.abspath(directory)
+    with _jobs_lock:
+        job = _jobs.pop(key, None)
+        if job is None or _needs_restart(job, read_images):
+            job = IndexJob(get_registry(directory, refresh=False), read_images)
+            job.start()
+        # Re-insert so the dict stays ordered by most recent request
+        _jobs[key] = job
+        for old_key in list(_jobs):
+            if len(_jobs) <= MAX_INDEX_JOBS:
+                break
+            if _jobs[old_key].finished:
+                del _jobs[old_key]
+    return job
+
+
+def get_job(directory: str) -> IndexJob | None:
+    """Get the index job started for a directory, if any.
+
+    Args:
+        directory (str): Image directory, manifest or archive.
+
+    Returns:
+        IndexJob | None: Job, or None if none was started.
+    """
+    with _jobs_lock:
+        return _jobs.get(os.path.abspath(directory))
@@ -0,0 +1,143 @@
+"""SQLite work queue that hands out disjoint batches of files to annotator
+sessions working on the same folder."""
+
+from __future__ import annotations
+
+import sqlite3
+import time
+from collections.abc import Container, Iterable, Iterator
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+__all__ = ["LEASE_BATCH_SIZE", "LEASE_TTL", "LeaseQueue", "lease_db_path"]
+
+# Files leased to a session at a time
+LEASE_BATCH_SIZE = 25
+# Seconds a lease lasts without being renewed. Sessions renew on every click,
+# so this only matters for sessions that were closed or left idle.
+LEASE_TTL = 600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    directory TEXT NOT NULL,
+    file TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (directory, file)
+)
+"""
+
+
+def lease_db_path(json_path: str | Path) -> str:
+    """Get the lease database path that goes with an annotations json file.
+
+    Args:
+        json_path (str | Path): Path of the annotations json file.
+
+    Returns:
+        str: ``<json_path without suffix>.leases.db``.
+    """
+    return str(Path(json_path).with_suffix(".leases.db"))
+
+
+class LeaseQueue:
+    """Leases of files in one directory, shared by every session that uses
+    the same database.
+
+    Each session (``owner``) holds at most one batch of leases at a time.
+    Leasing a new batch drops the owner's old leases and any expired ones, then
+    takes the first ``batch_size`` files that are neither leased by another
+    session nor already annotated. All of this happens in one ``BEGIN
+    IMMEDIATE`` transaction, so two sessions never get the same file.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path,
+        directory: str,
+        owner: str,
+        batch_size: int = LEASE_BATCH_SIZE,
+        ttl: float = LEASE_TTL,
+    ):
+        """Initialize the queue.
+
+        Args:
+            db_path (str | Path): SQLite database file. Created if missing.
+            directory (str): Image directory or manifest the files belong to.
+            owner (str): Id of the session holding the leases.
+            batch_size (int, optional): Files per batch. Defaults to
+                ``LEASE_BATCH_SIZE``.
+            ttl (float, optional): Lease lifetime in seconds. Defaults to
+                ``LEASE_TTL``.
+        """
+        self.db_path = str(db_path)
+        self.directory = directory
+        self.owner = owner
+        self.batch_size = batch_size
+        self.ttl = ttl
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with closing(
+            sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        ) as conn:
+            conn.execute(_SCHEMA)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def acquire(self, files: Iterable[str], done: Container[str]) -> list[str]:
+        """Replace this session's leases with the next batch of free files.
+
+        Args:
+            files (Iterable[str]): Candidate files, in the order to hand them out.
+            done (Container[str]): Files that are already annotated.
+
+        Returns:
+            list[str]: Files leased to this session, in ``files`` order. Empty
+                if every file is annotated or leased by someone else.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM leases WHERE directory = ? AND (owner = ? OR expires < ?)",
+                (self.directory, self.owner, now),
+            )
+            taken = {
+                file
+                for (file,) in conn.execute(
+                    "SELECT file FROM leases WHERE directory = ?", (self.directory,)
+                )
+            }
+            batch = []
+            for file in files:
+                if file in taken or file in done:
+                    continue
+                batch.append(file)
+                if len(batch) >= self.batch_size:
+                    break
+            conn.executemany(
+                "INSERT INTO leases VALUES (?, ?, ?, ?)",
+                [(self.directory, file, self.owner, now + self.ttl) for file in batch],
+            )
+        return batch
+
+    def renew(self) -> None:
+        """Push back the expiry of this session's leases."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE leases SET expires = ? WHERE directory = ? AND owner = ?",
+                (time.time() + self.ttl, self.directory, self.owner),
+            )
+
+    def release(self) -> None:
+        """Drop all of this session's leases."""
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM leases WHERE directory = ? AND owner = ?",
+                (self.directory, self.owner),
+            )
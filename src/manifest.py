@@ -0,0 +1,132 @@
+"""Streaming readers for dataset manifests (CSV, JSONL or Parquet files that
+list image files) used in place of an image directory."""
+
+from __future__ import annotations
+
+import csv
+import json
+import os
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+__all__ = [
+    "FILE_COLUMNS",
+    "MANIFEST_SUFFIXES",
+    "filter_manifest",
+    "is_manifest",
+    "iter_manifest",
+    "manifest_files",
+]
+
+MANIFEST_SUFFIXES = (".csv", ".jsonl", ".parquet")
+# Column names accepted for the image path, in order of preference
+FILE_COLUMNS = ("file", "path", "file_name", "filename")
+# Rows per record batch when reading Parquet manifests
+_PARQUET_BATCH_SIZE = 8192
+
+
+def is_manifest(path: str | Path) -> bool:
+    """Check if a path is a manifest file rather than an image directory.
+
+    Args:
+        path (str | Path): Path provided as the image "directory".
+
+    Returns:
+        bool: True if the path is a file with a manifest suffix.
+    """
+    return Path(path).suffix.lower() in MANIFEST_SUFFIXES and os.path.isfile(path)
+
+
+def _iter_csv(path: str | Path) -> Iterator[dict[str, Any]]:
+    with open(path, encoding="utf-8", newline="") as infile:
+        yield from csv.DictReader(infile)
+
+
+def _iter_jsonl(path: str | Path) -> Iterator[dict[str, Any]]:
+    with open(path, encoding="utf-8") as infile:
+        for line in infile:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _iter_parquet(path: str | Path) -> Iterator[dict[str, Any]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as err:
+        raise ImportError(
+            "Reading Parquet manifests requires pyarrow. Install it with "
+            "`uv pip install pyarrow`."
+        ) from err
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=_PARQUET_BATCH_SIZE):
+        yield from batch.to_pylist()
+
+
+def iter_manifest(path: str | Path) -> Iterator[dict[str, Any]]:
+    """Stream manifest rows one at a time without loading the whole file.
+
+    Args:
+        path (str | Path): Path to a ``.csv``, ``.jsonl`` or ``.parquet`` file.
+
+    Yields:
+        dict[str, Any]: One row per listed image.
+
+    Raises:
+        ValueError: If the file suffix is not a supported manifest format.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".csv":
+        yield from _iter_csv(path)
+    elif suffix == ".jsonl":
+        yield from _iter_jsonl(path)
+    elif suffix == ".parquet":
+        yield from _iter_parquet(path)
+    else:
+        raise ValueError(f"Unsupported manifest format: {suffix!r}")
+
+
+def _row_file(row: dict[str, Any]) -> str | None:
+    """Get the image path of a manifest row from the first file column set."""
+    for column in FILE_COLUMNS:
+        value = row.get(column)
+        if value:
+            return str(value)
+    return None
+
+
+def manifest_files(path: str | Path) -> Iterator[str]:
+    """Stream the image paths listed in a manifest. Paths are returned as
+    written; relative paths are relative to the manifest's folder.
+
+    Args:
+        path (str | Path): Manifest path.
+
+    Yields:
+        str: Image path of each row that has one.
+    """
+    for row in iter_manifest(path):
+        file = _row_file(row)
+        if file:
+            yield file
+
+
+def filter_manifest(
+    path: str | Path, predicate: Callable[[dict[str, Any]], bool]
+) -> Iterator[str]:
+    """Stream the image paths of manifest rows that satisfy ``predicate``.
+    Only the manifest is read; image files are never opened.
+
+    Args:
+        path (str | Path): Manifest path.
+        predicate (Callable[[dict[str, Any]], bool]): Test applied to each row,
+            e.g. a check on optional ``prompt``, ``seed`` or ``width`` columns.
+
+    Yields:
+        str: Image path of each matching row.
+    """
+    for row in iter_manifest(path):
+        file = _row_file(row)
+        if file and predicate(row):
+            yield file
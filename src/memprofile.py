@@ -0,0 +1,367 @@
+"""Opt-in memory profiling of app reruns.
+
+With ``memory_profile: true`` in config.yml the apps trace Python allocations
+with `tracemalloc` and build a `MemoryReport` at the end of every script
+rerun: the current and peak traced memory, the source lines holding the most
+memory, the size of each session state entry and the size of the
+process-wide caches. The latest report is shown in a debug panel and every
+report is appended to a JSON lines file. Clicks that rerun only a fragment
+(e.g. the annotator's image pane or the viewer's navigation) get a report of
+their own in the JSON lines file, see `fragment_window`.
+
+Tracing is process wide, so with several sessions open the peak of a rerun
+also counts allocations made by other sessions in the meantime. Tracing
+slows allocation-heavy code down, so leave it off outside of debugging."""
+
+from __future__ import annotations
+
+import json
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, NamedTuple
+
+import numpy as np
+from PIL import Image
+
+import decode
+import dedup
+import encode
+import features
+import headers
+import ordering
+import registry
+import tiles
+from registry import FileRegistry
+
+__all__ = [
+    "MEMORY_LOG_PATH",
+    "TOP_SITES",
+    "TRACE_FRAMES",
+    "AllocationSite",
+    "MemoryReport",
+    "cache_sizes",
+    "deep_sizeof",
+    "dump_snapshot",
+    "finish_rerun",
+    "format_bytes",
+    "fragment_window",
+    "report_rows",
+    "session_sizes",
+    "start_rerun",
+    "write_report",
+]
+
+# Allocation sites listed per report
+TOP_SITES = 10
+# Stack frames stored per traced allocation; 1 groups by the allocating line
+TRACE_FRAMES = 1
+# JSON lines file reports are appended to unless ``memory_log`` is set
+MEMORY_LOG_PATH = Path(tempfile.gettempdir()) / "image_annotator_memory.jsonl"
+# Objects that are never counted towards a session entry
+_SKIPPED_TYPES = (type, ModuleType, FunctionType, MethodType, BuiltinFunctionType)
+# Allocations made by the profiler itself or by imports
+_PROFILER_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+_log_lock = threading.Lock()
+# Tracks whether a script rerun is being traced on the script thread
+_window = threading.local()
+
+
+class AllocationSite(NamedTuple):
+    """Memory held by the allocations made on one source line."""
+
+    location: str
+    size: int
+    count: int
+
+
+class MemoryReport(NamedTuple):
+    """Memory usage recorded at the end of one rerun."""
+
+    app: str
+    # "script" for a full rerun, else the fragment that reran on its own
+    scope: str
+    time: float
+    # Traced bytes at the end of the rerun and the peak during it
+    current: int
+    peak: int
+    sites: list[AllocationSite]
+    # Bytes per session state key, largest first
+    session: dict[str, int]
+    # Entries and bytes per process-wide cache
+    caches: dict[str, tuple[int, int]]
+
+    def to_json(self) -> dict[str, Any]:
+        """Convert the report to JSON-serializable values.
+
+        Returns:
+            dict[str, Any]: Report with the sites as dicts.
+        """
+        report = self._asdict()
+        report["sites"] = [site._asdict() for site in self.sites]
+        report["caches"] = {
+            name: {"entries": entries, "bytes": nbytes}
+            for name, (entries, nbytes) in self.caches.items()
+        }
+        return report
+
+
+def format_bytes(nbytes: int) -> str:
+    """Format a byte count for display, e.g. ``"12.3 MB"``.
+
+    Args:
+        nbytes (int): Number of bytes.
+
+    Returns:
+        str: Human readable size.
+    """
+    size = float(nbytes)
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} GB"
+
+
+def deep_sizeof(obj: Any, shared: tuple[type, ...] = (FileRegistry,)) -> int:
+    """Estimate the memory held by an object and everything it references.
+
+    Containers, instance attributes, NumPy arrays and the pixel data of PIL
+    images are followed; every object is counted once. Classes, modules and
+    functions are skipped, as are instances of ``shared``, so a session's
+    file list does not include the registry every session shares (it is
+    reported by `cache_sizes`).
+
+    Args:
+        obj (Any): Object to measure.
+        shared (tuple[type, ...], optional): Types that are not counted.
+            Defaults to `registry.FileRegistry`.
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+    seen: set[int] = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (*_SKIPPED_TYPES, *shared)):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, np.ndarray):
+            # getsizeof counts the data of arrays that own it
+            continue
+        if isinstance(item, Image.Image):
+            total += item.width * item.height * len(item.getbands())
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        elif not isinstance(item, (str, bytes, bytearray, memoryview)):
+            if hasattr(item, "__dict__"):
+                stack.append(vars(item))
+            for name in getattr(type(item), "__slots__", ()):
+                if hasattr(item, name):
+                    stack.append(getattr(item, name))
+    return total
+
+
+def session_sizes(session: Mapping[str, Any]) -> dict[str, int]:
+    """Measure every session state entry with `deep_sizeof`.
+
+    Args:
+        session (Mapping[str, Any]): Session state, e.g. ``st.session_state``.
+
+    Returns:
+        dict[str, int]: Bytes per key, largest first.
+    """
+    sizes = {str(key): deep_sizeof(value) for key, value in list(session.items())}
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+def cache_sizes() -> dict[str, tuple[int, int]]:
+    """Collect the size of every process-wide cache of the apps.
+
+    Returns:
+        dict[str, tuple[int, int]]: Entries and approximate bytes per cache.
+    """
+    sizes: dict[str, tuple[int, int]] = {}
+    for module in (registry, headers, ordering, dedup, features, decode, encode, tiles):
+        sizes.update(module.cache_usage())
+    return sizes
+
+
+def start_rerun(frames: int = TRACE_FRAMES) -> None:
+    """Start tracing allocations if needed and reset the traced peak, so the
+    next `finish_rerun` reports the peak of this rerun.
+
+    Args:
+        frames (int, optional): Stack frames stored per allocation when
+            tracing starts. Defaults to `TRACE_FRAMES`.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    tracemalloc.reset_peak()
+    _window.open = True
+
+
+def _top_sites(snapshot: tracemalloc.Snapshot, limit: int) -> list[AllocationSite]:
+    stats = snapshot.filter_traces(_PROFILER_FILTERS).statistics("lineno")
+    return [
+        AllocationSite(
+            f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            stat.size,
+            stat.count,
+        )
+        for stat in stats[:limit]
+    ]
+
+
+def finish_rerun(
+    app: str,
+    session: Mapping[str, Any],
+    limit: int = TOP_SITES,
+    scope: str = "script",
+) -> MemoryReport:
+    """Build the report of a rerun started with `start_rerun`.
+
+    Args:
+        app (str): App the rerun belongs to, e.g. ``"annotator"``.
+        session (Mapping[str, Any]): Session state to measure.
+        limit (int, optional): Allocation sites to list. Defaults to
+            `TOP_SITES`.
+        scope (str, optional): Fragment that reran, or ``"script"`` for a
+            full rerun. Defaults to "script".
+
+    Returns:
+        MemoryReport: Report of the rerun.
+
+    Raises:
+        RuntimeError: If allocations are not being traced.
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Call start_rerun before finish_rerun.")
+    _window.open = False
+    current, peak = tracemalloc.get_traced_memory()
+    sites = _top_sites(tracemalloc.take_snapshot(), limit)
+    return MemoryReport(
+        app=app,
+        scope=scope,
+        time=time.time(),
+        current=current,
+        peak=peak,
+        sites=sites,
+        session=session_sizes(session),
+        caches=cache_sizes(),
+    )
+
+
+@contextmanager
+def fragment_window(
+    app: str,
+    fragment: str,
+    session: Mapping[str, Any],
+    path: str | Path = MEMORY_LOG_PATH,
+) -> Iterator[None]:
+    """Trace a rerun of only one fragment and append its report to the
+    memory log. Fragments also run inside every full rerun, whose window
+    is already open; then this does nothing, so the script's peak is not
+    reset halfway through.
+
+    Args:
+        app (str): App the fragment belongs to, e.g. ``"viewer"``.
+        fragment (str): Name of the fragment, e.g. ``"navigation"``.
+        session (Mapping[str, Any]): Session state to measure.
+        path (str | Path, optional): Log file. Defaults to `MEMORY_LOG_PATH`.
+
+    Yields:
+        None: Control while the fragment runs.
+    """
+    if getattr(_window, "open", False):
+        yield
+        return
+    start_rerun()
+    try:
+        yield
+    finally:
+        write_report(finish_rerun(app, session, scope=fragment), path)
+
+
+def write_report(report: MemoryReport, path: str | Path = MEMORY_LOG_PATH) -> None:
+    """Append a report to a JSON lines file.
+
+    Args:
+        report (MemoryReport): Report to write.
+        path (str | Path, optional): Log file. Defaults to `MEMORY_LOG_PATH`.
+    """
+    line = json.dumps(report.to_json())
+    with _log_lock, open(path, "a", encoding="utf-8") as outfile:
+        outfile.write(line + "\n")
+
+
+def dump_snapshot(path: str | Path | None = None) -> str:
+    """Write every traced allocation to a file that can be loaded with
+    ``tracemalloc.Snapshot.load`` and compared to a later one.
+
+    Args:
+        path (str | Path | None, optional): Snapshot file. Defaults to a
+            timestamped file next to `MEMORY_LOG_PATH`.
+
+    Returns:
+        str: Path of the snapshot file.
+
+    Raises:
+        RuntimeError: If allocations are not being traced.
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Allocations are not being traced.")
+    if path is None:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = MEMORY_LOG_PATH.with_name(f"image_annotator_memory_{stamp}.snapshot")
+    tracemalloc.take_snapshot().dump(str(path))
+    return str(path)
+
+
+def report_rows(report: MemoryReport, limit: int = TOP_SITES) -> dict[str, list]:
+    """Lay a report out as tables for the debug panel.
+
+    Args:
+        report (MemoryReport): Report to show.
+        limit (int, optional): Session entries to list. Defaults to
+            `TOP_SITES`.
+
+    Returns:
+        dict[str, list]: Rows per table title.
+    """
+    return {
+        "Largest allocation sites": [
+            {
+                "line": site.location,
+                "size": format_bytes(site.size),
+                "blocks": site.count,
+            }
+            for site in report.sites
+        ],
+        "Session state": [
+            {"key": key, "size": format_bytes(nbytes)}
+            for key, nbytes in list(report.session.items())[:limit]
+        ],
+        "Caches": [
+            {"cache": name, "entries": entries, "size": format_bytes(nbytes)}
+            for name, (entries, nbytes) in report.caches.items()
+        ],
+    }
@@ -0,0 +1,194 @@
+"""Sort files into folders: plan the moves first, then run them in batches.
+
+Moving by keyword used to filter the whole listing once per keyword, each
+pass over the files the earlier keywords left, and to check every file
+against the listing with a list lookup before moving it. A `KeywordMatcher`
+instead splits each file name once (see `utils.split_file_name`) and finds
+the first keyword it matches in the same pass, so a file still goes to the
+folder of the first matching keyword. `plan_moves` turns the resulting
+groups (or the groups of the json file's labels) into a `MovePlan` whose
+per-folder counts can be shown as a dry run before `execute_moves` touches
+the disk."""
+
+from __future__ import annotations
+
+import os
+import shutil
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from utils import get_base_dir, get_file_path, split_file_name
+
+__all__ = [
+    "MOVE_BATCH",
+    "MOVE_WORKERS",
+    "KeywordMatcher",
+    "MovePlan",
+    "assign_keywords",
+    "execute_moves",
+    "plan_moves",
+]
+
+# Files moved per task handed to the worker threads
+MOVE_BATCH = 256
+# Threads moving files at once; renames mostly wait on the file system
+MOVE_WORKERS = 4
+
+
+class KeywordMatcher:
+    """Keyword phrases indexed by their first word, so a file name is split
+    once and only the phrases starting with one of its words are compared."""
+
+    def __init__(self, keywords: Sequence[str], sep: str = " "):
+        """Initialize the matcher.
+
+        Args:
+            keywords (Sequence[str]): Keyword phrases in priority order.
+            sep (str, optional): Separator between words, in file names and
+                phrases. Defaults to " ".
+        """
+        self.sep = sep or " "
+        self.keywords = list(keywords)
+        self._phrases: dict[str, list[tuple[int, list[str]]]] = {}
+        for idx, keyword in enumerate(self.keywords):
+            words = keyword.split(self.sep) if self.sep in keyword else [keyword]
+            self._phrases.setdefault(words[0], []).append((idx, words))
+
+    def first_match(self, file: str) -> int | None:
+        """Find the first keyword a file name contains, in the sense of
+        `utils.matches_keyword`.
+
+        Args:
+            file (str): File name.
+
+        Returns:
+            int | None: Index of the keyword, or None if none matches.
+        """
+        words = split_file_name(file, self.sep)
+        best = None
+        for pos, word in enumerate(words):
+            for idx, phrase in self._phrases.get(word, ()):
+                if best is not None and idx >= best:
+                    continue
+                if words[pos : pos + len(phrase)] == phrase:
+                    best = idx
+            if best == 0:
+                break
+        return best
+
+
+def assign_keywords(
+    files: Iterable[str], keywords: Sequence[str], sep: str = " "
+) -> dict[str, list[str]]:
+    """Group files by the first keyword their name contains, in one pass.
+
+    Args:
+        files (Iterable[str]): File names.
+        keywords (Sequence[str]): Keyword phrases in priority order.
+        sep (str, optional): Separator between words. Defaults to " ".
+
+    Returns:
+        dict[str, list[str]]: Matching files per keyword, in the order of
+            ``files``. Every keyword is a key, with an empty list if nothing
+            matched.
+    """
+    matcher = KeywordMatcher(keywords, sep)
+    groups: dict[str, list[str]] = {keyword: [] for keyword in keywords}
+    first_match = matcher.first_match
+    for file in files:
+        idx = first_match(file)
+        if idx is not None:
+            groups[keywords[idx]].append(file)
+    return groups
+
+
+class MovePlan(NamedTuple):
+    """Files to move into folders next to an image directory."""
+
+    img_dir: str
+    # Files per destination folder name; folders without files are left out
+    groups: dict[str, list[str]]
+
+    @property
+    def counts(self) -> dict[str, int]:
+        """Number of files per folder, the dry run report of the plan."""
+        return {folder: len(files) for folder, files in self.groups.items()}
+
+    @property
+    def total(self) -> int:
+        """Number of files the plan moves."""
+        return sum(len(files) for files in self.groups.values())
+
+
+def plan_moves(
+    img_dir: str,
+    groups: Mapping[str, Iterable[str]],
+    present: Callable[[str], bool] | None = None,
+) -> MovePlan:
+    """Plan moving grouped files into a folder per group. Nothing is read or
+    written on disk.
+
+    Args:
+        img_dir (str): Image directory or manifest the file names belong to.
+        groups (Mapping[str, Iterable[str]]): Files per folder name, e.g. from
+            `assign_keywords` or the labels of the json file.
+        present (Callable[[str], bool] | None, optional): Check that a file
+            is still listed; others are skipped. Defaults to keeping all.
+
+    Returns:
+        MovePlan: Files to move per folder.
+    """
+    planned = {}
+    for folder, files in groups.items():
+        kept = [file for file in files if present is None or present(file)]
+        if kept:
+            planned[folder] = kept
+    return MovePlan(img_dir, planned)
+
+
+def _move_batch(img_dir: str, folder_dir: str, files: list[str]) -> list[str]:
+    """Move files into ``folder_dir`` and return the ones that were moved.
+    Renames are tried first; files on another file system are copied and
+    removed by `shutil.move`, and files that are gone are skipped."""
+    moved = []
+    for file in files:
+        src = get_file_path(img_dir, file)
+        dest = os.path.join(folder_dir, os.path.basename(file))
+        try:
+            os.rename(src, dest)
+        except FileNotFoundError:
+            continue
+        except OSError:
+            shutil.move(src, dest)
+        moved.append(file)
+    return moved
+
+
+def execute_moves(plan: MovePlan, workers: int = MOVE_WORKERS) -> dict[str, list[str]]:
+    """Run a plan: create each folder once, then move its files in batches
+    of `MOVE_BATCH` on a thread pool.
+
+    Args:
+        plan (MovePlan): Plan from `plan_moves`.
+        workers (int, optional): Threads moving files at once. Defaults to
+            `MOVE_WORKERS`.
+
+    Returns:
+        dict[str, list[str]]: Files that were moved per folder.
+    """
+    base_dir = get_base_dir(plan.img_dir)
+    tasks = []
+    for folder, files in plan.groups.items():
+        folder_dir = os.path.join(base_dir, folder)
+        os.makedirs(folder_dir, exist_ok=True)
+        for start in range(0, len(files), MOVE_BATCH):
+            tasks.append((folder, folder_dir, files[start : start + MOVE_BATCH]))
+    moved: dict[str, list[str]] = {folder: [] for folder in plan.groups}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = executor.map(
+            lambda task: _move_batch(plan.img_dir, task[1], task[2]), tasks
+        )
+        for (folder, _, _), done in zip(tasks, results):
+            moved[folder].extend(done)
+    return moved
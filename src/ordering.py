@@ -0,0 +1,333 @@
+"""Orders the apps can show files in, and the cached values they sort on.
+
+Besides name order, files can be sorted by modification time and size, by
+image size (see `headers`) or by a numeric Stable Diffusion metadata field
+such as the seed. Stat values come from one `os.scandir` pass over the
+directory per registry version, and metadata values are read once per file,
+both into NumPy arrays indexed by registry id. Switching the sort order then
+only argsorts those arrays."""
+
+from __future__ import annotations
+
+import os
+import threading
+from array import array
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from archive import get_index
+from headers import HEADER_SORT_KEYS, get_header_index
+from registry import FileRegistry, FileView
+from utils import get_file_path, get_metadata_dict
+
+__all__ = [
+    "METADATA_SORT_FIELDS",
+    "SORT_KEYS",
+    "SORT_WORKERS",
+    "MetadataIndex",
+    "StatIndex",
+    "cache_usage",
+    "get_metadata_index",
+    "get_stat_index",
+    "sort_view",
+]
+
+# Metadata sort keys and the Stable Diffusion parameter each one reads
+METADATA_SORT_FIELDS = {"seed": "Seed", "steps": "Steps", "cfg scale": "CFG scale"}
+# Every sort key, in the order they are offered
+SORT_KEYS = ("name", "modified", "file size", *HEADER_SORT_KEYS, *METADATA_SORT_FIELDS)
+# Threads that stat manifest files or read image metadata
+SORT_WORKERS = 16
+
+
+def _ids_array(file_ids: Iterable[int]) -> np.ndarray:
+    return np.array(file_ids, dtype=np.uint32).reshape(-1)
+
+
+def _stat(path: str) -> tuple[int, int]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return -1, -1
+    return stat.st_mtime_ns, stat.st_size
+
+
+class StatIndex:
+    """Modification times and sizes of the files of one registry, by id."""
+
+    def __init__(self, registry: FileRegistry):
+        """Initialize an empty index; call `refresh` to fill it.
+
+        Args:
+            registry (FileRegistry): Registry whose ids index the arrays.
+        """
+        self.registry = registry
+        self._version = -1
+        self._mtime = np.zeros(0, dtype=np.int64)
+        self._size = np.zeros(0, dtype=np.int64)
+        self._inode = np.zeros(0, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Stat every file again if the registry changed since the last pass.
+
+        Directories are listed with a single `os.scandir`, whose entries carry
+        the stat data on Windows and need one ``stat`` call each elsewhere.
+        Files of a manifest are stat-ed in a thread pool, and archive members
+        get their stored size and the archive's modification time. Inode
+        numbers are only kept for directories, whose files share a device.
+        """
+        registry = self.registry
+        with self._lock:
+            version = registry.version
+            if version == self._version:
+                return
+            view = registry.view()
+            ids_of = dict(zip(view, view.ids))
+            mtime = np.full(registry.capacity, -1, dtype=np.int64)
+            size = np.full(registry.capacity, -1, dtype=np.int64)
+            inode = np.full(registry.capacity, -1, dtype=np.int64)
+            directory = registry.directory
+            if registry.is_archive:
+                archive_mtime = os.stat(directory).st_mtime_ns
+                members = get_index(directory).members
+                for name, file_id in ids_of.items():
+                    mtime[file_id] = archive_mtime
+                    size[file_id] = members[name].size
+            elif registry.is_manifest:
+                paths = [get_file_path(directory, name) for name in ids_of]
+                with ThreadPoolExecutor(max_workers=SORT_WORKERS) as pool:
+                    stats = list(pool.map(_stat, paths))
+                for file_id, (mtime_ns, nbytes) in zip(ids_of.values(), stats):
+                    mtime[file_id] = mtime_ns
+                    size[file_id] = nbytes
+            else:
+                with os.scandir(directory) as scan:
+                    for entry in scan:
+                        file_id = ids_of.get(entry.name)
+                        if file_id is None:
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        mtime[file_id] = stat.st_mtime_ns
+                        size[file_id] = stat.st_size
+                        # Zero on Windows, where scandir does not fill it
+                        inode[file_id] = stat.st_ino or -1
+            self._mtime, self._size, self._inode = mtime, size, inode
+            self._version = version
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the stat arrays."""
+        return self._mtime.nbytes + self._size.nbytes + self._inode.nbytes
+
+    def stats(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get the modification times and sizes of files.
+
+        Args:
+            ids (np.ndarray): Registry ids.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: ``int64`` mtimes (ns) and sizes,
+                -1 for files that could not be stat-ed.
+        """
+        self.refresh()
+        return self._mtime[ids], self._size[ids]
+
+    def inodes(self, ids: np.ndarray) -> np.ndarray:
+        """Get the inode numbers of files, which are equal for hard links to
+        the same file.
+
+        Args:
+            ids (np.ndarray): Registry ids.
+
+        Returns:
+            np.ndarray: ``int64`` inode numbers, -1 where unknown (archive
+                members, manifest files and files that could not be stat-ed).
+        """
+        self.refresh()
+        return self._inode[ids]
+
+    def sort_values(self, key: str, ids: np.ndarray) -> np.ndarray:
+        """Get ascending sort values: oldest first for ``"modified"``,
+        largest first for ``"file size"``. Missing files sort last.
+
+        Args:
+            key (str): ``"modified"`` or ``"file size"``.
+            ids (np.ndarray): Registry ids.
+
+        Returns:
+            np.ndarray: One value per id.
+        """
+        self.refresh()
+        if key == "modified":
+            values = self._mtime[ids].astype(np.float64)
+        else:
+            values = -self._size[ids].astype(np.float64)
+        values[self._mtime[ids] < 0] = np.inf
+        return values
+
+
+class MetadataIndex:
+    """Numeric Stable Diffusion parameters of the images of one registry, by
+    id. Each image's metadata is read once for all `METADATA_SORT_FIELDS`."""
+
+    def __init__(self, registry: FileRegistry):
+        """Initialize an empty index; values are read by `sort_values`.
+
+        Args:
+            registry (FileRegistry): Registry whose ids index the arrays.
+        """
+        self.registry = registry
+        self._read = np.zeros(0, dtype=bool)
+        self._values = np.zeros((0, len(METADATA_SORT_FIELDS)), dtype=np.float64)
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the metadata arrays."""
+        return self._read.nbytes + self._values.nbytes
+
+    def _read_values(self, image_path: str) -> list[float]:
+        """Read the numeric value of every metadata sort field; fields that are
+        missing or not numbers read as NaN."""
+        try:
+            meta = get_metadata_dict(image_path)
+        except (OSError, SyntaxError, ValueError):
+            meta = {}
+        values = []
+        for field in METADATA_SORT_FIELDS.values():
+            try:
+                values.append(float(meta[field]))
+            except (KeyError, TypeError, ValueError):
+                values.append(np.nan)
+        return values
+
+    def ensure(self, ids: np.ndarray) -> None:
+        """Read the metadata of the ids that have not been read yet, in a
+        thread pool.
+
+        Args:
+            ids (np.ndarray): Registry ids.
+        """
+        with self._lock:
+            extra = self.registry.capacity - len(self._read)
+            if extra > 0:
+                self._read = np.concatenate([self._read, np.zeros(extra, bool)])
+                self._values = np.vstack(
+                    [self._values, np.full((extra, self._values.shape[1]), np.nan)]
+                )
+            missing = ids[~self._read[ids]].tolist()
+        if not missing:
+            return
+        name = self.registry.name
+        directory = self.registry.directory
+        paths = [get_file_path(directory, name(file_id)) for file_id in missing]
+        with ThreadPoolExecutor(max_workers=SORT_WORKERS) as pool:
+            rows = list(pool.map(self._read_values, paths))
+        with self._lock:
+            self._values[missing] = rows
+            self._read[missing] = True
+
+    def sort_values(self, key: str, ids: np.ndarray) -> np.ndarray:
+        """Get ascending sort values for a metadata field; images without it
+        sort last.
+
+        Args:
+            key (str): One of `METADATA_SORT_FIELDS`.
+            ids (np.ndarray): Registry ids.
+
+        Returns:
+            np.ndarray: One value per id.
+        """
+        self.ensure(ids)
+        column = list(METADATA_SORT_FIELDS).index(key)
+        values = self._values[ids, column]
+        return np.where(np.isnan(values), np.inf, values)
+
+
+_stat_indexes: dict[FileRegistry, StatIndex] = {}
+_metadata_indexes: dict[FileRegistry, MetadataIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_stat_index(registry: FileRegistry) -> StatIndex:
+    """Get the process-wide stat index of a registry.
+
+    Args:
+        registry (FileRegistry): Registry of the directory.
+
+    Returns:
+        StatIndex: Shared index.
+    """
+    with _indexes_lock:
+        index = _stat_indexes.get(registry)
+        if index is None:
+            index = _stat_indexes[registry] = StatIndex(registry)
+        return index
+
+
+def get_metadata_index(registry: FileRegistry) -> MetadataIndex:
+    """Get the process-wide metadata index of a registry.
+
+    Args:
+        registry (FileRegistry): Registry of the directory.
+
+    Returns:
+        MetadataIndex: Shared index.
+    """
+    with _indexes_lock:
+        index = _metadata_indexes.get(registry)
+        if index is None:
+            index = _metadata_indexes[registry] = MetadataIndex(registry)
+        return index
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the stat and metadata indexes.
+
+    Returns:
+        dict[str, tuple[int, int]]: Indexes and the bytes of their arrays.
+    """
+    with _indexes_lock:
+        stats = list(_stat_indexes.values())
+        metadata = list(_metadata_indexes.values())
+    return {
+        "stat indexes": (len(stats), sum(index.nbytes for index in stats)),
+        "metadata indexes": (len(metadata), sum(index.nbytes for index in metadata)),
+    }
+
+
+def sort_view(view: FileView, start: int, key: str) -> FileView:
+    """Sort the files from ``start`` on by one of `SORT_KEYS`, keeping the
+    ones before it in place. The sort is stable, so ties stay in their
+    current order.
+
+    Args:
+        view (FileView): Files to sort.
+        start (int): First position to reorder (e.g. ``state.counter``).
+        key (str): One of `SORT_KEYS`.
+
+    Returns:
+        FileView: Sorted view.
+    """
+    if key not in SORT_KEYS[1:]:
+        return view.reordered(start, lambda file: file)
+    ids = _ids_array(view.ids[start:])
+    registry = view.registry
+    if key in HEADER_SORT_KEYS:
+        index = get_header_index(registry)
+        index.ensure(ids)
+        values = index.sort_values(key, ids)
+    elif key in METADATA_SORT_FIELDS:
+        values = get_metadata_index(registry).sort_values(key, ids)
+    else:
+        values = get_stat_index(registry).sort_values(key, ids)
+    order = np.argsort(values, kind="stable")
+    return FileView(
+        registry, view.ids[:start] + array("I", ids[order].astype(np.uint32).tobytes())
+    )
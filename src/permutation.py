@@ -0,0 +1,205 @@
+"""Seeded, lazily evaluated permutation of ``range(size)``."""
+
+from __future__ import annotations
+
+import random
+from array import array
+from collections.abc import Iterable
+
+import numpy as np
+
+__all__ = ["LazyPermutation", "ShuffledOrder"]
+
+_N_ROUNDS = 4
+
+
+class LazyPermutation:
+    """A reproducible shuffle of ``range(size)`` that never materialises the
+    shuffled order.
+
+    Positions are mapped to indices with a small balanced Feistel network over
+    the smallest power-of-four domain that holds ``size``, using cycle walking
+    to stay inside ``range(size)``. Because the domain is less than four times
+    ``size``, a lookup takes a handful of rounds on average, so next, back and
+    jump are all O(1) and the object only stores the size and round keys.
+    """
+
+    def __init__(self, size: int, seed: int):
+        """Initialize the permutation.
+
+        Args:
+            size (int): Number of items being shuffled.
+            seed (int): Seed for the round keys. The same seed and size always
+                give the same order.
+        """
+        if size < 0:
+            raise ValueError("size must be >= 0")
+        self.size = size
+        self.seed = seed
+        self._half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self._half_mask = (1 << self._half_bits) - 1
+        rng = random.Random(seed)
+        self._keys = [rng.getrandbits(32) for _ in range(_N_ROUNDS)]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, position: int) -> int:
+        """Return the index shown at ``position`` in the shuffled order."""
+        if position < 0:
+            position += self.size
+        if not 0 <= position < self.size:
+            raise IndexError("permutation index out of range")
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def index(self, value: int) -> int:
+        """Return the position of ``value`` in the shuffled order (the inverse
+        of ``__getitem__``).
+
+        Args:
+            value (int): Index into the unshuffled sequence.
+
+        Returns:
+            int: Position of ``value`` in the shuffled order.
+        """
+        if not 0 <= value < self.size:
+            raise ValueError(f"{value} is not in range({self.size})")
+        position = self._decrypt(value)
+        while position >= self.size:
+            position = self._decrypt(position)
+        return position
+
+    def _round(self, half: int, key: int) -> int:
+        """Feistel round function: a cheap integer mix of ``half`` and ``key``."""
+        half = (half ^ key) * 0x45D9F3B & 0xFFFFFFFF
+        half ^= half >> 16
+        half = half * 0x45D9F3B & 0xFFFFFFFF
+        half ^= half >> 16
+        return half & self._half_mask
+
+    def _encrypt(self, value: int) -> int:
+        left = value >> self._half_bits
+        right = value & self._half_mask
+        for key in self._keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self._half_bits) | right
+
+    def _decrypt(self, value: int) -> int:
+        left = value >> self._half_bits
+        right = value & self._half_mask
+        for key in reversed(self._keys):
+            left, right = right ^ self._round(left, key), left
+        return (left << self._half_bits) | right
+
+
+class ShuffledOrder:
+    """A seeded shuffle of a list of ids that keeps its order while ids are
+    added and removed.
+
+    The ids present when shuffling are looked up through a `LazyPermutation`.
+    Added ids are appended after the last position, and a removed id's
+    position is taken by the id at the last position, so every other
+    position keeps showing the same id. Only those changed positions are
+    stored, in a small dict that overrides the permutation.
+    """
+
+    def __init__(self, ids: Iterable[int], seed: int):
+        """Initialize the order.
+
+        Args:
+            ids (Iterable[int]): Ids to shuffle, e.g. the registry ids of a
+                `registry.FileView`.
+            seed (int): Seed of the permutation.
+        """
+        self.seed = seed
+        self._base = np.frombuffer(array("I", ids), dtype=np.uint32)
+        self._perm = LazyPermutation(len(self._base), seed)
+        self.size = len(self._base)
+        # Positions whose id is not the permutation's, and the reverse map
+        self._moved: dict[int, int] = {}
+        self._moved_at: dict[int, int] = {}
+        self._sorted: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, position: int) -> int:
+        """Return the id shown at ``position``."""
+        if position < 0:
+            position += self.size
+        if not 0 <= position < self.size:
+            raise IndexError("order index out of range")
+        moved = self._moved.get(position)
+        if moved is not None:
+            return moved
+        return int(self._base[self._perm[position]])
+
+    def position_of(self, file_id: int) -> int | None:
+        """Find the position of an id.
+
+        Args:
+            file_id (int): Id to look up.
+
+        Returns:
+            int | None: Its position, or None if it is not in the order.
+        """
+        position = self._moved_at.get(file_id)
+        if position is not None:
+            return position
+        if self._sorted is None:
+            # Built on the first lookup; shuffles that never change skip it
+            self._sorted = np.argsort(self._base, kind="stable").astype(np.uint32)
+        idx = int(np.searchsorted(self._base, file_id, sorter=self._sorted))
+        if idx == len(self._base) or self._base[self._sorted[idx]] != file_id:
+            return None
+        position = self._perm.index(int(self._sorted[idx]))
+        if position < self.size and position not in self._moved:
+            return position
+        return None
+
+    def _set(self, position: int, file_id: int) -> None:
+        previous = self._moved.get(position)
+        if previous is not None:
+            del self._moved_at[previous]
+        self._moved[position] = file_id
+        self._moved_at[file_id] = position
+
+    def _clear(self, position: int) -> None:
+        previous = self._moved.pop(position, None)
+        if previous is not None:
+            del self._moved_at[previous]
+
+    def synced(
+        self, added: Iterable[int], removed: Iterable[int], position: int
+    ) -> int:
+        """Apply added and removed ids in place.
+
+        Args:
+            added (Iterable[int]): Ids to append.
+            removed (Iterable[int]): Ids to drop; ids not in the order are
+                ignored.
+            position (int): Current position (e.g. ``state.counter``).
+
+        Returns:
+            int: ``position`` moved along with its id if that id was the last
+                one and took the place of a removed id.
+        """
+        for file_id in removed:
+            at = self.position_of(file_id)
+            if at is None:
+                continue
+            last = self.size - 1
+            last_id = self[last]
+            self._clear(last)
+            if at != last:
+                self._set(at, last_id)
+            self.size -= 1
+            if position == last:
+                position = at
+        for file_id in added:
+            self._set(self.size, file_id)
+            self.size += 1
+        return position
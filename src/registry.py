@@ -0,0 +1,773 @@
+"""Shared, array-backed file name registry and the compact per-session
+views built on top of it."""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from array import array
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, MutableMapping, Sequence
+from itertools import accumulate
+from typing import Any, overload
+
+from archive import is_archive
+from manifest import filter_manifest, is_manifest
+from utils import (
+    get_filtered_files,
+    iter_filtered_files,
+    matches_conditions,
+    parse_conditions,
+)
+
+__all__ = [
+    "AnnotationMap",
+    "FileRegistry",
+    "FileView",
+    "cache_usage",
+    "get_registry",
+]
+
+
+# Manifest query results kept per registry before the cache is cleared
+_MAX_CACHED_QUERIES = 8
+# Number of change sets kept so sessions can catch up incrementally
+_MAX_CHANGE_LOG = 1024
+# Above this many changed names, re-sort instead of inserting one by one
+_MAX_INCREMENTAL_CHANGES = 256
+# Names registered by the first batch of `refresh_in_batches`; later batches
+# double in size so the whole listing is re-sorted only O(log n) times
+_FIRST_BATCH = 256
+
+
+def _bisect_names(ids: array, name: str, name_of: Callable[[int], str]) -> int:
+    """Leftmost position in name-sorted ``ids`` where ``name`` would go."""
+    low, high = 0, len(ids)
+    while low < high:
+        mid = (low + high) // 2
+        if name_of(ids[mid]) < name:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+class FileRegistry:
+    """All image file names of one directory, stored once per process.
+
+    Names live in a single UTF-8 buffer with an offset table, so a million
+    names cost roughly their byte length plus a few bytes each instead of a
+    Python ``str`` object apiece. Every name gets a stable integer id. Ids are
+    never reused: new files are appended and removed files are only marked
+    dead, so per-session id arrays and label codes stay valid across
+    ``refresh`` calls.
+    """
+
+    def __init__(self, directory: str):
+        """Initialize an empty registry for ``directory``. Call ``refresh``
+        to list it.
+
+        Args:
+            directory (str): Image directory the registry describes.
+        """
+        self.directory = directory
+        self.version = 0
+        # Set while a `watcher.DirectoryWatcher` keeps the registry up to date,
+        # so callers of `get_registry` skip the mtime check and relist.
+        self.watched = False
+        # Set while an `indexing.IndexJob` lists the directory in batches, so
+        # callers of `get_registry` use the names listed so far.
+        self.indexing = False
+        self._blob = bytearray()
+        self._offsets = array("Q", [0])
+        self._alive = bytearray()
+        self._sorted = array("I")
+        self._mtime_ns: int | None = None
+        self._lock = threading.Lock()
+        self._queries: dict[tuple[str, int], array] = {}
+        self._changes: deque[tuple[int, tuple[int, ...], tuple[int, ...]]] = deque(
+            maxlen=_MAX_CHANGE_LOG
+        )
+
+    def __len__(self) -> int:
+        """Number of names currently in the directory."""
+        return len(self._sorted)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self.id_of(name) is not None
+
+    @property
+    def is_manifest(self) -> bool:
+        """True if the names are read from a manifest file."""
+        return is_manifest(self.directory)
+
+    @property
+    def is_archive(self) -> bool:
+        """True if the names are the members of a zip or tar archive."""
+        return is_archive(self.directory)
+
+    @property
+    def capacity(self) -> int:
+        """Number of ids handed out so far, including removed files."""
+        return len(self._alive)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the names, ids and cached query results."""
+        buffers = [self._blob, self._offsets, self._alive, self._sorted]
+        buffers.extend(self._queries.values())
+        return sum(sys.getsizeof(buffer) for buffer in buffers)
+
+    def name(self, file_id: int) -> str:
+        """Get the file name for an id.
+
+        Args:
+            file_id (int): Registry id.
+
+        Returns:
+            str: File name.
+        """
+        start = self._offsets[file_id]
+        end = self._offsets[file_id + 1]
+        return self._blob[start:end].decode("utf-8")
+
+    def id_of(self, name: str) -> int | None:
+        """Find the id of a file name with a binary search over the
+        name-sorted ids.
+
+        Args:
+            name (str): File name.
+
+        Returns:
+            int | None: Registry id, or None if the file is not present.
+        """
+        sorted_ids = self._sorted
+        idx = _bisect_names(sorted_ids, name, self.name)
+        if idx < len(sorted_ids) and self.name(sorted_ids[idx]) == name:
+            return sorted_ids[idx]
+        return None
+
+    def changes_since(self, version: int) -> tuple[list[int], list[int]] | None:
+        """Get the ids added and removed after ``version``.
+
+        Args:
+            version (int): Registry version the caller last synced to.
+
+        Returns:
+            tuple[list[int], list[int]] | None: Added and removed ids, or None
+                if the change log no longer reaches back to ``version`` and the
+                caller has to rebuild its view.
+        """
+        if version == self.version:
+            return [], []
+        changes = list(self._changes)
+        if not changes or changes[0][0] > version + 1 or version > self.version:
+            return None
+        added: list[int] = []
+        removed: list[int] = []
+        for change_version, change_added, change_removed in changes:
+            if change_version > version:
+                added.extend(change_added)
+                removed.extend(change_removed)
+        return added, removed
+
+    def removed_ids(self, stop: int | None = None) -> Iterator[int]:
+        """Iterate over ids of names that have been removed.
+
+        Args:
+            stop (int | None, optional): Only look at ids below this value.
+                Defaults to all ids.
+
+        Yields:
+            int: Removed registry id.
+        """
+        alive = self._alive
+        stop = len(alive) if stop is None else min(stop, len(alive))
+        file_id = alive.find(0, 0, stop)
+        while file_id >= 0:
+            yield file_id
+            file_id = alive.find(0, file_id + 1, stop)
+
+    def manifest_ids(self, conditions: str) -> array:
+        """Get the ids of manifest rows matching column conditions such as
+        ``seed=42, prompt~cat``. Only the manifest is read, never the images.
+        Results are shared by all sessions until the manifest changes.
+
+        Args:
+            conditions (str): Conditions in `utils.parse_conditions` syntax.
+
+        Returns:
+            array: ``array('I')`` of matching registry ids.
+        """
+        key = (conditions, self.version)
+        cached = self._queries.get(key)
+        if cached is not None:
+            return cached
+        parsed = parse_conditions(conditions)
+        matching = filter_manifest(
+            self.directory, lambda row: matches_conditions(row, parsed)
+        )
+        ids = array(
+            "I",
+            (file_id for file_id in map(self.id_of, matching) if file_id is not None),
+        )
+        with self._lock:
+            if len(self._queries) >= _MAX_CACHED_QUERIES:
+                self._queries.clear()
+            self._queries[key] = ids
+        return ids
+
+    def view(self) -> FileView:
+        """Get a view of all current names in sorted order.
+
+        Returns:
+            FileView: New view backed by a copy of the sorted id array.
+        """
+        return FileView(self, array("I", self._sorted))
+
+    def refresh(self, force: bool = False) -> bool:
+        """Relist the directory if its modification time changed, appending
+        new names and marking removed ones dead.
+
+        Args:
+            force (bool, optional): Relist even if the mtime is unchanged.
+                Defaults to False.
+
+        Returns:
+            bool: True if the set of names changed. False also if the listing
+                failed; the names are then kept as they are, since a partial
+                listing would mark every name it did not reach as removed,
+                and the directory is listed again on the next call.
+        """
+        try:
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        with self._lock:
+            if not force and mtime_ns is not None and mtime_ns == self._mtime_ns:
+                return False
+            try:
+                listed = set(get_filtered_files(self.directory, strict=True))
+            except OSError:
+                self._mtime_ns = None
+                return False
+            self._mtime_ns = mtime_ns
+            current = {self.name(file_id): file_id for file_id in self._sorted}
+            added = sorted(listed.difference(current))
+            removed = [
+                file_id for name, file_id in current.items() if name not in listed
+            ]
+            if not added and not removed:
+                return False
+            self._apply(added, removed)
+            return True
+
+    def refresh_in_batches(
+        self, batch_size: int = _FIRST_BATCH, force: bool = False
+    ) -> Iterator[int]:
+        """Relist the directory like `refresh`, registering names in batches
+        as they are read so they can be shown before the listing finishes.
+        Each batch is twice the size of the previous one, and names that are
+        gone are removed once the listing is complete. Other changes to the
+        registry must wait until it is done (see `indexing.IndexJob`).
+
+        Args:
+            batch_size (int, optional): Size of the first batch. Defaults to
+                256.
+            force (bool, optional): Relist even if the mtime is unchanged,
+                e.g. since the names were loaded with `import_names`.
+                Defaults to False.
+
+        Yields:
+            int: Number of names listed so far, after each batch.
+
+        Raises:
+            OSError: If the listing fails part way. The names listed so far
+                are kept registered, but no name is removed.
+        """
+        try:
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if not force and mtime_ns is not None and mtime_ns == self._mtime_ns:
+            yield len(self)
+            return
+        with self._lock:
+            known = {self.name(file_id) for file_id in self._sorted}
+        listed: set[str] = set()
+        batch: list[str] = []
+        try:
+            for name in iter_filtered_files(self.directory, strict=True):
+                listed.add(name)
+                if name not in known:
+                    batch.append(name)
+                if len(batch) >= batch_size:
+                    with self._lock:
+                        self._apply(sorted(set(batch)), [])
+                    known.update(batch)
+                    yield len(listed)
+                    batch = []
+                    batch_size *= 2
+        except OSError:
+            # Names the listing did not reach are not known to be gone
+            with self._lock:
+                self._apply(sorted(set(batch)), [])
+                self._mtime_ns = None
+            raise
+        with self._lock:
+            removed = [
+                file_id for file_id in self._sorted if self.name(file_id) not in listed
+            ]
+            self._apply(sorted(set(batch)), removed)
+            self._mtime_ns = mtime_ns
+        yield len(listed)
+
+    def export_names(self) -> tuple[bytes, array, int | None]:
+        """Get the current names for saving, e.g. in a session snapshot.
+
+        Returns:
+            tuple[bytes, array, int | None]: The UTF-8 names in sorted order
+                joined by NUL bytes (which file names cannot contain), their
+                ids in the same order and the directory mtime they were
+                listed at.
+        """
+        with self._lock:
+            # Copied so the buffer can keep growing while the names are joined
+            blob = bytes(self._blob)
+            offsets = self._offsets
+            sorted_ids = self._sorted
+            mtime_ns = self._mtime_ns
+        data = b"\0".join(
+            blob[offsets[file_id] : offsets[file_id + 1]] for file_id in sorted_ids
+        )
+        return data, sorted_ids, mtime_ns
+
+    def import_names(self, data: bytes, mtime_ns: int | None) -> bool:
+        """Load names saved with `export_names` into an empty registry, so
+        the directory is not listed again until its mtime changes. The names
+        get ids 0, 1, ... in their saved order, which makes an array of
+        positions into the saved names an array of ids.
+
+        Args:
+            data (bytes): Names from `export_names`.
+            mtime_ns (int | None): Directory mtime the names were listed at.
+
+        Returns:
+            bool: True if the names were loaded, False if the registry already
+                had names (e.g. listed by another session) and was left as is.
+        """
+        parts = data.split(b"\0") if data else []
+        with self._lock:
+            if self._alive:
+                return False
+            self._blob = bytearray(b"".join(parts))
+            self._offsets = array("Q", accumulate(map(len, parts), initial=0))
+            self._alive = bytearray(b"\1" * len(parts))
+            self._sorted = array("I", range(len(parts)))
+            self._mtime_ns = mtime_ns
+            self.version += 1
+            # Views of the empty registry have nothing to catch up with
+            self._changes.clear()
+        return True
+
+    def add(self, names: Iterable[str]) -> list[int]:
+        """Register names that are not yet present.
+
+        Args:
+            names (Iterable[str]): File names to add.
+
+        Returns:
+            list[int]: Ids of the names that were actually added.
+        """
+        with self._lock:
+            added = sorted({name for name in names if self.id_of(name) is None})
+            return self._apply(added, [])
+
+    def remove(self, names: Iterable[str]) -> list[int]:
+        """Mark names as removed. Their ids are not reused.
+
+        Args:
+            names (Iterable[str]): File names to remove.
+
+        Returns:
+            list[int]: Ids that were removed.
+        """
+        with self._lock:
+            removed = [
+                file_id
+                for file_id in (self.id_of(name) for name in names)
+                if file_id is not None
+            ]
+            self._apply([], removed)
+            return removed
+
+    def _apply(self, added: list[str], removed: list[int]) -> list[int]:
+        """Append ``added`` names and drop ``removed`` ids. Must be called with
+        the lock held."""
+        new_ids = []
+        for name in added:
+            new_ids.append(len(self._alive))
+            self._blob.extend(name.encode("utf-8"))
+            self._offsets.append(len(self._blob))
+            self._alive.append(1)
+        for file_id in removed:
+            self._alive[file_id] = 0
+        if not new_ids and not removed:
+            return new_ids
+        if len(new_ids) + len(removed) <= _MAX_INCREMENTAL_CHANGES:
+            sorted_ids = array("I", self._sorted)
+            for file_id in removed:
+                idx = _bisect_names(sorted_ids, self.name(file_id), self.name)
+                if idx < len(sorted_ids) and sorted_ids[idx] == file_id:
+                    del sorted_ids[idx]
+            for file_id in new_ids:
+                idx = _bisect_names(sorted_ids, self.name(file_id), self.name)
+                sorted_ids.insert(idx, file_id)
+        else:
+            alive_ids = [file_id for file_id in self._sorted if self._alive[file_id]]
+            alive_ids.extend(new_ids)
+            alive_ids.sort(key=self.name)
+            sorted_ids = array("I", alive_ids)
+        # Swap in a new array so readers never see a half-built one
+        self._sorted = sorted_ids
+        self.version += 1
+        self._changes.append((self.version, tuple(new_ids), tuple(removed)))
+        return new_ids
+
+
+class FileView(Sequence[str]):
+    """A session's list of file names, held as an ``array('I')`` of registry
+    ids. It behaves like a read-only list of names."""
+
+    def __init__(self, registry: FileRegistry, ids: array):
+        """Initialize the view.
+
+        Args:
+            registry (FileRegistry): Registry the ids belong to.
+            ids (array): ``array('I')`` of registry ids in display order.
+        """
+        self.registry = registry
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> FileView: ...
+
+    def __getitem__(self, index: int | slice) -> str | FileView:
+        if isinstance(index, slice):
+            return FileView(self.registry, self.ids[index])
+        return self.registry.name(self.ids[index])
+
+    def __iter__(self) -> Iterator[str]:
+        name = self.registry.name
+        for file_id in self.ids:
+            yield name(file_id)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, FileView):
+            return self.registry is other.registry and self.ids == other.ids
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(
+                mine == theirs for mine, theirs in zip(self, other)
+            )
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"FileView({self.registry.directory!r}, {len(self)} files)"
+
+    def synced(
+        self,
+        added: list[int],
+        removed: list[int],
+        position: int,
+        predicate: Callable[[str], bool] | None = None,
+        name_order: bool = True,
+    ) -> tuple[FileView, int]:
+        """Apply registry changes to a view without rebuilding it.
+
+        ``position`` is shifted so it keeps pointing at the same file: removing
+        or inserting a name before it moves it by one.
+
+        Args:
+            added (list[int]): Ids added to the registry.
+            removed (list[int]): Ids removed from the registry.
+            position (int): Current position (e.g. ``state.counter``) in the view.
+            predicate (Callable[[str], bool] | None, optional): Filter that new
+                names must pass to join the view. Defaults to accepting all.
+            name_order (bool, optional): True if the view is sorted by name, so
+                new names are inserted in order. Otherwise (e.g. after
+                `reordered`) they are appended. Defaults to True.
+
+        Returns:
+            tuple[FileView, int]: Updated view and shifted position.
+        """
+        name = self.registry.name
+        ids = array("I", self.ids)
+        if not name_order:
+            return self._appended(ids, added, removed, position, predicate)
+        if len(added) + len(removed) > _MAX_INCREMENTAL_CHANGES:
+            return self._merged(ids, added, removed, position, predicate)
+        for file_id in removed:
+            idx = _bisect_names(ids, name(file_id), name)
+            if idx < len(ids) and ids[idx] == file_id:
+                del ids[idx]
+                if idx < position:
+                    position -= 1
+        dropped = set(removed)
+        for file_id in added:
+            if file_id in dropped:
+                continue
+            file_name = name(file_id)
+            if predicate is not None and not predicate(file_name):
+                continue
+            idx = _bisect_names(ids, file_name, name)
+            at_end = position >= len(ids)
+            ids.insert(idx, file_id)
+            if idx < position or (idx == position and not at_end):
+                position += 1
+        return FileView(self.registry, ids), position
+
+    def _merged(
+        self,
+        ids: array,
+        added: list[int],
+        removed: list[int],
+        position: int,
+        predicate: Callable[[str], bool] | None,
+    ) -> tuple[FileView, int]:
+        """Apply a large set of registry changes to a name-sorted view in one
+        pass over the registry's sorted ids, instead of inserting one by one
+        (e.g. for the batches of a background listing)."""
+        registry = self.registry
+        name = registry.name
+        mask = bytearray(registry.capacity)
+        for file_id in ids:
+            mask[file_id] = 1
+        for file_id in removed:
+            mask[file_id] = 0
+        dropped = set(removed)
+        for file_id in added:
+            if file_id in dropped:
+                continue
+            if predicate is None or predicate(name(file_id)):
+                mask[file_id] = 1
+        merged = array("I", (file_id for file_id in registry._sorted if mask[file_id]))
+        if position >= len(ids):
+            # Past-the-end positions point at the first file after the old ones
+            position = 0
+            if ids:
+                position = _bisect_names(merged, name(ids[-1]), name)
+                if position < len(merged) and merged[position] == ids[-1]:
+                    position += 1
+        elif position >= 0:
+            # The current file, or the one after it if it was removed
+            position = _bisect_names(merged, name(ids[position]), name)
+        return FileView(registry, merged), position
+
+    def _appended(
+        self,
+        ids: array,
+        added: list[int],
+        removed: list[int],
+        position: int,
+        predicate: Callable[[str], bool] | None,
+    ) -> tuple[FileView, int]:
+        """Apply registry changes to a view in a custom order: removed ids are
+        dropped and new names are appended."""
+        dropped = set(removed)
+        if dropped:
+            position -= sum(1 for file_id in ids[:position] if file_id in dropped)
+            ids = array("I", (file_id for file_id in ids if file_id not in dropped))
+        name = self.registry.name
+        ids.extend(
+            file_id
+            for file_id in added
+            if file_id not in dropped
+            and (predicate is None or predicate(name(file_id)))
+        )
+        return FileView(self.registry, ids), position
+
+    def reordered(self, start: int, key: Callable[[str], Any]) -> FileView:
+        """Sort the names from ``start`` on by ``key``, keeping the ones before
+        it in place. The sort is stable, so ties keep their current order.
+
+        Args:
+            start (int): First position to reorder (e.g. ``state.counter``).
+            key (Callable[[str], Any]): Sort key of a name.
+
+        Returns:
+            FileView: Reordered view.
+        """
+        name = self.registry.name
+        tail = sorted(self.ids[start:], key=lambda file_id: key(name(file_id)))
+        return FileView(self.registry, self.ids[:start] + array("I", tail))
+
+    def keep_ids(self, file_ids: Iterable[int]) -> FileView:
+        """Keep only the given registry ids, preserving this view's order.
+
+        Args:
+            file_ids (Iterable[int]): Registry ids to keep.
+
+        Returns:
+            FileView: Restricted view.
+        """
+        mask = bytearray(self.registry.capacity)
+        for file_id in file_ids:
+            mask[file_id] = 1
+        return FileView(
+            self.registry,
+            array("I", (file_id for file_id in self.ids if mask[file_id])),
+        )
+
+    def filter(self, predicate: Callable[[str], bool]) -> FileView:
+        """Keep the names for which ``predicate`` is true, preserving order.
+
+        Args:
+            predicate (Callable[[str], bool]): Test applied to each name.
+
+        Returns:
+            FileView: Filtered view.
+        """
+        name = self.registry.name
+        return FileView(
+            self.registry,
+            array("I", (file_id for file_id in self.ids if predicate(name(file_id)))),
+        )
+
+
+class AnnotationMap(MutableMapping[str, str]):
+    """Mapping of file name to label stored as one label code byte per
+    registry id, with the label strings kept once in ``labels``.
+
+    Code 0 means unlabeled, so at most 255 distinct labels are supported.
+    Labels of files that have since been removed from the registry are
+    dropped.
+    """
+
+    def __init__(self, registry: FileRegistry):
+        """Initialize an empty annotation map.
+
+        Args:
+            registry (FileRegistry): Registry used to resolve file names.
+        """
+        self.registry = registry
+        self.labels: list[str] = []
+        self._codes = bytearray()
+        self._count = 0
+        self._version = registry.version
+
+    def _prune(self) -> None:
+        """Clear codes of files removed from the registry since the last call."""
+        if self._version == self.registry.version:
+            return
+        self._version = self.registry.version
+        for file_id in self.registry.removed_ids(len(self._codes)):
+            if self._codes[file_id]:
+                self._codes[file_id] = 0
+                self._count -= 1
+
+    def _id(self, name: str) -> int:
+        file_id = self.registry.id_of(name)
+        if file_id is None:
+            raise KeyError(name)
+        return file_id
+
+    def _code(self, label: str) -> int:
+        if label not in self.labels:
+            if len(self.labels) >= 255:
+                raise ValueError("AnnotationMap supports at most 255 labels.")
+            self.labels.append(label)
+        return self.labels.index(label) + 1
+
+    def is_labeled(self, file_id: int) -> bool:
+        """Check if a file has a label by its registry id, without looking up
+        its name.
+
+        Args:
+            file_id (int): Registry id.
+
+        Returns:
+            bool: True if the file is labeled.
+        """
+        return file_id < len(self._codes) and self._codes[file_id] != 0
+
+    def __getitem__(self, name: str) -> str:
+        file_id = self._id(name)
+        if file_id >= len(self._codes) or not self._codes[file_id]:
+            raise KeyError(name)
+        return self.labels[self._codes[file_id] - 1]
+
+    def __setitem__(self, name: str, label: str) -> None:
+        file_id = self._id(name)
+        if file_id >= len(self._codes):
+            self._codes.extend(bytes(self.registry.capacity - len(self._codes)))
+        if not self._codes[file_id]:
+            self._count += 1
+        self._codes[file_id] = self._code(label)
+
+    def __delitem__(self, name: str) -> None:
+        file_id = self._id(name)
+        if file_id >= len(self._codes) or not self._codes[file_id]:
+            raise KeyError(name)
+        self._codes[file_id] = 0
+        self._count -= 1
+
+    def __iter__(self) -> Iterator[str]:
+        self._prune()
+        name = self.registry.name
+        for file_id, code in enumerate(self._codes):
+            if code:
+                yield name(file_id)
+
+    def __len__(self) -> int:
+        self._prune()
+        return self._count
+
+    def __repr__(self) -> str:
+        return f"AnnotationMap({dict(self)!r})"
+
+
+_registries: dict[str, FileRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(directory: str, refresh: bool = True) -> FileRegistry:
+    """Get the process-wide registry for a directory, relisting it only when
+    the directory's modification time has changed. Registries kept up to date
+    by a watcher or being listed by an index job are not relisted.
+
+    Args:
+        directory (str): Image directory.
+        refresh (bool, optional): False to return the registry as it is,
+            without checking the directory. Defaults to True.
+
+    Returns:
+        FileRegistry: Shared registry for ``directory``.
+    """
+    key = os.path.abspath(directory)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = _registries[key] = FileRegistry(directory)
+    if refresh and not registry.watched and not registry.indexing:
+        registry.refresh()
+    return registry
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the process-wide registries.
+
+    Returns:
+        dict[str, tuple[int, int]]: Registries and their approximate bytes.
+    """
+    with _registries_lock:
+        registries = list(_registries.values())
+    return {"file registries": (len(registries), sum(r.nbytes for r in registries))}
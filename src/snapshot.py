@@ -0,0 +1,293 @@
+"""Session snapshots for resuming the annotator after a restart.
+
+A restarted app used to start over: the directory was listed again, every
+filter re-ran and the session went back to the first file, with none of the
+earlier labels counted. The annotator now keeps a snapshot of each session
+next to its annotations json file, in two parts named after the session's id,
+so sessions sharing a json file do not overwrite each other's:
+
+- ``<json stem>.session-<id>.json``: the directory, filters, sort key and
+  position. It is small and rewritten atomically whenever one of them
+  changes.
+- ``<json stem>.session-<id>.npz``: the directory listing as one NUL-joined name
+  buffer with its mtime, and the session's filtered and sorted file list as
+  ``uint32`` positions into it. It is only rewritten when the file list was
+  rebuilt, and at most every `SNAPSHOT_INTERVAL` seconds while files are
+  added or removed in the background.
+
+Restoring loads the names straight into the directory's registry (see
+`registry.FileRegistry.import_names`), so neither the listing nor the filter
+pipeline runs again until the directory's mtime changes."""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+import re
+import tempfile
+import uuid
+from array import array
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from registry import FileView, get_registry
+from utils import load_json, save_json
+
+__all__ = [
+    "FILTER_KEYS",
+    "SNAPSHOT_INTERVAL",
+    "SNAPSHOT_KEYS",
+    "SNAPSHOT_VERSION",
+    "SessionSnapshot",
+    "ensure_session_id",
+    "files_key",
+    "latest_session",
+    "load_snapshot",
+    "restore_files",
+    "save_files",
+    "save_state",
+    "snapshot_paths",
+]
+
+# Bumped when the layout of the snapshot files changes; older ones are ignored
+SNAPSHOT_VERSION = 1
+# Minimum seconds between rewrites of the file list while it only changes
+# because files were added or removed
+SNAPSHOT_INTERVAL = 10.0
+# Session state entries that decide which files are listed and in what order
+FILTER_KEYS = (
+    "img_dir",
+    "split_keywords",
+    "keyword_and_or",
+    "sep",
+    "manifest_filter",
+    "size_filter",
+    "sort_key",
+    "duplicates",
+)
+# Session state entries saved in the light part of the snapshot
+SNAPSHOT_KEYS = (*FILTER_KEYS, "keywords", "name_order", "counter", "current_file")
+# Marks registry ids without a saved position
+_NO_POSITION = -1
+# Session ids are part of file names, so only these characters are allowed
+_SESSION_ID = re.compile(r"[0-9A-Za-z_-]{1,64}")
+
+
+class SessionSnapshot(NamedTuple):
+    """A session saved by `save_state` and `save_files`."""
+
+    # Values of `SNAPSHOT_KEYS`
+    state: dict[str, Any]
+    # Directory names from `FileRegistry.export_names` and their mtime, or
+    # None if no file list matching ``state`` was saved
+    names: bytes | None
+    mtime_ns: int | None
+    # Positions into ``names`` of the session's files, in display order
+    order: np.ndarray | None
+
+
+def ensure_session_id(value: object) -> str:
+    """Check a session id, e.g. one taken from the page URL, and make a new
+    one if it is missing or cannot be used in a file name.
+
+    Args:
+        value (object): Candidate session id.
+
+    Returns:
+        str: ``value`` if it is a valid id, else a new random id.
+    """
+    if isinstance(value, str) and _SESSION_ID.fullmatch(value):
+        return value
+    return uuid.uuid4().hex[:12]
+
+
+def snapshot_paths(json_path: str | Path, session: str) -> tuple[str, str]:
+    """Get the snapshot files of a session that go with an annotations json
+    file.
+
+    Args:
+        json_path (str | Path): Path of the annotations json file.
+        session (str): Session id (see `ensure_session_id`).
+
+    Returns:
+        tuple[str, str]: ``<json stem>.session-<id>.json`` for the session
+            state and ``<json stem>.session-<id>.npz`` for its file list.
+
+    Raises:
+        ValueError: If ``session`` is not a valid session id.
+    """
+    if not _SESSION_ID.fullmatch(session):
+        raise ValueError(f"Invalid session id: {session!r}")
+    path = Path(json_path)
+    return (
+        str(path.with_suffix(f".session-{session}.json")),
+        str(path.with_suffix(f".session-{session}.npz")),
+    )
+
+
+def latest_session(json_path: str | Path) -> str | None:
+    """Find the session whose snapshot next to an annotations json file was
+    saved last.
+
+    Args:
+        json_path (str | Path): Path of the annotations json file.
+
+    Returns:
+        str | None: Session id, or None if no session was saved.
+    """
+    path = Path(json_path)
+    prefix = f"{path.stem}.session-"
+    pattern = os.path.join(
+        glob.escape(str(path.parent)), glob.escape(prefix) + "*.json"
+    )
+    latest = None
+    for state_path in glob.glob(pattern):
+        session = os.path.basename(state_path)[len(prefix) : -len(".json")]
+        try:
+            mtime = os.stat(state_path).st_mtime_ns
+        except OSError:
+            continue
+        if _SESSION_ID.fullmatch(session) and (latest is None or mtime > latest[0]):
+            latest = (mtime, session)
+    return latest[1] if latest else None
+
+
+def files_key(state: Mapping[str, Any]) -> list[Any]:
+    """Get the values of `FILTER_KEYS` in a form that survives a JSON round
+    trip, to check that a saved file list belongs to a saved state.
+
+    Args:
+        state (Mapping[str, Any]): Session state or saved state.
+
+    Returns:
+        list[Any]: Filter values.
+    """
+    return json.loads(json.dumps([state[key] for key in FILTER_KEYS]))
+
+
+def save_state(state: Mapping[str, Any], json_path: str | Path, session: str) -> None:
+    """Save the light part of a session snapshot.
+
+    Args:
+        state (Mapping[str, Any]): Session state. Missing `SNAPSHOT_KEYS`
+            entries (e.g. ``current_file`` before any file was shown) are
+            saved as None.
+        json_path (str | Path): Path of the annotations json file.
+        session (str): Session id.
+    """
+    saved = {key: state.get(key) for key in SNAPSHOT_KEYS}
+    save_json(
+        {"version": SNAPSHOT_VERSION, **saved}, snapshot_paths(json_path, session)[0]
+    )
+
+
+def save_files(
+    files: FileView, state: Mapping[str, Any], json_path: str | Path, session: str
+) -> None:
+    """Save a session's file list and its directory's listing. The file is
+    written to a temporary file and moved into place like `utils.save_json`.
+
+    Args:
+        files (FileView): Filtered and sorted files of the session.
+        state (Mapping[str, Any]): Session state the files were built for.
+        json_path (str | Path): Path of the annotations json file.
+        session (str): Session id.
+    """
+    names, sorted_ids, mtime_ns = files.registry.export_names()
+    # Position of every id in the order the names are saved in; files removed
+    # since the view was built have none and are left out
+    ids = np.frombuffer(files.ids, dtype=np.uint32)
+    positions = np.full(files.registry.capacity, _NO_POSITION, np.int64)
+    positions[np.frombuffer(sorted_ids, dtype=np.uint32)] = np.arange(len(sorted_ids))
+    order = positions[ids]
+    order = order[order != _NO_POSITION].astype(np.uint32)
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "files_key": files_key(state),
+        "mtime_ns": mtime_ns,
+    }
+    path = snapshot_paths(json_path, session)[1]
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            np.savez(
+                outfile,
+                meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+                names=np.frombuffer(names, dtype=np.uint8),
+                order=order,
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(json_path: str | Path, session: str) -> SessionSnapshot | None:
+    """Load a session's snapshot saved next to an annotations json file.
+
+    Args:
+        json_path (str | Path): Path of the annotations json file.
+        session (str): Session id.
+
+    Returns:
+        SessionSnapshot | None: Saved session, or None if there is none or it
+            cannot be read. The file list is left out (``names`` is None) if
+            it is missing, unreadable or was saved for other filters.
+    """
+    state_path, files_path = snapshot_paths(json_path, session)
+    try:
+        saved = load_json(state_path)
+    except (OSError, ValueError):
+        return None
+    if saved.pop("version", None) != SNAPSHOT_VERSION or not all(
+        key in saved for key in SNAPSHOT_KEYS
+    ):
+        return None
+    state = {key: saved[key] for key in SNAPSHOT_KEYS}
+    try:
+        with np.load(files_path) as arrays:
+            meta = json.loads(arrays["meta"].tobytes())
+            names = arrays["names"].tobytes()
+            order = arrays["order"]
+    except (OSError, ValueError, KeyError):
+        return SessionSnapshot(state, None, None, None)
+    if meta.get("version") != SNAPSHOT_VERSION or meta.get("files_key") != files_key(
+        state
+    ):
+        return SessionSnapshot(state, None, None, None)
+    return SessionSnapshot(state, names, meta.get("mtime_ns"), order)
+
+
+def restore_files(snapshot: SessionSnapshot) -> FileView | None:
+    """Rebuild a session's file list from a snapshot. The saved listing is
+    loaded into the directory's registry if nothing listed it yet in this
+    process; otherwise the saved names are looked up in the registry.
+
+    Args:
+        snapshot (SessionSnapshot): Snapshot with a file list.
+
+    Returns:
+        FileView | None: Files in their saved order, or None if the snapshot
+            has no file list.
+    """
+    if snapshot.names is None or snapshot.order is None:
+        return None
+    registry = get_registry(snapshot.state["img_dir"], refresh=False)
+    if registry.import_names(snapshot.names, snapshot.mtime_ns):
+        # Positions into the saved names are the new ids
+        return FileView(
+            registry, array("I", snapshot.order.astype(np.uint32).tobytes())
+        )
+    names = snapshot.names.split(b"\0")
+    ids = (
+        registry.id_of(names[position].decode("utf-8")) for position in snapshot.order
+    )
+    return FileView(
+        registry, array("I", (file_id for file_id in ids if file_id is not None))
+    )
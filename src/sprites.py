@@ -0,0 +1,219 @@
+"""Sprite sheets of thumbnails for the viewer's filmstrip.
+
+A sheet holds the thumbnails of `SHEET_SIZE` consecutive images of the viewing
+order in a `SPRITE_GRID` x `SPRITE_GRID` grid, so the browser gets dozens of
+thumbnails in one image. Sheets are named after the paths and mtimes of their
+images and kept in the system temp folder, where every session and process
+can reuse them. They are built in a background thread pool; the filmstrip
+waits only for the sheets it is about to show and queues their neighbours."""
+
+from __future__ import annotations
+
+import base64
+import os
+import tempfile
+import threading
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from hashlib import sha1
+from pathlib import Path
+
+from PIL import Image
+
+from archive import file_mtime_ns, open_image
+
+__all__ = [
+    "MAX_SPRITE_SHEETS",
+    "SHEET_SIZE",
+    "SPRITE_CACHE_DIR",
+    "SPRITE_GRID",
+    "SPRITE_THUMB",
+    "SPRITE_WORKERS",
+    "THUMB_WORKERS",
+    "build_sheet",
+    "get_sheet",
+    "sheet_cell",
+    "sheet_data_uri",
+]
+
+# Side of the square cell each thumbnail is fitted into, in pixels
+SPRITE_THUMB = 96
+# Cells per sheet row and column
+SPRITE_GRID = 8
+SHEET_SIZE = SPRITE_GRID * SPRITE_GRID
+# Sheets kept on disk; the oldest are removed beyond this
+MAX_SPRITE_SHEETS = 512
+# Threads building sheets in the background
+SPRITE_WORKERS = 2
+# Threads decoding the thumbnails of one sheet
+THUMB_WORKERS = min(8, os.cpu_count() or 1)
+SPRITE_CACHE_DIR = Path(tempfile.gettempdir()) / "image_annotator_sprites"
+
+_executor: ThreadPoolExecutor | None = None
+_pending: dict[Path, Future] = {}
+_pending_lock = threading.Lock()
+
+
+def sheet_cell(index: int) -> tuple[int, int]:
+    """Get the column and row of a thumbnail in its sheet.
+
+    Args:
+        index (int): Position of the image within the sheet.
+
+    Returns:
+        tuple[int, int]: Column and row of its cell.
+    """
+    return index % SPRITE_GRID, index // SPRITE_GRID
+
+
+def _sheet_path(image_paths: Sequence[str], cache_dir: Path) -> Path:
+    """Get the file of the sheet of these images: its name changes when any
+    image is edited, added or removed."""
+    digest = sha1(f"{SPRITE_THUMB}:{SPRITE_GRID}".encode())
+    for path in image_paths:
+        try:
+            mtime_ns = file_mtime_ns(path)
+        except OSError:
+            mtime_ns = -1
+        digest.update(f"\0{os.path.abspath(path)}\0{mtime_ns}".encode())
+    return cache_dir / f"{digest.hexdigest()[:24]}.jpg"
+
+
+def _thumbnail(image_path: str) -> Image.Image | None:
+    """Decode an image just large enough for its cell."""
+    try:
+        with open_image(image_path) as img:
+            img.draft("RGB", (SPRITE_THUMB, SPRITE_THUMB))
+            img.thumbnail((SPRITE_THUMB, SPRITE_THUMB))
+            return img.convert("RGB")
+    except (OSError, ValueError):
+        return None
+
+
+def _prune(cache_dir: Path, keep: Path) -> None:
+    """Remove the oldest sheets beyond `MAX_SPRITE_SHEETS`."""
+    with os.scandir(cache_dir) as scan:
+        entries = [
+            (entry.stat().st_mtime, entry.path)
+            for entry in scan
+            if not entry.name.startswith(".") and entry.path != str(keep)
+        ]
+    if len(entries) < MAX_SPRITE_SHEETS:
+        return
+    entries.sort()
+    for _, path in entries[: len(entries) - MAX_SPRITE_SHEETS + 1]:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def build_sheet(image_paths: Sequence[str], cache_dir: Path | None = None) -> Path:
+    """Render a sprite sheet, or get it if it was already built.
+
+    Thumbnails keep their aspect ratio and are centered in their cell.
+    Unreadable images leave their cell blank.
+
+    Args:
+        image_paths (Sequence[str]): At most `SHEET_SIZE` image paths, in
+            cell order.
+        cache_dir (Path | None, optional): Folder of the sheets. Defaults to
+            ``SPRITE_CACHE_DIR``.
+
+    Returns:
+        Path: JPEG file of the sheet.
+    """
+    cache_dir = cache_dir or SPRITE_CACHE_DIR
+    target = _sheet_path(image_paths, cache_dir)
+    if target.exists():
+        return target
+    rows = -(-len(image_paths) // SPRITE_GRID)
+    sheet = Image.new("RGB", (SPRITE_GRID * SPRITE_THUMB, max(rows, 1) * SPRITE_THUMB))
+    with ThreadPoolExecutor(max_workers=THUMB_WORKERS) as pool:
+        thumbs = list(pool.map(_thumbnail, image_paths[:SHEET_SIZE]))
+    for index, thumb in enumerate(thumbs):
+        if thumb is None:
+            continue
+        col, row = sheet_cell(index)
+        sheet.paste(
+            thumb,
+            (
+                col * SPRITE_THUMB + (SPRITE_THUMB - thumb.width) // 2,
+                row * SPRITE_THUMB + (SPRITE_THUMB - thumb.height) // 2,
+            ),
+        )
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".{target.stem}")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            sheet.save(outfile, format="JPEG", quality=80)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    _prune(cache_dir, keep=target)
+    return target
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _pending_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=SPRITE_WORKERS, thread_name_prefix="sprites"
+            )
+        return _executor
+
+
+def get_sheet(
+    image_paths: Sequence[str], wait: bool = True, cache_dir: Path | None = None
+) -> Path | None:
+    """Get a sprite sheet, building it in the background pool if needed.
+
+    A sheet that is already being built is not queued again.
+
+    Args:
+        image_paths (Sequence[str]): At most `SHEET_SIZE` image paths, in
+            cell order.
+        wait (bool, optional): Wait for the sheet if it has to be built.
+            Pass False to only queue it. Defaults to True.
+        cache_dir (Path | None, optional): Folder of the sheets. Defaults to
+            ``SPRITE_CACHE_DIR``.
+
+    Returns:
+        Path | None: JPEG file of the sheet, or None if it is still being
+            built and ``wait`` is False.
+    """
+    cache_dir = cache_dir or SPRITE_CACHE_DIR
+    target = _sheet_path(image_paths, cache_dir)
+    if target.exists():
+        return target
+    executor = _get_executor()
+    with _pending_lock:
+        future = _pending.get(target)
+        queued = future is None
+        if queued:
+            future = executor.submit(build_sheet, list(image_paths), cache_dir)
+            _pending[target] = future
+    if queued:
+        # Outside the lock: the callback runs at once if the build is done
+        future.add_done_callback(lambda _: _forget(target))
+    if not wait:
+        return None
+    return future.result()
+
+
+def _forget(target: Path) -> None:
+    with _pending_lock:
+        _pending.pop(target, None)
+
+
+def sheet_data_uri(path: Path) -> str:
+    """Read a sheet into a base64 data URI.
+
+    Args:
+        path (Path): JPEG file of the sheet.
+
+    Returns:
+        str: ``data:image/jpeg;base64,...`` string.
+    """
+    return "data:image/jpeg;base64," + base64.b64encode(path.read_bytes()).decode()
@@ -0,0 +1,190 @@
+"""Publish previews as files under Streamlit's static directory so the
+browser loads them over plain HTTP and caches them.
+
+Streamlit serves ``<app folder>/static`` at ``app/static/`` when
+``server.enableStaticServing`` is on, and answers requests that carry a ``v``
+query argument with long-lived cache headers. Preview URLs carry the image's
+mtime there, so going back to an image that was already shown is served from
+the browser cache, and an edited image gets a new URL."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import uuid
+from collections.abc import Callable
+from contextlib import suppress
+from hashlib import sha1
+from pathlib import Path
+
+from archive import file_mtime_ns, split_archive_path
+from encode import EncodedPreview
+
+__all__ = [
+    "MAX_STATIC_PREVIEWS",
+    "PREVIEW_DIR",
+    "STATIC_DIR",
+    "preview_file",
+    "publish_preview",
+    "published_preview_url",
+    "static_url",
+]
+
+# Directory Streamlit serves at ``app/static/`` for apps in this folder
+STATIC_DIR = Path(__file__).parent / "static"
+PREVIEW_DIR = STATIC_DIR / "previews"
+# Published previews kept on disk; the oldest are removed beyond this
+MAX_STATIC_PREVIEWS = 1024
+# Suffixes previews are published with, by PIL format name
+_SUFFIXES = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+
+def _preview_name(image_path: str, height: int, is_clamped: bool) -> tuple[str, int]:
+    """Get the file name (without suffix) and version of a published preview."""
+    mtime_ns = file_mtime_ns(image_path)
+    digest = sha1(os.path.abspath(image_path).encode()).hexdigest()[:20]
+    size = str(height) if is_clamped else "full"
+    return f"{digest}-{mtime_ns}-{size}", mtime_ns
+
+
+def _find_preview(name: str, preview_dir: Path) -> Path | None:
+    for suffix in _SUFFIXES.values():
+        path = preview_dir / f"{name}{suffix}"
+        if os.path.lexists(path):
+            return path
+    return None
+
+
+def published_preview_url(
+    image_path: str,
+    height: int,
+    is_clamped: bool,
+    preview_dir: Path = PREVIEW_DIR,
+) -> str | None:
+    """Get the URL of a preview that was already published.
+
+    Args:
+        image_path (str): Path to the image.
+        height (int): Height of the image if clamped.
+        is_clamped (bool): True if the image is clamped.
+        preview_dir (Path, optional): Directory previews are published to.
+            Defaults to ``PREVIEW_DIR``.
+
+    Returns:
+        str | None: URL relative to the static root (pass it to
+            `static_url`), or None if the preview has not been published.
+    """
+    name, mtime_ns = _preview_name(image_path, height, is_clamped)
+    path = _find_preview(name, preview_dir)
+    if path is None:
+        return None
+    return f"{preview_dir.name}/{path.name}?v={mtime_ns}"
+
+
+def _link_or_copy(source: str, target: Path) -> None:
+    """Symlink ``source`` to ``target``, copying it where symlinks are not
+    allowed (e.g. Windows without developer mode)."""
+    tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}")
+    try:
+        os.symlink(os.path.abspath(source), tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def _write(data: bytes, target: Path) -> None:
+    """Write an encoded preview atomically."""
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(data)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _prune(preview_dir: Path, keep: Path) -> None:
+    """Remove the oldest previews beyond `MAX_STATIC_PREVIEWS`."""
+    with os.scandir(preview_dir) as scan:
+        entries = [
+            (entry.stat(follow_symlinks=False).st_mtime, entry.path)
+            for entry in scan
+            if not entry.name.startswith(".") and entry.path != str(keep)
+        ]
+    if len(entries) < MAX_STATIC_PREVIEWS:
+        return
+    entries.sort()
+    for _, path in entries[: len(entries) - MAX_STATIC_PREVIEWS + 1]:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def publish_preview(
+    image_path: str,
+    height: int,
+    is_clamped: bool,
+    encode: Callable[[], EncodedPreview],
+    preview_dir: Path = PREVIEW_DIR,
+) -> str:
+    """Publish the preview of an image and get its URL.
+
+    Previews that are the original file (see `encode.encode_preview`) are
+    linked instead of written again.
+
+    Args:
+        image_path (str): Path to the image.
+        height (int): Height of the image if clamped.
+        is_clamped (bool): True if the image is clamped.
+        encode (Callable[[], EncodedPreview]): Encodes the preview; only
+            called if it has not been published yet.
+        preview_dir (Path, optional): Directory previews are published to.
+            Defaults to ``PREVIEW_DIR``.
+
+    Returns:
+        str: URL relative to the static root (pass it to `static_url`).
+    """
+    url = published_preview_url(image_path, height, is_clamped, preview_dir)
+    if url is not None:
+        return url
+    preview_dir.mkdir(parents=True, exist_ok=True)
+    name, mtime_ns = _preview_name(image_path, height, is_clamped)
+    encoded = encode()
+    target = preview_dir / f"{name}{_SUFFIXES[encoded.format]}"
+    if encoded.passthrough and split_archive_path(image_path) is None:
+        _link_or_copy(image_path, target)
+    else:
+        _write(encoded.data, target)
+    _prune(preview_dir, keep=target)
+    return f"{preview_dir.name}/{target.name}?v={mtime_ns}"
+
+
+def preview_file(relative_url: str, preview_dir: Path = PREVIEW_DIR) -> Path:
+    """Get the file behind a URL from `publish_preview`.
+
+    Args:
+        relative_url (str): URL relative to the static root.
+        preview_dir (Path, optional): Directory previews are published to.
+            Defaults to ``PREVIEW_DIR``.
+
+    Returns:
+        Path: Published preview file (or link to the original).
+    """
+    return preview_dir / relative_url.split("?", 1)[0].rsplit("/", 1)[-1]
+
+
+def static_url(relative_url: str, base_url_path: str = "") -> str:
+    """Turn a URL from `publish_preview` into an absolute URL path.
+
+    Args:
+        relative_url (str): URL relative to the static root.
+        base_url_path (str, optional): Streamlit's ``server.baseUrlPath``.
+            Defaults to "".
+
+    Returns:
+        str: e.g. ``/app/static/previews/<name>.jpg?v=<mtime>``.
+    """
+    base = base_url_path.strip("/")
+    prefix = f"/{base}" if base else ""
+    return f"{prefix}/app/static/{relative_url}"
@@ -0,0 +1,296 @@
+"""Suggest labels for unannotated images from the ones already labeled.
+
+A distance-weighted k-nearest-neighbour vote over the cosine similarity of
+`features` vectors. Fitting only stacks the labeled vectors, so the model is
+cheap enough to rebuild whenever more labels come in. Suggestions for a large
+folder are made by a `SuggestionJob` in the background, a chunk of files at a
+time, and kept as arrays over registry ids instead of a dict of names."""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from contextlib import closing
+
+import numpy as np
+
+from features import directory_features, iter_directory_features
+from registry import FileRegistry, FileView
+
+__all__ = [
+    "KNN_NEIGHBORS",
+    "MIN_TRAINING_LABELS",
+    "SUGGEST_CHUNK",
+    "LabelSuggester",
+    "SuggestionJob",
+    "Suggestions",
+    "suggest_labels",
+]
+
+# Neighbours that vote on each suggestion
+KNN_NEIGHBORS = 7
+# Labeled images needed before suggestions are made
+MIN_TRAINING_LABELS = 10
+# Query rows scored at once, bounding the similarity matrix held in memory
+_QUERY_CHUNK = 1024
+# Files featurized and labeled at once by `suggest_labels`
+SUGGEST_CHUNK = 4096
+
+
+class LabelSuggester:
+    """Distance-weighted kNN classifier over unit-length feature vectors."""
+
+    def __init__(self, k: int = KNN_NEIGHBORS):
+        """Initialize an unfitted model.
+
+        Args:
+            k (int, optional): Neighbours that vote. Defaults to
+                `KNN_NEIGHBORS`.
+        """
+        self.k = k
+        self.classes: list[str] = []
+        self._features = np.zeros((0, 0), dtype=np.float32)
+        self._codes = np.zeros(0, dtype=np.intp)
+
+    def fit(self, features: np.ndarray, labels: Sequence[str]) -> LabelSuggester:
+        """Remember the labeled feature vectors.
+
+        Args:
+            features (np.ndarray): ``(n, d)`` array of labeled vectors.
+            labels (Sequence[str]): Label of each row.
+
+        Returns:
+            LabelSuggester: This model.
+        """
+        self.classes = sorted(set(labels))
+        index = {label: code for code, label in enumerate(self.classes)}
+        self._features = np.asarray(features, dtype=np.float32)
+        self._codes = np.fromiter(
+            (index[label] for label in labels), dtype=np.intp, count=len(labels)
+        )
+        return self
+
+    def predict(self, features: np.ndarray) -> tuple[list[str], np.ndarray]:
+        """Suggest a label for each row.
+
+        Args:
+            features (np.ndarray): ``(m, d)`` array of vectors to label.
+
+        Returns:
+            tuple[list[str], np.ndarray]: Suggested labels and their
+                confidence, the winning share of the neighbour votes (0-1).
+        """
+        n_train = len(self._codes)
+        if not n_train or not len(features):
+            return [], np.zeros(0, dtype=np.float32)
+        k = min(self.k, n_train)
+        codes = np.empty(len(features), dtype=np.intp)
+        confidence = np.empty(len(features), dtype=np.float32)
+        for start in range(0, len(features), _QUERY_CHUNK):
+            chunk = np.asarray(features[start : start + _QUERY_CHUNK], np.float32)
+            similarity = chunk @ self._features.T
+            nearest = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            weights = np.clip(np.take_along_axis(similarity, nearest, 1), 0, None)
+            # Small floor so neighbours with no similarity still get a vote
+            weights += 1e-6
+            votes = np.zeros((len(chunk), len(self.classes)), dtype=np.float32)
+            rows = np.repeat(np.arange(len(chunk)), k)
+            np.add.at(votes, (rows, self._codes[nearest].ravel()), weights.ravel())
+            share = votes / votes.sum(axis=1, keepdims=True)
+            codes[start : start + len(chunk)] = share.argmax(axis=1)
+            confidence[start : start + len(chunk)] = share.max(axis=1)
+        return [self.classes[code] for code in codes], confidence
+
+
+class Suggestions(Mapping[str, tuple[str, float]]):
+    """Mapping of file name to suggested label and confidence, stored as the
+    sorted registry ids with one label code byte and one ``float32``
+    confidence per id. Files removed from the registry since are skipped."""
+
+    def __init__(
+        self,
+        registry: FileRegistry,
+        ids: np.ndarray,
+        labels: Sequence[str],
+        codes: np.ndarray,
+        confidence: np.ndarray,
+    ):
+        """Initialize the suggestions.
+
+        Args:
+            registry (FileRegistry): Registry used to resolve file names.
+            ids (np.ndarray): Registry ids of the suggested files.
+            labels (Sequence[str]): Label strings the codes index, at most
+                256.
+            codes (np.ndarray): Index into ``labels`` of each id's label.
+            confidence (np.ndarray): Confidence of each id's label (0-1).
+        """
+        order = np.argsort(ids, kind="stable")
+        self.registry = registry
+        self.labels = list(labels)
+        self._ids = np.asarray(ids, dtype=np.uint32)[order]
+        self._codes = np.asarray(codes, dtype=np.uint8)[order]
+        self._confidence = np.asarray(confidence, dtype=np.float32)[order]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the id, code and confidence arrays."""
+        return self._ids.nbytes + self._codes.nbytes + self._confidence.nbytes
+
+    def lookup(self, file_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get the suggestions of many files by registry id at once.
+
+        Args:
+            file_ids (np.ndarray): Registry ids.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Index into ``labels`` of each id's
+                suggestion, -1 if it has none, and its confidence, 0 if none.
+        """
+        file_ids = np.asarray(file_ids, dtype=np.uint32)
+        if not len(self._ids):
+            return np.full(len(file_ids), -1, np.intp), np.zeros(len(file_ids))
+        positions = np.minimum(np.searchsorted(self._ids, file_ids), len(self._ids) - 1)
+        found = self._ids[positions] == file_ids
+        codes = np.where(found, self._codes[positions].astype(np.intp), -1)
+        return codes, np.where(found, self._confidence[positions], 0.0)
+
+    def __getitem__(self, name: str) -> tuple[str, float]:
+        file_id = self.registry.id_of(name)
+        if file_id is None:
+            raise KeyError(name)
+        codes, confidence = self.lookup(np.array([file_id]))
+        if codes[0] < 0:
+            raise KeyError(name)
+        return self.labels[codes[0]], float(confidence[0])
+
+    def _removed(self) -> np.ndarray:
+        """Mask of the ids whose files have been removed from the registry."""
+        removed = np.fromiter(self.registry.removed_ids(), dtype=np.uint32)
+        return np.isin(self._ids, removed)
+
+    def __iter__(self) -> Iterator[str]:
+        name = self.registry.name
+        for file_id in self._ids[~self._removed()]:
+            yield name(int(file_id))
+
+    def __len__(self) -> int:
+        return len(self._ids) - int(np.count_nonzero(self._removed()))
+
+    def __repr__(self) -> str:
+        return f"Suggestions({dict(self)!r})"
+
+
+def suggest_labels(
+    directory: str,
+    annotations: Mapping[str, str],
+    files: FileView,
+    min_labels: int = MIN_TRAINING_LABELS,
+    progress: Callable[[int, int], None] | None = None,
+) -> Suggestions:
+    """Suggest labels for the unannotated files of a directory. The files are
+    featurized and labeled `SUGGEST_CHUNK` at a time, so memory does not grow
+    with the number of files beyond the result arrays.
+
+    Args:
+        directory (str): Image directory or manifest path.
+        annotations (Mapping[str, str]): File name to label of the files
+            labeled so far (e.g. ``state.annotations``).
+        files (FileView): Files to suggest labels for; annotated ones are
+            skipped.
+        min_labels (int, optional): Labeled files needed before suggesting.
+            Defaults to `MIN_TRAINING_LABELS`.
+        progress (Callable[[int, int], None] | None, optional): Called with
+            the number of pending files done and their total after each chunk.
+            Defaults to None.
+
+    Returns:
+        Suggestions: Suggested label and confidence of each pending file.
+            Empty if there are too few labels or only one label has been used.
+    """
+    registry = files.registry
+    empty = Suggestions(registry, np.zeros(0, np.uint32), [], np.zeros(0), np.zeros(0))
+    labeled = list(annotations.items())
+    if len(labeled) < min_labels or len({label for _, label in labeled}) < 2:
+        return empty
+    labeled_ids = np.array(
+        [
+            file_id
+            for file_id in map(registry.id_of, annotations)
+            if file_id is not None
+        ],
+        dtype=np.uint32,
+    )
+    ids = np.frombuffer(files.ids, dtype=np.uint32)
+    pending = ids[~np.isin(ids, labeled_ids)]
+    if not len(pending):
+        return empty
+    train = directory_features(directory, [file for file, _ in labeled])
+    model = LabelSuggester().fit(train, [label for _, label in labeled])
+    codes = np.empty(len(pending), dtype=np.uint8)
+    confidence = np.empty(len(pending), dtype=np.float32)
+    index = {label: code for code, label in enumerate(model.classes)}
+    chunks = (
+        [
+            registry.name(int(file_id))
+            for file_id in pending[start : start + SUGGEST_CHUNK]
+        ]
+        for start in range(0, len(pending), SUGGEST_CHUNK)
+    )
+    start = 0
+    with closing(iter_directory_features(directory, chunks)) as chunk_rows:
+        for rows in chunk_rows:
+            labels, scores = model.predict(rows)
+            end = start + len(rows)
+            codes[start:end] = [index[label] for label in labels]
+            confidence[start:end] = scores
+            start = end
+            if progress is not None:
+                progress(end, len(pending))
+    return Suggestions(registry, pending, model.classes, codes, confidence)
+
+
+class SuggestionJob(threading.Thread):
+    """Daemon thread that runs `suggest_labels` for one session, so the app
+    keeps responding while a large folder is featurized."""
+
+    def __init__(self, directory: str, annotations: Mapping[str, str], files: FileView):
+        """Initialize the job. Call ``start`` to begin.
+
+        Args:
+            directory (str): Image directory or manifest path.
+            annotations (Mapping[str, str]): File name to label of the files
+                labeled so far; copied, so later labels do not change the
+                model.
+            files (FileView): Files to suggest labels for.
+        """
+        super().__init__(name=f"suggest:{directory}", daemon=True)
+        self.directory = directory
+        self.annotations = dict(annotations)
+        self.files = files
+        self.done = 0
+        # Unannotated files, known once the model is trained
+        self.total = 0
+        self.result: Suggestions | None = None
+        self.error: Exception | None = None
+        self.finished = False
+
+    @property
+    def fraction(self) -> float:
+        """Share of the files that are done."""
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    def run(self) -> None:
+        """Make the suggestions, recording an error instead of raising."""
+        try:
+            self.result = suggest_labels(
+                self.directory, self.annotations, self.files, progress=self._advance
+            )
+        except Exception as err:
+            # Shown in the options expander by the app
+            self.error = err
+        finally:
+            self.finished = True
+
+    def _advance(self, done: int, total: int) -> None:
+        self.done, self.total = done, total
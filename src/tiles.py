@@ -0,0 +1,542 @@
+"""Lazily built tile pyramids for viewing large images at full resolution.
+
+Level 0 of a pyramid is the full image and every level above it halves the
+size. The first time a level is viewed, the image is read once from top to
+bottom in bands of rows: each band is cut into tiles of that level, which are
+spilled to a disk cache, and halved into the next coarser level, which is
+built in the same pass. Only a band per level is held at a time, so memory
+grows with the image width and not its area. 8-bit PNGs, the usual output of
+image generators, are decoded band by band (see `_png_strips`); other formats
+are decoded whole once per pass (JPEGs straight to the smaller scale), then
+cut the same way. Only the tiles around the viewport are kept in memory."""
+
+from __future__ import annotations
+
+import io
+import math
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterator
+from hashlib import sha1
+from pathlib import Path
+from typing import BinaryIO
+
+from PIL import Image
+
+from archive import file_mtime_ns, open_file, open_image
+
+__all__ = [
+    "MAX_CACHED_PYRAMIDS",
+    "MAX_TILE_BYTES",
+    "TILE_CACHE_DIR",
+    "TILE_SIZE",
+    "VIEWPORT_WIDTH",
+    "ZOOM_LEVELS",
+    "TilePyramid",
+    "cache_usage",
+    "get_pyramid",
+    "zoom_label",
+]
+
+# Width and height of a tile in pixels
+TILE_SIZE = 512
+# Bytes of decoded tiles kept in memory per process (shared by all sessions)
+MAX_TILE_BYTES = 128 * 1024 * 1024
+# Images whose tiles are kept in the disk cache
+MAX_CACHED_PYRAMIDS = 16
+# Width of the zoom/pan viewport shown in the apps
+VIEWPORT_WIDTH = 1280
+# Zoom options offered by the apps, coarsest first: "fit" or a pyramid level
+ZOOM_LEVELS = ("fit", 4, 3, 2, 1, 0)
+TILE_CACHE_DIR = Path(tempfile.gettempdir()) / "image_annotator_tiles"
+# Modes tiles are stored in as-is; anything else is converted
+_TILE_MODES = ("L", "LA", "RGB", "RGBA")
+# Rows of a PNG decoded at a time
+_PNG_BAND_ROWS = 64
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Bytes per pixel of the 8-bit PNG color types, by IHDR color type
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# Chunks copied into each band, since decoding needs them
+_PNG_DECODE_CHUNKS = (b"PLTE", b"tRNS")
+
+_tiles: OrderedDict[tuple, Image.Image] = OrderedDict()
+_tile_bytes = 0
+_tiles_lock = threading.Lock()
+_pyramids: OrderedDict[tuple, TilePyramid] = OrderedDict()
+_pyramids_lock = threading.Lock()
+
+
+def _nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def _cache_tile(key: tuple, tile: Image.Image) -> None:
+    """Keep a tile in memory, evicting the least recently used ones."""
+    global _tile_bytes
+    with _tiles_lock:
+        if key in _tiles:
+            _tiles.move_to_end(key)
+            return
+        _tiles[key] = tile
+        _tile_bytes += _nbytes(tile)
+        while _tile_bytes > MAX_TILE_BYTES and len(_tiles) > 1:
+            _, evicted = _tiles.popitem(last=False)
+            _tile_bytes -= _nbytes(evicted)
+
+
+def _cached_tile(key: tuple) -> Image.Image | None:
+    with _tiles_lock:
+        tile = _tiles.get(key)
+        if tile is not None:
+            _tiles.move_to_end(key)
+        return tile
+
+
+def _tile_mode(img: Image.Image) -> str:
+    if img.mode in _TILE_MODES:
+        return img.mode
+    if "A" in img.getbands() or "transparency" in img.info:
+        return "RGBA"
+    return "RGB"
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def _read_png_chunk(file: BinaryIO) -> tuple[bytes, bytes]:
+    head = file.read(8)
+    if len(head) < 8:
+        return b"", b""
+    length, kind = struct.unpack(">I4s", head)
+    data = file.read(length)
+    file.read(4)  # CRC
+    return kind, data
+
+
+def _png_strips(file: BinaryIO, rows: int) -> Iterator[Image.Image] | None:
+    """Decode a PNG a band of rows at a time.
+
+    The compressed image data is inflated only as far as the next band, and
+    the band's filtered rows are wrapped in a small uncompressed PNG for
+    Pillow to unfilter, after the last decoded row of the band above it
+    (which the filters of its first row refer to).
+
+    Args:
+        file (BinaryIO): PNG file, at its start.
+        rows (int): Rows per band.
+
+    Returns:
+        Iterator[Image.Image] | None: Bands from top to bottom, or None if
+            the file is not a non-interlaced 8-bit PNG.
+    """
+    if file.read(8) != _PNG_SIGNATURE:
+        return None
+    kind, ihdr = _read_png_chunk(file)
+    if kind != b"IHDR" or len(ihdr) != 13:
+        return None
+    width, height, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", ihdr)
+    if depth != 8 or interlace or color not in _PNG_CHANNELS:
+        return None
+    extra = b""
+    kind, data = _read_png_chunk(file)
+    while kind and kind != b"IDAT":
+        if kind in _PNG_DECODE_CHUNKS:
+            extra += _png_chunk(kind, data)
+        kind, data = _read_png_chunk(file)
+    if kind != b"IDAT":
+        return None
+    row_bytes = width * _PNG_CHANNELS[color] + 1
+
+    def strips(data: bytes) -> Iterator[Image.Image]:
+        inflate = zlib.decompressobj()
+        previous = b""
+        top = 0
+        while top < height:
+            band = min(rows, height - top)
+            need = band * row_bytes
+            filtered = bytearray()
+            while len(filtered) < need:
+                if not data:
+                    kind, data = _read_png_chunk(file)
+                    if kind != b"IDAT":
+                        raise OSError("PNG image data ends early")
+                filtered += inflate.decompress(data, need - len(filtered))
+                data = inflate.unconsumed_tail
+            if previous:
+                # The row above the band, unfiltered (filter type 0)
+                filtered[0:0] = b"\0" + previous
+            header = bytearray(ihdr)
+            header[4:8] = struct.pack(">I", band + (1 if previous else 0))
+            png = io.BytesIO()
+            png.write(_PNG_SIGNATURE)
+            png.write(_png_chunk(b"IHDR", bytes(header)))
+            png.write(extra)
+            png.write(_png_chunk(b"IDAT", zlib.compress(filtered, 0)))
+            png.write(_png_chunk(b"IEND", b""))
+            del filtered
+            png.seek(0)
+            with Image.open(png) as img:
+                skip = 1 if previous else 0
+                strip = img.crop((0, skip, width, band + skip))
+            previous = strip.crop((0, band - 1, width, band)).tobytes()
+            yield strip
+            top += band
+
+    return strips(data)
+
+
+class _LevelWriter:
+    """Collects the rows of one pyramid level, cuts every full band of
+    ``tile_size`` rows into tiles and hands it on, halved, to the next
+    coarser level."""
+
+    def __init__(
+        self,
+        tile_size: int,
+        tile_dir: Path | None,
+        coarser: _LevelWriter | None,
+    ):
+        self.tile_size = tile_size
+        # None for levels that are only passed through to coarser ones
+        self.tile_dir = tile_dir
+        self.coarser = coarser
+        # Rows collected towards the next band, and how many there are
+        self._band: Image.Image | None = None
+        self._filled = 0
+        self._row = 0
+
+    def add(self, strip: Image.Image) -> None:
+        """Add rows below the ones added so far."""
+        step = self.tile_size
+        top = 0
+        while top < strip.height:
+            take = min(step - self._filled, strip.height - top)
+            if self._filled == 0 and take == step:
+                # A whole band, e.g. from a coarser level's half of two bands
+                if strip.height != step:
+                    strip_band = strip.crop((0, top, strip.width, top + step))
+                else:
+                    strip_band = strip
+                self._emit(strip_band)
+            else:
+                if self._band is None:
+                    self._band = Image.new(strip.mode, (strip.width, step))
+                self._band.paste(
+                    strip.crop((0, top, strip.width, top + take)), (0, self._filled)
+                )
+                self._filled += take
+                if self._filled == step:
+                    self._emit(self._band)
+                    self._band, self._filled = None, 0
+            top += take
+
+    def finish(self) -> None:
+        """Write the last, shorter band and finish the coarser levels."""
+        if self._band is not None:
+            self._emit(self._band.crop((0, 0, self._band.width, self._filled)))
+            self._band, self._filled = None, 0
+        if self.coarser is not None:
+            self.coarser.finish()
+
+    def _emit(self, band: Image.Image) -> None:
+        step = self.tile_size
+        if self.tile_dir is not None:
+            for col in range(-(-band.width // step)):
+                right = min((col + 1) * step, band.width)
+                tile = band.crop((col * step, 0, right, band.height))
+                tile.save(self.tile_dir / f"{col}_{self._row}.png", compress_level=1)
+        self._row += 1
+        if self.coarser is not None:
+            size = (-(-band.width // 2), -(-band.height // 2))
+            self.coarser.add(band.resize(size, Image.Resampling.BOX))
+
+
+def zoom_label(zoom: int | str) -> str:
+    """Format an entry of `ZOOM_LEVELS` for display, e.g. ``2`` -> ``"25%"``."""
+    if zoom == "fit":
+        return "fit"
+    return f"{100 / 2 ** int(zoom):g}%"
+
+
+class TilePyramid:
+    """Tile pyramid of one image, backed by the shared memory and disk caches.
+
+    Tiles are addressed by ``(level, col, row)``. The disk cache directory is
+    keyed by the image path and mtime, so an edited image gets a new pyramid.
+    """
+
+    def __init__(
+        self,
+        image_path: str,
+        tile_size: int = TILE_SIZE,
+        cache_dir: str | Path = TILE_CACHE_DIR,
+    ):
+        """Initialize the pyramid, reading only the image header.
+
+        Args:
+            image_path (str): Path to the image.
+            tile_size (int, optional): Tile width and height. Defaults to
+                ``TILE_SIZE``.
+            cache_dir (str | Path, optional): Disk cache root. Defaults to
+                ``TILE_CACHE_DIR``.
+        """
+        self.image_path = image_path
+        self.tile_size = tile_size
+        self.cache_dir = Path(cache_dir)
+        mtime_ns = file_mtime_ns(image_path)
+        digest = sha1(f"{os.path.abspath(image_path)}:{mtime_ns}:{tile_size}".encode())
+        self.key = digest.hexdigest()
+        with open_image(image_path) as img:
+            self.size: tuple[int, int] = img.size
+            self.mode = _tile_mode(img)
+        # Levels until the whole image fits in one tile
+        self.levels = max(0, math.ceil(math.log2(max(self.size) / tile_size))) + 1
+        self._build_lock = threading.Lock()
+
+    @property
+    def root(self) -> Path:
+        """Disk cache directory of this pyramid."""
+        return self.cache_dir / self.key
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        """Get the image size at a level.
+
+        Args:
+            level (int): Pyramid level, 0 being full resolution.
+
+        Returns:
+            tuple[int, int]: Width and height, rounded up.
+        """
+        factor = 2**level
+        return -(-self.size[0] // factor), -(-self.size[1] // factor)
+
+    def grid(self, level: int) -> tuple[int, int]:
+        """Get the number of tile columns and rows at a level."""
+        width, height = self.level_size(level)
+        return -(-width // self.tile_size), -(-height // self.tile_size)
+
+    def fit_level(self, view_size: tuple[int, int]) -> int:
+        """Get the finest level that fits entirely inside a viewport.
+
+        Args:
+            view_size (tuple[int, int]): Viewport width and height.
+
+        Returns:
+            int: Pyramid level.
+        """
+        for level in range(self.levels):
+            width, height = self.level_size(level)
+            if width <= view_size[0] and height <= view_size[1]:
+                return level
+        return self.levels - 1
+
+    def _level_dir(self, level: int) -> Path:
+        return self.root / str(level)
+
+    def _tile_path(self, level: int, col: int, row: int) -> Path:
+        return self._level_dir(level) / f"{col}_{row}.png"
+
+    def _strips(self, level: int) -> tuple[int, Iterator[Image.Image]]:
+        """Read the image in bands of rows for building ``level``.
+
+        Returns:
+            tuple[int, Iterator[Image.Image]]: Level the bands are at (a JPEG
+                may decode straight to a coarser one) and the bands, top to
+                bottom, in the tile mode.
+        """
+        file = open_file(self.image_path)
+        strips = _png_strips(file, _PNG_BAND_ROWS)
+        if strips is not None:
+
+            def converted() -> Iterator[Image.Image]:
+                with file:
+                    for strip in strips:
+                        if strip.mode != self.mode:
+                            strip = strip.convert(self.mode)
+                        yield strip
+
+            return 0, converted()
+        file.close()
+        with open_image(self.image_path) as img:
+            # JPEGs can decode straight to a smaller power-of-two scale
+            img.draft(self.mode, self.level_size(level))
+            image = img.convert(self.mode) if img.mode != self.mode else img
+            image.load()
+        source = next(
+            (lv for lv in range(level + 1) if self.level_size(lv) == image.size),
+            None,
+        )
+        if source is None:
+            image = image.resize(self.level_size(level), Image.Resampling.BOX)
+            source = level
+
+        def cropped(image: Image.Image) -> Iterator[Image.Image]:
+            step = self.tile_size
+            for top in range(0, image.height, step):
+                yield image.crop((0, top, image.width, min(top + step, image.height)))
+
+        return source, cropped(image)
+
+    def _build_level(self, level: int) -> None:
+        """Build a level, and every coarser level not built yet, in one pass
+        over the image, and write their tiles to the disk cache.
+
+        The tiles of each level are written to a temporary directory that is
+        then renamed into place, so other sessions never see a half-written
+        level.
+        """
+        with self._build_lock:
+            if self._level_dir(level).is_dir():
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            _prune_disk_cache(self.cache_dir, keep=self.root)
+            missing = [
+                lv
+                for lv in range(level, self.levels)
+                if not self._level_dir(lv).is_dir()
+            ]
+            source, strips = self._strips(level)
+            tmp_dirs = {
+                lv: Path(tempfile.mkdtemp(prefix=f".{lv}-", dir=self.root))
+                for lv in missing
+            }
+            writer = None
+            for lv in range(missing[-1], source - 1, -1):
+                writer = _LevelWriter(self.tile_size, tmp_dirs.get(lv), writer)
+            try:
+                for strip in strips:
+                    writer.add(strip)
+                writer.finish()
+            except BaseException:
+                for tmp_dir in tmp_dirs.values():
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+            for lv, tmp_dir in tmp_dirs.items():
+                try:
+                    os.replace(tmp_dir, self._level_dir(lv))
+                except OSError:
+                    # Another process finished the same level first
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def tile(self, level: int, col: int, row: int) -> Image.Image:
+        """Get one tile, from memory, the disk cache or a fresh decode.
+
+        Args:
+            level (int): Pyramid level.
+            col (int): Tile column.
+            row (int): Tile row.
+
+        Returns:
+            Image.Image: Tile, smaller than ``tile_size`` at the right and
+                bottom edges.
+        """
+        key = (self.key, level, col, row)
+        tile = _cached_tile(key)
+        if tile is not None:
+            return tile
+        path = self._tile_path(level, col, row)
+        if not path.is_file():
+            self._build_level(level)
+        with Image.open(path) as img:
+            tile = img.copy()
+        _cache_tile(key, tile)
+        return tile
+
+    def viewport(
+        self,
+        level: int,
+        center: tuple[float, float],
+        view_size: tuple[int, int],
+    ) -> Image.Image:
+        """Assemble the part of a level visible in a viewport.
+
+        The tiles one ring outside the viewport are loaded as well, so a small
+        pan does not have to wait for them.
+
+        Args:
+            level (int): Pyramid level, clipped to the levels that exist.
+            center (tuple[float, float]): Viewport center as fractions (0-1)
+                of the image width and height.
+            view_size (tuple[int, int]): Viewport width and height.
+
+        Returns:
+            Image.Image: Visible region, no larger than ``view_size``.
+        """
+        level = min(max(level, 0), self.levels - 1)
+        width, height = self.level_size(level)
+        view_w, view_h = min(view_size[0], width), min(view_size[1], height)
+        left = min(max(round(center[0] * width - view_w / 2), 0), width - view_w)
+        top = min(max(round(center[1] * height - view_h / 2), 0), height - view_h)
+        step = self.tile_size
+        cols = range(left // step, (left + view_w - 1) // step + 1)
+        rows = range(top // step, (top + view_h - 1) // step + 1)
+        n_cols, n_rows = self.grid(level)
+        for col in range(max(cols.start - 1, 0), min(cols.stop + 1, n_cols)):
+            for row in range(max(rows.start - 1, 0), min(rows.stop + 1, n_rows)):
+                if col not in cols or row not in rows:
+                    self.tile(level, col, row)
+        view = Image.new(self.mode, (view_w, view_h))
+        for col in cols:
+            for row in rows:
+                view.paste(
+                    self.tile(level, col, row), (col * step - left, row * step - top)
+                )
+        return view
+
+
+def _prune_disk_cache(cache_dir: Path, keep: Path) -> None:
+    """Remove the least recently built pyramids beyond `MAX_CACHED_PYRAMIDS`."""
+    try:
+        entries = [entry for entry in cache_dir.iterdir() if entry.is_dir()]
+    except OSError:
+        return
+    if len(entries) <= MAX_CACHED_PYRAMIDS:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[: len(entries) - MAX_CACHED_PYRAMIDS]:
+        if entry != keep:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def cache_usage() -> dict[str, tuple[int, int]]:
+    """Report the size of the in-memory tile cache.
+
+    Returns:
+        dict[str, tuple[int, int]]: Entries and bytes of pixel data.
+    """
+    with _tiles_lock:
+        return {"zoom tiles": (len(_tiles), _tile_bytes)}
+
+
+def get_pyramid(image_path: str) -> TilePyramid:
+    """Get the pyramid of an image, shared by all sessions of the process.
+
+    Args:
+        image_path (str): Path to the image.
+
+    Returns:
+        TilePyramid: Pyramid for the current version of the file.
+    """
+    key = (image_path, file_mtime_ns(image_path))
+    with _pyramids_lock:
+        pyramid = _pyramids.get(key)
+        if pyramid is not None:
+            _pyramids.move_to_end(key)
+            return pyramid
+    pyramid = TilePyramid(image_path)
+    with _pyramids_lock:
+        pyramid = _pyramids.setdefault(key, pyramid)
+        while len(_pyramids) > MAX_CACHED_PYRAMIDS:
+            _pyramids.popitem(last=False)
+    return pyramid
@@ -4,20 +4,39 @@ from __future__ import annotations
 
 import json
 import os
+import re
+import tempfile
+import time
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Any
 
 from omegaconf import OmegaConf
 from PIL import Image
 
+from archive import archive_files, is_archive, open_image
+from manifest import is_manifest, manifest_files
+
 __all__ = [
     "FILTER_EXT_LIST",
+    "clamp_size",
     "filter_by_keyword",
+    "get_base_dir",
+    "get_file_path",
     "get_filtered_files",
     "get_metadata_str",
+    "is_image_source",
+    "iter_filtered_files",
+    "json_labels",
+    "json_lock",
     "load_image",
     "load_json",
+    "matches_conditions",
+    "matches_keyword",
+    "parse_conditions",
     "save_json",
+    "split_file_name",
     "update_json",
 ]
 
@@ -73,7 +92,7 @@ def get_metadata_dict(image_path: str) -> dict[str, Any]:
             ``bytes``, ``int``, or other PIL info types when the image has
             no Stable Diffusion parameters.
     """
-    with Image.open(image_path) as img_file:
+    with open_image(image_path) as img_file:
         metadata = img_file.info
     if "parameters" not in metadata:
         return metadata
@@ -123,6 +142,52 @@ def get_metadata_str(image_path: str) -> tuple[str, str]:
     return prompts, meta_data
 
 
+def split_file_name(file: str, sep_: str = " ") -> list[str]:
+    """Split a file name into the words keyword phrases are matched against:
+    the extension and punctuation other than the separator are dropped.
+
+    Args:
+        file (str): File name to split.
+        sep_ (str, optional): Separator between words. Defaults to " ".
+
+    Returns:
+        list[str]: Words of the file name.
+    """
+    if not sep_:
+        sep_ = " "
+    no_ext = file.rsplit(".", 1)[0]
+    char_filter = "-_',()!?:"
+    char_filter = char_filter.replace(sep_, "")
+    for char in char_filter:
+        no_ext = no_ext.replace(char, "")
+    return no_ext.split(sep_)
+
+
+def matches_keyword(file: str, keyword: str, sep_: str = " ") -> bool:
+    """Check if a file name contains a keyword phrase. This can be
+    multiple words.
+
+    Args:
+        file (str): File name to check.
+        keyword (str): Keyword(s) to look for.
+        sep_ (str, optional): Separator that will be used to split
+            the file name. Defaults to " ".
+
+    Returns:
+        bool: True if the keyword phrase appears in the file name.
+    """
+    if not sep_:
+        sep_ = " "
+    split_file = split_file_name(file, sep_)
+    split_keyword = keyword.split(sep_) if sep_ in keyword else [keyword]
+    n_key = len(split_keyword)
+    return any(
+        split_file[idx : idx + n_key] == split_keyword
+        for idx, val in enumerate(split_file)
+        if val == split_keyword[0]
+    )
+
+
 def filter_by_keyword(
     str_list: list[str], keyword: str, sep_: str = " "
 ) -> tuple[list[str], list[str]]:
@@ -140,43 +205,90 @@ def filter_by_keyword(
             containing the keyword(s) and a list of file names that do
             contain the keyword(s).
     """
-    if not sep_:
-        sep_ = " "
-    str_list_ = str_list.copy()
+    remaining = []
     filtered = []
+    seen = set()
     for file in str_list:
-        no_ext = file.rsplit(".", 1)[0]
-        char_filter = "-_',()!?:"
-        char_filter = char_filter.replace(sep_, "")
-        for char in char_filter:
-            no_ext = no_ext.replace(char, "")
-        split_file = no_ext.split(sep_)
-        split_keyword = keyword.split(sep_) if sep_ in keyword else [keyword]
-        n_key = len(split_keyword)
-        first_idxs = [
-            idx for idx, val in enumerate(split_file) if val == split_keyword[0]
-        ]
-        if first_idxs:
-            for idx in first_idxs:
-                if (
-                    split_file[idx : idx + n_key] == split_keyword
-                    and file not in filtered
-                ):
-                    filtered.append(file)
-                    str_list_.remove(file)
-    return str_list_, filtered
+        if file in seen:
+            continue
+        if matches_keyword(file, keyword, sep_):
+            seen.add(file)
+            filtered.append(file)
+        else:
+            remaining.append(file)
+    return remaining, filtered
+
+
+def _to_json(obj: Any) -> Any:
+    """Convert mapping and sequence types that ``json`` does not know about
+    (e.g. ``registry.AnnotationMap``) into dicts and lists."""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    try:
+        return list(obj)
+    except TypeError:
+        raise TypeError(
+            f"Object of type {type(obj).__name__} is not JSON serializable"
+        ) from None
+
+
+@contextmanager
+def json_lock(json_path: str | Path) -> Iterator[None]:
+    """Hold an exclusive lock on a json file while reading and rewriting it.
+
+    The lock is taken on a ``<json_path>.lock`` file next to it, so it works
+    across processes and across sessions of the same Streamlit server. It is
+    not re-entrant: do not call `update_json` while holding it.
+
+    Args:
+        json_path (str | Path): Path of the json file to lock.
+    """
+    with open(f"{json_path}.lock", "a+b") as lock_file:
+        fd = lock_file.fileno()
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 seconds; keep waiting
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
 
 
 def save_json(json_dict: dict[str, Any], json_path: str | Path) -> None:
-    """Save a dictionary to a json file.
+    """Save a dictionary to a json file. The file is written to a temporary
+    file and moved into place, so readers never see a partial file.
 
     Args:
         json_dict (dict[str, Any]): Dictionary to serialise.
         json_path (str | Path): File path for json file.
     """
-    json_object = json.dumps(json_dict, indent=4)
-    with open(json_path, "w", encoding="utf-8") as outfile:
-        outfile.write(json_object)
+    json_object = json.dumps(json_dict, indent=4, default=_to_json)
+    json_dir = os.path.dirname(os.path.abspath(json_path))
+    fd, tmp_path = tempfile.mkstemp(dir=json_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as outfile:
+            outfile.write(json_object)
+        os.replace(tmp_path, json_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 
 def load_json(json_path: str | Path) -> dict[str, Any]:
@@ -198,24 +310,66 @@ def load_json(json_path: str | Path) -> dict[str, Any]:
     return json_dict
 
 
+def _same_directory(first: Any, second: Any) -> bool:
+    """Check if two ``"directory"`` entries name the same folder."""
+    if not first or not second:
+        return False
+    return os.path.normcase(os.path.abspath(first)) == os.path.normcase(
+        os.path.abspath(second)
+    )
+
+
+def json_labels(json_dict: Mapping[str, Any], directory: str) -> dict[str, str]:
+    """Get the labels of a json file if they belong to a directory.
+
+    Args:
+        json_dict (Mapping[str, Any]): Loaded json file.
+        directory (str): Image directory or manifest the labels must be for.
+
+    Returns:
+        dict[str, str]: File name to label, empty if the json file holds the
+            labels of another directory.
+    """
+    if not _same_directory(json_dict.get("directory"), directory):
+        return {}
+    return json_dict.get("files", {})
+
+
 def update_json(json_dict: dict[str, Any], json_path: str | Path) -> None:
     """Update a json file by loading it into a dict, updating
     the dict, and saving the dict as a json file.
 
+    Nested dicts (e.g. ``"files"``) are merged key by key rather than
+    replaced, and the read-modify-write happens under `json_lock`, so
+    sessions annotating the same folder do not overwrite each other's labels.
+    The ``"files"`` of a json file are the labels of its ``"directory"``:
+    writing another directory starts them over.
+
     Args:
         json_dict (dict[str, Any]): Dictionary to merge in.
         json_path (str | Path): Path of the json file.
     """
-    if Path(json_path).exists():
-        with open(json_path, encoding="utf-8") as infile:
-            data = json.load(infile)
-    else:
-        data = {}
-    data.update(json_dict)
-    save_json(data, json_path)
-
-
-def get_filtered_files(file_dir: str, ext_list: list[str] | None = None) -> list[str]:
+    with json_lock(json_path):
+        if Path(json_path).exists():
+            with open(json_path, encoding="utf-8") as infile:
+                data = json.load(infile)
+        else:
+            data = {}
+        if "directory" in json_dict and not _same_directory(
+            data.get("directory"), json_dict["directory"]
+        ):
+            data.pop("files", None)
+        for key, value in json_dict.items():
+            if isinstance(value, Mapping) and isinstance(data.get(key), dict):
+                data[key].update(value)
+            else:
+                data[key] = value
+        save_json(data, json_path)
+
+
+def get_filtered_files(
+    file_dir: str, ext_list: list[str] | None = None, strict: bool = False
+) -> list[str]:
     """Get files in directory and return a list of files that
     have file extensions provided in ``ext_list``.
 
@@ -223,17 +377,192 @@ def get_filtered_files(file_dir: str, ext_list: list[str] | None = None) -> list
         file_dir (str): File directory with files to filter.
         ext_list (list[str] | None): List of valid file extensions.
             Defaults to ``FILTER_EXT_LIST`` from config when ``None``.
+        strict (bool, optional): Raise errors while listing instead of
+            returning the names read so far. Defaults to False.
+
+    If ``file_dir`` is a manifest file (see `manifest.py`), the file names
+    are streamed from the manifest instead of listing a directory. If it is a
+    zip or tar archive (see `archive.py`), its member names are listed from
+    the archive index without extracting anything.
 
     Returns:
         list[str]: Filtered list of files with valid extensions.
+
+    Raises:
+        OSError: If ``strict`` is set and the listing fails.
+    """
+    return list(iter_filtered_files(file_dir, ext_list, strict))
+
+
+def iter_filtered_files(
+    file_dir: str, ext_list: list[str] | None = None, strict: bool = False
+) -> Iterator[str]:
+    """Yield the files `get_filtered_files` would list, as they are read.
+
+    Directories are read with `os.scandir` and manifests are streamed, so the
+    first names are available long before a large listing finishes.
+
+    Args:
+        file_dir (str): File directory, manifest or archive.
+        ext_list (list[str] | None): List of valid file extensions.
+            Defaults to ``FILTER_EXT_LIST`` from config when ``None``.
+        strict (bool, optional): Raise errors while listing instead of
+            stopping early. Callers that treat names missing from the listing
+            as removed need this. Defaults to False.
+
+    Yields:
+        str: File name with a valid extension. Unless ``strict`` is set, a
+            listing that fails part way stops early instead of raising.
+
+    Raises:
+        OSError: If ``strict`` is set and the listing fails.
     """
     if ext_list is None:
         ext_list = FILTER_EXT_LIST
     try:
-        files = os.listdir(file_dir)
-        return [file for file in files if Path(file).suffix in ext_list]
+        if is_manifest(file_dir):
+            files: Iterator[str] = iter(manifest_files(file_dir))
+        elif is_archive(file_dir):
+            files = iter(archive_files(file_dir))
+        else:
+            with os.scandir(file_dir) as scan:
+                for entry in scan:
+                    if Path(entry.name).suffix in ext_list:
+                        yield entry.name
+            return
+        for file in files:
+            if Path(file).suffix in ext_list:
+                yield file
     except OSError:
-        return []
+        if strict:
+            raise
+        return
+
+
+def is_image_source(path: str) -> bool:
+    """Check if a path can be used as the image "directory": a directory, a
+    manifest file or a zip or tar archive.
+
+    Args:
+        path (str): Path entered by the user.
+
+    Returns:
+        bool: True if images can be listed from ``path``.
+    """
+    return bool(path) and (os.path.isdir(path) or is_manifest(path) or is_archive(path))
+
+
+def get_base_dir(img_dir: str) -> str:
+    """Get the folder that relative file names and sort folders are based on.
+    This is the folder of a manifest, or the image directory itself. Member
+    names of an archive are relative to the archive, as if it were a folder.
+
+    Args:
+        img_dir (str): Image directory or manifest path.
+
+    Returns:
+        str: Base folder.
+    """
+    if is_manifest(img_dir):
+        return os.path.dirname(os.path.abspath(img_dir))
+    return img_dir
+
+
+def get_file_path(img_dir: str, file_name: str) -> str:
+    """Get the full path of an image listed in an image directory or manifest.
+
+    Args:
+        img_dir (str): Image directory or manifest path.
+        file_name (str): File name (or manifest path) of the image.
+
+    Returns:
+        str: Path to the image file.
+    """
+    return os.path.join(get_base_dir(img_dir), file_name)
+
+
+# Two-character operators come first so ``>=`` wins over ``>`` at one position
+_CONDITION_OP = re.compile(">=|<=|!=|=|>|<|~")
+
+
+def parse_conditions(text: str) -> list[tuple[str, str, str]]:
+    """Parse comma separated conditions like ``seed=42, prompt~cat, width>=1024``.
+
+    ``~`` means "contains" (case-insensitive); the other operators compare
+    numerically when both sides are numbers and as text otherwise.
+
+    Args:
+        text (str): Conditions entered by the user.
+
+    Returns:
+        list[tuple[str, str, str]]: ``(column, operator, value)`` tuples.
+
+    Raises:
+        ValueError: If a condition has no operator or no column name.
+    """
+    conditions = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        # The first operator in the text splits it, so values may contain
+        # operator characters (e.g. ``prompt~a=b``)
+        match = _CONDITION_OP.search(part)
+        if match is None:
+            raise ValueError(f"No operator in condition {part!r}.")
+        op = match.group()
+        column, value = part[: match.start()], part[match.end() :]
+        column = column.strip()
+        if not column:
+            raise ValueError(f"No column name in condition {part!r}.")
+        conditions.append((column.lower(), op, value.strip()))
+    return conditions
+
+
+def _compare(actual: Any, op: str, expected: str) -> bool:
+    """Evaluate one condition against a row value."""
+    if op == "~":
+        return expected.lower() in str(actual).lower()
+    try:
+        left: Any = float(actual)
+        right: Any = float(expected)
+    except (TypeError, ValueError):
+        left = str(actual).lower()
+        right = expected.lower()
+    if op == "=":
+        return left == right
+    if op == "!=":
+        return left != right
+    if op == ">=":
+        return left >= right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    return left < right
+
+
+def matches_conditions(
+    row: Mapping[str, Any], conditions: list[tuple[str, str, str]]
+) -> bool:
+    """Check if a row (manifest row or metadata dict) meets every condition.
+    Column names are matched case-insensitively and a missing column never
+    matches.
+
+    Args:
+        row (Mapping[str, Any]): Values keyed by column name.
+        conditions (list[tuple[str, str, str]]): Output of `parse_conditions`.
+
+    Returns:
+        bool: True if all conditions hold.
+    """
+    lowered = {str(key).lower(): val for key, val in row.items()}
+    for column, op, expected in conditions:
+        if column not in lowered or lowered[column] is None:
+            return False
+        if not _compare(lowered[column], op, expected):
+            return False
+    return True
 
 
 def load_image(
@@ -244,6 +573,8 @@ def load_image(
     The `height` parameter will be used to clamp the height of the
     image and the width will change proportionally.
 
+    ``image_path`` may point into a zip or tar archive (see `archive.py`).
+
     Args:
         image_path (str): Path to the image to load.
         height (int, optional): Height of the image if clamped.
@@ -254,13 +585,25 @@ def load_image(
     Returns:
         Image: PIL Image that is either full resolution or clamped.
     """
-    with Image.open(image_path) as img:
+    with open_image(image_path) as img:
         if not is_clamped:
             return img.copy()
-        aspect_ratio = img.width / img.height
-        if img.height > height:
-            width = int(height * aspect_ratio)
-        else:
-            height = img.height
-            width = img.width
-        return img.resize((width, height))
+        return img.resize(clamp_size(img.size, height))
+
+
+def clamp_size(size: tuple[int, int], height: int) -> tuple[int, int]:
+    """Get the size of an image after clamping its height, keeping the
+    aspect ratio. Images shorter than ``height`` keep their size.
+
+    Args:
+        size (tuple[int, int]): Image width and height.
+        height (int): Maximum height.
+
+    Returns:
+        tuple[int, int]: Clamped width and height.
+    """
+    img_width, img_height = size
+    if img_height > height:
+        aspect_ratio = img_width / img_height
+        return int(height * aspect_ratio), height
+    return img_width, img_height
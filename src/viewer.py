@@ -2,16 +2,66 @@
 
 from __future__ import annotations
 
+import html
 import os
 import random
-import time
+from contextlib import AbstractContextManager, nullcontext
+from functools import partial
 from pathlib import Path
 from typing import Any
 
 import streamlit as st
+import streamlit.components.v1 as components
 from omegaconf import OmegaConf
-
-from utils import filter_by_keyword, get_filtered_files, load_image
+from PIL import Image
+
+from decode import (
+    PREFETCH_AHEAD,
+    load_placeholder,
+    load_preview,
+    prefetch_previews,
+    preview_size,
+)
+from encode import (
+    EncodedPreview,
+    byte_budget,
+    encode_image,
+    encode_preview,
+    payload_label,
+    to_data_uri,
+)
+from headers import filter_view, parse_header_conditions
+from indexing import INDEX_POLL_INTERVAL, get_job, start_indexing
+from manifest import is_manifest
+from memprofile import (
+    MEMORY_LOG_PATH,
+    dump_snapshot,
+    finish_rerun,
+    format_bytes,
+    fragment_window,
+    report_rows,
+    start_rerun,
+    write_report,
+)
+from ordering import SORT_KEYS, sort_view
+from permutation import ShuffledOrder
+from registry import FileView, get_registry
+from sprites import SHEET_SIZE, SPRITE_GRID, get_sheet, sheet_cell, sheet_data_uri
+from static_previews import (
+    STATIC_DIR,
+    preview_file,
+    publish_preview,
+    published_preview_url,
+    static_url,
+)
+from tiles import VIEWPORT_WIDTH, ZOOM_LEVELS, get_pyramid, zoom_label
+from utils import (
+    get_file_path,
+    is_image_source,
+    matches_keyword,
+    parse_conditions,
+)
+from watcher import watch
 
 # viewer.py is a Streamlit script entry point, not a library module;
 # __all__ is intentionally omitted.
@@ -24,16 +74,59 @@ def _get_default_dir() -> str:
     if os.path.isfile(_CONFIG_PATH):
         conf = OmegaConf.load(_CONFIG_PATH)
         default_dir = str(conf.default_directory) if conf.default_directory else ""
-        if default_dir and os.path.isdir(default_dir):
+        if default_dir and is_image_source(default_dir):
             return default_dir
     return os.getcwd()
 
 
+def _get_config_value(key: str, default: Any) -> Any:
+    """Read an optional value from config.yml, falling back to ``default``."""
+    if os.path.isfile(_CONFIG_PATH):
+        return OmegaConf.load(_CONFIG_PATH).get(key, default)
+    return default
+
+
 DEFAULT_DIR = _get_default_dir()
+WATCH_DIRECTORY = bool(_get_config_value("watch_directory", True))
+# Worker processes used to decode images; 0 decodes in the script thread
+DECODE_WORKERS = int(_get_config_value("decode_workers", 0))
+# Transport encoding of previews (see encode.py); None picks the default
+PREVIEW_FORMAT = str(_get_config_value("preview_format", "auto"))
+PREVIEW_QUALITY = int(_get_config_value("preview_quality", 0)) or None
+_max_bytes = _get_config_value("preview_max_bytes", None)
+PREVIEW_MAX_BYTES = int(_max_bytes) if _max_bytes is not None else None
+# Serve previews from Streamlit's static directory (needs static file serving)
+STATIC_PREVIEWS = bool(_get_config_value("static_previews", False)) and bool(
+    st.get_option("server.enableStaticServing")
+)
+# Trace allocations and show a memory report per rerun (see memprofile.py)
+MEMORY_PROFILE = bool(_get_config_value("memory_profile", False))
+MEMORY_LOG = str(_get_config_value("memory_log", None) or MEMORY_LOG_PATH)
+# Also read image sizes and metadata when indexing a directory (see indexing.py)
+INDEX_IMAGES = bool(_get_config_value("index_images", False))
 # Default height clamp for the viewer. Differs from the annotator default (896)
 # because the viewer sidebar takes vertical space, requiring a shorter image height.
 DEFAULT_HEIGHT_CLAMP = 785
+# Number of frames pushed to the browser per slideshow refill. The browser asks
+# for the next window once half of the current one has been shown.
+SLIDESHOW_WINDOW = 8
+# Thumbnails shown on each side of the current image in the filmstrip
+FILMSTRIP_RADIUS = 7
+# Displayed size of filmstrip thumbnails, in pixels
+FILMSTRIP_THUMB_SIZE = 52
+# Sprite sheets go under the static directory when it is served, so the
+# browser fetches and caches them by URL instead of receiving data URIs
+SPRITE_DIR = STATIC_DIR / "sprites" if STATIC_PREVIEWS else None
+
+_slideshow_component = components.declare_component(
+    "slideshow", path=str(Path(__file__).parent / "frontend" / "slideshow")
+)
+_filmstrip_component = components.declare_component(
+    "filmstrip", path=str(Path(__file__).parent / "frontend" / "filmstrip")
+)
 
+if MEMORY_PROFILE:
+    start_rerun()
 state = st.session_state
 if "img_dir" not in state:
     state.img_dir = DEFAULT_DIR
@@ -61,15 +154,34 @@ if "is_clamped" not in state:
     state.is_clamped = False
 if "is_shuffled" not in state:
     state.is_shuffled = False
+    state.shuffle_seed = 0
+    state.order = None
 if "is_slideshow" not in state:
     state.is_slideshow = False
 if "continuous" not in state:
     state.continuous = False
+if "slideshow_start" not in state:
+    state.slideshow_start = 0
+if "slideshow_window" not in state:
+    state.slideshow_window = None
 if "keywords" not in state:
     state.keywords = ""
     state.keyword_filter = ""
     state.sep = " "
     state.split_keywords = []
+if "manifest_filter" not in state:
+    state.manifest_filter = ""
+if "size_filter" not in state:
+    state.size_filter = ""
+    state.sort_key = "name"
+if "files_version" not in state:
+    state.files_version = 0
+if "show_filmstrip" not in state:
+    state.show_filmstrip = True
+if "zoom" not in state:
+    state.zoom = "fit"
+    state.pan_x = 0.5
+    state.pan_y = 0.5
 
 # Hide Streamlit's default chrome (toolbar, decoration, status widget, menu,
 # header, footer). These selectors target Streamlit-internal data-testid
@@ -107,54 +219,175 @@ HIDE_STREAMLIT_CHROME_CSS = """
                 """
 
 
-def get_imgs() -> list[str]:
-    """Get a filtered and sorted list of image filenames for the current directory.
+def get_imgs() -> FileView:
+    """Get a filtered and sorted view of image filenames for the current directory.
 
     Images are filtered to extensions defined in config.yml. If keyword filters
     are active and new keywords have been set, applies keyword filtering too.
+    Names come from the shared `FileRegistry`, so the session only keeps
+    arrays of ids. Files added or removed since the last call are applied
+    incrementally, keeping ``state.counter`` on the same file.
 
     Returns:
-        list[str]: Sorted list of image filenames (empty list if directory is invalid).
+        FileView: Sorted image filenames (empty if directory is invalid).
     """
+    registry = get_registry(state.img_dir)
+    version = registry.version
+    changes = None
+    if (
+        not state.is_new_dir
+        and isinstance(state.img_file_names, FileView)
+        and state.img_file_names.registry is registry
+    ):
+        changes = registry.changes_since(state.files_version)
+    if (
+        changes is not None
+        and changes != ([], [])
+        and (state.manifest_filter or state.size_filter)
+    ):
+        # Manifest and size filters are evaluated over the whole view, not
+        # per name
+        changes = None
+    state.files_version = version
+    # Whether ``filtered_words`` is rebuilt instead of synced, which the
+    # shuffled order has to follow
+    rebuilt = changes is None
+    if changes is None:
+        state.is_new_dir = True
+        state.is_new_keywords = True
+    elif changes != ([], []):
+        added, removed = changes
+        # A shuffled order tracks its own position (see `sync_order`)
+        position = -1 if state.is_shuffled else state.counter
+        unfiltered = state.img_file_names
+        state.img_file_names, shifted = state.img_file_names.synced(
+            added, removed, position, name_order=state.sort_key == "name"
+        )
+        if state.filtered_words is unfiltered:
+            state.filtered_words = state.img_file_names
+        elif state.split_keywords and isinstance(state.filtered_words, FileView):
+            keywords = state.split_keywords
+            sep = state.sep
+            state.filtered_words, shifted = state.filtered_words.synced(
+                added,
+                removed,
+                position,
+                lambda file: any(matches_keyword(file, key, sep) for key in keywords),
+                state.sort_key == "name",
+            )
+        if not state.is_shuffled:
+            state.counter = shifted
     if state.is_new_dir:
-        state.img_file_names = get_filtered_files(state.img_dir)
+        state.img_file_names = registry.view()
+        if state.manifest_filter and registry.is_manifest:
+            state.img_file_names = state.img_file_names.keep_ids(
+                registry.manifest_ids(state.manifest_filter)
+            )
+        if state.size_filter:
+            state.img_file_names = filter_view(state.img_file_names, state.size_filter)
+        if state.sort_key != "name":
+            state.img_file_names = sort_view(state.img_file_names, 0, state.sort_key)
         state.is_new_dir = False
-        if state.img_file_names:
-            state.img_file_names.sort()
         state.filtered_words = state.img_file_names
     if state.split_keywords and state.is_new_keywords:
-        keyword_filtered = []
-        for keyword in state.split_keywords:
-            _, filtered = filter_by_keyword(
-                state.img_file_names, keyword, sep_=state.sep
-            )
-            keyword_filtered.extend(filtered)
-        keyword_filtered = list(set(keyword_filtered))
+        keywords = state.split_keywords
+        sep = state.sep
+        state.filtered_words = state.img_file_names.filter(
+            lambda file: any(matches_keyword(file, key, sep) for key in keywords)
+        )
         state.is_new_keywords = False
-        if not state.is_shuffled:
-            keyword_filtered.sort()
-        state.filtered_words = keyword_filtered
+        rebuilt = True
 
-    if not state.split_keywords:
+    if not state.split_keywords and state.filtered_words is not state.img_file_names:
+        # Keywords were cleared
         state.filtered_words = state.img_file_names
+        rebuilt = True
+    if state.is_shuffled:
+        sync_order(None if rebuilt else changes)
     return state.filtered_words
 
 
+def sync_order(changes: tuple[list[int], list[int]] | None) -> None:
+    """Apply registry changes to the shuffled order. Files that joined the
+    list are appended and removed ones are replaced by the last file, so the
+    other positions, ``state.counter`` among them, keep their file. The order
+    is shuffled again with the same seed if the list was rebuilt.
+
+    Args:
+        changes (tuple[list[int], list[int]] | None): Added and removed
+            registry ids, or None if the file list was rebuilt (new
+            directory, filters or keywords).
+    """
+    files = state.filtered_words
+    if changes is None:
+        state.order = ShuffledOrder(files.ids, state.shuffle_seed)
+        return
+    added, removed = changes
+    if not added and not removed:
+        return
+    if added:
+        listed = set(files.ids)
+        added = [file_id for file_id in added if file_id in listed]
+    state.counter = state.order.synced(added, removed, state.counter)
+
+
 def set_dir() -> None:
     """Set the image directory and get image files if any exist.
     Also sets the current file in the state dict."""
-    if not os.path.isdir(state.img_dir):
+    if not is_image_source(state.img_dir):
         st.error(f"{state.img_dir} is not a valid directory!")
     else:
-        state.files = get_imgs()
+        start_indexing(state.img_dir, INDEX_IMAGES)
+        if WATCH_DIRECTORY:
+            watch(state.img_dir)
+        refresh_files()
+        index_status()
+    job = get_job(state.img_dir)
     if state.files and state.counter < len(state.files):
-        state.current_file = state.files[state.counter]
+        state.current_file = file_at(state.counter)
+    elif job is not None and not job.finished:
+        st.write("Listing images...")
     else:
         st.write("No image files in folder.")
 
 
+def index_status() -> None:
+    """Show the progress of the directory's index job in the sidebar. The
+    progress is a fragment that reruns on its own while the job runs, so it is
+    only polled until indexing is done."""
+    job = get_job(state.img_dir)
+    if job is None:
+        return
+    if job.error is not None:
+        st.sidebar.error(f"Indexing stopped: {job.error}")
+    elif not job.finished:
+        with st.sidebar:
+            st.fragment(index_progress, run_every=INDEX_POLL_INTERVAL)()
+
+
+def index_progress() -> None:
+    """Show the index job's progress. The whole app is rerun once the job is
+    done, or when the first files are listed and none are shown yet."""
+    job = get_job(state.img_dir)
+    if job is None or job.finished:
+        st.rerun()
+        return
+    if not state.files and job.registry.version != state.files_version:
+        st.rerun()
+        return
+    progress = job.progress()
+    st.progress(progress.fraction, text=f"Indexing {progress.label}")
+
+
+def refresh_files() -> None:
+    """Sync ``state.files`` with the directory."""
+    state.files = get_imgs()
+
+
 def show_image(img_container: Any, file_name_placeholder: Any) -> None:
-    """Display the current image in the viewer container.
+    """Display the current image in the viewer container. A low-resolution
+    placeholder is shown first when one can be had quickly (see
+    `load_placeholder`).
 
     Does nothing if ``state.current_file`` is ``None``.
 
@@ -164,20 +397,158 @@ def show_image(img_container: Any, file_name_placeholder: Any) -> None:
     """
     if state.current_file is None:
         return
-    file_path = os.path.join(state.img_dir, state.current_file)
+    file_path = get_file_path(state.img_dir, state.current_file)
     state.is_clamped = state.height_clamp > 0
-    image = load_image(file_path, state.height_clamp, state.is_clamped)
-    img_container.image(image, use_container_width=False)
-    if state.show_file_name:
-        file_name_placeholder.info(state.current_file)
+    if not state.is_clamped:
+        # Full resolution is shown a viewport at a time from the tile pyramid
+        pyramid = get_pyramid(file_path)
+        view_size = (VIEWPORT_WIDTH, DEFAULT_HEIGHT_CLAMP)
+        zoom = state.zoom
+        level = pyramid.fit_level(view_size) if zoom == "fit" else int(zoom)
+        image = pyramid.viewport(level, (state.pan_x, state.pan_y), view_size)
+        encoded = encode_image(
+            image, PREVIEW_FORMAT, PREVIEW_QUALITY, get_byte_budget(), webp=False
+        )
+        show_encoded(img_container, encoded)
+        show_file_name(file_name_placeholder, encoded)
+        return
+    url = None
+    if STATIC_PREVIEWS:
+        url = published_preview_url(file_path, state.height_clamp, state.is_clamped)
+    if url is None:
+        placeholder = load_placeholder(file_path)
+        if placeholder is not None:
+            # Shown straight away, then replaced once the full image is decoded
+            width, _ = preview_size(file_path, state.height_clamp, state.is_clamped)
+            img_container.image(placeholder, width=width)
+    if STATIC_PREVIEWS:
+        if url is None:
+            url = publish_preview(
+                file_path,
+                state.height_clamp,
+                state.is_clamped,
+                partial(encode_current_preview, file_path, webp=True),
+            )
+        src = static_url(url, st.get_option("server.baseUrlPath"))
+        img_container.markdown(
+            f'<img src="{html.escape(src)}">', unsafe_allow_html=True
+        )
+        published = preview_file(url)
+        state.payload_bytes = published.stat().st_size
+        label = payload_label(state.payload_bytes, published.suffix[1:].upper())
+        if state.show_file_name:
+            file_name_placeholder.info(f"{state.current_file} · {label}")
+    else:
+        encoded = encode_current_preview(file_path, webp=False)
+        show_encoded(img_container, encoded)
+        show_file_name(file_name_placeholder, encoded)
+    if DECODE_WORKERS:
+        upcoming = range(state.counter + 1, state.counter + 1 + PREFETCH_AHEAD)
+        prefetch_previews(
+            (
+                get_file_path(state.img_dir, file_at(position))
+                for position in upcoming
+                if position < len(state.files)
+            ),
+            state.height_clamp,
+            state.is_clamped,
+            DECODE_WORKERS,
+        )
+
+
+def get_byte_budget() -> int:
+    """Get the byte budget of a preview: ``preview_max_bytes`` from the
+    config, or `byte_budget` of the height clamp."""
+    if PREVIEW_MAX_BYTES is not None:
+        return PREVIEW_MAX_BYTES
+    return byte_budget(state.height_clamp if state.is_clamped else DEFAULT_HEIGHT_CLAMP)
+
+
+def encode_current_preview(file_path: str, webp: bool) -> EncodedPreview:
+    """Encode the preview of an image at the current height clamp.
+
+    Args:
+        file_path (str): Path to the image.
+        webp (bool): False if the preview is shown with ``st.image``, which
+            re-encodes WebP.
+
+    Returns:
+        EncodedPreview: Bytes to send, with their format and quality.
+    """
+    return encode_preview(
+        file_path,
+        state.height_clamp,
+        state.is_clamped,
+        partial(load_current_preview, file_path),
+        PREVIEW_FORMAT,
+        PREVIEW_QUALITY,
+        get_byte_budget(),
+        webp,
+    )
+
+
+def show_encoded(img_container: Any, encoded: EncodedPreview) -> None:
+    """Draw encoded JPEG or PNG bytes without Streamlit re-encoding them.
+
+    Args:
+        img_container: Streamlit container used to render the image.
+        encoded (EncodedPreview): Preview to show.
+    """
+    state.payload_bytes = len(encoded.data)
+    img_container.image(
+        encoded.data, use_container_width=False, output_format=encoded.format
+    )
+
+
+def show_file_name(file_name_placeholder: Any, encoded: EncodedPreview) -> None:
+    """Show the current file name and the payload size of its preview, if
+    file names are turned on.
+
+    Args:
+        file_name_placeholder: Streamlit container used to display the filename.
+        encoded (EncodedPreview): Preview that was shown.
+    """
+    if not state.show_file_name:
+        return
+    label = payload_label(
+        len(encoded.data), encoded.format, encoded.quality, encoded.passthrough
+    )
+    file_name_placeholder.info(f"{state.current_file} · {label}")
+
+
+def load_current_preview(file_path: str) -> Image.Image:
+    """Decode the preview of an image at the current height clamp.
+
+    Args:
+        file_path (str): Path to the image.
+
+    Returns:
+        Image.Image: Clamped preview.
+    """
+    return load_preview(file_path, state.height_clamp, state.is_clamped, DECODE_WORKERS)
+
+
+def file_at(position: int) -> str:
+    """Get the file shown at a position, following the shuffled order
+    if the files have been shuffled.
+
+    Args:
+        position (int): Position in the viewing order.
+
+    Returns:
+        str: File name at that position.
+    """
+    if state.is_shuffled:
+        return state.files.registry.name(state.order[position])
+    return state.files[position]
 
 
 def set_current_file() -> None:
     """Set the current file to the index of the
     state.counter.
     """
-    if state.counter < len(state.files):
-        state.current_file = state.files[state.counter]
+    if 0 <= state.counter < len(state.files):
+        state.current_file = file_at(state.counter)
 
 
 def change_img(val: int) -> None:
@@ -196,11 +567,53 @@ def change_img(val: int) -> None:
 def change_dir() -> None:
     """Change directory and reset images."""
     new_dir = getattr(state, "_img_dir", None)
-    if not new_dir or not os.path.isdir(new_dir):
-        st.error(f"{new_dir!r} is not a valid directory. Please enter another one.")
+    if not new_dir or not is_image_source(new_dir):
+        st.error(
+            f"{new_dir!r} is not a valid directory or manifest. "
+            "Please enter another one."
+        )
     else:
         state.img_dir = new_dir
         state.is_new_dir = True
+        # Lists the directory in the background; the script only takes the
+        # files listed so far
+        start_indexing(new_dir, INDEX_IMAGES)
+
+
+def change_manifest_filter() -> None:
+    """Change the manifest column filter if the conditions parse."""
+    new_filter = getattr(state, "_manifest_filter", "") or ""
+    try:
+        parse_conditions(new_filter)
+    except ValueError as err:
+        st.error(str(err))
+        return
+    state.manifest_filter = new_filter
+    state.counter = 0
+    state.is_new_dir = True
+    state.is_new_keywords = True
+
+
+def change_size_filter() -> None:
+    """Change the image size filter if the conditions parse."""
+    new_filter = getattr(state, "_size_filter", "") or ""
+    try:
+        parse_header_conditions(new_filter)
+    except ValueError as err:
+        st.error(str(err))
+        return
+    state.size_filter = new_filter
+    state.counter = 0
+    state.is_new_dir = True
+    state.is_new_keywords = True
+
+
+def change_sort_key() -> None:
+    """Change the order files are shown in."""
+    state.sort_key = getattr(state, "_sort_key", "name") or "name"
+    state.counter = 0
+    state.is_new_dir = True
+    state.is_new_keywords = True
 
 
 def clear_img() -> None:
@@ -209,10 +622,15 @@ def clear_img() -> None:
 
 
 def shuffle_files() -> None:
-    """Shuffle file list."""
-    random.shuffle(state.files)
+    """Shuffle the viewing order with a new seed. The file list itself is
+    left sorted; ``file_at`` maps positions through a ``ShuffledOrder`` of its
+    registry ids, which stays in place while files come and go.
+    """
+    state.shuffle_seed = random.getrandbits(64)
+    state.order = ShuffledOrder(state.files.ids, state.shuffle_seed)
     state.counter = 0
     state.is_shuffled = True
+    set_current_file()
 
 
 def change_height_clamp() -> None:
@@ -242,21 +660,269 @@ def reset_keywords() -> None:
     state.split_keywords = []
 
 
+@st.fragment
+def navigation(img_container: Any, file_name_placeholder: Any) -> None:
+    """Render the navigation buttons and the current image.
+
+    This is a Streamlit fragment, so back/next/clear/shuffle clicks only rerun
+    this function instead of the whole script. The buttons are drawn in the
+    fragment body and the image is written into the externally created
+    ``img_container``, which is emptied when no image should be shown.
+
+    Args:
+        img_container: Streamlit container used to render the image.
+        file_name_placeholder: Streamlit container used to display the filename.
+    """
+    with profile_fragment("navigation"):
+        if is_image_source(state.img_dir):
+            refresh_files()
+            set_current_file()
+        button_col1, button_col2 = st.columns(2)
+        button_col1.button("back", on_click=change_img, args=(-1,))
+        button_col2.button("next", on_click=change_img, args=(1,))
+        st.markdown("---")
+        col1, col2 = st.columns(2)
+        col1.button("clear", on_click=clear_img)
+        col2.button("shuffle", on_click=shuffle_files)
+        if (
+            state.show_filmstrip
+            and state.files
+            and 0 <= state.counter < len(state.files)
+            and not state.is_slideshow
+        ):
+            filmstrip()
+        if state.height_clamp <= 0 and not state.is_slideshow:
+            st.markdown("---")
+            state.zoom = st.select_slider(
+                "zoom",
+                options=ZOOM_LEVELS,
+                value="fit",
+                format_func=zoom_label,
+                key="_zoom",
+            )
+            state.pan_x = st.slider("pan x", 0.0, 1.0, 0.5, key="_pan_x")
+            state.pan_y = st.slider("pan y", 0.0, 1.0, 0.5, key="_pan_y")
+        if state.counter >= 0 and state.current_file and not state.is_slideshow:
+            show_image(img_container, file_name_placeholder)
+        elif not state.is_slideshow:
+            img_container.empty()
+            file_name_placeholder.empty()
+
+
+def sheet_image_paths(number: int) -> list[str]:
+    """Get the paths of the images in a filmstrip sprite sheet.
+
+    Args:
+        number (int): Sheet number; sheet ``n`` holds viewing positions
+            ``n * SHEET_SIZE`` up to the next sheet.
+
+    Returns:
+        list[str]: Image paths in cell order.
+    """
+    stop = min((number + 1) * SHEET_SIZE, len(state.files))
+    return [
+        get_file_path(state.img_dir, file_at(position))
+        for position in range(number * SHEET_SIZE, stop)
+    ]
+
+
+def get_filmstrip(radius: int = FILMSTRIP_RADIUS) -> tuple[list[str], list[dict]]:
+    """Get the sprite sheets and cells of the filmstrip around
+    ``state.counter``.
+
+    Sheets of the visible positions are built if needed; the sheets just
+    before and after them are queued in the background.
+
+    Args:
+        radius (int, optional): Thumbnails on each side of the current image.
+            Defaults to `FILMSTRIP_RADIUS`.
+
+    Returns:
+        tuple[list[str], list[dict]]: Sheet URLs, and the cells with their
+            viewing ``"position"``, ``"sheet"`` index, ``"col"``, ``"row"``
+            and file ``"name"``.
+    """
+    first = max(0, state.counter - radius)
+    last = min(len(state.files), state.counter + radius + 1)
+    numbers = range(first // SHEET_SIZE, (last - 1) // SHEET_SIZE + 1)
+    base_url_path = st.get_option("server.baseUrlPath")
+    sheets = []
+    for number in numbers:
+        path = get_sheet(sheet_image_paths(number), cache_dir=SPRITE_DIR)
+        if SPRITE_DIR is not None:
+            # Sheet names change with their content, so they can be cached
+            sheets.append(static_url(f"sprites/{path.name}?v=1", base_url_path))
+        else:
+            sheets.append(sheet_data_uri(path))
+    for number in (numbers.start - 1, numbers.stop):
+        if 0 <= number * SHEET_SIZE < len(state.files):
+            get_sheet(sheet_image_paths(number), wait=False, cache_dir=SPRITE_DIR)
+    cells = []
+    for position in range(first, last):
+        col, row = sheet_cell(position % SHEET_SIZE)
+        cells.append(
+            {
+                "position": position,
+                "sheet": position // SHEET_SIZE - numbers.start,
+                "col": col,
+                "row": row,
+                "name": file_at(position),
+            }
+        )
+    return sheets, cells
+
+
+def jump_from_filmstrip() -> None:
+    """Show the image whose filmstrip thumbnail was clicked."""
+    clicked = getattr(state, "_filmstrip", None)
+    if not clicked or not state.files:
+        return
+    state.counter = min(max(int(clicked["position"]), 0), len(state.files) - 1)
+    set_current_file()
+
+
+def filmstrip() -> None:
+    """Render the filmstrip of thumbnails around the current image. Clicking
+    a thumbnail jumps straight to that image."""
+    sheets, cells = get_filmstrip()
+    _filmstrip_component(
+        sheets=sheets,
+        cells=cells,
+        current=state.counter,
+        grid=SPRITE_GRID,
+        size=FILMSTRIP_THUMB_SIZE,
+        key="_filmstrip",
+        on_change=jump_from_filmstrip,
+        default=None,
+    )
+
+
+def get_slideshow_frames(start: int, size: int) -> list[dict[str, str]]:
+    """Load and encode a window of slideshow frames starting at ``start``.
+
+    Positions past the end of ``state.files`` wrap around when the slideshow is
+    continuous and are dropped otherwise. The last window is kept in
+    ``state.slideshow_window`` so unrelated reruns do not decode it again.
+
+    Args:
+        start (int): Slideshow position of the first frame.
+        size (int): Maximum number of frames in the window.
+
+    Returns:
+        list[dict[str, str]]: Frames with a ``"src"`` data URI and a ``"name"``.
+    """
+    n_files = len(state.files)
+    stop = start + size if state.continuous else min(start + size, n_files)
+    window_key = (
+        state.img_dir,
+        start,
+        stop,
+        state.height_clamp,
+        n_files,
+        state.is_shuffled and state.shuffle_seed,
+    )
+    if state.slideshow_window and state.slideshow_window[0] == window_key:
+        return state.slideshow_window[1]
+    file_names = [file_at(position % n_files) for position in range(start, stop)]
+    paths = [get_file_path(state.img_dir, file_name) for file_name in file_names]
+    is_clamped = state.height_clamp > 0
+    if STATIC_PREVIEWS:
+        frames = []
+        base_url_path = st.get_option("server.baseUrlPath")
+        # Only previews that were never published need decoding
+        unpublished = [
+            path
+            for path in paths
+            if published_preview_url(path, state.height_clamp, is_clamped) is None
+        ]
+        prefetch_previews(unpublished, state.height_clamp, is_clamped, DECODE_WORKERS)
+        for file_name, path in zip(file_names, paths):
+            encode = partial(encode_current_preview, path, webp=True)
+            url = publish_preview(path, state.height_clamp, is_clamped, encode)
+            frames.append({"src": static_url(url, base_url_path), "name": file_name})
+        state.slideshow_window = (window_key, frames)
+        return frames
+    # Decode the whole window in parallel before encoding frame by frame
+    prefetch_previews(paths, state.height_clamp, is_clamped, DECODE_WORKERS)
+    frames = []
+    for file_name, path in zip(file_names, paths):
+        encoded = encode_current_preview(path, webp=True)
+        frames.append({"src": to_data_uri(encoded), "name": file_name})
+    state.slideshow_window = (window_key, frames)
+    return frames
+
+
+def refill_slideshow() -> None:
+    """Move the slideshow window to the position reported by the browser."""
+    reported = getattr(state, "_slideshow", None)
+    if not reported or not state.files:
+        return
+    state.slideshow_start = int(reported["position"])
+    state.counter = state.slideshow_start % len(state.files)
+    set_current_file()
+
+
+@st.fragment
+def slideshow() -> None:
+    """Render the client-side slideshow.
+
+    The browser advances through the preloaded frames on its own timer, so no
+    script thread sleeps between frames. The only server round trip is the
+    refill request, which reruns just this fragment.
+    """
+    with profile_fragment("slideshow"):
+        frames = get_slideshow_frames(state.slideshow_start, SLIDESHOW_WINDOW)
+        _slideshow_component(
+            frames=frames,
+            start=state.slideshow_start,
+            total=len(state.files),
+            interval_ms=int(state.sleep_time * 1000),
+            refill_at=SLIDESHOW_WINDOW // 2,
+            continuous=state.continuous,
+            show_name=state.show_file_name,
+            key="_slideshow",
+            on_change=refill_slideshow,
+            default=None,
+        )
+
+
+def profile_fragment(fragment: str) -> AbstractContextManager[None]:
+    """Trace a rerun of only ``fragment`` when ``memory_profile`` is set (see
+    `memprofile.fragment_window`)."""
+    if not MEMORY_PROFILE:
+        return nullcontext()
+    return fragment_window("viewer", fragment, state, MEMORY_LOG)
+
+
+def memory_panel() -> None:
+    """Record the memory profile of this rerun, append it to the memory log
+    and show it in a sidebar expander."""
+    report = finish_rerun("viewer", state)
+    write_report(report, MEMORY_LOG)
+    with st.sidebar.expander("Memory profile"):
+        st.write(
+            f"Traced: {format_bytes(report.current)}, "
+            f"peak this rerun: {format_bytes(report.peak)}"
+        )
+        for title, rows in report_rows(report).items():
+            st.caption(title)
+            st.dataframe(rows, hide_index=True)
+        if st.button("Save snapshot", help="Dump every traced allocation."):
+            st.write(f"Saved {dump_snapshot()}")
+        st.caption(f"Reports are appended to {MEMORY_LOG}")
+
+
 st.set_page_config(layout="wide")
 set_dir()
 st.markdown(HIDE_STREAMLIT_CHROME_CSS, unsafe_allow_html=True)
 img_container = st.empty()
-button_col1, button_col2 = st.sidebar.columns(2)
-button_col1.button("back", on_click=change_img, args=(-1,))
-button_col2.button("next", on_click=change_img, args=(1,))
-st.sidebar.markdown("---")
-col1, col2 = st.sidebar.columns(2)
-col1.button("clear", on_click=clear_img)
-col2.button("shuffle", on_click=shuffle_files)
+nav_container = st.sidebar.container()
 file_name_placeholder = st.sidebar.empty()
 scol1, scol2, scol3 = st.sidebar.columns(3)
 state.show_file_name = scol1.checkbox("show filename")
 state.is_slideshow = scol2.checkbox("slide show", value=False)
+if not state.is_slideshow:
+    state.show_filmstrip = scol3.checkbox("filmstrip", value=True)
 if state.is_slideshow:
     state.continuous = scol3.checkbox("continuous", value=False)
     state.sleep_time = st.sidebar.number_input("view time", value=2)
@@ -266,6 +932,31 @@ st.sidebar.text_input(
     value=DEFAULT_DIR,
     key="_img_dir",
     on_change=change_dir,
+    help="A .csv, .jsonl or .parquet manifest listing image files, or a .zip or \
+        .tar archive, can be used instead of a directory.",
+)
+if is_manifest(state.img_dir):
+    st.sidebar.text_input(
+        "manifest filter",
+        value=state.manifest_filter,
+        key="_manifest_filter",
+        on_change=change_manifest_filter,
+        help="Comma separated column conditions, e.g. `seed=42, prompt~cat`.",
+    )
+st.sidebar.text_input(
+    "size filter",
+    value=state.size_filter,
+    key="_size_filter",
+    on_change=change_size_filter,
+    help="Comma separated conditions on width, height, aspect, megapixels, mode \
+        and format, e.g. `width>=2048, aspect>1`.",
+)
+st.sidebar.selectbox(
+    "sort by",
+    SORT_KEYS,
+    index=SORT_KEYS.index(state.sort_key),
+    key="_sort_key",
+    on_change=change_sort_key,
 )
 st.sidebar.info(f"number of images: {len(state.files)}")
 state.keyword_filter = st.sidebar.checkbox("Keyword Filter", on_change=reset_keywords)
@@ -283,18 +974,13 @@ st.sidebar.number_input(
     key="_height_clamp",
     on_change=change_height_clamp,
 )
-if state.counter >= 0 and state.current_file and not state.is_slideshow:
-    show_image(img_container, file_name_placeholder)
-# slide show code
+with nav_container:
+    navigation(img_container, file_name_placeholder)
 if state.is_slideshow and state.counter < len(state.files) and state.current_file:
-    show_image(img_container, file_name_placeholder)
-    time.sleep(state.sleep_time)
-    # Unlike change_img(), slideshow does not wrap to the beginning unless
-    # the "continuous" checkbox is enabled — stopping at the last image is
-    # the intended non-continuous behaviour.
-    if state.counter == len(state.files) - 1 and state.continuous:
-        state.counter = 0
-    else:
-        state.counter += 1
-    set_current_file()
-    st.rerun()
+    file_name_placeholder.empty()
+    with img_container:
+        slideshow()
+else:
+    state.slideshow_start = max(state.counter, 0)
+if MEMORY_PROFILE:
+    memory_panel()
@@ -0,0 +1,209 @@
+"""Background watchers that keep a `FileRegistry` in sync with its directory
+as files are written and removed."""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+from pathlib import Path
+
+from registry import FileRegistry, get_registry
+from utils import FILTER_EXT_LIST
+
+__all__ = ["DirectoryWatcher", "stop_all", "watch"]
+
+# Seconds between polls (polling backend) or between stop-flag checks (inotify)
+POLL_INTERVAL = 2.0
+# Watchers kept alive at once; the least recently requested one is stopped
+MAX_WATCHERS = 8
+
+# inotify constants from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (
+    _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_libc() -> ctypes.CDLL | None:
+    """Load libc if it provides inotify (Linux only)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+class DirectoryWatcher(threading.Thread):
+    """Daemon thread that applies file creations and deletions in one
+    directory to its registry as they happen.
+
+    On Linux it uses inotify. New files are added on ``IN_CLOSE_WRITE`` or
+    ``IN_MOVED_TO``, so half-written images are not picked up. Elsewhere, for
+    manifests, or if inotify cannot be set up, it polls the registry, which
+    only relists when the directory's mtime changes.
+    """
+
+    def __init__(self, registry: FileRegistry, interval: float = POLL_INTERVAL):
+        """Initialize the watcher. Call ``start`` to begin watching.
+
+        Args:
+            registry (FileRegistry): Registry to keep up to date.
+            interval (float, optional): Seconds between polls. Defaults to
+                ``POLL_INTERVAL``.
+        """
+        super().__init__(name=f"watch:{registry.directory}", daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self.backend = "polling"
+        self._indexed = False
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        """Ask the thread to exit after its current wait."""
+        self._stop_event.set()
+
+    def run(self) -> None:
+        """Watch with inotify if possible, falling back to polling."""
+        self.registry.watched = True
+        try:
+            self._watch()
+        finally:
+            self.registry.watched = False
+
+    def _watch(self) -> None:
+        # Leave the initial listing to a running `indexing.IndexJob`
+        self._indexed = self.registry.indexing
+        while self.registry.indexing:
+            if self._stop_event.wait(self.interval):
+                return
+        file_source = self.registry.is_manifest or self.registry.is_archive
+        libc = None if file_source else _load_libc()
+        if libc is not None:
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0:
+                try:
+                    path = os.fsencode(self.registry.directory)
+                    if libc.inotify_add_watch(fd, path, _WATCH_MASK) >= 0:
+                        self.backend = "inotify"
+                        self._run_inotify(fd)
+                        return
+                finally:
+                    os.close(fd)
+        self._run_polling()
+
+    def _run_polling(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.registry.refresh()
+
+    def _run_inotify(self, fd: int) -> None:
+        # Catch anything written between the initial listing and the watch.
+        # After an index job only an mtime change means the listing is stale.
+        self.registry.refresh(force=not self._indexed)
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([fd], [], [], self.interval)
+            if not readable:
+                continue
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            if self._apply_events(data):
+                return
+
+    def _apply_events(self, data: bytes) -> bool:
+        """Apply a buffer of inotify events to the registry.
+
+        Returns:
+            bool: True if the watched directory itself went away.
+        """
+        added: list[str] = []
+        removed: list[str] = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            raw_name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                self.registry.refresh(force=True)
+                return True
+            if mask & _IN_Q_OVERFLOW:
+                self.registry.refresh(force=True)
+                added.clear()
+                removed.clear()
+                continue
+            name = os.fsdecode(raw_name)
+            if mask & _IN_ISDIR or Path(name).suffix not in FILTER_EXT_LIST:
+                continue
+            if mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                if name in removed:
+                    removed.remove(name)
+                added.append(name)
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                if name in added:
+                    added.remove(name)
+                removed.append(name)
+        if removed:
+            self.registry.remove(removed)
+        if added:
+            self.registry.add(added)
+        return False
+
+
+_watchers: dict[str, DirectoryWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def watch(directory: str) -> DirectoryWatcher:
+    """Start (or reuse) the watcher for a directory or manifest.
+
+    Args:
+        directory (str): Image directory or manifest path.
+
+    Returns:
+        DirectoryWatcher: Running watcher for ``directory``.
+    """
+    key = os.path.abspath(directory)
+    with _watchers_lock:
+        watcher = _watchers.pop(key, None)
+        if watcher is None or not watcher.is_alive():
+            watcher = DirectoryWatcher(get_registry(directory))
+            watcher.start()
+        # Re-insert so the dict stays ordered by most recent request
+        _watchers[key] = watcher
+        while len(_watchers) > MAX_WATCHERS:
+            oldest = next(iter(_watchers))
+            _watchers.pop(oldest).stop()
+    return watcher
+
+
+def stop_all() -> None:
+    """Stop every running watcher."""
+    with _watchers_lock:
+        for watcher in _watchers.values():
+            watcher.stop()
+        _watchers.clear()
@@ -2,8 +2,14 @@
 
 from __future__ import annotations
 
+# Imported up front so the app tests' patch.dict(sys.modules) blocks do not
+# unload them; process pools pickle references to these exact modules, and
+# numpy cannot be imported twice in one process.
+import concurrent.futures.process  # noqa: F401
+import multiprocessing.shared_memory  # noqa: F401
 from types import SimpleNamespace
 
+import numpy  # noqa: F401
 import pytest
 from PIL import Image
 
@@ -54,4 +60,9 @@ def mock_state():
         show_prompt=False,
         move=False,
         keyword_and_or=False,
+        manifest_filter="",
+        files_key=None,
+        files_version=0,
+        work_queue=False,
+        lease_owner="owner",
     )
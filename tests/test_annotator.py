@@ -2,11 +2,16 @@
 
 from __future__ import annotations
 
+import functools
+import json
 import sys
+import zipfile
 from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+import numpy as np
 import pytest
+from PIL import Image
 
 # ---------------------------------------------------------------------------
 # Patch streamlit and utils module-level side-effects before importing
@@ -15,6 +20,8 @@ import pytest
 _mock_st = MagicMock()
 _mock_conf = MagicMock()
 _mock_conf.filter_files = "png, jpg"
+# Let @st.fragment return the undecorated method
+_mock_st.fragment.side_effect = lambda func, **kwargs: func
 
 sys.modules.setdefault("streamlit", _mock_st)
 
@@ -57,6 +64,31 @@ def _make_annotator_with_state(**state_kwargs):
         show_prompt=False,
         move=False,
         keyword_and_or=False,
+        manifest_filter="",
+        size_filter="",
+        sort_key="name",
+        files_key=None,
+        files_version=0,
+        work_queue=False,
+        lease_owner="owner",
+        suggest=False,
+        suggestions={},
+        suggestion_job=None,
+        suggest_threshold=0.9,
+        name_order=True,
+        duplicates="show",
+        cluster_order=False,
+        clusters={},
+        bulk_query="",
+        bulk_matches=[],
+        bulk_written=None,
+        resume_pending=False,
+        resume_file=None,
+        session_id="session",
+        snapshot_state=None,
+        snapshot_files=None,
+        snapshot_key=None,
+        snapshot_time=0.0,
     )
     defaults.update(state_kwargs)
     a = Annotator()
@@ -218,6 +250,92 @@ def test_get_keyword_file_dict_builds_mapping(tmp_path):
     assert a.keyword_dict["dog"] == ["dog running.png"]
 
 
+def test_keyword_move_dry_run_only_reports_counts(tmp_path):
+    """A dry run shows the files per folder without moving anything."""
+    for name in ["cat sitting.png", "dog running.png", "cat dog.png"]:
+        (tmp_path / name).write_text("")
+    a = _make_annotator_with_state(
+        img_dir=str(tmp_path), split_keywords=["cat", "dog"], _keywords="cat, dog"
+    )
+    with patch.object(ann_mod.st, "info") as info:
+        a.keyword_move_files(dry_run=True)
+    assert [call.args[0] for call in info.call_args_list] == [
+        "would move 2 images to cat...",
+        "would move 1 images to dog...",
+    ]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "cat dog.png",
+        "cat sitting.png",
+        "dog running.png",
+    ]
+    assert a.state.split_keywords == ["cat", "dog"]
+
+
+def test_move_files_from_json_labels(tmp_path):
+    """Labeled files are moved to a folder per label and leave the json file."""
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    for name in ["a.png", "b.png", "c.png"]:
+        (img_dir / name).write_text("")
+    json_path = str(tmp_path / "annotations.json")
+    labels = {"a.png": "keep", "b.png": "delete", "gone.png": "keep"}
+    ann_mod.save_json({"directory": str(img_dir), "files": labels}, json_path)
+    a = _make_annotator_with_state(
+        img_dir=str(img_dir), json_path=json_path, annotations={"a.png": "keep"}
+    )
+    a.make_folders_move_files()
+    assert (img_dir / "keep" / "a.png").exists()
+    assert (img_dir / "delete" / "b.png").exists()
+    assert (img_dir / "c.png").exists()
+    assert a.state.annotations == {}
+    # Labels of files that were not there stay in the json file
+    assert ann_mod.load_json(json_path)["files"] == {"gone.png": "keep"}
+
+
+def test_move_files_ignores_labels_of_another_directory(tmp_path):
+    """Labels made in one folder never move same-named files of another."""
+    dir_a, dir_b = tmp_path / "a", tmp_path / "b"
+    for directory in (dir_a, dir_b):
+        directory.mkdir()
+        for name in ["00001.png", "00002.png"]:
+            (directory / name).write_text("")
+    json_path = str(tmp_path / "annotations.json")
+    a = _make_annotator_with_state(
+        img_dir=str(dir_a), json_path=json_path, current_file="00001.png"
+    )
+    a.annotate("delete", {"directory": str(dir_a)}, json_path)
+    a.state._img_dir = str(dir_b)
+    a.info_placeholder = MagicMock()
+    a.change_dir()
+    ann_mod.get_job(str(dir_b)).join(10)
+    a.reset_imgs()
+    with patch.object(ann_mod.st, "warning") as warning:
+        a.make_folders_move_files()
+    warning.assert_called_once()
+    assert not (dir_b / "delete").exists()
+    a.state.current_file = "00002.png"
+    a.annotate("keep", {"directory": str(dir_b)}, json_path)
+    assert ann_mod.load_json(json_path)["files"] == {"00002.png": "keep"}
+    a.make_folders_move_files()
+    assert sorted(path.name for path in dir_b.iterdir()) == ["00001.png", "keep"]
+    assert (dir_b / "keep" / "00002.png").exists()
+    assert sorted(path.name for path in dir_a.iterdir()) == ["00001.png", "00002.png"]
+
+
+def test_load_annotations_warns_about_labels_missing_from_a_manifest(tmp_path):
+    manifest = tmp_path / "images.csv"
+    manifest.write_text("file\nx.png\n", encoding="utf-8")
+    json_path = str(tmp_path / "annotations.json")
+    labels = {"x.png": "keep", "gone.png": "delete"}
+    ann_mod.save_json({"directory": str(manifest), "files": labels}, json_path)
+    a = _make_annotator_with_state(img_dir=str(manifest), json_path=json_path)
+    registry = ann_mod.get_registry(str(manifest))
+    with patch.object(ann_mod.st, "warning") as warning:
+        annotations = a.load_annotations(registry)
+    assert dict(annotations) == {"x.png": "keep"}
+    assert warning.call_args.args[0].startswith("1 labeled files")
+
+
 # ---------------------------------------------------------------------------
 # change_dir
 # ---------------------------------------------------------------------------
@@ -261,6 +379,272 @@ def test_annotate_sets_label_and_advances(tmp_path):
     assert (tmp_path / "annotations.json").exists()
 
 
+def test_annotate_keeps_labels_from_other_sessions(tmp_path):
+    """Only the new label is merged, so another session's labels survive."""
+    json_path = str(tmp_path / "annotations.json")
+    ann_mod.save_json(
+        {"directory": str(tmp_path), "files": {"z.png": "delete"}}, json_path
+    )
+    a = _make_annotator_with_state(current_file="a.png", annotations={})
+    a.annotate("keep", {"directory": str(tmp_path)}, json_path)
+    assert ann_mod.load_json(json_path)["files"] == {
+        "z.png": "delete",
+        "a.png": "keep",
+    }
+
+
+def test_move_files_from_archive_writes_label_manifests(tmp_path):
+    """Archive images are listed in per-label manifests, not extracted."""
+    archive_path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(archive_path, "w") as bundle:
+        for name in ("a.png", "b.png", "c.png"):
+            bundle.writestr(name, b"")
+    json_path = str(tmp_path / "annotations.json")
+    labels = {"a.png": "keep", "b.png": "delete", "c.png": "keep", "x.png": "keep"}
+    ann_mod.save_json({"directory": str(archive_path), "files": labels}, json_path)
+    a = _make_annotator_with_state(img_dir=str(archive_path), json_path=json_path)
+    a.make_folders_move_files()
+    with open(tmp_path / "batch_keep.jsonl", encoding="utf-8") as infile:
+        rows = [json.loads(line) for line in infile]
+    assert [row["file"] for row in rows] == ["batch.zip/a.png", "batch.zip/c.png"]
+    assert (tmp_path / "batch_delete.jsonl").exists()
+    assert not (tmp_path / "keep").exists()
+    # Labels are kept so the sorted images stay out of the queue
+    assert ann_mod.load_json(json_path)["files"] == labels
+
+
+def test_lease_files_gives_sessions_disjoint_batches(tmp_path):
+    """Two sessions in work queue mode never get the same file."""
+    for idx in range(6):
+        (tmp_path / f"{idx}.png").write_bytes(b"")
+    json_path = str(tmp_path / "annotations.json")
+    ann_mod.save_json(
+        {"directory": str(tmp_path), "files": {"0.png": "keep"}}, json_path
+    )
+    sessions = [
+        _make_annotator_with_state(
+            img_dir=str(tmp_path),
+            json_path=json_path,
+            annotations={},
+            work_queue=True,
+            lease_owner=owner,
+        )
+        for owner in ("a", "b")
+    ]
+    small_batches = functools.partial(ann_mod.LeaseQueue, batch_size=2)
+    with patch.object(ann_mod, "LeaseQueue", small_batches):
+        for session in sessions:
+            session.lease_files()
+    assert list(sessions[0].state.files) == ["1.png", "2.png"]
+    assert list(sessions[1].state.files) == ["3.png", "4.png"]
+
+
+# ---------------------------------------------------------------------------
+# label suggestions
+# ---------------------------------------------------------------------------
+
+
+def _suggestions(registry, items):
+    """Build suggestions with the annotator's copy of the suggest module."""
+    suggestions_cls = ann_mod.SuggestionJob.run.__globals__["Suggestions"]
+    labels = sorted({label for label, _ in items.values()})
+    return suggestions_cls(
+        registry,
+        np.array([registry.id_of(name) for name in items], np.uint32),
+        labels,
+        np.array([labels.index(label) for label, _ in items.values()]),
+        np.array([confidence for _, confidence in items.values()]),
+    )
+
+
+def _suggesting_annotator(tmp_path, **state_kwargs):
+    state_kwargs.setdefault("current_file", "a.png")
+    for name in ["a.png", "b.png", "c.png", "d.png"]:
+        (tmp_path / name).write_bytes(b"")
+    registry = ann_mod.get_registry(str(tmp_path))
+    registry.refresh()
+    return _make_annotator_with_state(
+        img_dir=str(tmp_path),
+        json_path=str(tmp_path / "annotations.json"),
+        files=registry.view(),
+        suggest=True,
+        suggestions=_suggestions(
+            registry,
+            {
+                "b.png": ("keep", 0.6),
+                "c.png": ("delete", 0.95),
+                "d.png": ("keep", 0.99),
+            },
+        ),
+        **state_kwargs,
+    )
+
+
+def test_sort_by_confidence_orders_remaining_files(tmp_path):
+    a = _suggesting_annotator(tmp_path)
+    a.sort_by_confidence()
+    assert list(a.state.files) == ["d.png", "c.png", "b.png", "a.png"]
+    assert a.state.current_file == "d.png"
+    assert not a.state.name_order
+
+
+def test_confirm_suggestions_writes_once_and_skips_confirmed(tmp_path):
+    a = _suggesting_annotator(tmp_path, counter=1, annotations={"a.png": "keep"})
+    with patch.object(ann_mod, "update_json", wraps=ann_mod.update_json) as write:
+        a.confirm_suggestions()
+    write.assert_called_once()
+    assert ann_mod.load_json(a.state.json_path)["files"] == {
+        "c.png": "delete",
+        "d.png": "keep",
+    }
+    assert list(a.state.files) == ["a.png", "c.png", "d.png", "b.png"]
+    assert a.state.counter == 3
+    assert a.state.current_file == "b.png"
+    assert a.state.annotations["d.png"] == "keep"
+
+
+def test_update_suggestions_runs_in_the_background(tmp_path):
+    colors = {"r": (220, 20, 20), "b": (20, 20, 220)}
+    annotations = {}
+    for idx in range(6):
+        for key, color in colors.items():
+            Image.new("RGB", (16, 16), color).save(tmp_path / f"{key}{idx}.png")
+            if idx < 5:
+                annotations[f"{key}{idx}.png"] = "red" if key == "r" else "blue"
+    registry = ann_mod.get_registry(str(tmp_path))
+    registry.refresh()
+    a = _make_annotator_with_state(
+        img_dir=str(tmp_path), files=registry.view(), annotations=annotations
+    )
+    with patch.dict(
+        ann_mod.SuggestionJob.run.__globals__["iter_directory_features"].__globals__,
+        FEATURE_CACHE_DIR=tmp_path / "features",
+    ):
+        a.update_suggestions()
+        job = a.state.suggestion_job
+        job.join()
+    assert (job.done, job.total) == (2, 2)
+    assert a.collect_suggestions() is False
+    assert a.state.suggestion_job is None
+    suggestions = a.state.suggestions
+    assert sorted(suggestions) == ["b5.png", "r5.png"]
+    assert suggestions["b5.png"][0] == "blue"
+    assert suggestions["r5.png"][0] == "red"
+    assert suggestions["r5.png"][1] > 0.5
+
+
+def test_image_pane_highlights_suggested_label(tmp_image):
+    a = _make_annotator_with_state(
+        img_dir=str(tmp_image.parent),
+        json_path=str(tmp_image.parent / "annotations.json"),
+        files=[tmp_image.name],
+        current_file=tmp_image.name,
+        split_categories=["keep", "delete"],
+        suggest=True,
+        suggestions={tmp_image.name: ("delete", 0.8)},
+    )
+    a.image_placeholder = MagicMock()
+    a.img_height_clamp = 50
+
+    def _empty():
+        placeholder = MagicMock()
+        placeholder.columns.side_effect = lambda n: [MagicMock() for _ in range(n)]
+        return placeholder
+
+    with patch.object(ann_mod.st, "empty", side_effect=_empty):
+        a.image_pane()
+    a.info_placeholder.info.assert_called_with(
+        "Annotated: 0, Remaining: 1, Suggested: delete (80%)"
+    )
+    assert a.button_cols[0].button.call_args.kwargs["type"] == "secondary"
+    assert a.button_cols[1].button.call_args.kwargs["type"] == "primary"
+
+
+def test_cluster_files_orders_remaining_files_by_cluster(tmp_path):
+    colors = {"a.png": "red", "b.png": "blue", "c.png": "red", "d.png": "blue"}
+    for name, color in colors.items():
+        Image.new("RGB", (16, 16), color).save(tmp_path / name)
+    registry = ann_mod.get_registry(str(tmp_path))
+    registry.refresh()
+    a = _make_annotator_with_state(
+        img_dir=str(tmp_path), files=registry.view(), counter=1
+    )
+    # Patched through the functions' globals, since the app tests import
+    # their own copies of the modules
+    with (
+        patch.dict(
+            ann_mod.directory_features.__globals__,
+            FEATURE_CACHE_DIR=tmp_path / "features",
+        ),
+        patch.dict(ann_mod.cluster_order.__globals__, TARGET_CLUSTER_SIZE=2),
+        patch.object(ann_mod, "cluster_order", wraps=ann_mod.cluster_order) as order,
+    ):
+        a.cluster_files()
+    assert len(order.call_args.args[0]) == 3
+    files = list(a.state.files)
+    assert files[0] == "a.png"
+    # "b.png" and "d.png" are in one cluster, so they are next to each other
+    assert abs(files.index("b.png") - files.index("d.png")) == 1
+    assert a.state.clusters["b.png"] == a.state.clusters["d.png"]
+    assert a.state.clusters["b.png"] != a.state.clusters["c.png"]
+    assert not a.state.name_order
+
+
+def test_label_rest_of_cluster_writes_once(tmp_path):
+    a = _suggesting_annotator(
+        tmp_path,
+        counter=1,
+        current_file="b.png",
+        cluster_order=True,
+        clusters={"a.png": 0, "b.png": 1, "c.png": 0, "d.png": 1},
+        _cluster_label="fix",
+    )
+    assert a.get_cluster_rest() == ["b.png", "d.png"]
+    with patch.object(ann_mod, "update_json", wraps=ann_mod.update_json) as write:
+        a.label_rest_of_cluster()
+    write.assert_called_once()
+    assert ann_mod.load_json(a.state.json_path)["files"] == {
+        "b.png": "fix",
+        "d.png": "fix",
+    }
+    assert list(a.state.files) == ["a.png", "b.png", "d.png", "c.png"]
+    assert a.state.current_file == "c.png"
+
+
+def test_bulk_annotate_labels_matches_with_one_write(tmp_path):
+    a = _suggesting_annotator(
+        tmp_path,
+        counter=1,
+        annotations={"a.png": "keep"},
+        bulk_matches=["c.png", "d.png"],
+        _bulk_label="delete",
+    )
+    with patch.object(ann_mod, "update_json", wraps=ann_mod.update_json) as write:
+        a.bulk_annotate()
+    write.assert_called_once()
+    assert a.state.bulk_written == (2, "delete")
+    assert ann_mod.load_json(a.state.json_path)["files"] == {
+        "c.png": "delete",
+        "d.png": "delete",
+    }
+    assert a.state.counter == 3
+    assert a.state.bulk_matches == []
+
+
+def test_change_bulk_query_searches_remaining_unannotated_files(tmp_path):
+    a = _suggesting_annotator(
+        tmp_path, counter=1, annotations={"c.png": "keep"}, _bulk_query="x"
+    )
+    with patch.object(ann_mod, "find_matches", return_value=["b.png"]) as find:
+        a.change_bulk_query()
+    assert find.call_args.args[1] == ["b.png", "d.png"]
+    assert a.state.bulk_matches == ["b.png"]
+    a.state._bulk_query = "seed=="
+    with patch.object(ann_mod, "find_matches", side_effect=ValueError("bad")):
+        a.change_bulk_query()
+    assert a.state.bulk_matches == []
+
+
 # ---------------------------------------------------------------------------
 # get_imgs — keyword filtering
 # ---------------------------------------------------------------------------
@@ -306,3 +690,330 @@ def test_get_imgs_and_mode_requires_all_keywords(tmp_path):
     assert "big cat.png" in result
     assert "small cat.png" not in result
     assert "big dog.png" not in result
+
+
+# ---------------------------------------------------------------------------
+# image_pane (fragment)
+# ---------------------------------------------------------------------------
+
+
+def test_image_pane_everything_annotated_clears_image():
+    """When the counter is past the end, the image is cleared and info shown."""
+    a = _make_annotator_with_state(counter=3, files=["a.png", "b.png", "c.png"])
+    a.image_placeholder = MagicMock()
+    with patch.object(ann_mod.st, "empty", side_effect=lambda: MagicMock()):
+        a.image_pane()
+    a.image_placeholder.empty.assert_called_once()
+    a.options_buttons_placeholder.info.assert_called_once_with(
+        "Everything is annotated."
+    )
+
+
+def test_image_pane_renders_category_buttons(tmp_image):
+    """Each category button should be wired to annotate with its label."""
+    a = _make_annotator_with_state(
+        img_dir=str(tmp_image.parent),
+        json_path=str(tmp_image.parent / "annotations.json"),
+        files=[tmp_image.name],
+        current_file=tmp_image.name,
+        split_categories=["keep", "delete"],
+    )
+    a.image_placeholder = MagicMock()
+    a.img_height_clamp = 50
+
+    def _empty():
+        placeholder = MagicMock()
+        placeholder.columns.side_effect = lambda n: [MagicMock() for _ in range(n)]
+        return placeholder
+
+    with patch.object(ann_mod.st, "empty", side_effect=_empty):
+        a.image_pane()
+    for idx, option in enumerate(["keep", "delete"]):
+        _, kwargs = a.button_cols[idx].button.call_args
+        assert kwargs["on_click"] == a.annotate
+        assert kwargs["args"][0] == option
+    a.image_placeholder.container.assert_called_once()
+
+
+def test_get_imgs_and_mode_no_match_on_first_keyword(tmp_path):
+    """In AND mode, a keyword nothing matches should leave nothing to annotate."""
+    for name in ["big cat.png", "small dog.png"]:
+        (tmp_path / name).write_text("")
+    a = _make_annotator_with_state(
+        img_dir=str(tmp_path),
+        split_keywords=["bird", "cat"],
+        keyword_and_or=True,
+        sep=" ",
+    )
+    assert list(a.get_imgs()) == []
+
+
+def test_get_imgs_manifest_filter(tmp_path):
+    """A manifest can replace the directory and its columns filter the files."""
+    path = tmp_path / "images.csv"
+    path.write_text("file,seed\nb.png,1\na.png,2\nc.png,1\n")
+    a = _make_annotator_with_state(img_dir=str(path), manifest_filter="seed=1")
+    assert list(a.get_imgs()) == ["b.png", "c.png"]
+
+
+def test_get_imgs_size_filter_and_sort(tmp_path):
+    """Header conditions filter the files and a sort key orders them."""
+    for name, size in (("a.png", (64, 64)), ("b.png", (256, 128)), ("c.png", (96, 32))):
+        Image.new("RGB", size).save(tmp_path / name)
+    a = _make_annotator_with_state(img_dir=str(tmp_path), size_filter="aspect>1")
+    assert list(a.get_imgs()) == ["b.png", "c.png"]
+    a.state.sort_key = "aspect ratio"
+    assert list(a.get_imgs()) == ["c.png", "b.png"]
+    a.reset_order()
+    assert a.state.name_order is False
+
+
+def test_change_size_filter_rejects_unknown_columns():
+    a = _make_annotator_with_state(size_filter="width>1", _size_filter="seed=1")
+    a.change_size_filter()
+    assert a.state.size_filter == "width>1"
+    a.state._size_filter = "height<=512"
+    a.change_size_filter()
+    assert a.state.size_filter == "height<=512"
+
+
+def test_show_placeholder_renders_scaled_jpeg_draft(tmp_path):
+    """A JPEG gets a low-res placeholder drawn at the full image's width."""
+    path = tmp_path / "photo.jpg"
+    Image.new("RGB", (800, 1600)).save(path)
+    a = _make_annotator_with_state(img_dir=str(tmp_path), current_file="photo.jpg")
+    a.img_height_clamp = 400
+    a.image_placeholder = MagicMock()
+    a.file_path = str(path)
+    with patch.object(ann_mod.st, "image") as mock_image:
+        a.show_placeholder()
+    a.image_placeholder.container.assert_called_once()
+    (placeholder,) = mock_image.call_args.args
+    assert placeholder.size == (100, 200)
+    assert mock_image.call_args.kwargs["width"] == 200
+
+
+def test_show_placeholder_skips_unseen_png(tmp_image):
+    """There is no fast placeholder for a PNG that was never decoded."""
+    a = _make_annotator_with_state(img_dir=str(tmp_image.parent))
+    a.image_placeholder = MagicMock()
+    a.file_path = str(tmp_image)
+    a.show_placeholder()
+    a.image_placeholder.container.assert_not_called()
+
+
+def test_zoom_view_returns_viewport_region(tmp_path):
+    """Unclamped images are shown a viewport at a time from the tile pyramid."""
+    path = tmp_path / "big.png"
+    Image.new("RGB", (3000, 2000)).save(path)
+    a = _make_annotator_with_state(img_dir=str(tmp_path), clamp_state=False)
+    a.img_height_clamp = 896
+    a.file_path = str(path)
+    with (
+        patch.object(ann_mod.st, "select_slider", return_value=0),
+        patch.object(ann_mod.st, "slider", return_value=0.5),
+        patch.object(ann_mod, "get_pyramid") as mock_get_pyramid,
+    ):
+        mock_get_pyramid.return_value.viewport.return_value = "view"
+        assert a.zoom_view() == "view"
+    mock_get_pyramid.return_value.viewport.assert_called_once_with(
+        0, (0.5, 0.5), (ann_mod.VIEWPORT_WIDTH, 896)
+    )
+
+
+def test_show_clamped_preview_skips_placeholder_once_cached(tmp_image):
+    """The placeholder is only drawn while the preview still has to be decoded."""
+    a = _make_annotator_with_state(img_dir=str(tmp_image.parent))
+    a.img_height_clamp = 896
+    a.image_placeholder = MagicMock()
+    a.file_path = str(tmp_image)
+    ann_mod.encode_preview.__globals__["_encodings"].clear()
+    with (
+        patch.object(a, "show_placeholder") as mock_placeholder,
+        patch.object(ann_mod.st, "image") as mock_image,
+    ):
+        a.show_clamped_preview()
+        mock_placeholder.assert_called_once()
+        a.show_clamped_preview()
+        mock_placeholder.assert_called_once()
+    first, second = mock_image.call_args_list
+    assert first.args[0] == second.args[0]
+
+
+def test_show_static_preview_skips_decode_once_published(tmp_image):
+    """Published previews are shown by URL without decoding the image again."""
+    a = _make_annotator_with_state(img_dir=str(tmp_image.parent))
+    a.img_height_clamp = 896
+    a.image_placeholder = MagicMock()
+    a.file_path = str(tmp_image)
+    with (
+        patch.object(ann_mod, "published_preview_url", return_value="previews/a.png"),
+        patch.object(ann_mod, "preview_file", return_value=tmp_image),
+        patch.object(ann_mod, "publish_preview") as mock_publish,
+        patch.object(ann_mod.st, "get_option", return_value=""),
+        patch.object(ann_mod.st, "markdown") as mock_markdown,
+    ):
+        a.show_static_preview()
+    mock_publish.assert_not_called()
+    assert mock_markdown.call_args.args[0] == ('<img src="/app/static/previews/a.png">')
+
+
+# ---------------------------------------------------------------------------
+# session snapshots
+# ---------------------------------------------------------------------------
+
+
+def _snapshot_dir(tmp_path):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    for name in ["a.png", "b.png", "c.png", "d.png"]:
+        (img_dir / name).write_text("")
+    return str(img_dir)
+
+
+def test_restore_session_resumes_after_labeled_files(tmp_path):
+    """A restarted session gets its files back without relisting and resumes
+    at the first unlabeled file from where it left off."""
+    img_dir = _snapshot_dir(tmp_path)
+    json_path = str(tmp_path / "annotations.json")
+    a = _make_annotator_with_state(img_dir=img_dir, json_path=json_path, files=[])
+    a.sync_files()
+    a.state.counter = 1
+    a.set_current_file()
+    a.save_session()
+    ann_mod.save_json(
+        {"directory": img_dir, "files": {"b.png": "keep", "c.png": "delete"}},
+        json_path,
+    )
+    registry_mod = sys.modules["registry"]
+    # A new page without a snapshot of its own resumes the latest one
+    b = _make_annotator_with_state(
+        img_dir="/elsewhere", json_path=json_path, files=[], session_id="new"
+    )
+    with (
+        patch.dict(registry_mod._registries, clear=True),
+        patch.object(registry_mod, "get_filtered_files") as listing,
+        patch.object(registry_mod, "iter_filtered_files") as batches,
+        patch.object(ann_mod, "get_job", return_value=None),
+    ):
+        b.restore_session()
+        assert b.state.img_dir == img_dir
+        assert b.state.resume_pending
+        files = b.state.files
+        b.sync_files()
+        b.finish_resume()
+    listing.assert_not_called()
+    batches.assert_not_called()
+    assert b.state.files is files
+    assert list(files) == ["a.png", "b.png", "c.png", "d.png"]
+    assert b.state.counter == 3
+    assert dict(b.state.annotations) == {"b.png": "keep", "c.png": "delete"}
+    assert not b.state.resume_pending
+
+
+def test_save_session_throttles_file_list_writes(tmp_path):
+    """The file list is saved at once when it was rebuilt, but not on every
+    incremental change."""
+    img_dir = _snapshot_dir(tmp_path)
+    a = _make_annotator_with_state(
+        img_dir=img_dir, json_path=str(tmp_path / "annotations.json"), files=[]
+    )
+    a.sync_files()
+    with (
+        patch.object(ann_mod, "save_files") as save_files,
+        patch.object(ann_mod, "save_state") as save_state,
+    ):
+        a.save_session()
+        a.state.files = a.state.files[1:]
+        a.save_session()
+        assert save_files.call_count == 1
+        # Reruns that change nothing do not write the state again
+        assert save_state.call_count == 1
+        a.state.sort_key = "modified"
+        a.state.files_key = a.get_files_key()
+        a.save_session()
+        assert save_files.call_count == 2
+        a.state.split_keywords.append("cat")
+        a.save_session()
+    assert save_state.call_count == 3
+    assert save_state.call_args.args[2] == "session"
+
+
+def test_restore_session_skipped_in_work_queue(tmp_path):
+    json_path = str(tmp_path / "annotations.json")
+    a = _make_annotator_with_state(work_queue=True, json_path=json_path)
+    with patch.object(ann_mod, "load_snapshot") as load:
+        a.restore_session()
+        a.save_session()
+    load.assert_not_called()
+    assert not list(tmp_path.glob("annotations.session*"))
+
+
+def test_resume_skips_only_labels_of_the_restored_directory(tmp_path):
+    """Labels the json file holds for another directory are not loaded, so
+    the resumed session does not skip files by their names."""
+    img_dir = _snapshot_dir(tmp_path)
+    json_path = str(tmp_path / "annotations.json")
+    ann_mod.save_json(
+        {"directory": str(tmp_path / "other"), "files": {"a.png": "keep"}},
+        json_path,
+    )
+    a = _make_annotator_with_state(img_dir=img_dir, json_path=json_path, files=[])
+    a.sync_files()
+    a.state.resume_pending = True
+    a.state.resume_file = "a.png"
+    with patch.object(ann_mod, "get_job", return_value=None):
+        a.finish_resume()
+    assert len(a.state.annotations) == 0
+    assert a.state.counter == 0
+
+
+# ---------------------------------------------------------------------------
+# duplicates
+# ---------------------------------------------------------------------------
+
+
+def _duplicates_annotator(tmp_path, **state_kwargs):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    for name, data in [("a.png", b"one"), ("b.png", b"two"), ("c.png", b"one")]:
+        (img_dir / name).write_bytes(data)
+    a = _make_annotator_with_state(
+        img_dir=str(img_dir),
+        json_path=str(tmp_path / "annotations.json"),
+        annotations={},
+        **state_kwargs,
+    )
+    a.state.files = a.get_imgs()
+    a.state.current_file = a.state.files[0]
+    return a
+
+
+def test_annotate_labels_duplicates_like_their_twin(tmp_path):
+    """Labeling an image labels its copies, which are then skipped."""
+    a = _duplicates_annotator(tmp_path, duplicates="label")
+    a.annotate("keep", {"directory": a.state.img_dir}, a.state.json_path)
+    assert a.state.annotations == {"a.png": "keep", "c.png": "keep"}
+    assert a.state.current_file == "b.png"
+    assert list(a.state.files) == ["a.png", "c.png", "b.png"]
+    assert ann_mod.load_json(a.state.json_path)["files"] == {
+        "a.png": "keep",
+        "c.png": "keep",
+    }
+
+
+def test_change_duplicates_labels_existing_twins(tmp_path):
+    """Turning labeling on copies the label of the first-annotated twin."""
+    a = _duplicates_annotator(tmp_path)
+    a.state.annotations = {"c.png": "delete", "a.png": "keep"}
+    ann_mod.save_json({"files": {"c.png": "delete"}}, a.state.json_path)
+    a.state._duplicates = "label"
+    a.state.annotations.pop("a.png")
+    with patch.object(ann_mod.st, "info"):
+        a.change_duplicates()
+    assert a.state.annotations["a.png"] == "delete"
+
+
+def test_get_imgs_hides_duplicates(tmp_path):
+    a = _duplicates_annotator(tmp_path, duplicates="hide")
+    assert list(a.state.files) == ["a.png", "b.png"]
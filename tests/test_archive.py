@@ -0,0 +1,138 @@
+"""Tests for src/archive.py"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+import archive
+
+
+def _png_bytes(color, size=(24, 16), prompt=None):
+    info = None
+    if prompt is not None:
+        info = PngImagePlugin.PngInfo()
+        info.add_text("parameters", f"{prompt}\nSteps: 20, Seed: 7")
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG", pnginfo=info)
+    return buffer.getvalue()
+
+
+@pytest.fixture()
+def zip_path(tmp_path):
+    path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(path, "w") as bundle:
+        bundle.writestr("a.png", _png_bytes("red", prompt="a red cat"))
+        bundle.writestr(
+            "sub/b.png", _png_bytes("blue"), compress_type=zipfile.ZIP_DEFLATED
+        )
+        bundle.writestr("notes.txt", "not an image")
+        bundle.writestr("sub/", "")
+    return path
+
+
+@pytest.fixture()
+def tar_path(tmp_path):
+    path = tmp_path / "batch.tar"
+    with tarfile.open(path, "w") as bundle:
+        for name, data in (("./a.png", _png_bytes("green")), ("c.png", b"junk")):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            bundle.addfile(info, io.BytesIO(data))
+    return path
+
+
+def test_is_archive(zip_path, tar_path, tmp_path):
+    assert archive.is_archive(zip_path)
+    assert archive.is_archive(str(tar_path))
+    assert not archive.is_archive(tmp_path)
+    assert not archive.is_archive(tmp_path / "missing.zip")
+
+
+def test_split_archive_path(zip_path, tmp_path):
+    member = os.path.join(str(zip_path), "sub/b.png")
+    assert archive.split_archive_path(member) == (str(zip_path), "sub/b.png")
+    assert archive.split_archive_path(str(tmp_path / "a.png")) is None
+    assert archive.split_archive_path(str(tmp_path / "missing.zip" / "a.png")) is None
+
+
+def test_archive_files_lists_file_members(zip_path, tar_path):
+    assert archive.archive_files(str(zip_path)) == ["a.png", "sub/b.png", "notes.txt"]
+    # Leading "./" of tar member names is dropped
+    assert archive.archive_files(str(tar_path)) == ["a.png", "c.png"]
+
+
+def test_read_member_stored_is_a_view_of_the_map(zip_path):
+    data = archive.read_member(str(zip_path), "a.png")
+    assert isinstance(data, memoryview)
+    assert data.obj is archive.get_index(str(zip_path))._map
+    assert bytes(data) == zipfile.ZipFile(zip_path).read("a.png")
+
+
+def test_read_member_deflated_and_tar(zip_path, tar_path):
+    deflated = archive.read_member(str(zip_path), "sub/b.png")
+    assert bytes(deflated) == zipfile.ZipFile(zip_path).read("sub/b.png")
+    assert bytes(archive.read_member(str(tar_path), "c.png")) == b"junk"
+    with pytest.raises(FileNotFoundError):
+        archive.read_member(str(zip_path), "missing.png")
+
+
+def test_open_image_from_members(zip_path, tar_path):
+    with archive.open_image(os.path.join(str(zip_path), "sub/b.png")) as img:
+        assert img.size == (24, 16)
+        assert img.convert("RGB").getpixel((0, 0)) == (0, 0, 255)
+    with archive.open_image(os.path.join(str(tar_path), "a.png")) as img:
+        assert img.convert("RGB").getpixel((0, 0)) == (0, 128, 0)
+
+
+def test_open_file_reads_and_seeks(zip_path, tmp_path):
+    with archive.open_file(os.path.join(str(zip_path), "a.png")) as infile:
+        assert infile.read(8) == b"\x89PNG\r\n\x1a\n"
+        infile.seek(-4, os.SEEK_END)
+        assert infile.read() == b"\xaeB`\x82"
+        assert infile.read(10) == b""
+    plain = tmp_path / "plain.bin"
+    plain.write_bytes(b"data")
+    with archive.open_file(str(plain)) as infile:
+        assert infile.read() == b"data"
+
+
+def test_index_is_rebuilt_when_archive_changes(zip_path):
+    first = archive.get_index(str(zip_path))
+    assert archive.get_index(str(zip_path)) is first
+    with zipfile.ZipFile(zip_path, "a") as bundle:
+        bundle.writestr("new.png", _png_bytes("white"))
+    assert "new.png" in archive.archive_files(str(zip_path))
+
+
+def test_file_mtime_ns_of_member_is_the_archive_mtime(zip_path):
+    member = os.path.join(str(zip_path), "a.png")
+    assert archive.file_mtime_ns(member) == os.stat(zip_path).st_mtime_ns
+
+
+def test_invalid_archive_raises_oserror(tmp_path):
+    path = tmp_path / "broken.zip"
+    path.write_bytes(b"not a zip")
+    with pytest.raises(OSError, match="Cannot index"):
+        archive.archive_files(str(path))
+
+
+def test_write_label_manifests(zip_path):
+    written = archive.write_label_manifests(
+        str(zip_path), {"keep": ["a.png", "sub/b.png"], "delete": []}
+    )
+    assert list(written) == ["keep"]
+    assert written["keep"] == archive.label_manifest_path(str(zip_path), "keep")
+    assert written["keep"].endswith("batch_keep.jsonl")
+    with open(written["keep"], encoding="utf-8") as infile:
+        rows = [json.loads(line) for line in infile]
+    assert rows == [
+        {"file": "batch.zip/a.png", "label": "keep"},
+        {"file": "batch.zip/sub/b.png", "label": "keep"},
+    ]
@@ -0,0 +1,83 @@
+"""Tests for src/bulk.py"""
+
+from __future__ import annotations
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+_mock_conf = MagicMock()
+_mock_conf.filter_files = "png, jpg"
+
+with (
+    patch("os.path.isfile", return_value=True),
+    patch("omegaconf.OmegaConf.load", return_value=_mock_conf),
+):
+    import bulk
+
+
+def _save(tmp_path, name, sampler=None, prompt="a cat"):
+    info = PngImagePlugin.PngInfo()
+    if sampler is not None:
+        info.add_text("parameters", f"{prompt}\nSteps: 20, Sampler: {sampler}, Seed: 1")
+    Image.new("RGB", (4, 4)).save(tmp_path / name, pnginfo=info)
+
+
+def test_parse_query_splits_keywords_and_conditions():
+    keywords, conditions = bulk.parse_query(" cyberpunk, sampler=Euler a, ,seed>=3")
+    assert keywords == ["cyberpunk"]
+    assert conditions == "sampler=Euler a, seed>=3"
+    with pytest.raises(ValueError):
+        bulk.parse_query("=Euler")
+
+
+def test_find_matches_by_keyword_and_metadata(tmp_path):
+    _save(tmp_path, "red cat.png", "Euler a", "a blurry cat")
+    _save(tmp_path, "red dog.png", "DPM++ 2M", "a blurry dog")
+    _save(tmp_path, "blue cat.png", "Euler a", "a sharp cat")
+    _save(tmp_path, "red bird.png")
+    files = ["blue cat.png", "red bird.png", "red cat.png", "red dog.png"]
+    assert bulk.find_matches(str(tmp_path), files, "red") == [
+        "red bird.png",
+        "red cat.png",
+        "red dog.png",
+    ]
+    assert bulk.find_matches(str(tmp_path), files, "sampler=euler a") == [
+        "blue cat.png",
+        "red cat.png",
+    ]
+    assert bulk.find_matches(str(tmp_path), files, "red, prompt~blurry", workers=1) == [
+        "red cat.png",
+        "red dog.png",
+    ]
+    assert bulk.find_matches(str(tmp_path), files, "") == files
+
+
+def test_find_matches_only_reads_metadata_of_keyword_matches(tmp_path):
+    _save(tmp_path, "red cat.png", "Euler a")
+    _save(tmp_path, "blue cat.png", "Euler a")
+    with patch.object(
+        bulk, "get_metadata_dict", wraps=bulk.get_metadata_dict
+    ) as read_metadata:
+        matches = bulk.find_matches(
+            str(tmp_path), ["blue cat.png", "red cat.png"], "red, sampler=Euler a"
+        )
+    assert matches == ["red cat.png"]
+    read_metadata.assert_called_once()
+
+
+def test_find_matches_skips_unreadable_images(tmp_path):
+    (tmp_path / "bad.png").write_bytes(b"not an image")
+    assert bulk.find_matches(str(tmp_path), ["bad.png"], "sampler=x") == []
+
+
+def test_find_matches_uses_manifest_columns(tmp_path):
+    for name in ["a.png", "b.png"]:
+        Image.new("RGB", (4, 4)).save(tmp_path / name)
+    manifest = tmp_path / "images.csv"
+    manifest.write_text("file,seed\na.png,1\nb.png,2\n")
+    with patch.object(bulk, "get_metadata_dict") as read_metadata:
+        matches = bulk.find_matches(str(manifest), ["a.png", "b.png"], "seed=2")
+    assert matches == ["b.png"]
+    read_metadata.assert_not_called()
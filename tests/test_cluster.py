@@ -0,0 +1,63 @@
+"""Tests for src/cluster.py"""
+
+from __future__ import annotations
+
+import numpy as np
+
+import cluster
+
+
+def _blobs(sizes, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = np.eye(len(sizes), 4, dtype=np.float32) * 10
+    points = [
+        center + rng.normal(0, 0.1, (size, 4)).astype(np.float32)
+        for center, size in zip(centers, sizes)
+    ]
+    return np.concatenate(points), np.repeat(np.arange(len(sizes)), sizes)
+
+
+def test_kmeans_recovers_separated_blobs():
+    points, truth = _blobs([30, 20, 10])
+    labels, centers = cluster.kmeans(points, 3)
+    assert centers.shape == (3, 4)
+    # Same partition as the blobs, whatever the cluster numbering
+    for blob in range(3):
+        assert len(set(labels[truth == blob])) == 1
+    assert len(set(labels)) == 3
+
+
+def test_kmeans_is_deterministic_and_handles_small_inputs():
+    points, _ = _blobs([5, 5])
+    first, _ = cluster.kmeans(points, 2, seed=3)
+    second, _ = cluster.kmeans(points, 2, seed=3)
+    np.testing.assert_array_equal(first, second)
+    labels, centers = cluster.kmeans(points[:2], 5)
+    assert len(centers) == 2
+    labels, centers = cluster.kmeans(np.zeros((0, 4), np.float32), 3)
+    assert len(labels) == 0
+
+
+def test_kmeans_handles_duplicate_points():
+    labels, centers = cluster.kmeans(np.ones((6, 3), np.float32), 3)
+    assert len(labels) == 6
+    assert np.isfinite(centers).all()
+
+
+def test_cluster_order_groups_clusters_largest_first():
+    points, truth = _blobs([3, 8, 5])
+    order, labels = cluster.cluster_order(points, 3)
+    assert len(set(labels)) == 3
+    assert sorted(order) == list(range(16))
+    assert list(truth[order]) == [1] * 8 + [2] * 5 + [0] * 3
+    # Members of a cluster start with the one nearest the center
+    first = points[order[:8]]
+    center = first.mean(axis=0)
+    distances = np.linalg.norm(first - center, axis=1)
+    assert distances[0] == distances.min()
+
+
+def test_default_clusters():
+    assert cluster.default_clusters(0) == 1
+    assert cluster.default_clusters(120) == 3
+    assert cluster.default_clusters(10**6) == cluster.MAX_CLUSTERS
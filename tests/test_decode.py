@@ -0,0 +1,116 @@
+"""Tests for src/decode.py"""
+
+from __future__ import annotations
+
+import io
+import struct
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image
+
+_mock_conf = MagicMock()
+_mock_conf.filter_files = "png, jpg"
+
+with (
+    patch("os.path.isfile", return_value=True),
+    patch("omegaconf.OmegaConf.load", return_value=_mock_conf),
+):
+    import decode
+    import utils
+
+
+@pytest.fixture()
+def pool():
+    yield 1
+    decode.shutdown_pool()
+
+
+def _save(tmp_path, name, mode, size):
+    path = tmp_path / name
+    Image.new(mode, size, color=0).save(path)
+    return str(path)
+
+
+def test_load_preview_without_workers_uses_load_image(tmp_path):
+    path = _save(tmp_path, "a.png", "RGB", (40, 80))
+    with patch.object(decode, "get_pool") as mock_pool:
+        image = decode.load_preview(path, 40, True, workers=0)
+    mock_pool.assert_not_called()
+    assert image.size == (20, 40)
+
+
+def test_load_preview_in_pool_matches_load_image(tmp_path, pool):
+    path = tmp_path / "gradient.png"
+    Image.linear_gradient("L").convert("RGB").resize((64, 128)).save(path)
+    image = decode.load_preview(str(path), 32, True, workers=pool)
+    expected = utils.load_image(str(path), 32, True)
+    assert image.size == expected.size == (16, 32)
+    assert image.mode == "RGB"
+    assert image.tobytes() == expected.tobytes()
+
+
+def test_load_preview_converts_palette_images(tmp_path, pool):
+    path = _save(tmp_path, "p.png", "P", (10, 10))
+    image = decode.load_preview(path, 896, False, workers=pool)
+    assert image.mode == "RGB"
+    assert image.size == (10, 10)
+
+
+def test_prefetch_previews_are_reused(tmp_path, pool):
+    paths = [_save(tmp_path, f"{idx}.png", "RGBA", (8, 8)) for idx in range(3)]
+    decode.prefetch_previews(paths, 896, True, workers=pool)
+    assert len(decode._previews) == 3
+    with patch.object(decode, "_submit") as mock_submit:
+        images = [decode.load_preview(path, 896, True, workers=pool) for path in paths]
+    mock_submit.assert_not_called()
+    assert all(image.mode == "RGBA" for image in images)
+
+
+def test_load_preview_raises_for_missing_file(tmp_path, pool):
+    with pytest.raises(OSError):
+        decode.load_preview(str(tmp_path / "missing.png"), 896, True, workers=pool)
+
+
+def _exif_with_thumbnail(thumbnail_bytes):
+    """Build EXIF data with an empty IFD0 and an IFD1 pointing at a thumbnail."""
+    ifd1_offset = 8 + 2 + 4
+    thumb_offset = ifd1_offset + 2 + 2 * 12 + 4
+    tiff = b"II*\x00" + struct.pack("<I", 8)
+    tiff += struct.pack("<HI", 0, ifd1_offset)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x0201, 4, 1, thumb_offset)
+    tiff += struct.pack("<HHII", 0x0202, 4, 1, len(thumbnail_bytes))
+    tiff += struct.pack("<I", 0)
+    return b"Exif\x00\x00" + tiff + thumbnail_bytes
+
+
+def test_load_placeholder_uses_exif_thumbnail(tmp_path):
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 12), color="red").save(buffer, format="JPEG")
+    path = tmp_path / "photo.jpg"
+    exif = _exif_with_thumbnail(buffer.getvalue())
+    Image.new("RGB", (640, 480)).save(path, exif=exif)
+    placeholder = decode.load_placeholder(str(path))
+    assert placeholder.size == (16, 12)
+
+
+def test_load_placeholder_drafts_jpegs_without_thumbnail(tmp_path):
+    path = tmp_path / "photo.jpg"
+    Image.new("RGB", (640, 480)).save(path)
+    placeholder = decode.load_placeholder(str(path))
+    assert placeholder.size == (80, 60)
+
+
+def test_load_placeholder_remembers_decoded_pngs(tmp_path):
+    path = _save(tmp_path, "big.png", "RGB", (512, 1024))
+    assert decode.load_placeholder(path) is None
+    decode.load_preview(path, 896, True)
+    placeholder = decode.load_placeholder(path)
+    assert placeholder.size == (64, decode.PLACEHOLDER_HEIGHT)
+
+
+def test_preview_size(tmp_path):
+    path = _save(tmp_path, "a.png", "RGB", (400, 200))
+    assert decode.preview_size(path, 100, True) == (200, 100)
+    assert decode.preview_size(path, 100, False) == (400, 200)
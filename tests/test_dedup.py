@@ -0,0 +1,122 @@
+"""Tests for src/dedup.py"""
+
+from __future__ import annotations
+
+import os
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+import dedup
+from registry import FileRegistry
+
+
+@pytest.fixture()
+def registry(tmp_path):
+    big = bytearray(3 * dedup.PARTIAL_BYTES)
+    (tmp_path / "a.png").write_bytes(b"same small")
+    (tmp_path / "b.png").write_bytes(b"same small")
+    (tmp_path / "c.png").write_bytes(b"diff small")
+    (tmp_path / "e1.png").write_bytes(big)
+    (tmp_path / "e2.png").write_bytes(big)
+    # Same size, start and end as e1.png but not the same file
+    big[len(big) // 2] = 1
+    (tmp_path / "f.png").write_bytes(big)
+    (tmp_path / "g.png").write_bytes(b"unique")
+    registry = FileRegistry(str(tmp_path))
+    registry.refresh()
+    return registry
+
+
+def _names(registry, groups):
+    return [[registry.name(file_id) for file_id in group] for group in groups]
+
+
+def test_groups_identical_files(registry):
+    groups = dedup.DuplicateIndex(registry).groups()
+    assert _names(registry, groups) == [["a.png", "b.png"], ["e1.png", "e2.png"]]
+
+
+def test_only_partial_collisions_are_hashed_in_full(registry):
+    index = dedup.DuplicateIndex(registry)
+    with patch.object(dedup, "_digest", wraps=dedup._digest) as digest:
+        index.refresh(workers=2)
+    hashed = sorted((call.args[1], call.args[2]) for call in digest.call_args_list)
+    # g.png has a unique size and is never read
+    assert hashed == [
+        ("a.png", False),
+        ("b.png", False),
+        ("c.png", False),
+        ("e1.png", False),
+        ("e1.png", True),
+        ("e2.png", False),
+        ("e2.png", True),
+        ("f.png", False),
+        ("f.png", True),
+    ]
+
+
+def test_new_files_are_the_only_ones_hashed_again(registry, tmp_path):
+    index = dedup.DuplicateIndex(registry)
+    index.refresh()
+    (tmp_path / "h.png").write_bytes(b"same small")
+    registry.refresh(force=True)
+    with patch.object(dedup, "_digest", wraps=dedup._digest) as digest:
+        groups = index.groups()
+    assert [call.args[1] for call in digest.call_args_list] == ["h.png"]
+    assert _names(registry, groups)[0] == ["a.png", "b.png", "h.png"]
+    assert [registry.name(i) for i in index.twins(registry.id_of("h.png"))] == [
+        "a.png",
+        "b.png",
+    ]
+    assert index.twins(registry.id_of("g.png")) == []
+
+
+def test_hard_links_are_read_once(tmp_path):
+    big = bytes(3 * dedup.PARTIAL_BYTES)
+    (tmp_path / "a.png").write_bytes(big)
+    for name in ("b.png", "c.png"):
+        os.link(tmp_path / "a.png", tmp_path / name)
+    (tmp_path / "d.png").write_bytes(big)
+    registry = FileRegistry(str(tmp_path))
+    registry.refresh()
+    index = dedup.DuplicateIndex(registry)
+    with patch.object(dedup, "_digest", wraps=dedup._digest) as digest:
+        groups = index.groups()
+    hashed = sorted((call.args[1], call.args[2]) for call in digest.call_args_list)
+    assert hashed == [
+        ("a.png", False),
+        ("a.png", True),
+        ("d.png", False),
+        ("d.png", True),
+    ]
+    assert _names(registry, groups) == [["a.png", "b.png", "c.png", "d.png"]]
+
+
+def test_drop_duplicates_keeps_the_first_copy_in_view_order(registry):
+    view = registry.view().reordered(0, lambda name: name != "b.png")
+    assert list(dedup.drop_duplicates(view)) == [
+        "b.png",
+        "c.png",
+        "e1.png",
+        "f.png",
+        "g.png",
+    ]
+
+
+def test_archive_members(tmp_path):
+    path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(path, "w") as bundle:
+        for name, data in (
+            ("a.png", b"x" * 10),
+            ("b.png", b"x" * 10),
+            ("c.png", b"y" * 10),
+        ):
+            bundle.writestr(name, data)
+    registry = FileRegistry(str(path))
+    registry.refresh()
+    groups = dedup.get_duplicate_index(registry).groups()
+    assert _names(registry, groups) == [["a.png", "b.png"]]
+    entries, nbytes = dedup.cache_usage()["content hashes"]
+    assert entries >= 3 and nbytes > 0
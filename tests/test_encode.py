@@ -0,0 +1,117 @@
+"""Tests for src/encode.py"""
+
+from __future__ import annotations
+
+import io
+import os
+import random
+from unittest.mock import MagicMock
+
+import pytest
+from PIL import Image
+
+import encode
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    encode._encodings.clear()
+    yield
+    encode._encodings.clear()
+
+
+def _noise(size=(256, 256)):
+    rng = random.Random(0)
+    return Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+
+
+def test_auto_picks_webp_or_jpeg_and_png():
+    assert encode.encode_image(_noise()).format == "WEBP"
+    assert encode.encode_image(_noise(), webp=False).format == "JPEG"
+    rgba = Image.new("RGBA", (8, 8))
+    assert encode.encode_image(rgba, webp=False).format == "PNG"
+    # WebP is only used where the client keeps it
+    assert encode.encode_image(_noise(), "webp", webp=False).format == "JPEG"
+
+
+def test_quality_drops_until_budget_fits():
+    image = _noise()
+    unbounded = encode.encode_image(image, "jpeg")
+    assert unbounded.quality == encode.QUALITY_TIERS[0]
+    budget = len(encode.encode_image(image, "jpeg", quality=70).data)
+    fitted = encode.encode_image(image, "jpeg", max_bytes=budget)
+    assert fitted.quality == 70
+    assert len(fitted.data) <= budget
+
+
+def test_lowest_tier_is_used_when_nothing_fits():
+    encoded = encode.encode_image(_noise(), "jpeg", max_bytes=1)
+    assert encoded.quality == encode.QUALITY_TIERS[-1]
+
+
+def test_explicit_quality_is_tried_first():
+    encoded = encode.encode_image(_noise(), "jpeg", quality=65)
+    assert encoded.quality == 65
+    assert Image.open(io.BytesIO(encoded.data)).format == "JPEG"
+
+
+def test_original_jpeg_passes_through(tmp_path):
+    path = tmp_path / "a.jpg"
+    _noise((20, 40)).save(path, quality=95)
+    load = MagicMock()
+    encoded = encode.encode_preview(str(path), 896, True, load)
+    load.assert_not_called()
+    assert encoded.passthrough
+    assert encoded.data == path.read_bytes()
+    assert encoded.format == "JPEG"
+
+
+def test_resized_or_png_previews_are_encoded(tmp_path):
+    path = tmp_path / "a.jpg"
+    _noise((20, 40)).save(path)
+    load = MagicMock(return_value=_noise((10, 20)))
+    encoded = encode.encode_preview(str(path), 20, True, load)
+    load.assert_called_once()
+    assert not encoded.passthrough
+    png = tmp_path / "a.png"
+    _noise((20, 40)).save(png)
+    encoded = encode.encode_preview(str(png), 896, True, lambda: _noise((20, 40)))
+    assert encoded.format == "WEBP"
+
+
+def test_webp_passes_through_only_when_allowed(tmp_path):
+    path = tmp_path / "a.webp"
+    _noise((20, 40)).save(path)
+    assert encode.encode_preview(str(path), 896, True, _noise).passthrough
+    encoded = encode.encode_preview(str(path), 896, True, _noise, webp=False)
+    assert not encoded.passthrough
+    assert encoded.format == "JPEG"
+
+
+def test_encodings_are_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / "a.png"
+    _noise((20, 40)).save(path)
+    load = MagicMock(return_value=_noise((10, 20)))
+    assert encode.cached_preview(str(path), 20, True) is None
+    first = encode.encode_preview(str(path), 20, True, load)
+    assert encode.encode_preview(str(path), 20, True, load) is first
+    assert encode.cached_preview(str(path), 20, True) is first
+    load.assert_called_once()
+    os.utime(path, ns=(0, 10**9))
+    assert encode.cached_preview(str(path), 20, True) is None
+    encode.encode_preview(str(path), 20, True, load)
+    assert load.call_count == 2
+
+
+def test_byte_budget_grows_with_height():
+    assert encode.byte_budget(896) == int(0.3 * 896 * 896)
+    assert encode.byte_budget(512) < encode.byte_budget(896)
+
+
+def test_payload_label_and_data_uri():
+    encoded = encode.EncodedPreview(b"x" * 2048, "WEBP", 80, False)
+    assert encode.payload_label(2048, "WEBP", 80) == "2.0 KB WEBP q80"
+    assert encode.payload_label(3 * 1024**2, "JPEG", passthrough=True) == (
+        "3.00 MB JPEG (original)"
+    )
+    assert encode.to_data_uri(encoded).startswith("data:image/webp;base64,eHh4")
@@ -0,0 +1,123 @@
+"""Tests for src/export.py"""
+
+from __future__ import annotations
+
+import csv
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+_mock_conf = MagicMock()
+_mock_conf.filter_files = "png, jpg"
+
+with (
+    patch("os.path.isfile", return_value=True),
+    patch("omegaconf.OmegaConf.load", return_value=_mock_conf),
+):
+    import export
+    import utils
+
+PARAMETERS = "a cat\nSteps: 20, Sampler: Euler a, Seed: 42"
+
+
+@pytest.fixture()
+def annotated_dir(tmp_path):
+    info = PngImagePlugin.PngInfo()
+    info.add_text("parameters", PARAMETERS)
+    Image.new("RGB", (40, 30)).save(tmp_path / "a.png", pnginfo=info)
+    Image.new("RGB", (20, 10)).save(tmp_path / "b.png")
+    json_path = tmp_path / "annotations.json"
+    utils.save_json(
+        {"directory": str(tmp_path), "files": {"a.png": "keep", "b.png": "delete"}},
+        json_path,
+    )
+    return tmp_path
+
+
+def test_iter_records_joins_dims_and_meta(annotated_dir):
+    records = list(
+        export.iter_records(annotated_dir / "annotations.json", dims=True, meta=True)
+    )
+    first, second = records
+    assert first["file"] == "a.png"
+    assert first["label"] == "keep"
+    assert (first["width"], first["height"], first["format"]) == (40, 30, "PNG")
+    assert first["prompt"] == "a cat"
+    assert first["seed"] == "42"
+    assert (second["width"], second["height"]) == (20, 10)
+
+
+def test_export_csv_has_fixed_meta_columns(annotated_dir):
+    out_path = annotated_dir / "labels.csv"
+    count = export.export(annotated_dir / "annotations.json", out_path, meta=True)
+    assert count == 2
+    with open(out_path, newline="", encoding="utf-8") as infile:
+        rows = list(csv.DictReader(infile))
+    assert set(export.META_COLUMNS) <= set(rows[0])
+    assert rows[0]["sampler"] == "Euler a"
+    assert rows[1]["label"] == "delete"
+    assert rows[1]["prompt"] == ""
+
+
+def test_export_jsonl(annotated_dir):
+    out_path = annotated_dir / "labels.jsonl"
+    export.export(annotated_dir / "annotations.json", out_path)
+    lines = out_path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["label"] for line in lines] == ["keep", "delete"]
+
+
+def test_export_coco(annotated_dir):
+    out_path = annotated_dir / "labels.json"
+    export.export(annotated_dir / "annotations.json", out_path, dims=True)
+    coco = json.loads(out_path.read_text(encoding="utf-8"))
+    assert coco["categories"] == [
+        {"id": 1, "name": "keep"},
+        {"id": 2, "name": "delete"},
+    ]
+    assert coco["images"][1]["file_name"] == "b.png"
+    assert coco["images"][1]["width"] == 20
+    assert coco["annotations"][1] == {"id": 2, "image_id": 2, "category_id": 2}
+
+
+def test_export_coco_empty(tmp_path):
+    json_path = tmp_path / "annotations.json"
+    utils.save_json({"directory": str(tmp_path), "files": {}}, json_path)
+    export.export(json_path, tmp_path / "labels.json")
+    coco = json.loads((tmp_path / "labels.json").read_text(encoding="utf-8"))
+    assert coco == {"images": [], "annotations": [], "categories": []}
+
+
+def test_manifest_columns_are_joined_without_opening_images(tmp_path):
+    manifest = tmp_path / "images.csv"
+    manifest.write_text(
+        "file,width,height,format,prompt\n"
+        "x.png,512,768,PNG,a dog\n"
+        "y.png,64,64,PNG,a cat\n",
+        encoding="utf-8",
+    )
+    json_path = tmp_path / "annotations.json"
+    utils.save_json({"directory": str(manifest), "files": {"y.png": "keep"}}, json_path)
+    with patch("PIL.Image.open") as mock_open:
+        (record,) = export.iter_records(json_path, dims=True, meta=True)
+    mock_open.assert_not_called()
+    assert record["width"] == "64"
+    assert record["prompt"] == "a cat"
+    assert record["label"] == "keep"
+
+
+def test_labels_missing_from_the_manifest_are_reported(tmp_path):
+    manifest = tmp_path / "images.csv"
+    manifest.write_text("file\nx.png\n", encoding="utf-8")
+    json_path = tmp_path / "annotations.json"
+    labels = {"x.png": "keep", "gone.png": "delete"}
+    utils.save_json({"directory": str(manifest), "files": labels}, json_path)
+    with pytest.warns(UserWarning, match="1 labeled files .*'gone.png'"):
+        records = list(export.iter_records(json_path))
+    assert [record["file"] for record in records] == ["x.png"]
+
+
+def test_export_unknown_format(annotated_dir):
+    with pytest.raises(ValueError, match="Unknown export format"):
+        export.export(annotated_dir / "annotations.json", annotated_dir / "x.txt")
@@ -0,0 +1,153 @@
+"""Tests for src/features.py"""
+
+from __future__ import annotations
+
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+
+import features
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    features._features.clear()
+    yield
+    features._features.clear()
+
+
+def _save(tmp_path, name, color, prompt=None):
+    path = tmp_path / name
+    info = PngImagePlugin.PngInfo()
+    if prompt is not None:
+        info.add_text("parameters", f"{prompt}\nSteps: 20, Seed: 1")
+    Image.new("RGB", (96, 64), color).save(path, pnginfo=info)
+    return str(path)
+
+
+def test_feature_blocks_are_unit_length(tmp_path):
+    path = _save(tmp_path, "a.png", (200, 30, 30), "A red Cat, sitting")
+    vector = features.image_features(path)
+    assert vector.shape == (features.FEATURE_DIMS,)
+    assert vector.dtype == np.float32
+    hist_end = 3 * features.HIST_BINS
+    token_start = features.FEATURE_DIMS - features.TOKEN_DIMS
+    assert np.linalg.norm(vector[:hist_end]) == pytest.approx(1)
+    # A flat image has no pixel variation, so its thumbnail block is zero
+    assert not vector[hist_end:token_start].any()
+    assert np.linalg.norm(vector[token_start:]) == pytest.approx(1)
+
+
+def test_prompt_tokens(tmp_path):
+    path = _save(tmp_path, "a.png", "red", "A red Cat, sitting")
+    assert features.prompt_tokens(path) == ["a", "red", "cat", "sitting"]
+    assert features.prompt_tokens(_save(tmp_path, "b.png", "red")) == []
+
+
+def test_similar_images_have_similar_features(tmp_path):
+    red = features.image_features(_save(tmp_path, "a.png", (200, 20, 20)))
+    red2 = features.image_features(_save(tmp_path, "b.png", (210, 25, 20)))
+    blue = features.image_features(_save(tmp_path, "c.png", (20, 20, 200)))
+    assert red @ red2 > red @ blue
+
+
+def test_compute_features_caches_and_handles_bad_files(tmp_path):
+    good = _save(tmp_path, "a.png", "red")
+    bad = tmp_path / "b.png"
+    bad.write_bytes(b"not an image")
+    with patch.object(
+        features, "image_features", wraps=features.image_features
+    ) as compute:
+        first = features.compute_features([good, str(bad)], workers=2)
+        second = features.compute_features([good, str(bad)], workers=2)
+    assert compute.call_count == 2
+    assert first.shape == (2, features.FEATURE_DIMS)
+    assert not first[1].any()
+    np.testing.assert_array_equal(first, second)
+    os.utime(good, ns=(0, 10**9))
+    with patch.object(features, "image_features") as compute:
+        compute.return_value = np.ones(features.FEATURE_DIMS, dtype=np.float32)
+        features.compute_features([good])
+    compute.assert_called_once_with(good)
+
+
+def test_compute_features_empty():
+    assert features.compute_features([]).shape == (0, features.FEATURE_DIMS)
+
+
+def test_directory_features_reuse_the_directory_file(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    cache_dir = tmp_path / "cache"
+    for name, color in [("a.png", "red"), ("b.png", "blue")]:
+        _save(images, name, color)
+    first = features.directory_features(str(images), ["a.png", "b.png"], 1, cache_dir)
+    assert len(list(cache_dir.glob("*.npz"))) == 1
+    features._features.clear()
+    with patch.object(features, "image_features") as compute:
+        again = features.directory_features(str(images), ["b.png"], 1, cache_dir)
+    compute.assert_not_called()
+    np.testing.assert_array_equal(again[0], first[1])
+
+
+def test_directory_features_recompute_edited_images(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    cache_dir = tmp_path / "cache"
+    path = _save(images, "a.png", "red")
+    features.directory_features(str(images), ["a.png"], 1, cache_dir)
+    _save(images, "a.png", "blue")
+    os.utime(path, ns=(0, 10**9))
+    features._features.clear()
+    with patch.object(
+        features, "image_features", wraps=features.image_features
+    ) as compute:
+        features.directory_features(str(images), ["a.png"], 1, cache_dir)
+        features._features.clear()
+        features.directory_features(str(images), ["a.png"], 1, cache_dir)
+    compute.assert_called_once_with(path)
+
+
+def test_corrupt_directory_file_is_ignored(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    cache_dir = tmp_path / "cache"
+    _save(images, "a.png", "red")
+    cache_dir.mkdir()
+    features._cache_file(str(images), cache_dir).write_bytes(b"garbage")
+    rows = features.directory_features(str(images), ["a.png"], 1, cache_dir)
+    assert rows.any()
+
+
+def test_directory_file_names_are_one_buffer(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    cache_dir = tmp_path / "cache"
+    for name, color in [("a.png", "red"), ("é.png", "blue")]:
+        _save(images, name, color)
+    features.directory_features(str(images), ["a.png", "é.png"], 1, cache_dir)
+    with np.load(features._cache_file(str(images), cache_dir)) as data:
+        assert data["names"].dtype == np.uint8
+        assert data["names"].tobytes() == "a.png\0é.png".encode()
+    entries = features._load_cache(features._cache_file(str(images), cache_dir))
+    assert list(entries) == ["a.png", "é.png"]
+
+
+def test_iter_directory_features_writes_the_file_once(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    cache_dir = tmp_path / "cache"
+    for name, color in [("a.png", "red"), ("b.png", "blue")]:
+        _save(images, name, color)
+    with patch.object(features, "_save_cache", wraps=features._save_cache) as save:
+        chunks = list(
+            features.iter_directory_features(
+                str(images), [["a.png"], ["b.png"]], 1, cache_dir
+            )
+        )
+    assert [chunk.shape for chunk in chunks] == [(1, features.FEATURE_DIMS)] * 2
+    save.assert_called_once()
+    assert len(save.call_args.args[1]) == 2
@@ -0,0 +1,76 @@
+"""Tests for src/headers.py"""
+
+from __future__ import annotations
+
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import headers
+from registry import FileRegistry
+
+
+@pytest.fixture()
+def image_dir(tmp_path):
+    Image.new("RGB", (300, 200), "red").save(tmp_path / "a.png")
+    Image.new("L", (100, 100), 128).save(tmp_path / "b.jpg")
+    Image.new("RGBA", (400, 800), "blue").save(tmp_path / "c.png")
+    (tmp_path / "d.png").write_bytes(b"not an image")
+    return tmp_path
+
+
+@pytest.fixture()
+def registry(image_dir):
+    registry = FileRegistry(str(image_dir))
+    registry.refresh()
+    return registry
+
+
+def test_read_header_does_not_decode_pixels(image_dir):
+    with patch("PIL.ImageFile.ImageFile.load") as load:
+        header = headers.read_header(str(image_dir / "a.png"))
+    load.assert_not_called()
+    assert header == headers.ImageHeader(300, 200, "RGB", "PNG")
+    assert header.aspect == 1.5
+    assert headers.read_header(str(image_dir / "d.png")) is None
+
+
+def test_parse_header_conditions_rejects_other_columns():
+    assert headers.parse_header_conditions("Width>=100") == [("width", ">=", "100")]
+    with pytest.raises(ValueError, match="Unknown column"):
+        headers.parse_header_conditions("seed=1")
+
+
+def test_index_reads_each_header_once(registry):
+    index = headers.HeaderIndex(registry)
+    with patch.object(headers, "read_header", wraps=headers.read_header) as read:
+        index.ensure(registry.view().ids)
+        index.ensure(registry.view().ids)
+    assert read.call_count == 4
+    c_id = registry.id_of("c.png")
+    assert index.header(c_id) == headers.ImageHeader(400, 800, "RGBA", "PNG")
+    assert index.header(registry.id_of("d.png")) is None
+
+
+@pytest.mark.parametrize(
+    ("conditions", "expected"),
+    [
+        ("", ["a.png", "b.jpg", "c.png"]),
+        ("width>=300", ["a.png", "c.png"]),
+        ("aspect>1", ["a.png"]),
+        ("aspect=1.5", ["a.png"]),
+        ("format=jpeg", ["b.jpg"]),
+        ("mode~rgb, height<=200", ["a.png"]),
+        ("megapixels>0.3", ["c.png"]),
+    ],
+)
+def test_filter_view(registry, conditions, expected):
+    assert list(headers.filter_view(registry.view(), conditions)) == expected
+
+
+def test_get_header_index_is_shared_per_registry(registry, image_dir):
+    index = headers.get_header_index(registry)
+    assert headers.get_header_index(registry) is index
+    other = FileRegistry(str(image_dir))
+    assert headers.get_header_index(other) is not index
@@ -0,0 +1,119 @@
+"""Tests for src/indexing.py"""
+
+from __future__ import annotations
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+
+import headers
+import indexing
+import ordering
+from registry import FileRegistry
+
+
+@pytest.fixture()
+def image_dir(tmp_path):
+    for idx in range(5):
+        info = PngImagePlugin.PngInfo()
+        info.add_text("parameters", f"a cat\nSteps: 20, Seed: {idx}")
+        Image.new("RGB", (10 + idx, 10), "gray").save(
+            tmp_path / f"{idx}.png", pnginfo=info
+        )
+    return tmp_path
+
+
+def test_index_progress_label_and_fraction():
+    listing = indexing.IndexProgress("listing", 1024, None)
+    assert listing.label == "listing: 1,024 files"
+    assert listing.fraction == 0.0
+    sizes = indexing.IndexProgress("image sizes", 256, 1024)
+    assert sizes.label == "image sizes: 256 / 1,024"
+    assert sizes.fraction == 0.25
+
+
+def test_job_lists_in_the_background_and_warms_stat_index(image_dir):
+    registry = FileRegistry(str(image_dir))
+    job = indexing.IndexJob(registry)
+    assert registry.indexing
+    assert job.progress() == ("listing", 0, None)
+    job.start()
+    job.join(10)
+    assert job.finished and job.error is None
+    assert not registry.indexing
+    assert list(registry.view()) == [f"{idx}.png" for idx in range(5)]
+    assert job.progress() == ("done", 5, 5)
+    stat_index = ordering.get_stat_index(registry)
+    with patch.object(ordering.os, "scandir") as scandir:
+        stat_index.refresh()
+    scandir.assert_not_called()
+
+
+def test_job_reads_image_sizes_and_metadata(image_dir):
+    registry = FileRegistry(str(image_dir))
+    job = indexing.IndexJob(registry, read_images=True)
+    with patch.object(indexing, "INDEX_CHUNK", 2):
+        job.start()
+        job.join(10)
+    assert job.error is None
+    ids = np.array(registry.view().ids, dtype=np.uint32)
+    with (
+        patch.object(headers, "read_header") as read_header,
+        patch.object(ordering, "get_metadata_dict") as read_metadata,
+    ):
+        widths = headers.get_header_index(registry).column("width", ids)
+        seeds = ordering.get_metadata_index(registry).sort_values("seed", ids)
+    read_header.assert_not_called()
+    read_metadata.assert_not_called()
+    assert widths.tolist() == [10, 11, 12, 13, 14]
+    assert seeds.tolist() == [0, 1, 2, 3, 4]
+
+
+def test_job_records_errors(image_dir):
+    registry = FileRegistry(str(image_dir))
+    job = indexing.IndexJob(registry)
+    with patch.object(
+        FileRegistry, "refresh_in_batches", side_effect=OSError("disk gone")
+    ):
+        job.start()
+        job.join(10)
+    assert job.finished
+    assert isinstance(job.error, OSError)
+    assert not registry.indexing
+
+
+def test_start_indexing_reuses_the_job(image_dir):
+    job = indexing.start_indexing(str(image_dir))
+    assert indexing.start_indexing(str(image_dir)) is job
+    assert indexing.get_job(str(image_dir)) is job
+    job.join(10)
+    assert job.finished
+    assert indexing.get_job(str(image_dir / "other")) is None
+
+
+def test_start_indexing_reads_images_when_asked_later(image_dir):
+    job = indexing.start_indexing(str(image_dir))
+    job.join(10)
+    again = indexing.start_indexing(str(image_dir), read_images=True)
+    assert again is not job and again.read_images
+    again.join(10)
+    # A job that read the images also serves requests without them
+    assert indexing.start_indexing(str(image_dir)) is again
+
+
+def test_start_indexing_retries_failed_jobs(image_dir):
+    with patch.object(
+        FileRegistry, "refresh_in_batches", side_effect=OSError("disk gone")
+    ):
+        job = indexing.start_indexing(str(image_dir))
+        job.join(10)
+    assert job.error is not None
+    assert indexing.start_indexing(str(image_dir)) is job
+    with patch.object(indexing, "INDEX_RETRY_DELAY", 0):
+        retry = indexing.start_indexing(str(image_dir))
+    assert retry is not job
+    retry.join(10)
+    assert retry.error is None
+    assert len(retry.registry) == 5
@@ -0,0 +1,66 @@
+"""Tests for src/leases.py"""
+
+from __future__ import annotations
+
+from unittest.mock import patch
+
+import leases
+
+FILES = [f"{idx:03d}.png" for idx in range(10)]
+
+
+def _queue(tmp_path, owner, **kwargs):
+    kwargs.setdefault("batch_size", 4)
+    return leases.LeaseQueue(tmp_path / "a.leases.db", "/imgs", owner, **kwargs)
+
+
+def test_lease_db_path():
+    assert leases.lease_db_path("/x/annotations.json") == "/x/annotations.leases.db"
+
+
+def test_acquire_hands_out_disjoint_batches(tmp_path):
+    first = _queue(tmp_path, "a").acquire(FILES, set())
+    second = _queue(tmp_path, "b").acquire(FILES, set())
+    third = _queue(tmp_path, "c").acquire(FILES, set())
+    assert first == FILES[:4]
+    assert second == FILES[4:8]
+    assert third == FILES[8:]
+
+
+def test_acquire_skips_done_files(tmp_path):
+    batch = _queue(tmp_path, "a").acquire(FILES, {FILES[0], FILES[2]})
+    assert batch == [FILES[1], FILES[3], FILES[4], FILES[5]]
+
+
+def test_acquire_replaces_own_leases(tmp_path):
+    queue_a = _queue(tmp_path, "a")
+    queue_a.acquire(FILES, set())
+    # The first batch was annotated, so the next one starts after it
+    assert queue_a.acquire(FILES, set(FILES[:4])) == FILES[4:8]
+    # Files a gave up are free again for b
+    batch_b = _queue(tmp_path, "b").acquire(FILES, set(FILES[:2]))
+    assert batch_b == [FILES[2], FILES[3], FILES[8], FILES[9]]
+
+
+def test_expired_leases_are_reclaimed(tmp_path):
+    _queue(tmp_path, "a", ttl=10).acquire(FILES, set())
+    with patch.object(leases.time, "time", return_value=leases.time.time() + 60):
+        assert _queue(tmp_path, "b").acquire(FILES, set()) == FILES[:4]
+
+
+def test_renew_keeps_leases_alive(tmp_path):
+    queue_a = _queue(tmp_path, "a", ttl=10)
+    queue_a.acquire(FILES, set())
+    later = leases.time.time() + 8
+    with patch.object(leases.time, "time", return_value=later):
+        queue_a.renew()
+    with patch.object(leases.time, "time", return_value=later + 5):
+        assert _queue(tmp_path, "b").acquire(FILES, set()) == FILES[4:8]
+
+
+def test_release_frees_leases(tmp_path):
+    queue_a = _queue(tmp_path, "a")
+    queue_a.acquire(FILES, set())
+    _queue(tmp_path, "b").acquire(FILES, set())
+    queue_a.release()
+    assert _queue(tmp_path, "c").acquire(FILES, set()) == FILES[:4]
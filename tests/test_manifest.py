@@ -0,0 +1,74 @@
+"""Tests for src/manifest.py"""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+import manifest
+
+
+@pytest.fixture()
+def csv_manifest(tmp_path):
+    path = tmp_path / "images.csv"
+    path.write_text(
+        "file,prompt,seed,width\n"
+        "a.png,a cat,1,512\n"
+        "b.png,a dog,2,1024\n"
+        ",missing file,3,512\n"
+        "sub/c.jpg,a blurry cat,4,2048\n"
+    )
+    return path
+
+
+@pytest.fixture()
+def jsonl_manifest(tmp_path):
+    path = tmp_path / "images.jsonl"
+    rows = [{"path": "a.png", "seed": 1}, {"path": "b.png", "seed": 2}]
+    path.write_text("\n".join(json.dumps(row) for row in rows) + "\n\n")
+    return path
+
+
+def test_is_manifest(csv_manifest, tmp_path):
+    assert manifest.is_manifest(csv_manifest)
+    assert not manifest.is_manifest(tmp_path)
+    assert not manifest.is_manifest(tmp_path / "missing.csv")
+
+
+def test_iter_manifest_streams_csv(csv_manifest):
+    rows = manifest.iter_manifest(csv_manifest)
+    assert next(rows) == {
+        "file": "a.png",
+        "prompt": "a cat",
+        "seed": "1",
+        "width": "512",
+    }
+    rows.close()
+
+
+def test_manifest_files_skips_rows_without_file(csv_manifest, jsonl_manifest):
+    assert list(manifest.manifest_files(csv_manifest)) == [
+        "a.png",
+        "b.png",
+        "sub/c.jpg",
+    ]
+    assert list(manifest.manifest_files(jsonl_manifest)) == ["a.png", "b.png"]
+
+
+def test_filter_manifest(csv_manifest):
+    files = manifest.filter_manifest(csv_manifest, lambda row: "cat" in row["prompt"])
+    assert list(files) == ["a.png", "sub/c.jpg"]
+
+
+def test_iter_manifest_parquet(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "images.parquet"
+    pq.write_table(pa.table({"file": ["a.png", "b.png"], "seed": [1, 2]}), path)
+    assert list(manifest.manifest_files(path)) == ["a.png", "b.png"]
+
+
+def test_iter_manifest_unsupported(tmp_path):
+    with pytest.raises(ValueError, match="Unsupported"):
+        list(manifest.iter_manifest(tmp_path / "images.txt"))
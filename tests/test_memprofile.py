@@ -0,0 +1,140 @@
+"""Tests for src/memprofile.py"""
+
+from __future__ import annotations
+
+import json
+import tracemalloc
+from array import array
+
+import pytest
+from PIL import Image
+
+import memprofile
+from registry import AnnotationMap, FileRegistry, FileView
+
+
+@pytest.fixture()
+def registry(tmp_path):
+    for name in ("a.png", "b.png", "c.png"):
+        Image.new("RGB", (4, 4)).save(tmp_path / name)
+    registry = FileRegistry(str(tmp_path))
+    registry.refresh()
+    return registry
+
+
+@pytest.fixture()
+def tracing():
+    was_tracing = tracemalloc.is_tracing()
+    yield
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def test_format_bytes():
+    assert memprofile.format_bytes(512) == "512 B"
+    assert memprofile.format_bytes(1536) == "1.5 KB"
+    assert memprofile.format_bytes(3 * 1024**3) == "3.00 GB"
+
+
+def test_deep_sizeof_follows_containers_and_attributes(registry):
+    words = ["x" * 1000, "y" * 1000]
+    assert memprofile.deep_sizeof(words) > 2000
+    # Shared objects are counted once
+    assert memprofile.deep_sizeof([words, words]) < memprofile.deep_sizeof(words) * 2
+    image = Image.new("RGB", (100, 100))
+    assert memprofile.deep_sizeof({"img": image}) > 30_000
+    annotations = AnnotationMap(registry)
+    annotations["a.png"] = "keep"
+    assert memprofile.deep_sizeof(annotations) > 0
+
+
+def test_deep_sizeof_skips_the_shared_registry(registry):
+    view = FileView(registry, array("I", range(3)))
+    with_registry = memprofile.deep_sizeof(view, shared=())
+    assert memprofile.deep_sizeof(view) < with_registry - registry.nbytes + 1
+
+
+def test_session_sizes_are_sorted_largest_first():
+    sizes = memprofile.session_sizes(
+        {"counter": 3, "img_file_names": ["f" * 200] * 50, "files": []}
+    )
+    assert next(iter(sizes)) == "img_file_names"
+    assert set(sizes) == {"counter", "img_file_names", "files"}
+
+
+def test_cache_sizes_cover_every_cache(registry):
+    sizes = memprofile.cache_sizes()
+    assert {
+        "file registries",
+        "header indexes",
+        "stat indexes",
+        "metadata indexes",
+        "content hashes",
+        "image features",
+        "decoded previews",
+        "placeholder thumbnails",
+        "encoded previews",
+        "zoom tiles",
+    } <= set(sizes)
+    assert all(entries >= 0 and nbytes >= 0 for entries, nbytes in sizes.values())
+
+
+def test_finish_rerun_reports_the_peak_of_the_rerun(tracing):
+    memprofile.start_rerun()
+    block = bytearray(8 * 1024**2)
+    del block
+    kept = [bytes(1000) for _ in range(200)]
+    report = memprofile.finish_rerun("viewer", {"kept": kept})
+    assert (report.app, report.scope) == ("viewer", "script")
+    assert report.peak >= 8 * 1024**2 > report.current - report.peak
+    assert report.sites and report.sites[0].size > 0
+    assert report.session["kept"] > 200_000
+    # The next rerun starts from a fresh peak
+    memprofile.start_rerun()
+    assert memprofile.finish_rerun("viewer", {}).peak < report.peak
+
+
+def test_finish_rerun_requires_tracing():
+    if tracemalloc.is_tracing():
+        pytest.skip("allocations are already traced")
+    with pytest.raises(RuntimeError):
+        memprofile.finish_rerun("viewer", {})
+
+
+def test_write_report_appends_json_lines(tmp_path, tracing):
+    memprofile.start_rerun()
+    report = memprofile.finish_rerun("annotator", {"counter": 1})
+    path = tmp_path / "memory.jsonl"
+    memprofile.write_report(report, path)
+    memprofile.write_report(report, path)
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(rows) == 2
+    assert rows[0]["app"] == "annotator"
+    assert rows[0]["session"] == report.session
+    assert set(rows[0]["caches"]["zoom tiles"]) == {"entries", "bytes"}
+    tables = memprofile.report_rows(report)
+    assert list(tables) == ["Largest allocation sites", "Session state", "Caches"]
+
+
+def test_fragment_window_reports_fragment_reruns_only(tmp_path, tracing):
+    path = tmp_path / "memory.jsonl"
+    # Inside a script rerun the script's window is left alone
+    memprofile.start_rerun()
+    with memprofile.fragment_window("viewer", "navigation", {}, path):
+        block = bytearray(4 * 1024**2)
+        del block
+    assert not path.exists()
+    assert memprofile.finish_rerun("viewer", {}).peak >= 4 * 1024**2
+    # A fragment rerun on its own gets a report of its own
+    with memprofile.fragment_window("viewer", "navigation", {"counter": 2}, path):
+        block = bytearray(2 * 1024**2)
+        del block
+    (row,) = [json.loads(line) for line in path.read_text().splitlines()]
+    assert (row["app"], row["scope"]) == ("viewer", "navigation")
+    assert 2 * 1024**2 <= row["peak"] < 4 * 1024**2
+
+
+def test_dump_snapshot_can_be_loaded(tmp_path, tracing):
+    memprofile.start_rerun()
+    path = memprofile.dump_snapshot(tmp_path / "memory.snapshot")
+    assert isinstance(tracemalloc.Snapshot.load(path), tracemalloc.Snapshot)
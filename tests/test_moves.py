@@ -0,0 +1,79 @@
+"""Tests for src/moves.py"""
+
+from __future__ import annotations
+
+import itertools
+from unittest.mock import patch
+
+import pytest
+
+import moves
+from utils import filter_by_keyword
+
+
+def _sequential_groups(files, keywords, sep):
+    """The per-keyword filtering the single pass replaces."""
+    remaining = list(files)
+    groups = {}
+    for keyword in keywords:
+        remaining, groups[keyword] = filter_by_keyword(remaining, keyword, sep)
+    return groups
+
+
+@pytest.mark.parametrize(
+    ("keywords", "sep"),
+    [
+        (["cat", "dog"], " "),
+        (["big cat", "cat", "small"], " "),
+        (["dog", "big-dog"], "-"),
+        (["sitting", "cat_sitting"], "_"),
+    ],
+)
+def test_assign_keywords_matches_sequential_filtering(keywords, sep):
+    words = ["big", "cat", "dog", "small", "sitting", "(cat)"]
+    files = [sep.join(combo) + ".png" for combo in itertools.permutations(words, 3)]
+    files.extend(["cat's toy.png", "unrelated.jpg"])
+    assert moves.assign_keywords(files, keywords, sep) == _sequential_groups(
+        files, keywords, sep
+    )
+
+
+def test_assign_keywords_splits_each_name_once():
+    files = ["cat sitting.png", "dog running.png", "bird.png"]
+    with patch.object(
+        moves, "split_file_name", wraps=moves.split_file_name
+    ) as split_name:
+        groups = moves.assign_keywords(files, ["bird", "dog", "cat", "fish"])
+    assert split_name.call_count == len(files)
+    assert groups == {
+        "bird": ["bird.png"],
+        "dog": ["dog running.png"],
+        "cat": ["cat sitting.png"],
+        "fish": [],
+    }
+
+
+def test_plan_moves_counts_without_touching_disk(tmp_path):
+    plan = moves.plan_moves(
+        str(tmp_path),
+        {"keep": ["a.png", "gone.png"], "delete": ["b.png"], "fix": []},
+        present={"a.png", "b.png"}.__contains__,
+    )
+    assert plan.counts == {"keep": 1, "delete": 1}
+    assert plan.total == 2
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_execute_moves_in_batches(tmp_path):
+    names = [f"{idx:02d}.png" for idx in range(7)]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+    plan = moves.plan_moves(
+        str(tmp_path), {"keep": [*names[:5], "missing.png"], "delete": names[5:]}
+    )
+    with patch.object(moves, "MOVE_BATCH", 2):
+        moved = moves.execute_moves(plan, workers=2)
+    assert moved == {"keep": names[:5], "delete": names[5:]}
+    assert sorted(path.name for path in (tmp_path / "keep").iterdir()) == names[:5]
+    assert sorted(path.name for path in (tmp_path / "delete").iterdir()) == names[5:]
+    assert not list(tmp_path.glob("*.png"))
@@ -0,0 +1,113 @@
+"""Tests for src/ordering.py"""
+
+from __future__ import annotations
+
+import io
+import os
+import zipfile
+from unittest.mock import patch
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+import ordering
+from registry import FileRegistry
+
+
+def _save_png(path, size, seed=None):
+    info = None
+    if seed is not None:
+        info = PngImagePlugin.PngInfo()
+        info.add_text("parameters", f"a cat\nSteps: 20, Seed: {seed}, CFG scale: 7")
+    Image.new("RGB", size, "gray").save(path, pnginfo=info)
+
+
+@pytest.fixture()
+def registry(tmp_path):
+    _save_png(tmp_path / "a.png", (300, 200), seed=30)
+    _save_png(tmp_path / "b.png", (100, 100), seed=5)
+    _save_png(tmp_path / "c.png", (400, 800))
+    (tmp_path / "c.png").write_bytes((tmp_path / "c.png").read_bytes() + bytes(4096))
+    for idx, name in enumerate(("c.png", "a.png", "b.png")):
+        os.utime(tmp_path / name, ns=(idx * 10**9, idx * 10**9))
+    registry = FileRegistry(str(tmp_path))
+    registry.refresh()
+    return registry
+
+
+@pytest.mark.parametrize(
+    ("key", "expected"),
+    [
+        ("name", ["a.png", "b.png", "c.png"]),
+        ("modified", ["c.png", "a.png", "b.png"]),
+        ("file size", ["c.png", "a.png", "b.png"]),
+        ("resolution", ["c.png", "a.png", "b.png"]),
+        ("aspect ratio", ["a.png", "b.png", "c.png"]),
+        # Images without the field go last
+        ("seed", ["b.png", "a.png", "c.png"]),
+    ],
+)
+def test_sort_view(registry, key, expected):
+    assert list(ordering.sort_view(registry.view(), 0, key)) == expected
+
+
+def test_sort_view_keeps_files_before_start(registry):
+    view = ordering.sort_view(registry.view(), 1, "modified")
+    assert list(view) == ["a.png", "c.png", "b.png"]
+
+
+def test_stat_index_scans_once_per_registry_version(registry, tmp_path):
+    index = ordering.StatIndex(registry)
+    ids = ordering._ids_array(registry.view().ids)
+    with patch.object(ordering.os, "scandir", wraps=os.scandir) as scandir:
+        index.sort_values("modified", ids)
+        index.sort_values("file size", ids)
+    assert scandir.call_count == 1
+    _save_png(tmp_path / "d.png", (10, 10))
+    registry.refresh(force=True)
+    with patch.object(ordering.os, "scandir", wraps=os.scandir) as scandir:
+        index.sort_values("modified", ordering._ids_array(registry.view().ids))
+    assert scandir.call_count == 1
+
+
+def test_metadata_index_reads_each_image_once(registry):
+    index = ordering.MetadataIndex(registry)
+    ids = ordering._ids_array(registry.view().ids)
+    with patch.object(
+        ordering, "get_metadata_dict", wraps=ordering.get_metadata_dict
+    ) as read:
+        seeds = index.sort_values("seed", ids)
+        steps = index.sort_values("steps", ids)
+    assert read.call_count == 3
+    assert seeds.tolist() == [30.0, 5.0, float("inf")]
+    assert steps.tolist() == [20.0, 20.0, float("inf")]
+
+
+def test_sort_archive_by_file_size(tmp_path):
+    path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(path, "w") as bundle:
+        for name, size in (("a.png", (8, 8)), ("b.png", (64, 64))):
+            buffer = io.BytesIO()
+            Image.effect_noise(size, 50).save(buffer, format="PNG")
+            bundle.writestr(name, buffer.getvalue())
+    registry = FileRegistry(str(path))
+    registry.refresh()
+    assert list(ordering.sort_view(registry.view(), 0, "file size")) == [
+        "b.png",
+        "a.png",
+    ]
+
+
+def test_sort_manifest_by_modified(tmp_path):
+    for idx, name in enumerate(("b.png", "a.png")):
+        _save_png(tmp_path / name, (8, 8))
+        os.utime(tmp_path / name, ns=(idx * 10**9, idx * 10**9))
+    manifest = tmp_path / "images.csv"
+    manifest.write_text("file\na.png\nb.png\nmissing.png\n")
+    registry = FileRegistry(str(manifest))
+    registry.refresh()
+    assert list(ordering.sort_view(registry.view(), 0, "modified")) == [
+        "b.png",
+        "a.png",
+        "missing.png",
+    ]
@@ -0,0 +1,54 @@
+"""Tests for src/permutation.py"""
+
+from __future__ import annotations
+
+import pytest
+
+from permutation import LazyPermutation, ShuffledOrder
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 17, 1000])
+def test_permutation_covers_range(size):
+    perm = LazyPermutation(size, seed=7)
+    assert sorted(perm[pos] for pos in range(size)) == list(range(size))
+
+
+def test_permutation_is_reproducible_from_seed():
+    first = [LazyPermutation(100, seed=3)[pos] for pos in range(100)]
+    second = [LazyPermutation(100, seed=3)[pos] for pos in range(100)]
+    other = [LazyPermutation(100, seed=4)[pos] for pos in range(100)]
+    assert first == second
+    assert first != other
+
+
+def test_permutation_index_is_inverse():
+    perm = LazyPermutation(257, seed=11)
+    for pos in range(257):
+        assert perm.index(perm[pos]) == pos
+
+
+def test_permutation_negative_and_out_of_range():
+    perm = LazyPermutation(5, seed=1)
+    assert perm[-1] == perm[4]
+    with pytest.raises(IndexError):
+        perm[5]
+    with pytest.raises(ValueError):
+        perm.index(5)
+
+
+def test_shuffled_order_keeps_positions_when_ids_change():
+    order = ShuffledOrder(range(100, 120), seed=5)
+    before = [order[pos] for pos in range(20)]
+    assert sorted(before) == list(range(100, 120))
+    removed = before[3]
+    position = order.synced([200, 201], [removed, 999], 19)
+    after = [order[pos] for pos in range(len(order))]
+    assert len(order) == 21
+    # The last id took the removed one's place, and the position followed it
+    assert after[3] == before[19] and position == 3
+    assert after[:3] == before[:3] and after[4:19] == before[4:19]
+    assert after[19:] == [200, 201]
+    assert order.position_of(201) == 20
+    assert order.position_of(removed) is None
+    assert order.synced([], [201, before[0]], 5) == 5
+    assert [order[pos] for pos in range(len(order))] == [200, *after[1:19]]
@@ -0,0 +1,327 @@
+"""Tests for src/registry.py"""
+
+from __future__ import annotations
+
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+_mock_conf = MagicMock()
+_mock_conf.filter_files = "png, jpg"
+
+with (
+    patch("os.path.isfile", return_value=True),
+    patch("omegaconf.OmegaConf.load", return_value=_mock_conf),
+):
+    import registry
+    import utils
+
+
+def _make_files(directory, names):
+    for name in names:
+        (directory / name).write_text("")
+
+
+@pytest.fixture()
+def img_registry(tmp_path):
+    _make_files(tmp_path, ["b.png", "a.png", "c.jpg", "notes.txt"])
+    with patch.object(utils, "FILTER_EXT_LIST", [".png", ".jpg"]):
+        reg = registry.FileRegistry(str(tmp_path))
+        reg.refresh()
+        yield reg
+
+
+# ---------------------------------------------------------------------------
+# FileRegistry
+# ---------------------------------------------------------------------------
+
+
+def test_registry_lists_sorted_names(img_registry):
+    assert list(img_registry.view()) == ["a.png", "b.png", "c.jpg"]
+    assert len(img_registry) == 3
+    assert "a.png" in img_registry
+    assert "notes.txt" not in img_registry
+
+
+def test_registry_ids_round_trip(img_registry):
+    for name in ["a.png", "b.png", "c.jpg"]:
+        assert img_registry.name(img_registry.id_of(name)) == name
+    assert img_registry.id_of("missing.png") is None
+
+
+def test_registry_refresh_keeps_ids_stable(img_registry, tmp_path):
+    """New files get new ids; existing ids and removed ids are not reused."""
+    b_id = img_registry.id_of("b.png")
+    a_id = img_registry.id_of("a.png")
+    os.remove(tmp_path / "a.png")
+    _make_files(tmp_path, ["0.png"])
+    with patch.object(utils, "FILTER_EXT_LIST", [".png", ".jpg"]):
+        assert img_registry.refresh(force=True)
+    assert list(img_registry.view()) == ["0.png", "b.png", "c.jpg"]
+    assert img_registry.id_of("b.png") == b_id
+    assert img_registry.id_of("0.png") == 3
+    assert list(img_registry.removed_ids()) == [a_id]
+
+
+def test_registry_refresh_skips_unchanged_dir(img_registry):
+    with patch.object(registry, "get_filtered_files") as mock_list:
+        assert not img_registry.refresh()
+    mock_list.assert_not_called()
+
+
+def test_registry_unicode_names():
+    reg = registry.FileRegistry("/unused")
+    reg.add(["ß.png", "日本.png", "a.png"])
+    assert list(reg.view()) == sorted(["ß.png", "日本.png", "a.png"])
+    assert reg.name(reg.id_of("日本.png")) == "日本.png"
+
+
+def test_get_registry_is_shared(tmp_path):
+    assert registry.get_registry(str(tmp_path)) is registry.get_registry(str(tmp_path))
+
+
+# ---------------------------------------------------------------------------
+# FileView
+# ---------------------------------------------------------------------------
+
+
+def test_file_view_behaves_like_list(img_registry):
+    view = img_registry.view()
+    assert view.ids.typecode == "I"
+    assert view[0] == "a.png"
+    assert view[-1] == "c.jpg"
+    assert list(view[1:]) == ["b.png", "c.jpg"]
+    assert view == ["a.png", "b.png", "c.jpg"]
+    assert view != ["a.png"]
+
+
+def test_file_view_filter_preserves_order(img_registry):
+    view = img_registry.view().filter(lambda name: name.endswith(".png"))
+    assert list(view) == ["a.png", "b.png"]
+
+
+# ---------------------------------------------------------------------------
+# AnnotationMap
+# ---------------------------------------------------------------------------
+
+
+def test_annotation_map_set_get_delete(img_registry):
+    annotations = registry.AnnotationMap(img_registry)
+    annotations["a.png"] = "keep"
+    annotations["c.jpg"] = "delete"
+    annotations["a.png"] = "fix"
+    assert dict(annotations) == {"a.png": "fix", "c.jpg": "delete"}
+    assert len(annotations) == 2
+    assert annotations.pop("c.jpg") == "delete"
+    assert annotations.pop("b.png", None) is None
+    assert len(annotations) == 1
+    with pytest.raises(KeyError):
+        annotations["missing.png"] = "keep"
+
+
+def test_annotation_map_drops_removed_files(img_registry):
+    annotations = registry.AnnotationMap(img_registry)
+    annotations["a.png"] = "keep"
+    annotations["b.png"] = "keep"
+    img_registry.remove(["a.png"])
+    assert dict(annotations) == {"b.png": "keep"}
+    assert len(annotations) == 1
+
+
+def test_annotation_map_serialises_to_json(img_registry, tmp_path):
+    annotations = registry.AnnotationMap(img_registry)
+    annotations["b.png"] = "keep"
+    json_path = tmp_path / "annotations.json"
+    utils.save_json({"directory": str(tmp_path), "files": annotations}, json_path)
+    assert utils.load_json(json_path)["files"] == {"b.png": "keep"}
+
+
+def test_registry_manifest_ids(tmp_path):
+    path = tmp_path / "images.jsonl"
+    path.write_text(
+        '{"file": "a.png", "seed": 1}\n'
+        '{"file": "b.png", "seed": 2}\n'
+        '{"file": "c.png", "seed": 1}\n'
+    )
+    with patch.object(utils, "FILTER_EXT_LIST", [".png"]):
+        reg = registry.get_registry(str(path))
+    assert reg.is_manifest
+    view = reg.view().keep_ids(reg.manifest_ids("seed=1"))
+    assert list(view) == ["a.png", "c.png"]
+    assert reg.manifest_ids("seed=1") is reg.manifest_ids("seed=1")
+
+
+def test_registry_changes_since(img_registry):
+    version = img_registry.version
+    assert img_registry.changes_since(version) == ([], [])
+    (added,) = img_registry.add(["d.png"])
+    removed = img_registry.remove(["a.png"])
+    assert img_registry.changes_since(version) == ([added], removed)
+    assert img_registry.changes_since(version - 5) is None
+    assert list(img_registry.view()) == ["b.png", "c.jpg", "d.png"]
+
+
+def test_file_view_synced_keeps_position(img_registry):
+    view = img_registry.view()
+    version = img_registry.version
+    img_registry.add(["0.png", "bb.png"])
+    img_registry.remove(["a.png"])
+    added, removed = img_registry.changes_since(version)
+    # Position 1 is "b.png" before and after the changes
+    synced, position = view.synced(added, removed, 1)
+    assert list(synced) == ["0.png", "b.png", "bb.png", "c.jpg"]
+    assert synced[position] == "b.png"
+
+
+def test_file_view_synced_applies_predicate(img_registry):
+    view = img_registry.view()
+    version = img_registry.version
+    img_registry.add(["d.png", "e.jpg"])
+    added, removed = img_registry.changes_since(version)
+    synced, position = view.synced(
+        added, removed, 3, lambda name: name.endswith(".png")
+    )
+    assert list(synced) == ["a.png", "b.png", "c.jpg", "d.png"]
+    # Past-the-end positions now point at the new file
+    assert position == 3
+
+
+def test_file_view_reordered_keeps_head(img_registry):
+    view = img_registry.view()
+    order = {"a.png": 2, "b.png": 1, "c.jpg": 0}
+    reordered = view.reordered(1, order.__getitem__)
+    assert list(reordered) == ["a.png", "c.jpg", "b.png"]
+
+
+def test_file_view_synced_appends_to_custom_order(img_registry):
+    view = img_registry.view().reordered(0, lambda name: name != "c.jpg")
+    version = img_registry.version
+    img_registry.add(["0.png"])
+    img_registry.remove(["c.jpg"])
+    added, removed = img_registry.changes_since(version)
+    # Position 1 is "a.png" before and after the changes
+    synced, position = view.synced(added, removed, 1, name_order=False)
+    assert list(synced) == ["a.png", "b.png", "0.png"]
+    assert synced[position] == "a.png"
+
+
+def test_file_view_synced_merges_large_changes(img_registry):
+    view = img_registry.view()
+    version = img_registry.version
+    many = [f"m{idx:04d}.png" for idx in range(300)]
+    img_registry.add(["0.png", *many])
+    img_registry.remove(["b.png"])
+    added, removed = img_registry.changes_since(version)
+    synced, position = view.synced(added, removed, 0)
+    assert list(synced) == ["0.png", "a.png", "c.jpg", *many]
+    assert synced[position] == "a.png"
+    # A removed current file moves to the next one
+    synced, position = view.synced(added, removed, 1)
+    assert synced[position] == "c.jpg"
+    # Past-the-end positions point at the first file after the old ones
+    synced, position = view.synced(added, removed, 3)
+    assert synced[position] == "m0000.png"
+
+
+def test_refresh_in_batches_registers_names_as_listed(tmp_path):
+    _make_files(tmp_path, [f"{idx:03d}.png" for idx in range(10)])
+    with patch.object(utils, "FILTER_EXT_LIST", [".png"]):
+        reg = registry.FileRegistry(str(tmp_path))
+        reg.add(["gone.png"])
+        counts = []
+        for listed in reg.refresh_in_batches(batch_size=2):
+            counts.append((listed, len(reg)))
+    # Batches of 2, 4 and then the rest; gone.png is removed at the end
+    assert counts == [(2, 3), (6, 7), (10, 10)]
+    assert list(reg.view()) == [f"{idx:03d}.png" for idx in range(10)]
+    assert not reg.refresh()
+
+
+_scandir = os.scandir
+
+
+class _FailingScan:
+    """``os.scandir`` stand-in that fails after the first entries, like a
+    network share dropping out part way through a listing."""
+
+    def __init__(self, path, after=1):
+        self._entries = list(_scandir(path))[:after]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        yield from self._entries
+        raise OSError("connection lost")
+
+
+def test_failed_listing_removes_no_names(img_registry):
+    version = img_registry.version
+    with (
+        patch.object(utils.os, "scandir", _FailingScan),
+        patch.object(utils, "FILTER_EXT_LIST", [".png", ".jpg"]),
+    ):
+        assert not img_registry.refresh(force=True)
+    with (
+        patch.object(utils.os, "scandir", _FailingScan),
+        patch.object(utils, "FILTER_EXT_LIST", [".png", ".jpg"]),
+        pytest.raises(OSError),
+    ):
+        list(img_registry.refresh_in_batches(force=True))
+    assert list(img_registry.removed_ids()) == []
+    assert img_registry.version == version
+    assert list(img_registry.view()) == ["a.png", "b.png", "c.jpg"]
+    # The next refresh lists again even though the mtime did not change
+    with patch.object(registry, "get_filtered_files", return_value=[]) as listing:
+        img_registry.refresh()
+    listing.assert_called_once()
+
+
+def test_get_registry_skips_refresh_while_indexing(tmp_path):
+    reg = registry.get_registry(str(tmp_path))
+    reg.indexing = True
+    _make_files(tmp_path, ["new.png"])
+    os.utime(tmp_path, ns=(0, 0))
+    assert "new.png" not in registry.get_registry(str(tmp_path))
+    reg.indexing = False
+    assert "new.png" in registry.get_registry(str(tmp_path))
+
+
+def test_export_and_import_names(img_registry, tmp_path):
+    img_registry.remove(["b.png"])
+    data, ids, mtime_ns = img_registry.export_names()
+    assert data == b"a.png\0c.jpg"
+    assert list(ids) == list(img_registry.view().ids)
+    restored = registry.FileRegistry(str(tmp_path))
+    assert restored.import_names(data, mtime_ns)
+    assert list(restored.view()) == ["a.png", "c.jpg"]
+    assert restored.id_of("c.jpg") == 1
+    # Registries that already have names are left alone
+    assert not img_registry.import_names(b"x.png", mtime_ns)
+    assert "x.png" not in img_registry
+
+
+def test_refresh_in_batches_skips_unchanged_directory(img_registry, tmp_path):
+    data, _, mtime_ns = img_registry.export_names()
+    restored = registry.FileRegistry(str(tmp_path))
+    restored.import_names(data, mtime_ns)
+    with patch.object(registry, "iter_filtered_files") as listing:
+        assert list(restored.refresh_in_batches()) == [3]
+    listing.assert_not_called()
+    with patch.object(utils, "FILTER_EXT_LIST", [".png", ".jpg"]):
+        _make_files(tmp_path, ["d.png"])
+        os.utime(tmp_path, ns=(0, 0))
+        list(restored.refresh_in_batches())
+    assert "d.png" in restored
+
+
+def test_annotation_map_is_labeled(img_registry):
+    annotations = registry.AnnotationMap(img_registry)
+    annotations["b.png"] = "keep"
+    assert annotations.is_labeled(img_registry.id_of("b.png"))
+    assert not annotations.is_labeled(img_registry.id_of("a.png"))
+    assert not annotations.is_labeled(img_registry.capacity + 5)
@@ -0,0 +1,138 @@
+"""Tests for src/snapshot.py"""
+
+from __future__ import annotations
+
+import os
+from array import array
+from unittest.mock import patch
+
+import pytest
+
+import registry
+import snapshot
+from registry import FileRegistry, FileView
+from utils import load_json, save_json
+
+
+@pytest.fixture()
+def image_dir(tmp_path):
+    directory = tmp_path / "images"
+    directory.mkdir()
+    for name in ("a.png", "b.png", "c.png", "d.png"):
+        (directory / name).write_bytes(b"")
+    return directory
+
+
+def _state(image_dir, **kwargs):
+    state = dict(
+        img_dir=str(image_dir),
+        split_keywords=[],
+        keyword_and_or=False,
+        sep=" ",
+        manifest_filter="",
+        size_filter="",
+        sort_key="name",
+        duplicates="show",
+        keywords="",
+        name_order=False,
+        counter=1,
+        current_file="c.png",
+    )
+    state.update(kwargs)
+    return state
+
+
+def _saved_view(image_dir):
+    files = FileRegistry(str(image_dir))
+    files.refresh()
+    # A custom order, as after a sort key or clustering
+    return FileView(files, array("I", [3, 2, 0]))
+
+
+def test_snapshot_paths():
+    assert snapshot.snapshot_paths("/data/annotations.json", "s1") == (
+        "/data/annotations.session-s1.json",
+        "/data/annotations.session-s1.npz",
+    )
+    with pytest.raises(ValueError):
+        snapshot.snapshot_paths("/data/annotations.json", "../s1")
+
+
+def test_ensure_session_id():
+    assert snapshot.ensure_session_id("a1_b-2") == "a1_b-2"
+    new = snapshot.ensure_session_id("../x")
+    assert new != "../x" and snapshot.ensure_session_id(new) == new
+    assert snapshot.ensure_session_id(None) != snapshot.ensure_session_id(None)
+
+
+def test_sessions_sharing_a_json_file_keep_their_own_snapshot(image_dir, tmp_path):
+    json_path = tmp_path / "annotations.json"
+    assert snapshot.latest_session(json_path) is None
+    snapshot.save_state(_state(image_dir, counter=1), json_path, "first")
+    snapshot.save_state(_state(image_dir, counter=3), json_path, "second")
+    assert snapshot.load_snapshot(json_path, "first").state["counter"] == 1
+    assert snapshot.load_snapshot(json_path, "second").state["counter"] == 3
+    assert snapshot.load_snapshot(json_path, "third") is None
+    first_path = snapshot.snapshot_paths(json_path, "first")[0]
+    os.utime(first_path, ns=(0, os.stat(first_path).st_mtime_ns + 10**9))
+    assert snapshot.latest_session(json_path) == "first"
+
+
+def test_restores_files_without_listing(image_dir, tmp_path):
+    json_path = tmp_path / "annotations.json"
+    state = _state(image_dir)
+    snapshot.save_state(state, json_path, "s1")
+    snapshot.save_files(_saved_view(image_dir), state, json_path, "s1")
+    loaded = snapshot.load_snapshot(json_path, "s1")
+    assert loaded.state == state
+    with patch.object(registry, "iter_filtered_files") as listing:
+        files = snapshot.restore_files(loaded)
+        assert list(files) == ["d.png", "c.png", "a.png"]
+        assert not files.registry.refresh()
+    listing.assert_not_called()
+    assert list(files.registry.view()) == ["a.png", "b.png", "c.png", "d.png"]
+
+
+def test_restore_looks_names_up_in_a_listed_registry(image_dir, tmp_path):
+    json_path = tmp_path / "annotations.json"
+    state = _state(image_dir)
+    snapshot.save_files(_saved_view(image_dir), state, json_path, "s1")
+    snapshot.save_state(state, json_path, "s1")
+    (image_dir / "c.png").unlink()
+    (image_dir / "0.png").write_bytes(b"")
+    listed = registry.get_registry(str(image_dir))
+    files = snapshot.restore_files(snapshot.load_snapshot(json_path, "s1"))
+    assert files.registry is listed
+    assert list(files) == ["d.png", "a.png"]
+
+
+def test_save_files_skips_removed_files(image_dir, tmp_path):
+    json_path = tmp_path / "annotations.json"
+    view = _saved_view(image_dir)
+    view.registry.remove(["c.png"])
+    state = _state(image_dir)
+    snapshot.save_files(view, state, json_path, "s1")
+    snapshot.save_state(state, json_path, "s1")
+    loaded = snapshot.load_snapshot(json_path, "s1")
+    assert loaded.names == b"a.png\0b.png\0d.png"
+    assert loaded.order.tolist() == [2, 0]
+
+
+def test_file_list_of_other_filters_is_ignored(image_dir, tmp_path):
+    json_path = tmp_path / "annotations.json"
+    snapshot.save_files(_saved_view(image_dir), _state(image_dir), json_path, "s1")
+    snapshot.save_state(_state(image_dir, sort_key="modified"), json_path, "s1")
+    loaded = snapshot.load_snapshot(json_path, "s1")
+    assert loaded.state["sort_key"] == "modified"
+    assert loaded.names is None
+    assert snapshot.restore_files(loaded) is None
+
+
+def test_missing_or_outdated_snapshots(image_dir, tmp_path):
+    json_path = tmp_path / "annotations.json"
+    assert snapshot.load_snapshot(json_path, "s1") is None
+    snapshot.save_state(_state(image_dir), json_path, "s1")
+    assert snapshot.load_snapshot(json_path, "s1").names is None
+    state_path = snapshot.snapshot_paths(json_path, "s1")[0]
+    save_json({**load_json(state_path), "version": 0}, state_path)
+    assert snapshot.load_snapshot(json_path, "s1") is None
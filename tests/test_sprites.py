@@ -0,0 +1,89 @@
+"""Tests for src/sprites.py"""
+
+from __future__ import annotations
+
+import os
+from unittest.mock import patch
+
+from PIL import Image
+
+import sprites
+
+
+def _images(tmp_path, n, size=(40, 20)):
+    paths = []
+    for idx in range(n):
+        path = tmp_path / f"{idx}.png"
+        Image.new("RGB", size, (idx * 20 % 256, 0, 0)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_sheet_cell():
+    assert sprites.sheet_cell(0) == (0, 0)
+    assert sprites.sheet_cell(sprites.SPRITE_GRID + 3) == (3, 1)
+
+
+def test_build_sheet_lays_out_thumbnails(tmp_path):
+    paths = _images(tmp_path, 10)
+    sheet_path = sprites.build_sheet(paths, tmp_path / "cache")
+    thumb = sprites.SPRITE_THUMB
+    with Image.open(sheet_path) as sheet:
+        assert sheet.format == "JPEG"
+        # Two rows are enough for 10 thumbnails
+        assert sheet.size == (sprites.SPRITE_GRID * thumb, 2 * thumb)
+        # The wide thumbnail is centered vertically in its cell
+        col, row = sprites.sheet_cell(9)
+        center = (col * thumb + thumb // 2, row * thumb + thumb // 2)
+        assert sheet.getpixel(center)[0] > 150
+        assert sheet.getpixel((col * thumb + thumb // 2, row * thumb + 2)) == (
+            0,
+            0,
+            0,
+        )
+
+
+def test_sheets_are_built_once_until_an_image_changes(tmp_path):
+    paths = _images(tmp_path, 3)
+    cache_dir = tmp_path / "cache"
+    first = sprites.get_sheet(paths, cache_dir=cache_dir)
+    with patch.object(sprites, "_thumbnail") as thumbnail:
+        assert sprites.get_sheet(paths, cache_dir=cache_dir) == first
+    thumbnail.assert_not_called()
+    os.utime(paths[1], ns=(0, 10**9))
+    second = sprites.get_sheet(paths, cache_dir=cache_dir)
+    assert second != first
+    # The order of the images is part of the sheet's name too
+    assert sprites.get_sheet(paths[::-1], cache_dir=cache_dir) != second
+
+
+def test_get_sheet_without_waiting_queues_the_build(tmp_path):
+    paths = _images(tmp_path, 2)
+    cache_dir = tmp_path / "cache"
+    assert sprites.get_sheet(paths, wait=False, cache_dir=cache_dir) is None
+    sprites._get_executor().submit(lambda: None).result()
+    # Building twice returns the same file, whether queued or waited for
+    assert sprites.get_sheet(paths, cache_dir=cache_dir).exists()
+    assert len(list(cache_dir.glob("*.jpg"))) == 1
+
+
+def test_unreadable_images_leave_blank_cells(tmp_path):
+    bad = tmp_path / "bad.png"
+    bad.write_bytes(b"not an image")
+    sheet_path = sprites.build_sheet([str(bad)], tmp_path / "cache")
+    with Image.open(sheet_path) as sheet:
+        assert sheet.getextrema() == ((0, 0), (0, 0), (0, 0))
+
+
+def test_old_sheets_are_pruned(tmp_path):
+    paths = _images(tmp_path, 4)
+    cache_dir = tmp_path / "cache"
+    with patch.object(sprites, "MAX_SPRITE_SHEETS", 2):
+        for path in paths:
+            sprites.build_sheet([path], cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_sheet_data_uri(tmp_path):
+    sheet_path = sprites.build_sheet(_images(tmp_path, 1), tmp_path / "cache")
+    assert sprites.sheet_data_uri(sheet_path).startswith("data:image/jpeg;base64,/9j/")
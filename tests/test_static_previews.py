@@ -0,0 +1,104 @@
+"""Tests for src/static_previews.py"""
+
+from __future__ import annotations
+
+import os
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+import static_previews
+from encode import EncodedPreview, encode_preview
+
+
+def _save(tmp_path, name, size, mode="RGB"):
+    path = tmp_path / name
+    Image.new(mode, size).save(path)
+    return str(path)
+
+
+def _encoder(path, height):
+    def load():
+        with Image.open(path) as img:
+            width = round(img.width * height / img.height)
+            return img.resize((width, height))
+
+    return MagicMock(side_effect=lambda: encode_preview(path, height, True, load))
+
+
+def test_unpublished_preview_has_no_url(tmp_path):
+    path = _save(tmp_path, "a.png", (10, 10))
+    preview_dir = tmp_path / "static" / "previews"
+    assert static_previews.published_preview_url(path, 896, True, preview_dir) is None
+
+
+def test_original_jpegs_are_linked(tmp_path):
+    path = _save(tmp_path, "a.jpg", (10, 20))
+    preview_dir = tmp_path / "static" / "previews"
+    url = static_previews.publish_preview(
+        path, 896, True, _encoder(path, 896), preview_dir
+    )
+    mtime_ns = os.stat(path).st_mtime_ns
+    assert url.startswith("previews/") and url.endswith(f".jpg?v={mtime_ns}")
+    published = static_previews.preview_file(url, preview_dir)
+    assert published.read_bytes() == (tmp_path / "a.jpg").read_bytes()
+    assert static_previews.published_preview_url(path, 896, True, preview_dir) == url
+
+
+def test_clamped_previews_are_encoded_once(tmp_path):
+    path = _save(tmp_path, "big.png", (40, 80))
+    preview_dir = tmp_path / "static" / "previews"
+    encode = _encoder(path, 20)
+    url = static_previews.publish_preview(path, 20, True, encode, preview_dir)
+    again = static_previews.publish_preview(path, 20, True, encode, preview_dir)
+    assert url == again
+    encode.assert_called_once()
+    published = static_previews.preview_file(url, preview_dir)
+    assert published.suffix == ".webp"
+    with Image.open(published) as img:
+        assert img.size == (10, 20)
+
+
+def test_published_suffix_follows_format(tmp_path):
+    path = _save(tmp_path, "a.png", (4, 4))
+    preview_dir = tmp_path / "static" / "previews"
+    encoded = EncodedPreview(b"png", "PNG", None, False)
+    url = static_previews.publish_preview(path, 896, True, lambda: encoded, preview_dir)
+    assert url.split("?")[0].endswith(".png")
+    assert static_previews.preview_file(url, preview_dir).read_bytes() == b"png"
+
+
+def test_edited_image_gets_a_new_url(tmp_path):
+    path = _save(tmp_path, "a.jpg", (10, 10))
+    preview_dir = tmp_path / "static" / "previews"
+    first = static_previews.publish_preview(
+        path, 896, True, _encoder(path, 896), preview_dir
+    )
+    os.utime(path, ns=(0, 10**9))
+    assert static_previews.published_preview_url(path, 896, True, preview_dir) is None
+    second = static_previews.publish_preview(
+        path, 896, True, _encoder(path, 896), preview_dir
+    )
+    assert first != second
+    assert second.endswith("?v=1000000000")
+
+
+def test_old_previews_are_pruned(tmp_path):
+    preview_dir = tmp_path / "static" / "previews"
+    paths = [_save(tmp_path, f"{idx}.jpg", (4, 4)) for idx in range(4)]
+    with patch.object(static_previews, "MAX_STATIC_PREVIEWS", 2):
+        for path in paths:
+            static_previews.publish_preview(
+                path, 896, True, _encoder(path, 896), preview_dir
+            )
+    assert len(os.listdir(preview_dir)) == 2
+    assert static_previews.published_preview_url(paths[-1], 896, True, preview_dir)
+
+
+def test_static_url():
+    assert static_previews.static_url("previews/a.jpg?v=1") == (
+        "/app/static/previews/a.jpg?v=1"
+    )
+    assert static_previews.static_url("previews/a.jpg?v=1", "/sub/") == (
+        "/sub/app/static/previews/a.jpg?v=1"
+    )
@@ -0,0 +1,136 @@
+"""Tests for src/suggest.py"""
+
+from __future__ import annotations
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import features
+import suggest
+from registry import FileRegistry
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(tmp_path):
+    features._features.clear()
+    with patch.object(features, "FEATURE_CACHE_DIR", tmp_path / "features"):
+        yield
+    features._features.clear()
+
+
+def _unit_rows(rows):
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_knn_votes_for_nearest_class():
+    train = _unit_rows([[1, 0], [0.9, 0.1], [0, 1], [0.1, 0.9]])
+    model = suggest.LabelSuggester(k=2).fit(train, ["a", "a", "b", "b"])
+    labels, confidence = model.predict(_unit_rows([[1, 0.05], [0.05, 1]]))
+    assert labels == ["a", "b"]
+    assert confidence == pytest.approx([1, 1])
+
+
+def test_knn_confidence_reflects_mixed_neighbours():
+    train = _unit_rows([[1, 0], [1, 0.01], [0.98, 0.02]])
+    model = suggest.LabelSuggester(k=3).fit(train, ["a", "a", "b"])
+    labels, confidence = model.predict(_unit_rows([[1, 0]]))
+    assert labels == ["a"]
+    assert 0.5 < confidence[0] < 0.8
+
+
+def test_knn_scores_queries_in_chunks():
+    train = _unit_rows([[1, 0], [0, 1]])
+    model = suggest.LabelSuggester(k=1).fit(train, ["a", "b"])
+    queries = _unit_rows([[1, 0.1], [0.1, 1]] * 3)
+    with patch.object(suggest, "_QUERY_CHUNK", 4):
+        labels, _ = model.predict(queries)
+    assert labels == ["a", "b"] * 3
+
+
+def test_predict_without_training_data():
+    labels, confidence = suggest.LabelSuggester().predict(np.ones((2, 3)))
+    assert labels == [] and len(confidence) == 0
+
+
+def _view(tmp_path, names):
+    for name in names:
+        if not (tmp_path / name).exists():
+            (tmp_path / name).write_bytes(b"")
+    registry = FileRegistry(str(tmp_path))
+    registry.refresh()
+    return registry.view()
+
+
+def test_suggestions_store_registry_ids(tmp_path):
+    view = _view(tmp_path, ["a.png", "b.png", "c.png"])
+    registry = view.registry
+    ids = np.array([registry.id_of("c.png"), registry.id_of("a.png")], np.uint32)
+    suggestions = suggest.Suggestions(
+        registry, ids, ["keep", "drop"], np.array([1, 0]), np.array([0.9, 0.6])
+    )
+    assert dict(suggestions) == {
+        "a.png": ("keep", pytest.approx(0.6)),
+        "c.png": ("drop", pytest.approx(0.9)),
+    }
+    assert suggestions.get("b.png") is None
+    codes, confidence = suggestions.lookup(np.frombuffer(view.ids, np.uint32))
+    assert codes.tolist() == [0, -1, 1]
+    assert confidence[1] == 0
+    assert suggestions.nbytes == 2 * (4 + 1 + 4)
+    (tmp_path / "c.png").unlink()
+    registry.refresh(force=True)
+    assert list(suggestions) == ["a.png"]
+    assert len(suggestions) == 1
+
+
+def test_suggest_labels_needs_enough_labels_and_classes(tmp_path):
+    files = _view(tmp_path, [f"{idx}.png" for idx in range(4)])
+    one_class = dict.fromkeys(list(files)[:3], "keep")
+    assert not suggest.suggest_labels(str(tmp_path), one_class, files, 2)
+    assert not suggest.suggest_labels(str(tmp_path), {"0.png": "keep"}, files)
+
+
+def test_suggest_labels_on_images(tmp_path):
+    colors = {"r": (220, 20, 20), "b": (20, 20, 220)}
+    annotations = {}
+    for idx in range(6):
+        for key, color in colors.items():
+            name = f"{key}{idx}.png"
+            shade = tuple(max(0, channel - 10 * idx) for channel in color)
+            Image.new("RGB", (32, 32), shade).save(tmp_path / name)
+            if idx < 5:
+                annotations[name] = "red" if key == "r" else "blue"
+    files = _view(tmp_path, [])
+    progress = MagicMock()
+    with patch.object(suggest, "SUGGEST_CHUNK", 1):
+        suggestions = suggest.suggest_labels(
+            str(tmp_path), annotations, files, progress=progress
+        )
+    assert set(suggestions) == {"r5.png", "b5.png"}
+    assert suggestions["r5.png"][0] == "red"
+    assert suggestions["b5.png"][0] == "blue"
+    assert suggestions["r5.png"][1] > 0.5
+    assert [call.args for call in progress.call_args_list] == [(1, 2), (2, 2)]
+
+
+def test_suggest_labels_skips_when_nothing_pending(tmp_path):
+    annotations = {f"{idx}.png": ("a" if idx % 2 else "b") for idx in range(10)}
+    files = _view(tmp_path, ["0.png"])
+    with patch.object(suggest, "directory_features", MagicMock()) as compute:
+        assert not suggest.suggest_labels(str(tmp_path), annotations, files)
+    compute.assert_not_called()
+
+
+def test_suggestion_job_records_errors(tmp_path):
+    files = _view(tmp_path, ["0.png"])
+    job = suggest.SuggestionJob(str(tmp_path), {}, files)
+    with patch.object(suggest, "suggest_labels", side_effect=OSError("gone")):
+        job.start()
+        job.join()
+    assert job.finished
+    assert job.result is None
+    assert str(job.error) == "gone"
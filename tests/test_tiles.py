@@ -0,0 +1,166 @@
+"""Tests for src/tiles.py"""
+
+from __future__ import annotations
+
+import os
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import tiles
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    tiles._tiles.clear()
+    tiles._tile_bytes = 0
+    yield
+    tiles._tiles.clear()
+    tiles._tile_bytes = 0
+
+
+def _gradient(tmp_path, size=(100, 60)):
+    path = tmp_path / "big.png"
+    Image.linear_gradient("L").convert("RGB").resize(size).save(path)
+    return str(path)
+
+
+def test_levels_and_sizes(tmp_path):
+    pyramid = tiles.TilePyramid(_gradient(tmp_path), 16, tmp_path / "cache")
+    # 100 -> 50 -> 25 -> 13 fits a 16 px tile
+    assert pyramid.levels == 4
+    assert pyramid.level_size(0) == (100, 60)
+    assert pyramid.level_size(2) == (25, 15)
+    assert pyramid.grid(0) == (7, 4)
+    assert pyramid.grid(3) == (1, 1)
+    assert pyramid.fit_level((60, 40)) == 1
+    assert pyramid.fit_level((1, 1)) == 3
+
+
+def test_viewport_matches_crop_of_full_image(tmp_path):
+    path = _gradient(tmp_path)
+    pyramid = tiles.TilePyramid(path, 16, tmp_path / "cache")
+    view = pyramid.viewport(0, (0.5, 0.5), (30, 20))
+    with Image.open(path) as img:
+        expected = img.crop((35, 20, 65, 40))
+    assert view.size == (30, 20)
+    assert view.tobytes() == expected.tobytes()
+
+
+def test_viewport_is_clamped_to_the_image(tmp_path):
+    path = _gradient(tmp_path)
+    pyramid = tiles.TilePyramid(path, 16, tmp_path / "cache")
+    view = pyramid.viewport(0, (1.0, 0.0), (30, 20))
+    with Image.open(path) as img:
+        expected = img.crop((70, 0, 100, 20))
+    assert view.tobytes() == expected.tobytes()
+    assert pyramid.viewport(9, (0.5, 0.5), (500, 500)).size == (13, 8)
+
+
+def test_viewport_loads_only_visible_tiles_and_one_ring(tmp_path):
+    pyramid = tiles.TilePyramid(_gradient(tmp_path), 16, tmp_path / "cache")
+    pyramid.viewport(0, (0.0, 0.0), (16, 16))
+    loaded = {key[1:] for key in tiles._tiles}
+    assert loaded == {(0, 0, 0), (0, 0, 1), (0, 1, 0), (0, 1, 1)}
+
+
+def test_levels_are_built_once_and_shared_through_disk(tmp_path):
+    path = _gradient(tmp_path)
+    pyramid = tiles.TilePyramid(path, 16, tmp_path / "cache")
+    pyramid.viewport(1, (0.5, 0.5), (16, 16))
+    assert (pyramid.root / "1" / "3_1.png").is_file()
+    assert not (pyramid.root / "0").exists()
+    tiles._tiles.clear()
+    other = tiles.TilePyramid(path, 16, tmp_path / "cache")
+    with patch.object(tiles.Image, "open", wraps=Image.open) as mock_open:
+        other.tile(1, 0, 0)
+    # Read from the disk cache, not decoded from the image again
+    mock_open.assert_called_once_with(other.root / "1" / "0_0.png")
+
+
+def test_memory_cache_is_bounded(tmp_path):
+    pyramid = tiles.TilePyramid(_gradient(tmp_path), 16, tmp_path / "cache")
+    with patch.object(tiles, "MAX_TILE_BYTES", 16 * 16 * 3 * 4):
+        pyramid.viewport(0, (0.5, 0.5), (100, 60))
+    assert tiles._tile_bytes <= 16 * 16 * 3 * 4
+
+
+def test_edited_image_gets_new_pyramid(tmp_path):
+    path = _gradient(tmp_path)
+    first = tiles.TilePyramid(path, 16, tmp_path / "cache")
+    Image.new("RGB", (100, 60), "red").save(path)
+    os.utime(path, ns=(0, 10**9))
+    second = tiles.TilePyramid(path, 16, tmp_path / "cache")
+    assert first.key != second.key
+    assert second.viewport(0, (0.5, 0.5), (4, 4)).getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_palette_images_are_tiled_as_rgb(tmp_path):
+    path = tmp_path / "p.png"
+    Image.new("P", (40, 40)).save(path)
+    pyramid = tiles.TilePyramid(str(path), 16, tmp_path / "cache")
+    assert pyramid.viewport(0, (0.5, 0.5), (20, 20)).mode == "RGB"
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "LA", "L", "P"])
+def test_png_bands_match_a_full_decode(tmp_path, mode):
+    path = tmp_path / "noise.png"
+    noise = Image.effect_noise((37, 29), 80).convert("RGB")
+    if mode == "P":
+        # More than 16 colors, so the palette is stored with 8 bits
+        noise.quantize(64).save(path, transparency=3)
+    else:
+        noise.convert(mode).save(path)
+    with open(path, "rb") as file:
+        bands = list(tiles._png_strips(file, 8))
+    assert [band.height for band in bands] == [8, 8, 8, 5]
+    with Image.open(path) as img:
+        expected = img.convert("RGBA")
+    for top, band in zip(range(0, 29, 8), bands):
+        region = expected.crop((0, top, 37, top + band.height))
+        assert band.convert("RGBA").tobytes() == region.tobytes()
+
+
+def test_png_pyramid_is_built_band_by_band_in_one_pass(tmp_path):
+    path = tmp_path / "noise.png"
+    Image.effect_noise((96, 64), 80).convert("RGB").save(path)
+    pyramid = tiles.TilePyramid(str(path), 16, tmp_path / "cache")
+    with (
+        patch.object(tiles, "open_image", side_effect=AssertionError),
+        patch.object(tiles, "open_file", wraps=tiles.open_file) as mock_open,
+        # Bands shorter than a tile, so rows are collected across bands
+        patch.object(tiles, "_PNG_BAND_ROWS", 5),
+    ):
+        view = pyramid.viewport(0, (0.5, 0.5), (96, 64))
+        # Coarser levels were built in the same pass
+        coarse = pyramid.viewport(1, (0.5, 0.5), (96, 64))
+    mock_open.assert_called_once()
+    with Image.open(path) as img:
+        assert view.tobytes() == img.tobytes()
+        expected = img.resize((48, 32), Image.Resampling.BOX)
+    assert coarse.tobytes() == expected.tobytes()
+    assert [(pyramid.root / str(lv)).is_dir() for lv in range(4)] == [True] * 4
+
+
+def test_low_bit_depth_pngs_are_decoded_whole(tmp_path):
+    path = tmp_path / "few.png"
+    Image.effect_noise((20, 20), 80).convert("RGB").quantize(4).save(path)
+    with open(path, "rb") as file:
+        assert tiles._png_strips(file, 8) is None
+    pyramid = tiles.TilePyramid(str(path), 16, tmp_path / "cache")
+    assert pyramid.viewport(0, (0.5, 0.5), (20, 20)).size == (20, 20)
+
+
+def test_other_formats_are_decoded_whole(tmp_path):
+    path = tmp_path / "photo.jpg"
+    Image.linear_gradient("L").convert("RGB").resize((100, 60)).save(path)
+    pyramid = tiles.TilePyramid(str(path), 16, tmp_path / "cache")
+    assert pyramid.viewport(2, (0.5, 0.5), (500, 500)).size == (25, 15)
+    assert pyramid.viewport(0, (0.5, 0.5), (500, 500)).size == (100, 60)
+
+
+def test_zoom_label():
+    assert tiles.zoom_label("fit") == "fit"
+    assert tiles.zoom_label(0) == "100%"
+    assert tiles.zoom_label(3) == "12.5%"
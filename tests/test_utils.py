@@ -2,10 +2,13 @@
 
 from __future__ import annotations
 
+import io
+import threading
+import zipfile
 from unittest.mock import MagicMock, patch
 
 import pytest
-from PIL import Image
+from PIL import Image, PngImagePlugin
 
 # ---------------------------------------------------------------------------
 # Patch out the module-level config.yml check before importing utils
@@ -166,6 +169,40 @@ def test_update_json_merges_existing(tmp_path):
     assert loaded == {"a": 1, "b": 99, "c": 3}
 
 
+def test_update_json_merges_nested_files(tmp_path):
+    json_path = str(tmp_path / "annotations.json")
+    utils.update_json({"directory": "/d", "files": {"a.png": "keep"}}, json_path)
+    utils.update_json({"directory": "/d", "files": {"b.png": "delete"}}, json_path)
+    loaded = utils.load_json(json_path)
+    assert loaded == {"directory": "/d", "files": {"a.png": "keep", "b.png": "delete"}}
+
+
+def test_update_json_starts_files_over_for_another_directory(tmp_path):
+    json_path = str(tmp_path / "annotations.json")
+    utils.update_json({"directory": "/d", "files": {"a.png": "keep"}}, json_path)
+    utils.update_json({"directory": "/e", "files": {"b.png": "delete"}}, json_path)
+    loaded = utils.load_json(json_path)
+    assert loaded == {"directory": "/e", "files": {"b.png": "delete"}}
+    assert utils.json_labels(loaded, "/e") == {"b.png": "delete"}
+    assert utils.json_labels(loaded, "/d") == {}
+
+
+def test_update_json_concurrent_writers_keep_every_label(tmp_path):
+    json_path = str(tmp_path / "annotations.json")
+
+    def _annotate(worker):
+        for idx in range(20):
+            utils.update_json({"files": {f"{worker}_{idx}.png": "keep"}}, json_path)
+
+    threads = [threading.Thread(target=_annotate, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(utils.load_json(json_path)["files"]) == 80
+    assert not list(tmp_path.glob("*.tmp"))
+
+
 # ---------------------------------------------------------------------------
 # load_image
 # ---------------------------------------------------------------------------
@@ -183,6 +220,11 @@ def test_load_image_unclamped(tmp_image):
     assert img.size == (100, 200)
 
 
+def test_clamp_size():
+    assert utils.clamp_size((200, 100), 50) == (100, 50)
+    assert utils.clamp_size((20, 10), 50) == (20, 10)
+
+
 def test_load_image_no_clamp_needed(tmp_path):
     """When image height <= clamp height, dimensions are unchanged."""
     img_path = tmp_path / "small.png"
@@ -210,3 +252,81 @@ def test_get_metadata_str_png_no_sd_params(tmp_image):
     prompts, meta = utils.get_metadata_str(str(tmp_image))
     assert prompts == ""
     assert meta == ""
+
+
+# ---------------------------------------------------------------------------
+# matches_keyword
+# ---------------------------------------------------------------------------
+
+
+def test_matches_keyword_phrase_and_sep():
+    assert utils.matches_keyword("a big cat.png", "big cat")
+    assert not utils.matches_keyword("a big dog.png", "big cat")
+    assert utils.matches_keyword("fantasy_setting_town.png", "fantasy_setting", "_")
+    assert not utils.matches_keyword("category.png", "cat")
+
+
+# ---------------------------------------------------------------------------
+# manifests / conditions
+# ---------------------------------------------------------------------------
+
+
+def test_get_filtered_files_reads_manifest(tmp_path):
+    path = tmp_path / "images.csv"
+    path.write_text("file,seed\na.png,1\nb.txt,2\nsub/c.jpg,3\n")
+    assert utils.get_filtered_files(str(path), [".png", ".jpg"]) == [
+        "a.png",
+        "sub/c.jpg",
+    ]
+    assert utils.is_image_source(str(path))
+    assert utils.get_file_path(str(path), "sub/c.jpg") == str(tmp_path / "sub/c.jpg")
+
+
+def test_archive_is_read_like_a_directory(tmp_path):
+    info = PngImagePlugin.PngInfo()
+    info.add_text("parameters", "a cat\nSteps: 20, Seed: 7")
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), "red").save(buffer, format="PNG", pnginfo=info)
+    path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(path, "w") as bundle:
+        bundle.writestr("sub/a.png", buffer.getvalue())
+        bundle.writestr("b.txt", "text")
+    assert utils.is_image_source(str(path))
+    assert utils.get_filtered_files(str(path), [".png"]) == ["sub/a.png"]
+    image_path = utils.get_file_path(str(path), "sub/a.png")
+    assert utils.get_metadata_dict(image_path)["Seed"] == "7"
+    assert utils.load_image(image_path, height=10).size == (20, 10)
+    # Manifests listing archive members resolve relative to their folder
+    manifest = tmp_path / "batch_keep.jsonl"
+    manifest.write_text('{"file": "batch.zip/sub/a.png"}\n')
+    member_path = utils.get_file_path(str(manifest), "batch.zip/sub/a.png")
+    assert utils.load_image(member_path, is_clamped=False).size == (40, 20)
+
+
+def test_parse_conditions():
+    assert utils.parse_conditions("seed=42, Prompt~blurry cat, width>=1024") == [
+        ("seed", "=", "42"),
+        ("prompt", "~", "blurry cat"),
+        ("width", ">=", "1024"),
+    ]
+    with pytest.raises(ValueError):
+        utils.parse_conditions("seed")
+
+
+def test_parse_conditions_splits_at_the_first_operator():
+    assert utils.parse_conditions("prompt~a=b, note=x<y, cfg>=7") == [
+        ("prompt", "~", "a=b"),
+        ("note", "=", "x<y"),
+        ("cfg", ">=", "7"),
+    ]
+    with pytest.raises(ValueError):
+        utils.parse_conditions("=42")
+
+
+def test_matches_conditions():
+    row = {"Prompt": "A Blurry cat", "seed": "42", "width": 1024}
+    assert utils.matches_conditions(row, utils.parse_conditions("prompt~blurry"))
+    assert utils.matches_conditions(row, utils.parse_conditions("seed=42.0"))
+    assert utils.matches_conditions(row, utils.parse_conditions("width>512"))
+    assert not utils.matches_conditions(row, utils.parse_conditions("width<512"))
+    assert not utils.matches_conditions(row, utils.parse_conditions("sampler=Euler"))
@@ -6,6 +6,9 @@ import os
 import sys
 from unittest.mock import MagicMock, patch
 
+import pytest
+from PIL import Image
+
 # ---------------------------------------------------------------------------
 # Import viewer functions by patching away Streamlit and module-level side
 # effects so the top-level script code does not execute during import.
@@ -25,12 +28,21 @@ def _import_viewer():
     # Make columns() return the correct number of values for tuple unpacking
     mock_st.sidebar.columns.side_effect = _make_columns
     mock_st.columns.side_effect = _make_columns
+    # Let @st.fragment return the undecorated function
+    mock_st.fragment.side_effect = lambda func, **kwargs: func
 
     # Patch streamlit in sys.modules so 'import streamlit' in viewer returns mock
-    with patch.dict(sys.modules, {"streamlit": mock_st}):
+    modules = {
+        "streamlit": mock_st,
+        "streamlit.components": mock_st.components,
+        "streamlit.components.v1": mock_st.components.v1,
+    }
+    with patch.dict(sys.modules, modules):
         # Also stub utils' module-level config read
         mock_conf = MagicMock()
         mock_conf.filter_files = "png, jpg"
+        # Don't start a directory watcher on import
+        mock_conf.get.return_value = False
         with (
             patch("os.path.isfile", return_value=True),
             patch("omegaconf.OmegaConf.load", return_value=mock_conf),
@@ -46,6 +58,13 @@ _viewer = _import_viewer()
 _get_default_dir = _viewer._get_default_dir
 
 
+@pytest.fixture(autouse=True)
+def _reset_shuffle():
+    """Keep a shuffle from one test leaking into the next via module state."""
+    yield
+    _viewer.state.is_shuffled = False
+
+
 # ---------------------------------------------------------------------------
 # _get_default_dir
 # ---------------------------------------------------------------------------
@@ -130,4 +149,208 @@ def test_show_image_shows_filename_when_enabled(tmp_image):
 
     _viewer.show_image(mock_container, mock_placeholder)
 
-    mock_placeholder.info.assert_called_once_with(tmp_image.name)
+    mock_placeholder.info.assert_called_once()
+    (label,) = mock_placeholder.info.call_args.args
+    # The payload size of the preview follows the file name
+    assert label.startswith(f"{tmp_image.name} · ")
+    assert label.endswith("KB JPEG q90")
+
+
+# ---------------------------------------------------------------------------
+# navigation (fragment) / shuffle_files
+# ---------------------------------------------------------------------------
+
+
+def test_navigation_clears_image_when_cleared():
+    """After "clear" (counter == -1) the fragment should empty the containers."""
+    _viewer.state.counter = -1
+    _viewer.state.current_file = "a.png"
+    _viewer.state.is_slideshow = False
+    mock_container = MagicMock()
+    mock_placeholder = MagicMock()
+
+    _viewer.navigation(mock_container, mock_placeholder)
+
+    mock_container.image.assert_not_called()
+    mock_container.empty.assert_called_once()
+
+
+def _listed_files(tmp_path, names):
+    """List a directory into ``state.files`` the way ``set_dir`` does."""
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+    state = _viewer.state
+    state.img_dir = str(tmp_path)
+    state.is_new_dir = True
+    state.is_new_keywords = True
+    state.img_file_names = None
+    state.filtered_words = None
+    state.files_version = 0
+    state.split_keywords = []
+    state.manifest_filter = ""
+    state.size_filter = ""
+    state.sort_key = "name"
+    state.counter = 0
+    _viewer.refresh_files()
+
+
+def test_shuffle_files_updates_current_file(tmp_path):
+    """Shuffling should point current_file at the new first file."""
+    _listed_files(tmp_path, ["a.png", "b.png", "c.png"])
+    _viewer.state.counter = 2
+    _viewer.shuffle_files()
+    assert _viewer.state.counter == 0
+    assert _viewer.state.current_file == _viewer.file_at(0)
+
+
+def test_shuffle_files_keeps_file_list_sorted(tmp_path):
+    """Shuffling should only change the viewing order, not state.files."""
+    names = sorted(f"{idx}.png" for idx in range(50))
+    _listed_files(tmp_path, names)
+    _viewer.shuffle_files()
+    assert list(_viewer.state.files) == names
+    shuffled = [_viewer.file_at(idx) for idx in range(50)]
+    assert sorted(shuffled) == names
+    assert shuffled != names
+
+
+def test_shuffled_order_survives_added_and_removed_files(tmp_path):
+    """A file arriving or leaving should not reshuffle the order or move the
+    counter off the current image."""
+    _listed_files(tmp_path, [f"{idx:02d}.png" for idx in range(30)])
+    _viewer.shuffle_files()
+    _viewer.state.counter = 10
+    before = [_viewer.file_at(idx) for idx in range(30)]
+    gone = before[4]
+    (tmp_path / gone).unlink()
+    (tmp_path / "new.png").write_bytes(b"")
+    os.utime(tmp_path, ns=(0, 10**18))
+    _viewer.refresh_files()
+    after = [_viewer.file_at(idx) for idx in range(len(_viewer.state.files))]
+    assert _viewer.file_at(_viewer.state.counter) == before[10]
+    assert after[:4] == before[:4] and after[5:29] == before[5:29]
+    assert after[4] == before[29]
+    assert after[29] == "new.png"
+
+
+def test_shuffled_order_follows_keyword_changes(tmp_path):
+    """Setting or clearing keywords while shuffled should shuffle the new
+    file list, not keep positions of the old one."""
+    names = [f"cat {idx:02d}.png" for idx in range(14)]
+    names += [f"dog {idx:02d}.png" for idx in range(6)]
+    _listed_files(tmp_path, names)
+    _viewer.shuffle_files()
+    state = _viewer.state
+    state._keywords = "dog"
+    state.sep = " "
+    _viewer.change_keywords()
+    _viewer.refresh_files()
+    shown = [_viewer.file_at(idx) for idx in range(len(state.files))]
+    assert len(shown) == 6
+    assert sorted(shown) == names[14:]
+    _viewer.reset_keywords()
+    _viewer.refresh_files()
+    shown = [_viewer.file_at(idx) for idx in range(len(state.files))]
+    assert sorted(shown) == sorted(names)
+
+
+# ---------------------------------------------------------------------------
+# slideshow window
+# ---------------------------------------------------------------------------
+
+
+def _slideshow_dir(tmp_path, n):
+    names = [f"{idx}.png" for idx in range(n)]
+    for name in names:
+        Image.new("RGB", (20, 40)).save(tmp_path / name)
+    _viewer.state.img_dir = str(tmp_path)
+    _viewer.state.files = names
+    _viewer.state.height_clamp = 10
+    _viewer.state.slideshow_window = None
+    return names
+
+
+def test_get_slideshow_frames_stops_at_end(tmp_path):
+    """A non-continuous window should not run past the last file."""
+    names = _slideshow_dir(tmp_path, 3)
+    _viewer.state.continuous = False
+    frames = _viewer.get_slideshow_frames(1, 8)
+    assert [frame["name"] for frame in frames] == names[1:]
+    assert frames[0]["src"].startswith("data:image/webp;base64,")
+
+
+def test_get_slideshow_frames_wraps_when_continuous(tmp_path):
+    """A continuous window should wrap around to the first file."""
+    _slideshow_dir(tmp_path, 3)
+    _viewer.state.continuous = True
+    frames = _viewer.get_slideshow_frames(2, 3)
+    assert [frame["name"] for frame in frames] == ["2.png", "0.png", "1.png"]
+
+
+def test_get_slideshow_frames_reuses_last_window(tmp_path):
+    """Asking for the same window again should not reload any image."""
+    _slideshow_dir(tmp_path, 3)
+    _viewer.state.continuous = False
+    first = _viewer.get_slideshow_frames(0, 2)
+    with patch.object(_viewer, "load_preview") as mock_load:
+        second = _viewer.get_slideshow_frames(0, 2)
+    mock_load.assert_not_called()
+    assert second is first
+
+
+def test_refill_slideshow_moves_window():
+    """A refill request should move the window and the counter."""
+    _viewer.state.files = ["a.png", "b.png", "c.png"]
+    _viewer.state._slideshow = {"position": 4}
+    _viewer.refill_slideshow()
+    assert _viewer.state.slideshow_start == 4
+    assert _viewer.state.counter == 1
+    assert _viewer.state.current_file == "b.png"
+
+
+# ---------------------------------------------------------------------------
+# filmstrip
+# ---------------------------------------------------------------------------
+
+
+def test_get_filmstrip_cells_around_counter(tmp_path):
+    """The filmstrip should cover the positions around the counter, with each
+    cell pointing into the sheet holding its position."""
+    names = _slideshow_dir(tmp_path, 5)
+    _viewer.state.counter = 1
+    with (
+        patch.object(_viewer, "SPRITE_DIR", tmp_path / "sprites"),
+        patch.object(_viewer, "SHEET_SIZE", 2),
+        patch.object(_viewer.st, "get_option", return_value=""),
+    ):
+        sheets, cells = _viewer.get_filmstrip(radius=2)
+    assert [cell["position"] for cell in cells] == [0, 1, 2, 3]
+    assert [cell["name"] for cell in cells] == names[:4]
+    assert [cell["sheet"] for cell in cells] == [0, 0, 1, 1]
+    assert (cells[1]["col"], cells[1]["row"]) == (1, 0)
+    assert len(sheets) == 2
+    assert sheets[0].startswith("/app/static/sprites/")
+
+
+def test_get_filmstrip_sends_data_uris_without_static_serving(tmp_path):
+    _slideshow_dir(tmp_path, 2)
+    _viewer.state.counter = 0
+    with (
+        patch.object(_viewer, "SPRITE_DIR", None),
+        patch.object(_viewer, "get_sheet") as get_sheet,
+    ):
+        sheet = tmp_path / "sheet.jpg"
+        Image.new("RGB", (4, 4)).save(sheet)
+        get_sheet.return_value = sheet
+        sheets, _ = _viewer.get_filmstrip()
+    assert sheets[0].startswith("data:image/jpeg;base64,")
+
+
+def test_jump_from_filmstrip():
+    """Clicking a thumbnail should jump straight to its image."""
+    _viewer.state.files = ["a.png", "b.png", "c.png"]
+    _viewer.state.counter = 0
+    _viewer.state._filmstrip = {"position": 2, "clicked": 1}
+    _viewer.jump_from_filmstrip()
+    assert _viewer.state.counter == 2
+    assert _viewer.state.current_file == "c.png"
@@ -0,0 +1,142 @@
+"""Tests for src/watcher.py"""
+
+from __future__ import annotations
+
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+_mock_conf = MagicMock()
+_mock_conf.filter_files = "png, jpg"
+
+with (
+    patch("os.path.isfile", return_value=True),
+    patch("omegaconf.OmegaConf.load", return_value=_mock_conf),
+):
+    import registry
+    import utils
+    import watcher
+
+
+def _event(mask, name=""):
+    # inotify NUL-terminates names and pads them to a multiple of 16 bytes
+    raw = os.fsencode(name) + b"\0"
+    raw += b"\0" * (-len(raw) % 16)
+    return watcher._EVENT_HEADER.pack(1, mask, 0, len(raw)) + raw
+
+
+@pytest.fixture()
+def img_registry(tmp_path):
+    for name in ["a.png", "b.png"]:
+        (tmp_path / name).write_text("")
+    with patch.object(utils, "FILTER_EXT_LIST", [".png", ".jpg"]):
+        reg = registry.FileRegistry(str(tmp_path))
+        reg.refresh()
+        yield reg
+
+
+def test_apply_events_adds_and_removes(img_registry):
+    w = watcher.DirectoryWatcher(img_registry)
+    with patch.object(watcher, "FILTER_EXT_LIST", [".png", ".jpg"]):
+        data = (
+            _event(watcher._IN_CLOSE_WRITE, "c.png")
+            + _event(watcher._IN_MOVED_TO, "d.jpg")
+            + _event(watcher._IN_DELETE, "a.png")
+            + _event(watcher._IN_CLOSE_WRITE, "notes.txt")
+        )
+        assert w._apply_events(data) is False
+    assert list(img_registry.view()) == ["b.png", "c.png", "d.jpg"]
+
+
+def test_apply_events_created_then_deleted_is_ignored(img_registry):
+    w = watcher.DirectoryWatcher(img_registry)
+    version = img_registry.version
+    with patch.object(watcher, "FILTER_EXT_LIST", [".png", ".jpg"]):
+        data = _event(watcher._IN_CLOSE_WRITE, "tmp.png") + _event(
+            watcher._IN_DELETE, "tmp.png"
+        )
+        w._apply_events(data)
+    assert img_registry.version == version
+    assert list(img_registry.view()) == ["a.png", "b.png"]
+
+
+def test_apply_events_stops_when_dir_removed(img_registry):
+    w = watcher.DirectoryWatcher(img_registry)
+    with patch.object(img_registry, "refresh") as refresh:
+        assert w._apply_events(_event(watcher._IN_DELETE_SELF)) is True
+    refresh.assert_called_once_with(force=True)
+
+
+def test_polling_backend_refreshes_registry(img_registry, tmp_path):
+    w = watcher.DirectoryWatcher(img_registry, interval=0.01)
+    with patch.object(watcher, "_load_libc", return_value=None):
+        w.start()
+        try:
+            (tmp_path / "c.png").write_text("")
+            os.utime(tmp_path, ns=(0, 0))
+            for _ in range(200):
+                if "c.png" in img_registry:
+                    break
+                w.join(0.01)
+        finally:
+            w.stop()
+            w.join()
+    assert w.backend == "polling"
+    assert "c.png" in img_registry
+    assert img_registry.watched is False
+
+
+def test_failed_poll_keeps_the_names(img_registry, tmp_path):
+    """A listing error while polling must not turn into a "removed" event
+    for every file."""
+    w = watcher.DirectoryWatcher(img_registry, interval=0.01)
+    os.utime(tmp_path, ns=(0, 0))
+    with (
+        patch.object(watcher, "_load_libc", return_value=None),
+        patch.object(utils.os, "scandir", side_effect=PermissionError("denied")),
+    ):
+        w.start()
+        try:
+            w.join(0.1)
+            assert w.is_alive()
+        finally:
+            w.stop()
+            w.join()
+    assert list(img_registry.removed_ids()) == []
+    assert list(img_registry.view()) == ["a.png", "b.png"]
+
+
+def test_inotify_backend_picks_up_new_file(img_registry, tmp_path):
+    if watcher._load_libc() is None:
+        pytest.skip("inotify not available")
+    w = watcher.DirectoryWatcher(img_registry, interval=0.01)
+    with patch.object(watcher, "FILTER_EXT_LIST", [".png", ".jpg"]):
+        w.start()
+        try:
+            for _ in range(200):
+                if w.backend == "inotify" and img_registry.watched:
+                    break
+                w.join(0.01)
+            (tmp_path / "c.png").write_text("")
+            for _ in range(200):
+                if "c.png" in img_registry:
+                    break
+                w.join(0.01)
+        finally:
+            w.stop()
+            w.join()
+    assert w.backend == "inotify"
+    assert "c.png" in img_registry
+
+
+def test_watch_reuses_running_watcher(tmp_path):
+    with patch.object(watcher, "DirectoryWatcher") as mock_watcher:
+        mock_watcher.return_value.is_alive.return_value = True
+        try:
+            first = watcher.watch(str(tmp_path))
+            second = watcher.watch(str(tmp_path))
+        finally:
+            watcher.stop_all()
+    assert first is second
+    mock_watcher.return_value.start.assert_called_once()